@@ -13,6 +13,10 @@ if os.environ.get('SERVICE_ACCOUNT_JSON'):
 
 db = firestore.Client()
 
+# Non-blocking client for code running on the event loop (e.g. the realtime listen websocket), bound to the
+# first loop that uses it: never use it from another loop
+async_db = firestore.AsyncClient()
+
 
 def get_users_uid():
     users_ref = db.collection('users')
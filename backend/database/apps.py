@@ -18,6 +18,7 @@ from .redis_db import get_app_reviews
 apps_collection = 'plugins_data'
 app_analytics_collection = 'plugins'
 testers_collection = 'testers'
+persona_state_collection = 'persona_state'
 
 
 def migrate_reviews_from_redis_to_firestore():
@@ -40,6 +41,13 @@ def get_app_by_id_db(app_id: str):
     return None
 
 
+def get_apps_by_ids_db(app_ids: List[str]) -> List[dict]:
+    """Existing apps among `app_ids`, in that order, fetched in one round trip."""
+    refs = [db.collection(apps_collection).document(app_id) for app_id in app_ids]
+    docs = {doc.id: doc.to_dict() for doc in db.get_all(refs) if doc.exists}
+    return [docs[app_id] for app_id in app_ids if app_id in docs]
+
+
 def get_audio_apps_count(app_ids: List[str]):
     if not app_ids or len(app_ids) == 0:
         return 0
@@ -387,6 +395,16 @@ def update_persona_in_db(persona_data: dict):
     persona_ref.update(persona_data)
 
 
+def get_persona_state_db(uid: str) -> dict | None:
+    """Condensed memories and conversations the user's personas are built from, see `utils.apps.get_persona_context`."""
+    doc = db.collection('users').document(uid).collection(persona_state_collection).document('condensed').get()
+    return doc.to_dict() if doc.exists else None
+
+
+def set_persona_state_db(uid: str, state: dict):
+    db.collection('users').document(uid).collection(persona_state_collection).document('condensed').set(state)
+
+
 def migrate_app_owner_id_db(new_id: str, old_id: str):
     filters = [FieldFilter('uid', '==', old_id)]
     apps_ref = db.collection(apps_collection).where(filter=BaseCompositeFilter('AND', filters)).stream()
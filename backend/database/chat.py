@@ -55,6 +55,26 @@ def _prepare_message_for_read(message_data: Optional[Dict[str, Any]], uid: str)
     return message_data
 
 
+def _prepare_messages_for_read(messages_data: List[Any], uid: str) -> List[Any]:
+    """List counterpart of _prepare_message_for_read, all enhanced texts are decrypted with a single key lookup."""
+    result = []
+    encrypted = []
+    for message_data in messages_data:
+        if isinstance(message_data, dict):
+            if not message_data:
+                message_data = None
+            elif message_data.get('data_protection_level') == 'enhanced' and isinstance(message_data.get('text'), str):
+                # only the top level 'text' is replaced, a shallow copy keeps the raw data untouched
+                message_data = dict(message_data)
+                encrypted.append(message_data)
+        result.append(message_data)
+
+    decrypted = encryption.decrypt_batch([message_data['text'] for message_data in encrypted], uid)
+    for message_data, text in zip(encrypted, decrypted):
+        message_data['text'] = text
+    return result
+
+
 # *****************************
 # ********** CRUD *************
 # *****************************
@@ -98,7 +118,7 @@ def add_summary_message(text: str, uid: str) -> Message:
     return ai_message
 
 
-@prepare_for_read(decrypt_func=_prepare_message_for_read)
+@prepare_for_read(decrypt_func=_prepare_message_for_read, batch_decrypt_func=_prepare_messages_for_read)
 def get_app_messages(uid: str, app_id: str, limit: int = 20, offset: int = 0, include_conversations: bool = False):
     user_ref = db.collection('users').document(uid)
     messages_ref = (
@@ -142,7 +162,7 @@ def get_app_messages(uid: str, app_id: str, limit: int = 20, offset: int = 0, in
     return messages
 
 
-@prepare_for_read(decrypt_func=_prepare_message_for_read)
+@prepare_for_read(decrypt_func=_prepare_message_for_read, batch_decrypt_func=_prepare_messages_for_read)
 def get_messages(
         uid: str, limit: int = 20, offset: int = 0, include_conversations: bool = False, app_id: Optional[str] = None,
         chat_session_id: Optional[str] = None
@@ -6,8 +6,9 @@ import zlib
 from datetime import datetime, timedelta
 from typing import List, Tuple, Optional, Dict, Any
 
+from google.api_core.exceptions import Conflict, FailedPrecondition, NotFound
 from google.cloud import firestore
-from google.cloud.firestore_v1 import FieldFilter
+from google.cloud.firestore_v1 import FieldFilter, transactional
 from google.cloud.firestore_v1.async_client import AsyncClient
 
 import utils.other.hume as hume
@@ -20,17 +21,25 @@ from .helpers import set_data_protection_level, prepare_for_write, prepare_for_r
 
 conversations_collection = 'conversations'
 
+# Streaming updates are appended to this subcollection as sequence-numbered entries, and periodically
+# folded back into the compressed `transcript_segments` blob of the conversation document.
+transcript_segments_log_collection = 'transcript_segments_log'
+transcript_segments_log_compact_every = 50
+
 
 # *********************************
 # ******* ENCRYPTION HELPERS ******
 # *********************************
 
-def _decrypt_conversation_data(conversation_data: Dict[str, Any], uid: str) -> Dict[str, Any]:
-    data = copy.deepcopy(conversation_data)
+def _decrypt_conversation_data(
+        conversation_data: Dict[str, Any], uid: str, decrypted_payload: Optional[str] = None
+) -> Dict[str, Any]:
+    data = dict(conversation_data)
 
     if 'transcript_segments' in data and isinstance(data['transcript_segments'], str):
         try:
-            decrypted_payload = encryption.decrypt(data['transcript_segments'], uid)
+            if decrypted_payload is None:
+                decrypted_payload = encryption.decrypt(data['transcript_segments'], uid)
             if data.get('transcript_segments_compressed'):
                 # New format: encrypted(compressed(json))
                 compressed_bytes = bytes.fromhex(decrypted_payload)
@@ -60,18 +69,22 @@ def _prepare_conversation_for_write(data: Dict[str, Any], uid: str, level: str)
     return data
 
 
-def _prepare_conversation_for_read(conversation_data: Optional[Dict[str, Any]], uid: str) -> Optional[Dict[str, Any]]:
+def _prepare_conversation_for_read(
+        conversation_data: Optional[Dict[str, Any]], uid: str, decrypted_payload: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
     if not conversation_data:
         return None
 
-    data = copy.deepcopy(conversation_data)
+    # only top level fields are replaced or popped below, no need to deep copy the nested data
+    data = dict(conversation_data)
+    segments_log = data.pop('transcript_segments_log', None)
     level = data.get('data_protection_level')
 
     if level == 'enhanced':
-        return _decrypt_conversation_data(data, uid)
+        data = _decrypt_conversation_data(data, uid, decrypted_payload)
 
     # Handle standard level with potential compression
-    if data.get('transcript_segments_compressed'):
+    elif data.get('transcript_segments_compressed'):
         if 'transcript_segments' in data and isinstance(data['transcript_segments'], bytes):
             try:
                 decompressed_json = zlib.decompress(data['transcript_segments']).decode('utf-8')
@@ -79,9 +92,120 @@ def _prepare_conversation_for_read(conversation_data: Optional[Dict[str, Any]],
             except (json.JSONDecodeError, TypeError, zlib.error):
                 pass
 
+    if segments_log:
+        data['transcript_segments'] = _merge_segments_log(data.get('transcript_segments') or [], segments_log, uid)
+
+    return data
+
+
+def _prepare_conversations_for_read(conversations_data: List[Any], uid: str) -> List[Any]:
+    """List counterpart of _prepare_conversation_for_read, all enhanced transcripts are decrypted with a single key lookup."""
+    encrypted = [
+        i for i, data in enumerate(conversations_data)
+        if isinstance(data, dict) and data.get('data_protection_level') == 'enhanced'
+        and isinstance(data.get('transcript_segments'), str)
+    ]
+    payloads = encryption.decrypt_batch([conversations_data[i]['transcript_segments'] for i in encrypted], uid)
+    decrypted_payloads = dict(zip(encrypted, payloads))
+
+    return [
+        _prepare_conversation_for_read(data, uid, decrypted_payloads.get(i)) if isinstance(data, dict) else data
+        for i, data in enumerate(conversations_data)
+    ]
+
+
+# *********************************
+# ****** SEGMENTS LOG HELPERS *****
+# *********************************
+
+def _has_pending_segments_log(data: Dict[str, Any]) -> bool:
+    return data.get('transcript_segments_log_seq', 0) > data.get('transcript_segments_log_base', 0)
+
+
+def _prepare_segments_log_entry_for_write(segments: List[dict], uid: str, level: str, seq: int) -> Dict[str, Any]:
+    entry = _prepare_conversation_for_write({'transcript_segments': segments}, uid, level)
+    entry['seq'] = seq
+    entry['data_protection_level'] = level
+    entry['created_at'] = datetime.now()
+    return entry
+
+
+def _merge_segments_log(segments: List[dict], entries: List[Dict[str, Any]], uid: str) -> List[dict]:
+    """
+    Replays log entries (ordered by seq) on top of the compacted segments.
+    Each entry carries the segments touched by one update, a segment with a known id replaces the stored one.
+    """
+    if not isinstance(segments, list):
+        return segments
+
+    segments = list(segments)
+    index = {segment.get('id'): i for i, segment in enumerate(segments) if segment.get('id')}
+    for entry, plain_entry in zip(entries, _prepare_conversations_for_read(entries, uid)):
+        entry_segments = plain_entry.get('transcript_segments')
+        if not isinstance(entry_segments, list):
+            print(f"Could not read transcript segments log entry {entry.get('seq')}", uid)
+            continue
+        for segment in entry_segments:
+            i = index.get(segment.get('id'))
+            if i is not None:
+                segments[i] = segment
+                continue
+            if segment.get('id'):
+                index[segment['id']] = len(segments)
+            segments.append(segment)
+    return segments
+
+
+def _get_segments_log(conversation_ref, base: int = 0) -> List[firestore.DocumentSnapshot]:
+    query = (
+        conversation_ref.collection(transcript_segments_log_collection)
+        .where(filter=FieldFilter('seq', '>=', base))
+        .order_by('seq')
+    )
+    return list(query.stream())
+
+
+def _with_segments_log(doc: firestore.DocumentSnapshot) -> Optional[Dict[str, Any]]:
+    """Raw conversation data with its pending log entries attached, for _prepare_conversation_for_read."""
+    data = doc.to_dict()
+    if data and _has_pending_segments_log(data):
+        entries = _get_segments_log(doc.reference, data.get('transcript_segments_log_base', 0))
+        data['transcript_segments_log'] = [entry.to_dict() for entry in entries]
     return data
 
 
+_segments_log_fields = ['transcript_segments_log_seq', 'transcript_segments_log_base']
+
+
+@transactional
+def _set_conversation(transaction, conversation_ref, conversation_data: dict) -> Tuple[int, int]:
+    """
+    Writes the full conversation over the stored one. The log seq is kept (it only grows, appends may be racing
+    this write) and the base moves up to it: the full segments supersede the pending entries. The previous
+    (seq, base).
+    """
+    snapshot = conversation_ref.get(field_paths=_segments_log_fields, transaction=transaction)
+    log = (snapshot.to_dict() if snapshot.exists else None) or {}
+    seq = log.get('transcript_segments_log_seq', 0)
+    if seq:
+        conversation_data = {**conversation_data, 'transcript_segments_log_seq': seq,
+                             'transcript_segments_log_base': seq}
+    transaction.set(conversation_ref, conversation_data)
+    return seq, log.get('transcript_segments_log_base', 0)
+
+
+def _delete_segments_log(conversation_ref, before_seq: Optional[int] = None):
+    log_ref = conversation_ref.collection(transcript_segments_log_collection)
+    if before_seq is not None:
+        log_ref = log_ref.where(filter=FieldFilter('seq', '<', before_seq))
+    docs = list(log_ref.select([]).stream())
+    for i in range(0, len(docs), 400):
+        batch = db.batch()
+        for doc in docs[i:i + 400]:
+            batch.delete(doc.reference)
+        batch.commit()
+
+
 # *****************************
 # ********** CRUD *************
 # *****************************
@@ -96,18 +220,22 @@ def upsert_conversation(uid: str, conversation_data: dict):
 
     user_ref = db.collection('users').document(uid)
     conversation_ref = user_ref.collection(conversations_collection).document(conversation_data['id'])
-    conversation_ref.set(conversation_data)
+    seq, base = _set_conversation(db.transaction(), conversation_ref, conversation_data)
 
+    # The full segments were just written, the entries before it are stale; later appends have a greater seq
+    if seq > base:
+        _delete_segments_log(conversation_ref, before_seq=seq)
 
-@prepare_for_read(decrypt_func=_prepare_conversation_for_read)
+
+@prepare_for_read(decrypt_func=_prepare_conversation_for_read, batch_decrypt_func=_prepare_conversations_for_read)
 def get_conversation(uid, conversation_id):
     user_ref = db.collection('users').document(uid)
     conversation_ref = user_ref.collection(conversations_collection).document(conversation_id)
-    conversation_data = conversation_ref.get().to_dict()
+    conversation_data = _with_segments_log(conversation_ref.get())
     return conversation_data
 
 
-@prepare_for_read(decrypt_func=_prepare_conversation_for_read)
+@prepare_for_read(decrypt_func=_prepare_conversation_for_read, batch_decrypt_func=_prepare_conversations_for_read)
 def get_conversations(uid: str, limit: int = 100, offset: int = 0, include_discarded: bool = False,
                       statuses: List[str] = [], start_date: Optional[datetime] = None,
                       end_date: Optional[datetime] = None, categories: Optional[List[str]] = None):
@@ -134,7 +262,7 @@ def get_conversations(uid: str, limit: int = 100, offset: int = 0, include_disca
     # Limits
     conversations_ref = conversations_ref.limit(limit).offset(offset)
 
-    conversations = [doc.to_dict() for doc in conversations_ref.stream()]
+    conversations = [_with_segments_log(doc) for doc in conversations_ref.stream()]
     return conversations
 
 
@@ -144,9 +272,14 @@ def update_conversation(uid: str, conversation_id: str, update_data: dict):
     if not doc_snapshot.exists:
         return
 
-    doc_level = doc_snapshot.to_dict().get('data_protection_level', 'standard')
+    doc_data = doc_snapshot.to_dict()
+    doc_level = doc_data.get('data_protection_level', 'standard')
     prepared_data = _prepare_conversation_for_write(update_data, uid, doc_level)
+    if 'transcript_segments' in prepared_data and _has_pending_segments_log(doc_data):
+        prepared_data['transcript_segments_log_base'] = doc_data['transcript_segments_log_seq']
     doc_ref.update(prepared_data)
+    if 'transcript_segments' in prepared_data and _has_pending_segments_log(doc_data):
+        _delete_segments_log(doc_ref, before_seq=doc_data['transcript_segments_log_seq'])
 
 
 def update_conversation_title(uid: str, conversation_id: str, title: str):
@@ -164,9 +297,10 @@ def delete_conversation(uid, conversation_id):
     user_ref = db.collection('users').document(uid)
     conversation_ref = user_ref.collection(conversations_collection).document(conversation_id)
     conversation_ref.delete()
+    _delete_segments_log(conversation_ref)
 
 
-@prepare_for_read(decrypt_func=_prepare_conversation_for_read)
+@prepare_for_read(decrypt_func=_prepare_conversation_for_read, batch_decrypt_func=_prepare_conversations_for_read)
 def filter_conversations_by_date(uid, start_date, end_date):
     user_ref = db.collection('users').document(uid)
     query = (
@@ -176,11 +310,11 @@ def filter_conversations_by_date(uid, start_date, end_date):
         .where(filter=FieldFilter('discarded', '==', False))
         .order_by('created_at', direction=firestore.Query.DESCENDING)
     )
-    conversations = [doc.to_dict() for doc in query.stream()]
+    conversations = [_with_segments_log(doc) for doc in query.stream()]
     return conversations
 
 
-@prepare_for_read(decrypt_func=_prepare_conversation_for_read)
+@prepare_for_read(decrypt_func=_prepare_conversation_for_read, batch_decrypt_func=_prepare_conversations_for_read)
 def get_conversations_by_id(uid, conversation_ids):
     user_ref = db.collection('users').document(uid)
     conversations_ref = user_ref.collection(conversations_collection)
@@ -191,7 +325,7 @@ def get_conversations_by_id(uid, conversation_ids):
     conversations = []
     for doc in docs:
         if doc.exists:
-            data = doc.to_dict()
+            data = _with_segments_log(doc)
             if data.get('discarded'):
                 continue
             conversations.append(data)
@@ -234,7 +368,7 @@ def migrate_conversation_level(uid: str, conversation_id: str, target_level: str
     if not doc_snapshot.exists:
         raise ValueError("Conversation not found")
 
-    conversation_data = doc_snapshot.to_dict()
+    conversation_data = _with_segments_log(doc_snapshot)
     current_level = conversation_data.get('data_protection_level', 'standard')
 
     if current_level == target_level:
@@ -258,7 +392,14 @@ def migrate_conversation_level(uid: str, conversation_id: str, target_level: str
     if not update_data.get('transcript_segments_compressed'):
         update_data['transcript_segments_compressed'] = firestore.DELETE_FIELD
 
+    # Log entries are folded into the migrated segments
+    pending_log = _has_pending_segments_log(conversation_data)
+    if pending_log:
+        update_data['transcript_segments_log_base'] = conversation_data['transcript_segments_log_seq']
+
     doc_ref.update(update_data)
+    if pending_log:
+        _delete_segments_log(doc_ref, before_seq=conversation_data['transcript_segments_log_seq'])
 
 
 def migrate_conversations_level_batch(uid: str, conversation_ids: List[str], target_level: str):
@@ -269,13 +410,14 @@ def migrate_conversations_level_batch(uid: str, conversation_ids: List[str], tar
     conversations_ref = db.collection('users').document(uid).collection(conversations_collection)
     doc_refs = [conversations_ref.document(conv_id) for conv_id in conversation_ids]
     doc_snapshots = db.get_all(doc_refs)
+    folded_logs = []
 
     for doc_snapshot in doc_snapshots:
         if not doc_snapshot.exists:
             print(f"Conversation {doc_snapshot.id} not found, skipping.")
             continue
 
-        conversation_data = doc_snapshot.to_dict()
+        conversation_data = _with_segments_log(doc_snapshot)
         current_level = conversation_data.get('data_protection_level', 'standard')
 
         if current_level == target_level:
@@ -299,35 +441,43 @@ def migrate_conversations_level_batch(uid: str, conversation_ids: List[str], tar
         if not update_data.get('transcript_segments_compressed'):
             update_data['transcript_segments_compressed'] = firestore.DELETE_FIELD
 
+        # Log entries are folded into the migrated segments
+        if _has_pending_segments_log(conversation_data):
+            update_data['transcript_segments_log_base'] = conversation_data['transcript_segments_log_seq']
+            folded_logs.append((doc_snapshot.reference, conversation_data['transcript_segments_log_seq']))
+
         batch.update(doc_snapshot.reference, update_data)
 
     batch.commit()
 
+    for doc_ref, seq in folded_logs:
+        _delete_segments_log(doc_ref, before_seq=seq)
+
 
 # **************************************
 # ********** STATUS *************
 # **************************************
 
-@prepare_for_read(decrypt_func=_prepare_conversation_for_read)
+@prepare_for_read(decrypt_func=_prepare_conversation_for_read, batch_decrypt_func=_prepare_conversations_for_read)
 def get_in_progress_conversation(uid: str):
     user_ref = db.collection('users').document(uid)
     conversations_ref = (
         user_ref.collection(conversations_collection)
         .where(filter=FieldFilter('status', '==', 'in_progress'))
     )
-    docs = [doc.to_dict() for doc in conversations_ref.stream()]
+    docs = [_with_segments_log(doc) for doc in conversations_ref.stream()]
     conversation = docs[0] if docs else None
     return conversation
 
 
-@prepare_for_read(decrypt_func=_prepare_conversation_for_read)
+@prepare_for_read(decrypt_func=_prepare_conversation_for_read, batch_decrypt_func=_prepare_conversations_for_read)
 def get_processing_conversations(uid: str):
     user_ref = db.collection('users').document(uid)
     conversations_ref = (
         user_ref.collection(conversations_collection)
         .where(filter=FieldFilter('status', '==', 'processing'))
     )
-    conversations = [doc.to_dict() for doc in conversations_ref.stream()]
+    conversations = [_with_segments_log(doc) for doc in conversations_ref.stream()]
     return conversations
 
 
@@ -370,15 +520,97 @@ def update_conversation_finished_at(uid: str, conversation_id: str, finished_at:
 
 
 def update_conversation_segments(uid: str, conversation_id: str, segments: List[dict]):
+    """Rewrites the full segments, any pending log entries are superseded."""
     doc_ref = db.collection('users').document(uid).collection(conversations_collection).document(conversation_id)
-    doc_snapshot = doc_ref.get(field_paths=['data_protection_level'])
+    doc_snapshot = doc_ref.get(
+        field_paths=['data_protection_level', 'transcript_segments_log_seq', 'transcript_segments_log_base'])
     if not doc_snapshot.exists:
         return
 
-    doc_level = doc_snapshot.to_dict().get('data_protection_level', 'standard')
+    doc_data = doc_snapshot.to_dict()
+    doc_level = doc_data.get('data_protection_level', 'standard')
     update_payload = {'transcript_segments': segments}
     prepared_payload = _prepare_conversation_for_write(update_payload, uid, doc_level)
+    pending_log = _has_pending_segments_log(doc_data)
+    if pending_log:
+        prepared_payload['transcript_segments_log_base'] = doc_data['transcript_segments_log_seq']
     doc_ref.update(prepared_payload)
+    if pending_log:
+        _delete_segments_log(doc_ref, before_seq=doc_data['transcript_segments_log_seq'])
+
+
+def append_conversation_segments(uid: str, conversation_id: str, segments: List[dict]) -> bool:
+    """
+    Appends the segments touched by a streaming update (new ones, or existing ones by id) to the segments log,
+    so the write cost is proportional to the update instead of the whole transcript.
+
+    True once the log is due for `compact_conversation_segments`, which the caller runs off its hot path.
+    """
+    if not segments:
+        return False
+
+    doc_ref = db.collection('users').document(uid).collection(conversations_collection).document(conversation_id)
+    doc_snapshot = doc_ref.get(
+        field_paths=['data_protection_level', 'transcript_segments_log_seq', 'transcript_segments_log_base'])
+    if not doc_snapshot.exists:
+        return False
+
+    doc_data = doc_snapshot.to_dict()
+    doc_level = doc_data.get('data_protection_level', 'standard')
+    seq = doc_data.get('transcript_segments_log_seq', 0)
+    base = doc_data.get('transcript_segments_log_base', 0)
+
+    # Entries are created, never overwritten; on a concurrent append move to the next seq
+    for _ in range(5):
+        entry = _prepare_segments_log_entry_for_write(segments, uid, doc_level, seq)
+        batch = db.batch()
+        batch.create(doc_ref.collection(transcript_segments_log_collection).document(f'{seq:012d}'), entry)
+        batch.update(doc_ref, {'transcript_segments_log_seq': firestore.Maximum(seq + 1)})
+        try:
+            batch.commit()
+            break
+        except Conflict:
+            seq += 1
+    else:
+        raise Exception(f'Could not append transcript segments log of {conversation_id}')
+
+    return seq + 1 - base >= transcript_segments_log_compact_every
+
+
+def compact_conversation_segments(uid: str, conversation_id: str, attempts: int = 3) -> bool:
+    """
+    Folds the pending segments log into the compressed `transcript_segments` of the conversation. Written only if
+    the document is unchanged since it was read, read again otherwise (a racing append or full rewrite). False if
+    nothing was folded.
+    """
+    doc_ref = db.collection('users').document(uid).collection(conversations_collection).document(conversation_id)
+    for _ in range(attempts):
+        doc_snapshot = doc_ref.get()
+        if not doc_snapshot.exists:
+            return False
+
+        conversation_data = _with_segments_log(doc_snapshot)
+        entries = conversation_data.get('transcript_segments_log')
+        if not entries:
+            return False
+
+        plain_data = _prepare_conversation_for_read(conversation_data, uid)
+        level = conversation_data.get('data_protection_level', 'standard')
+        prepared_payload = _prepare_conversation_for_write(
+            {'transcript_segments': plain_data.get('transcript_segments')}, uid, level)
+
+        # Entries appended meanwhile have a greater seq and stay in the log
+        folded_seq = entries[-1]['seq'] + 1
+        prepared_payload['transcript_segments_log_base'] = folded_seq
+        try:
+            doc_ref.update(prepared_payload, option=db.write_option(last_update_time=doc_snapshot.update_time))
+        except FailedPrecondition:
+            continue
+        except NotFound:
+            return False
+        _delete_segments_log(doc_ref, before_seq=folded_seq)
+        return True
+    return False
 
 
 # ***********************************
@@ -391,7 +623,7 @@ def set_conversation_visibility(uid: str, conversation_id: str, visibility: str)
     conversation_ref.update({'visibility': visibility})
 
 
-@prepare_for_read(decrypt_func=_prepare_conversation_for_read)
+@prepare_for_read(decrypt_func=_prepare_conversation_for_read, batch_decrypt_func=_prepare_conversations_for_read)
 async def _get_public_conversation(db_client: AsyncClient, uid: str, conversation_id: str):
     conversation_ref = db_client.collection('users').document(uid).collection('conversations').document(conversation_id)
     conversation_doc = await conversation_ref.get()
@@ -517,7 +749,7 @@ def get_conversation_photos(uid: str, conversation_id: str):
 # ********** SYNCING *************
 # ********************************
 
-@prepare_for_read(decrypt_func=_prepare_conversation_for_read)
+@prepare_for_read(decrypt_func=_prepare_conversation_for_read, batch_decrypt_func=_prepare_conversations_for_read)
 def get_closest_conversation_to_timestamps(
         uid: str, start_timestamp: int, end_timestamp: int
 ) -> Optional[dict]:
@@ -533,7 +765,7 @@ def get_closest_conversation_to_timestamps(
         .order_by('created_at', direction=firestore.Query.DESCENDING)
     )
 
-    conversations = [doc.to_dict() for doc in query.stream()]
+    conversations = [_with_segments_log(doc) for doc in query.stream()]
     print('get_closest_conversation_to_timestamps len(conversations)', len(conversations))
     if not conversations:
         return None
@@ -542,23 +774,90 @@ def get_closest_conversation_to_timestamps(
     for conversation in conversations:
         print('-', conversation['id'], conversation['started_at'], conversation['finished_at'])
 
-    # get the conversation that has the closest start timestamp or end timestamp
+    closest_conversation = closest_conversation_to_timestamps(conversations, start_timestamp, end_timestamp)
+    print('get_closest_conversation_to_timestamps closest_conversation:', closest_conversation['id'])
+    return closest_conversation
+
+
+def closest_conversation_to_timestamps(
+        conversations: List[dict], start_timestamp: float, end_timestamp: float
+) -> Optional[dict]:
+    """
+    The one of `conversations` (newest first) that `get_closest_conversation_to_timestamps` returns: within 2
+    minutes of the span, the closest by start or end timestamp.
+    """
     closest_conversation = None
     min_diff = float('inf')
     for conversation in conversations:
         conversation_start_timestamp = conversation['started_at'].timestamp()
         conversation_end_timestamp = conversation['finished_at'].timestamp()
+        if conversation_end_timestamp < start_timestamp - 120 or conversation_start_timestamp > end_timestamp + 120:
+            continue
+        # get the conversation that has the closest start timestamp or end timestamp
         diff1 = abs(conversation_start_timestamp - start_timestamp)
         diff2 = abs(conversation_end_timestamp - end_timestamp)
         if diff1 < min_diff or diff2 < min_diff:
             min_diff = min(diff1, diff2)
             closest_conversation = conversation
-
-    print('get_closest_conversation_to_timestamps closest_conversation:', closest_conversation['id'])
     return closest_conversation
 
 
+@prepare_for_read(decrypt_func=_prepare_conversation_for_read, batch_decrypt_func=_prepare_conversations_for_read)
+def get_conversations_near_timestamps(uid: str, start_timestamp: int, end_timestamp: int) -> List[dict]:
+    """
+    Every conversation `get_closest_conversation_to_timestamps` could return for a span within the range, newest
+    first, in one query. Each has the `update_time` of its document, for `update_conversation_segments_if_unchanged`.
+    """
+    start_threshold = datetime.utcfromtimestamp(start_timestamp) - timedelta(minutes=2)
+    end_threshold = datetime.utcfromtimestamp(end_timestamp) + timedelta(minutes=2)
+    query = (
+        db.collection('users').document(uid).collection(conversations_collection)
+        .where(filter=FieldFilter('finished_at', '>=', start_threshold))
+        .where(filter=FieldFilter('started_at', '<=', end_threshold))
+        .order_by('created_at', direction=firestore.Query.DESCENDING)
+    )
+    conversations = []
+    for doc in query.stream():
+        conversation = _with_segments_log(doc)
+        conversation['update_time'] = doc.update_time
+        conversations.append(conversation)
+    return conversations
+
+
 @prepare_for_read(decrypt_func=_prepare_conversation_for_read)
+def get_conversation_for_update(uid: str, conversation_id: str) -> Optional[dict]:
+    """The conversation with the `update_time` of its document, for `update_conversation_segments_if_unchanged`."""
+    doc_ref = db.collection('users').document(uid).collection(conversations_collection).document(conversation_id)
+    doc = doc_ref.get()
+    if not doc.exists:
+        return None
+    conversation = _with_segments_log(doc)
+    conversation['update_time'] = doc.update_time
+    return conversation
+
+
+def update_conversation_segments_if_unchanged(uid: str, conversation: dict, segments: List[dict]) -> bool:
+    """
+    `update_conversation_segments` without reading the document again: `conversation` is how it was read (with its
+    `update_time`). False, and nothing written, if the document changed since.
+    """
+    doc_ref = db.collection('users').document(uid).collection(conversations_collection).document(conversation['id'])
+    doc_level = conversation.get('data_protection_level', 'standard')
+    prepared_payload = _prepare_conversation_for_write({'transcript_segments': segments}, uid, doc_level)
+    # the segments read included the pending log entries, folded in now
+    pending_log = _has_pending_segments_log(conversation)
+    if pending_log:
+        prepared_payload['transcript_segments_log_base'] = conversation['transcript_segments_log_seq']
+    try:
+        doc_ref.update(prepared_payload, option=db.write_option(last_update_time=conversation['update_time']))
+    except (FailedPrecondition, NotFound):
+        return False
+    if pending_log:
+        _delete_segments_log(doc_ref, before_seq=conversation['transcript_segments_log_seq'])
+    return True
+
+
+@prepare_for_read(decrypt_func=_prepare_conversation_for_read, batch_decrypt_func=_prepare_conversations_for_read)
 def get_last_completed_conversation(uid: str) -> Optional[dict]:
     query = (
         db.collection('users').document(uid).collection(conversations_collection)
@@ -566,6 +865,6 @@ def get_last_completed_conversation(uid: str) -> Optional[dict]:
         .order_by('created_at', direction=firestore.Query.DESCENDING)
         .limit(1)
     )
-    conversations = [doc.to_dict() for doc in query.stream()]
+    conversations = [_with_segments_log(doc) for doc in query.stream()]
     conversation = conversations[0] if conversations else None
     return conversation
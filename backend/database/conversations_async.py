@@ -0,0 +1,290 @@
+"""
+Asyncio-native access to conversations and in-progress state.
+
+Mirrors the subset of `database.conversations` and `database.redis_db` used by the realtime
+listen websocket, so that Firestore and Redis round trips never block the event loop.
+Storage formats (compression, encryption, protection levels, redis keys) are shared with the
+sync modules, both can be used against the same documents.
+
+The clients are module attributes (`async_db`, `ar`); point them at the Firestore emulator
+(FIRESTORE_EMULATOR_HOST) or swap them for in-memory fakes in tests. Both are bound to the event loop
+that first uses them (their gRPC channel / connection pool is created there), so only call these
+functions from the server's loop: not from `asyncio.run` in a worker thread, nor from a second loop.
+"""
+import ast
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from google.api_core.exceptions import Conflict, FailedPrecondition, NotFound
+from google.cloud import firestore
+from google.cloud.firestore_v1 import FieldFilter, async_transactional
+
+from models.conversation import ConversationStatus
+from ._client import async_db
+from .conversations import conversations_collection, transcript_segments_log_collection, \
+    transcript_segments_log_compact_every, _prepare_conversation_for_write, _prepare_conversation_for_read, \
+    _prepare_conversations_for_read, _prepare_segments_log_entry_for_write, _has_pending_segments_log, \
+    _segments_log_fields
+from .redis_db import ar
+
+
+def _conversations_ref(uid: str):
+    return async_db.collection('users').document(uid).collection(conversations_collection)
+
+
+async def _with_segments_log(doc) -> Optional[dict]:
+    data = doc.to_dict()
+    if data and _has_pending_segments_log(data):
+        query = (
+            doc.reference.collection(transcript_segments_log_collection)
+            .where(filter=FieldFilter('seq', '>=', data.get('transcript_segments_log_base', 0)))
+            .order_by('seq')
+        )
+        data['transcript_segments_log'] = [entry.to_dict() async for entry in query.stream()]
+    return data
+
+
+@async_transactional
+async def _set_conversation(transaction, conversation_ref, conversation_data: dict) -> Tuple[int, int]:
+    """Async counterpart of `database.conversations._set_conversation`."""
+    snapshot = await conversation_ref.get(field_paths=_segments_log_fields, transaction=transaction)
+    log = (snapshot.to_dict() if snapshot.exists else None) or {}
+    seq = log.get('transcript_segments_log_seq', 0)
+    if seq:
+        conversation_data = {**conversation_data, 'transcript_segments_log_seq': seq,
+                             'transcript_segments_log_base': seq}
+    transaction.set(conversation_ref, conversation_data)
+    return seq, log.get('transcript_segments_log_base', 0)
+
+
+async def _delete_segments_log(conversation_ref, before_seq: Optional[int] = None):
+    log_ref = conversation_ref.collection(transcript_segments_log_collection)
+    if before_seq is not None:
+        log_ref = log_ref.where(filter=FieldFilter('seq', '<', before_seq))
+    docs = [doc async for doc in log_ref.select([]).stream()]
+    for i in range(0, len(docs), 400):
+        batch = async_db.batch()
+        for doc in docs[i:i + 400]:
+            batch.delete(doc.reference)
+        await batch.commit()
+
+
+# *****************************
+# ********* REDIS *************
+# *****************************
+
+async def set_in_progress_conversation_id(uid: str, conversation_id: str, ttl: int = 150):
+    await ar.set(f'users:{uid}:in_progress_memory_id', conversation_id, ex=ttl)
+
+
+async def remove_in_progress_conversation_id(uid: str):
+    await ar.delete(f'users:{uid}:in_progress_memory_id')
+
+
+async def get_in_progress_conversation_id(uid: str) -> str:
+    conversation_id = await ar.get(f'users:{uid}:in_progress_memory_id')
+    if not conversation_id:
+        return ''
+    return conversation_id.decode()
+
+
+async def claim_conversation_processing(conversation_id: str, token: str, ttl: int = 600) -> bool:
+    return bool(await ar.set(f'conversations:{conversation_id}:processing_claim', token, nx=True, ex=ttl))
+
+
+async def release_conversation_processing(conversation_id: str, token: str):
+    key = f'conversations:{conversation_id}:processing_claim'
+    claim = await ar.get(key)
+    if claim and claim.decode() == token:
+        await ar.delete(key)
+
+
+async def get_cached_user_geolocation(uid: str):
+    geolocation = await ar.get(f'users:{uid}:geolocation')
+    if not geolocation:
+        return None
+    return ast.literal_eval(geolocation.decode())
+
+
+async def get_user_data_protection_level(uid: str) -> str:
+    """Cached protection level, falls back to the user profile (same keys as the sync helpers)."""
+    key = f'user:{uid}:data_protection_level'
+    try:
+        level = await ar.get(key)
+        if level:
+            return level.decode()
+    except Exception as e:
+        print('Error calling get_user_data_protection_level', e)
+
+    level = 'standard'
+    try:
+        user_doc = await async_db.collection('users').document(uid).get()
+        if user_doc.exists:
+            level = user_doc.to_dict().get('data_protection_level') or 'standard'
+        await ar.set(key, level)
+    except Exception as e:
+        print(f"Failed to get user profile for {uid}: {e}")
+    return level
+
+
+# *****************************
+# ********** CRUD *************
+# *****************************
+
+async def upsert_conversation(uid: str, conversation_data: dict):
+    data = dict(conversation_data)
+    if data.get('data_protection_level') is None:
+        data['data_protection_level'] = await get_user_data_protection_level(uid)
+    data.pop('audio_base64_url', None)
+    data.pop('photos', None)
+
+    prepared_data = _prepare_conversation_for_write(data, uid, data['data_protection_level'])
+    conversation_ref = _conversations_ref(uid).document(data['id'])
+    seq, base = await _set_conversation(async_db.transaction(), conversation_ref, prepared_data)
+    if seq > base:
+        await _delete_segments_log(conversation_ref, before_seq=seq)
+    return conversation_data
+
+
+async def get_conversation(uid: str, conversation_id: str):
+    doc = await _conversations_ref(uid).document(conversation_id).get()
+    return _prepare_conversation_for_read(await _with_segments_log(doc), uid)
+
+
+async def get_in_progress_conversation(uid: str):
+    query = _conversations_ref(uid).where(filter=FieldFilter('status', '==', 'in_progress'))
+    docs = [doc async for doc in query.stream()]
+    return _prepare_conversation_for_read(await _with_segments_log(docs[0]), uid) if docs else None
+
+
+async def get_processing_conversations(uid: str) -> List[dict]:
+    query = _conversations_ref(uid).where(filter=FieldFilter('status', '==', 'processing'))
+    return _prepare_conversations_for_read([await _with_segments_log(doc) async for doc in query.stream()], uid)
+
+
+async def get_last_completed_conversation(uid: str) -> Optional[dict]:
+    query = (
+        _conversations_ref(uid)
+        .where(filter=FieldFilter('status', '==', ConversationStatus.completed))
+        .order_by('created_at', direction=firestore.Query.DESCENDING)
+        .limit(1)
+    )
+    docs = [doc async for doc in query.stream()]
+    return _prepare_conversation_for_read(await _with_segments_log(docs[0]), uid) if docs else None
+
+
+# **************************************
+# ********** STATUS *************
+# **************************************
+
+async def update_conversation_status(uid: str, conversation_id: str, status: str):
+    await _conversations_ref(uid).document(conversation_id).update({'status': status})
+
+
+async def set_conversation_as_discarded(uid: str, conversation_id: str):
+    await _conversations_ref(uid).document(conversation_id).update({'discarded': True})
+
+
+async def update_conversation_finished_at(uid: str, conversation_id: str, finished_at: datetime):
+    await _conversations_ref(uid).document(conversation_id).update({'finished_at': finished_at})
+
+
+async def update_conversation_segments(uid: str, conversation_id: str, segments: List[dict]):
+    doc_ref = _conversations_ref(uid).document(conversation_id)
+    doc_snapshot = await doc_ref.get(
+        field_paths=['data_protection_level', 'transcript_segments_log_seq', 'transcript_segments_log_base'])
+    if not doc_snapshot.exists:
+        return
+
+    doc_data = doc_snapshot.to_dict()
+    doc_level = doc_data.get('data_protection_level', 'standard')
+    prepared_payload = _prepare_conversation_for_write({'transcript_segments': segments}, uid, doc_level)
+    pending_log = _has_pending_segments_log(doc_data)
+    if pending_log:
+        prepared_payload['transcript_segments_log_base'] = doc_data['transcript_segments_log_seq']
+    await doc_ref.update(prepared_payload)
+    if pending_log:
+        await _delete_segments_log(doc_ref, before_seq=doc_data['transcript_segments_log_seq'])
+
+
+async def append_conversation_segments(uid: str, conversation_id: str, segments: List[dict]) -> bool:
+    """Async counterpart of `database.conversations.append_conversation_segments`."""
+    if not segments:
+        return False
+
+    doc_ref = _conversations_ref(uid).document(conversation_id)
+    doc_snapshot = await doc_ref.get(
+        field_paths=['data_protection_level', 'transcript_segments_log_seq', 'transcript_segments_log_base'])
+    if not doc_snapshot.exists:
+        return False
+
+    doc_data = doc_snapshot.to_dict()
+    doc_level = doc_data.get('data_protection_level', 'standard')
+    seq = doc_data.get('transcript_segments_log_seq', 0)
+    base = doc_data.get('transcript_segments_log_base', 0)
+
+    for _ in range(5):
+        entry = _prepare_segments_log_entry_for_write(segments, uid, doc_level, seq)
+        batch = async_db.batch()
+        batch.create(doc_ref.collection(transcript_segments_log_collection).document(f'{seq:012d}'), entry)
+        batch.update(doc_ref, {'transcript_segments_log_seq': firestore.Maximum(seq + 1)})
+        try:
+            await batch.commit()
+            break
+        except Conflict:
+            seq += 1
+    else:
+        raise Exception(f'Could not append transcript segments log of {conversation_id}')
+
+    return seq + 1 - base >= transcript_segments_log_compact_every
+
+
+async def compact_conversation_segments(uid: str, conversation_id: str, attempts: int = 3) -> bool:
+    """Async counterpart of `database.conversations.compact_conversation_segments`."""
+    doc_ref = _conversations_ref(uid).document(conversation_id)
+    for _ in range(attempts):
+        doc_snapshot = await doc_ref.get()
+        if not doc_snapshot.exists:
+            return False
+
+        conversation_data = await _with_segments_log(doc_snapshot)
+        entries = conversation_data.get('transcript_segments_log')
+        if not entries:
+            return False
+
+        plain_data = _prepare_conversation_for_read(conversation_data, uid)
+        level = conversation_data.get('data_protection_level', 'standard')
+        prepared_payload = _prepare_conversation_for_write(
+            {'transcript_segments': plain_data.get('transcript_segments')}, uid, level)
+
+        folded_seq = entries[-1]['seq'] + 1
+        prepared_payload['transcript_segments_log_base'] = folded_seq
+        try:
+            await doc_ref.update(prepared_payload,
+                                 option=async_db.write_option(last_update_time=doc_snapshot.update_time))
+        except FailedPrecondition:
+            continue
+        except NotFound:
+            return False
+        await _delete_segments_log(doc_ref, before_seq=folded_seq)
+        return True
+    return False
+
+
+# *************************************
+# ********** IN PROGRESS **************
+# *************************************
+
+async def retrieve_in_progress_conversation(uid: str):
+    """Async counterpart of `utils.conversations.process_conversation.retrieve_in_progress_conversation`."""
+    conversation_id = await get_in_progress_conversation_id(uid)
+    existing = None
+
+    if conversation_id:
+        existing = await get_conversation(uid, conversation_id)
+        if existing and existing['status'] != 'in_progress':
+            existing = None
+
+    if not existing:
+        existing = await get_in_progress_conversation(uid)
+    return existing
@@ -1,6 +1,6 @@
 import inspect
 from functools import wraps
-from typing import List, Dict, Any, Callable
+from typing import List, Dict, Any, Callable, Optional
 
 from database import users as users_db, redis_db
 
@@ -80,11 +80,17 @@ def set_data_protection_level(data_arg_name: str):
     return decorator
 
 
-def prepare_for_write(data_arg_name: str, prepare_func: Callable[[Dict[str, Any], str, str], Dict[str, Any]]):
+def prepare_for_write(
+        data_arg_name: str,
+        prepare_func: Callable[[Dict[str, Any], str, str], Dict[str, Any]],
+        batch_prepare_func: Optional[Callable[[List[Dict[str, Any]], str], List[Dict[str, Any]]]] = None,
+):
     """
     Decorator to prepare data before writing to the database.
     It uses the provided prepare_func to handle the specifics of data preparation,
     such as compression or encryption, based on the data's protection level.
+    Lists go through batch_prepare_func when given, so that a whole batch is encrypted with one key lookup;
+    it must return a list of the same length and leave the original items untouched.
     The decorated function's return value is ignored; the decorator returns the original, unencrypted data.
 
     Assumes 'uid' and the data dictionary (specified by data_arg_name) are arguments
@@ -113,7 +119,9 @@ def prepare_for_write(data_arg_name: str, prepare_func: Callable[[Dict[str, Any]
             if isinstance(original_data, dict):
                 prepared_data = prepare_func(original_data, uid, original_data.get('data_protection_level', 'standard'))
             elif isinstance(original_data, list):
-                if original_data and isinstance(original_data[0], dict):
+                if original_data and isinstance(original_data[0], dict) and batch_prepare_func is not None:
+                    prepared_data = batch_prepare_func(original_data, uid)
+                elif original_data and isinstance(original_data[0], dict):
                     prepared_data = [prepare_func(item, uid, item.get('data_protection_level', 'standard')) for item in original_data]
 
             # Modify the bound arguments with the prepared data and reconstruct the call
@@ -126,11 +134,16 @@ def prepare_for_write(data_arg_name: str, prepare_func: Callable[[Dict[str, Any]
     return decorator
 
 
-def prepare_for_read(decrypt_func: Callable[[Dict[str, Any], str], Dict[str, Any]]):
+def prepare_for_read(
+        decrypt_func: Callable[[Dict[str, Any], str], Dict[str, Any]],
+        batch_decrypt_func: Optional[Callable[[List[Any], str], List[Any]]] = None,
+):
     """
     Decorator to decrypt data after reading from the database.
     It processes the return value of the decorated function. If the return value is a dict or
     list of dicts, it applies the decrypt_func based on the 'data_protection_level' field.
+    Lists go through batch_decrypt_func when given, so that a whole page is decrypted with one key lookup;
+    it must return a list of the same length, leaving non-dict items untouched.
 
     Assumes 'uid' is an argument to the decorated function to be used for decryption.
     """
@@ -157,10 +170,15 @@ def prepare_for_read(decrypt_func: Callable[[Dict[str, Any], str], Dict[str, Any
                     return decrypt_func(item, uid)
                 return item
 
+            def _process_list(items):
+                if batch_decrypt_func is not None:
+                    return batch_decrypt_func(items, uid)
+                return [_process(item) for item in items]
+
             if isinstance(result, dict):
                 return _process(result)
             elif isinstance(result, list):
-                return [_process(item) for item in result]
+                return _process_list(result)
             elif isinstance(result, tuple):
                 # Handle functions that return a tuple, e.g., (data, doc_id)
                 processed_elements = []
@@ -168,7 +186,7 @@ def prepare_for_read(decrypt_func: Callable[[Dict[str, Any], str], Dict[str, Any
                     if isinstance(element, dict):
                         processed_elements.append(_process(element))
                     elif isinstance(element, list):
-                        processed_elements.append([_process(item) for item in element])
+                        processed_elements.append(_process_list(element))
                     else:
                         processed_elements.append(element)
                 return tuple(processed_elements)
@@ -9,9 +9,12 @@ from ._client import db
 from database import users as users_db
 from utils import encryption
 from .helpers import set_data_protection_level, prepare_for_write, prepare_for_read
+from .redis_db import bump_user_memories_version
 
 memories_collection = 'memories'
 users_collection = 'users'
+# Firestore batches hold at most 500 writes
+memories_batch_size = 400
 
 
 # *********************************
@@ -43,6 +46,23 @@ def _prepare_data_for_write(data: Dict[str, Any], uid: str, level: str) -> Dict[
     return data
 
 
+def _prepare_memories_for_write(memories_data: List[Dict[str, Any]], uid: str) -> List[Dict[str, Any]]:
+    """List counterpart of _prepare_data_for_write, all enhanced contents are encrypted with a single key lookup."""
+    result = []
+    plain = []
+    for memory_data in memories_data:
+        if memory_data.get('data_protection_level') == 'enhanced' and isinstance(memory_data.get('content'), str):
+            # only the top level 'content' is replaced, a shallow copy keeps the caller's data untouched
+            memory_data = dict(memory_data)
+            plain.append(memory_data)
+        result.append(memory_data)
+
+    encrypted = encryption.encrypt_batch([memory_data['content'] for memory_data in plain], uid)
+    for memory_data, content in zip(plain, encrypted):
+        memory_data['content'] = content
+    return result
+
+
 def _prepare_memory_for_read(memory_data: Optional[Dict[str, Any]], uid: str) -> Optional[Dict[str, Any]]:
     if not memory_data:
         return None
@@ -54,11 +74,31 @@ def _prepare_memory_for_read(memory_data: Optional[Dict[str, Any]], uid: str) ->
     return memory_data
 
 
+def _prepare_memories_for_read(memories_data: List[Any], uid: str) -> List[Any]:
+    """List counterpart of _prepare_memory_for_read, all enhanced contents are decrypted with a single key lookup."""
+    result = []
+    encrypted = []
+    for memory_data in memories_data:
+        if isinstance(memory_data, dict):
+            if not memory_data:
+                memory_data = None
+            elif memory_data.get('data_protection_level') == 'enhanced' and isinstance(memory_data.get('content'), str):
+                # only the top level 'content' is replaced, a shallow copy keeps the raw data untouched
+                memory_data = dict(memory_data)
+                encrypted.append(memory_data)
+        result.append(memory_data)
+
+    decrypted = encryption.decrypt_batch([memory_data['content'] for memory_data in encrypted], uid)
+    for memory_data, content in zip(encrypted, decrypted):
+        memory_data['content'] = content
+    return result
+
+
 # *****************************
 # ********** CRUD *************
 # *****************************
 
-@prepare_for_read(decrypt_func=_prepare_memory_for_read)
+@prepare_for_read(decrypt_func=_prepare_memory_for_read, batch_decrypt_func=_prepare_memories_for_read)
 def get_memories(uid: str, limit: int = 100, offset: int = 0, categories: List[str] = []):
     print('get_memories db', uid, limit, offset, categories)
     memories_ref = db.collection(users_collection).document(uid).collection(memories_collection)
@@ -80,7 +120,7 @@ def get_memories(uid: str, limit: int = 100, offset: int = 0, categories: List[s
     return result
 
 
-@prepare_for_read(decrypt_func=_prepare_memory_for_read)
+@prepare_for_read(decrypt_func=_prepare_memory_for_read, batch_decrypt_func=_prepare_memories_for_read)
 def get_user_public_memories(uid: str, limit: int = 100, offset: int = 0):
     print('get_public_memories', limit, offset)
 
@@ -100,7 +140,7 @@ def get_user_public_memories(uid: str, limit: int = 100, offset: int = 0):
     return public_memories
 
 
-@prepare_for_read(decrypt_func=_prepare_memory_for_read)
+@prepare_for_read(decrypt_func=_prepare_memory_for_read, batch_decrypt_func=_prepare_memories_for_read)
 def get_non_filtered_memories(uid: str, limit: int = 100, offset: int = 0):
     print('get_non_filtered_memories', uid, limit, offset)
     memories_ref = db.collection(users_collection).document(uid).collection(memories_collection)
@@ -119,21 +159,24 @@ def create_memory(uid: str, data: dict):
     memories_ref = user_ref.collection(memories_collection)
     memory_ref = memories_ref.document(data['id'])
     memory_ref.set(data)
+    bump_user_memories_version(uid)
 
 
 @set_data_protection_level(data_arg_name='data')
-@prepare_for_write(data_arg_name='data', prepare_func=_prepare_data_for_write)
+@prepare_for_write(data_arg_name='data', prepare_func=_prepare_data_for_write,
+                   batch_prepare_func=_prepare_memories_for_write)
 def save_memories(uid: str, data: List[dict]):
     if not data:
         return
 
-    batch = db.batch()
     user_ref = db.collection(users_collection).document(uid)
     memories_ref = user_ref.collection(memories_collection)
-    for memory in data:
-        memory_ref = memories_ref.document(memory['id'])
-        batch.set(memory_ref, memory)
-    batch.commit()
+    for i in range(0, len(data), memories_batch_size):
+        batch = db.batch()
+        for memory in data[i:i + memories_batch_size]:
+            batch.set(memories_ref.document(memory['id']), memory)
+        batch.commit()
+    bump_user_memories_version(uid)
 
 
 def delete_memories(uid: str):
@@ -143,9 +186,10 @@ def delete_memories(uid: str):
     for doc in memories_ref.stream():
         batch.delete(doc.reference)
     batch.commit()
+    bump_user_memories_version(uid)
 
 
-@prepare_for_read(decrypt_func=_prepare_memory_for_read)
+@prepare_for_read(decrypt_func=_prepare_memory_for_read, batch_decrypt_func=_prepare_memories_for_read)
 def get_memory(uid: str, memory_id: str):
     user_ref = db.collection(users_collection).document(uid)
     memories_ref = user_ref.collection(memories_collection)
@@ -159,6 +203,7 @@ def review_memory(uid: str, memory_id: str, value: bool):
     memories_ref = user_ref.collection(memories_collection)
     memory_ref = memories_ref.document(memory_id)
     memory_ref.update({'reviewed': True, 'user_review': value})
+    bump_user_memories_version(uid)
 
 
 def change_memory_visibility(uid: str, memory_id: str, value: str):
@@ -166,6 +211,7 @@ def change_memory_visibility(uid: str, memory_id: str, value: str):
     memories_ref = user_ref.collection(memories_collection)
     memory_ref = memories_ref.document(memory_id)
     memory_ref.update({'visibility': value})
+    bump_user_memories_version(uid)
 
 
 def edit_memory(uid: str, memory_id: str, value: str):
@@ -183,6 +229,7 @@ def edit_memory(uid: str, memory_id: str, value: str):
         content = encryption.encrypt(content, uid)
 
     memory_ref.update({'content': content, 'edited': True, 'updated_at': datetime.now(timezone.utc)})
+    bump_user_memories_version(uid)
 
 
 def delete_memory(uid: str, memory_id: str):
@@ -190,6 +237,7 @@ def delete_memory(uid: str, memory_id: str):
     memories_ref = user_ref.collection(memories_collection)
     memory_ref = memories_ref.document(memory_id)
     memory_ref.delete()
+    bump_user_memories_version(uid)
 
 
 def delete_all_memories(uid: str):
@@ -199,6 +247,7 @@ def delete_all_memories(uid: str):
     for doc in memories_ref.stream():
         batch.delete(doc.reference)
     batch.commit()
+    bump_user_memories_version(uid)
 
 
 def delete_memories_for_conversation(uid: str, memory_id: str):
@@ -214,6 +263,8 @@ def delete_memories_for_conversation(uid: str, memory_id: str):
         batch.delete(doc.reference)
         removed_ids.append(doc.id)
     batch.commit()
+    if removed_ids:
+        bump_user_memories_version(uid)
     print('delete_memories_for_conversation', memory_id, len(removed_ids))
 
 
@@ -347,5 +398,6 @@ def migrate_memories(prev_uid: str, new_uid: str, app_id: str = None):
 
     # Commit batch
     batch.commit()
+    bump_user_memories_version(new_uid)
     print(f'Migrated {len(memories_to_migrate)} memories from {prev_uid} to {new_uid}')
     return len(memories_to_migrate)
@@ -1,9 +1,10 @@
 import base64
 import json
 import os
-from typing import List, Union, Optional
+from typing import List, Union, Optional, Tuple
 
 import redis
+import redis.asyncio
 
 r = redis.Redis(
     host=os.getenv('REDIS_DB_HOST'),
@@ -13,6 +14,16 @@ r = redis.Redis(
     health_check_interval=30
 )
 
+# Non-blocking client for code running on the event loop, shares the same keys as `r`. Its connections
+# belong to the first loop that uses it: never use it from another loop
+ar = redis.asyncio.Redis(
+    host=os.getenv('REDIS_DB_HOST'),
+    port=int(os.getenv('REDIS_DB_PORT')) if os.getenv('REDIS_DB_PORT') is not None else 6379,
+    username='default',
+    password=os.getenv('REDIS_DB_PASSWORD'),
+    health_check_interval=30
+)
+
 
 def try_catch_decorator(func):
     def wrapper(*args, **kwargs):
@@ -211,10 +222,12 @@ def get_user_paid_app(app_id: str, uid: str) -> str:
 
 def enable_app(uid: str, app_id: str):
     r.sadd(f'users:{uid}:enabled_plugins', app_id)
+    bump_user_apps_registry_version(uid)
 
 
 def disable_app(uid: str, app_id: str):
     r.srem(f'users:{uid}:enabled_plugins', app_id)
+    bump_user_apps_registry_version(uid)
 
 
 def get_enabled_apps(uid: str):
@@ -224,6 +237,61 @@ def get_enabled_apps(uid: str):
     return [x.decode() for x in val]
 
 
+# ******************************************************
+# ******************* APPS REGISTRY ********************
+# ******************************************************
+
+def get_apps_registry_versions(uid: str) -> Tuple[int, int]:
+    """(global apps version, user enabled apps version), a registry built under other versions is stale."""
+    global_version, user_version = r.mget('apps:registry_version', f'users:{uid}:apps_registry_version')
+    return int(global_version or 0), int(user_version or 0)
+
+
+def get_apps_registry_version() -> int:
+    """The global part of `get_apps_registry_versions`, for caches that don't depend on the user."""
+    return int(r.get('apps:registry_version') or 0)
+
+
+def bump_apps_registry_version():
+    r.incr('apps:registry_version')
+
+
+def bump_user_apps_registry_version(uid: str):
+    r.incr(f'users:{uid}:apps_registry_version')
+
+
+def set_user_apps_registry(uid: str, versions: Tuple[int, int], apps: List[dict], ttl: int = 60 * 60):
+    data = {'versions': list(versions), 'apps': apps}
+    r.set(f'users:{uid}:apps_registry', json.dumps(data, default=str), ex=ttl)
+
+
+def get_user_apps_registry(uid: str) -> dict | None:
+    data = r.get(f'users:{uid}:apps_registry')
+    return json.loads(data) if data else None
+
+
+def set_app_selection(signature: str, app_id: str, ttl: int = 60 * 60 * 24):
+    r.set(f'apps:selection:{signature}', app_id, ex=ttl)
+
+
+def get_app_selection(signature: str) -> str | None:
+    app_id = r.get(f'apps:selection:{signature}')
+    return app_id.decode() if app_id is not None else None
+
+
+# ******************************************************
+# ****************** MEMORIES VERSION ******************
+# ******************************************************
+
+def get_user_memories_version(uid: str) -> int:
+    """Bumped on every write to the user's memories, caches built under another version are stale."""
+    return int(r.get(f'users:{uid}:memories_version') or 0)
+
+
+def bump_user_memories_version(uid: str):
+    r.incr(f'users:{uid}:memories_version')
+
+
 def get_app_reviews(app_id: str) -> dict:
     reviews = r.get(f'plugins:{app_id}:reviews')
     if not reviews:
@@ -531,3 +599,164 @@ def get_migration_status(uid: str) -> dict:
 def clear_migration_status(uid: str):
     key = f"migration_status:{uid}"
     r.delete(key)
+
+
+# ******************************************************
+# ****************** EMBEDDINGS CACHE ******************
+# ******************************************************
+
+def get_cached_embeddings(keys: List[str]) -> List[Optional[bytes]]:
+    if not keys:
+        return []
+    return r.mget([f'embeddings:{key}' for key in keys])
+
+
+def set_cached_embeddings(items: dict, ttl: int = 60 * 60 * 24 * 30):
+    if not items:
+        return
+    pipe = r.pipeline()
+    for key, value in items.items():
+        pipe.set(f'embeddings:{key}', value, ex=ttl)
+    pipe.execute()
+
+
+# ******************************************************
+# *************** VECTOR METADATA INDEX ****************
+# ******************************************************
+
+# Per user index of the conversation vectors metadata (see database/vector_db.py):
+#   users:{uid}:vector_metadata:created_at            zset, conversation id -> created_at
+#   users:{uid}:vector_metadata:{field}:{value}       set of conversation ids, field in people/topics/entities
+#   users:{uid}:vector_metadata:conversation:{id}     json of the indexed values, to unindex them on update/delete
+
+vector_metadata_fields = ['people', 'topics', 'entities']
+
+
+def _vector_metadata_key(uid: str, suffix: str) -> str:
+    return f'users:{uid}:vector_metadata:{suffix}'
+
+
+def set_conversations_vector_metadata(uid: str, items: List[Tuple[str, int, dict]]):
+    """items are (conversation_id, created_at, metadata), previously indexed values are replaced."""
+    if not items:
+        return
+    previous = r.mget([_vector_metadata_key(uid, f'conversation:{conversation_id}') for conversation_id, _, _ in items])
+
+    pipe = r.pipeline()
+    for (conversation_id, created_at, metadata), previous_values in zip(items, previous):
+        if previous_values:
+            for field, values in json.loads(previous_values).items():
+                for value in values:
+                    pipe.srem(_vector_metadata_key(uid, f'{field}:{value}'), conversation_id)
+
+        values = {field: list(set(metadata.get(field) or [])) for field in vector_metadata_fields}
+        for field, field_values in values.items():
+            for value in field_values:
+                pipe.sadd(_vector_metadata_key(uid, f'{field}:{value}'), conversation_id)
+        pipe.zadd(_vector_metadata_key(uid, 'created_at'), {conversation_id: created_at})
+        pipe.set(_vector_metadata_key(uid, f'conversation:{conversation_id}'), json.dumps(values))
+    pipe.execute()
+
+
+def remove_conversation_vector_metadata(uid: str, conversation_id: str):
+    previous = r.get(_vector_metadata_key(uid, f'conversation:{conversation_id}'))
+    pipe = r.pipeline()
+    if previous:
+        for field, values in json.loads(previous).items():
+            for value in values:
+                pipe.srem(_vector_metadata_key(uid, f'{field}:{value}'), conversation_id)
+    pipe.zrem(_vector_metadata_key(uid, 'created_at'), conversation_id)
+    pipe.delete(_vector_metadata_key(uid, f'conversation:{conversation_id}'))
+    pipe.execute()
+
+
+def get_vector_metadata_members(uid: str, field: str, values: List[str]) -> List[set]:
+    pipe = r.pipeline()
+    for value in values:
+        pipe.smembers(_vector_metadata_key(uid, f'{field}:{value}'))
+    return [{member.decode() for member in members} for members in pipe.execute()]
+
+
+def get_vector_metadata_created_at(uid: str, conversation_ids: List[str]) -> List[Optional[float]]:
+    if not conversation_ids:
+        return []
+    return r.zmscore(_vector_metadata_key(uid, 'created_at'), conversation_ids)
+
+
+def get_vector_metadata_by_created_at(
+        uid: str, starts_at: Optional[int] = None, ends_at: Optional[int] = None, limit: Optional[int] = None,
+):
+    """(conversation_id, created_at) pairs in the range, newest first."""
+    items = r.zrevrangebyscore(
+        _vector_metadata_key(uid, 'created_at'),
+        ends_at if ends_at is not None else '+inf', starts_at if starts_at is not None else '-inf',
+        start=0 if limit is not None else None, num=limit, withscores=True,
+    )
+    return [(conversation_id.decode(), created_at) for conversation_id, created_at in items]
+
+
+def set_vector_metadata_index_ready(uid: str, ttl: int = 60 * 60 * 24 * 7):
+    r.set(_vector_metadata_key(uid, 'ready'), 1, ex=ttl)
+
+
+def is_vector_metadata_index_ready(uid: str) -> bool:
+    return r.exists(_vector_metadata_key(uid, 'ready')) == 1
+
+
+# ******************************************************
+# ********************* SYNC JOBS **********************
+# ******************************************************
+
+@try_catch_decorator
+def set_sync_job(uid: str, job_id: str, job: dict, ttl: int = 60 * 60 * 24 * 3):
+    r.set(f'users:{uid}:sync_jobs:{job_id}', json.dumps(job, default=str), ex=ttl)
+
+
+@try_catch_decorator
+def get_sync_job(uid: str, job_id: str) -> dict | None:
+    data = r.get(f'users:{uid}:sync_jobs:{job_id}')
+    return json.loads(data) if data else None
+
+
+def claim_sync_job(uid: str, job_id: str, token: str, ttl: int = 600) -> bool:
+    return bool(r.set(f'users:{uid}:sync_jobs:{job_id}:claim', token, nx=True, ex=ttl))
+
+
+@try_catch_decorator
+def extend_sync_job_claim(uid: str, job_id: str, token: str, ttl: int = 600):
+    key = f'users:{uid}:sync_jobs:{job_id}:claim'
+    claim = r.get(key)
+    if claim and claim.decode() == token:
+        r.expire(key, ttl)
+
+
+@try_catch_decorator
+def release_sync_job(uid: str, job_id: str, token: str):
+    key = f'users:{uid}:sync_jobs:{job_id}:claim'
+    claim = r.get(key)
+    if claim and claim.decode() == token:
+        r.delete(key)
+
+
+# ******************************************************
+# ****************** PERSONA UPDATES *******************
+# ******************************************************
+
+def schedule_persona_update(uid: str, due_at: float, rebuild: bool = False) -> bool:
+    """Schedules the user's persona update at `due_at` unless one is pending already; True if this one is new."""
+    if rebuild:
+        # before the schedule: an update claimed in between still sees the flag, or leaves it to the next one
+        r.sadd('personas:updates:rebuild', uid)
+    return bool(r.zadd('personas:updates', {uid: due_at}, nx=True))
+
+
+def get_due_persona_updates(now: float, limit: int = 100) -> List[str]:
+    uids = r.zrangebyscore('personas:updates', '-inf', now, start=0, num=limit)
+    return [uid.decode() for uid in uids]
+
+
+def claim_persona_update(uid: str) -> Optional[bool]:
+    """Takes the pending update: whether it was asked to rebuild, None if another instance took it."""
+    if not r.zrem('personas:updates', uid):
+        return None
+    return bool(r.srem('personas:updates:rebuild', uid))
@@ -2,10 +2,11 @@ import json
 import os
 from collections import defaultdict
 from datetime import datetime, timezone, timedelta
-from typing import List
+from typing import List, Optional
 
 from pinecone import Pinecone
 
+from database import redis_db
 from models.conversation import Conversation
 from utils.llm.clients import embeddings
 
@@ -38,12 +39,15 @@ def upsert_vector2(uid: str, conversation: Conversation, vector: List[float], me
     data['metadata'].update(metadata)
     res = index.upsert(vectors=[data], namespace="ns1")
     print('upsert_vector', res)
+    _index_metadata(uid, conversation.id, data['metadata'])
 
 
 def update_vector_metadata(uid: str, conversation_id: str, metadata: dict):
     metadata['uid'] = uid
     metadata['memory_id'] = conversation_id
-    return index.update(f'{uid}-{conversation_id}', set_metadata=metadata, namespace="ns1")
+    res = index.update(f'{uid}-{conversation_id}', set_metadata=metadata, namespace="ns1")
+    _index_metadata(uid, conversation_id, metadata)
+    return res
 
 
 def upsert_vectors(
@@ -69,10 +73,157 @@ def query_vectors(query: str, uid: str, starts_at: int = None, ends_at: int = No
     return [item['id'].replace(f'{uid}-', '') for item in xc['matches']]
 
 
+# *********************************
+# ******* METADATA INDEX **********
+# *********************************
+
+# ids per Pinecone query when ranking tied candidates by similarity
+similarity_batch_size = 1000
+
+
+def _index_metadata(uid: str, conversation_id: str, metadata: dict):
+    created_at = metadata.get('created_at') or int(datetime.now(timezone.utc).timestamp())
+    try:
+        redis_db.set_conversations_vector_metadata(uid, [(conversation_id, created_at, metadata)])
+    except Exception as e:
+        print('vector metadata index: could not index', conversation_id, e)
+
+
+def _list_vectors_metadata(uid: str):
+    """Metadata of every vector of the user, a page of ids at a time."""
+    for ids in index.list(prefix=f'{uid}-', namespace="ns1"):
+        fetched = index.fetch(ids=ids, namespace="ns1")
+        for vector in fetched.vectors.values():
+            # the id prefix could also match a longer uid
+            if vector.metadata and vector.metadata.get('uid') == uid:
+                yield vector.metadata
+
+
+def _ensure_metadata_index(uid: str):
+    """
+    Builds the user's metadata index from Pinecone, conversations saved afterwards are indexed on write. Writes to
+    the index are best effort, so it is rebuilt when the ready flag expires.
+    """
+    if redis_db.is_vector_metadata_index_ready(uid):
+        return
+
+    started_at = int(datetime.now(timezone.utc).timestamp())
+    indexed = set()
+    items = []
+    for metadata in _list_vectors_metadata(uid):
+        if not metadata.get('memory_id'):
+            continue
+        indexed.add(metadata['memory_id'])
+        items.append((metadata['memory_id'], metadata.get('created_at', 0), metadata))
+        if len(items) == 500:
+            redis_db.set_conversations_vector_metadata(uid, items)
+            items = []
+    redis_db.set_conversations_vector_metadata(uid, items)
+
+    # vectors deleted without going through delete_vector; the ones upserted during the rebuild are newer
+    stale = [
+        conversation_id for conversation_id, created_at in redis_db.get_vector_metadata_by_created_at(uid)
+        if conversation_id not in indexed and created_at < started_at
+    ]
+    for conversation_id in stale:
+        redis_db.remove_conversation_vector_metadata(uid, conversation_id)
+    redis_db.set_vector_metadata_index_ready(uid)
+    print('vector metadata index: backfilled', uid, len(indexed), 'removed', len(stale))
+
+
+def _similarity_scores(uid: str, vector: List[float], conversations_id: List[str]) -> dict:
+    """Similarity of the query vector to each of the conversations, by Pinecone queries filtered to their ids."""
+    scores = {}
+    for i in range(0, len(conversations_id), similarity_batch_size):
+        batch = conversations_id[i:i + similarity_batch_size]
+        xc = index.query(
+            vector=vector, filter={'uid': uid, 'memory_id': {'$in': batch}}, namespace="ns1",
+            include_values=False, top_k=len(batch),
+        )
+        for item in xc['matches']:
+            scores[item['id'].replace(f'{uid}-', '')] = item['score']
+    return scores
+
+
+def _query_metadata_index(
+        uid: str, starts_at: Optional[int], ends_at: Optional[int], people: List[str], topics: List[str],
+        entities: List[str], has_structured_filters: bool, limit: int, vector: Optional[List[float]] = None,
+) -> List[str]:
+    matches = defaultdict(int)
+    if not has_structured_filters:
+        candidates = redis_db.get_vector_metadata_by_created_at(uid, starts_at, ends_at, limit=limit)
+    else:
+        for field, values in [('people', people), ('topics', topics), ('entities', entities)]:
+            if not values:
+                continue
+            for members in redis_db.get_vector_metadata_members(uid, field, values):
+                for conversation_id in members:
+                    matches[conversation_id] += 1
+
+        conversations_id = list(matches.keys())
+        candidates = [
+            (conversation_id, created_at) for conversation_id, created_at in
+            zip(conversations_id, redis_db.get_vector_metadata_created_at(uid, conversations_id))
+            if created_at is not None and (starts_at is None or starts_at <= created_at <= ends_at)
+        ]
+        if not candidates:
+            if starts_at is None:
+                return []
+            print('query_vectors_by_metadata retrying without structured filters')
+            candidates = redis_db.get_vector_metadata_by_created_at(uid, starts_at, ends_at, limit=20)
+
+    # most matched filter values first, then the most similar to a real query vector, then the most recent
+    candidates.sort(key=lambda item: (matches[item[0]], item[1], item[0]), reverse=True)
+    if vector is not None and len(set(vector)) > 1 and candidates and limit > 0:
+        # only the candidates tied with one in the first `limit` can move into it
+        threshold = matches[candidates[:limit][-1][0]]
+        tied = [conversation_id for conversation_id, _ in candidates if matches[conversation_id] >= threshold]
+        scores = _similarity_scores(uid, vector, tied)
+        candidates = [item for item in candidates if matches[item[0]] >= threshold]
+        candidates.sort(key=lambda item: (matches[item[0]], scores.get(item[0], float('-inf'))), reverse=True)
+    return [conversation_id for conversation_id, _ in candidates[:limit]]
+
+
 def query_vectors_by_metadata(
         uid: str, vector: List[float], dates_filter: List[datetime], people: List[str], topics: List[str],
+        entities: List[str], dates: List[str], limit: int = 5,
+):
+    """
+    Conversation ids matching any of the people / topics / entities (ranked by the number of matched values)
+    within the optional created_at range. Filters are answered by the per-user metadata index in Redis, ties
+    go to the most similar conversations when the query vector is a real one. Without people / topics / entities
+    filters a real query vector is a plain similarity search on Pinecone.
+    """
+    starts_at, ends_at = None, None
+    if dates_filter and len(dates_filter) == 2 and dates_filter[0] and dates_filter[1]:
+        print('dates_filter', dates_filter)
+        starts_at, ends_at = int(dates_filter[0].timestamp()), int(dates_filter[1].timestamp())
+    has_structured_filters = bool(people or topics or entities or dates)
+
+    # placeholder vectors ([1] * 3072, [0] * 3072) carry no similarity information
+    if not has_structured_filters and len(set(vector)) > 1:
+        filter_data = {'uid': uid}
+        if starts_at is not None:
+            filter_data['created_at'] = {'$gte': starts_at, '$lte': ends_at}
+        xc = index.query(vector=vector, filter=filter_data, namespace="ns1", include_values=False, top_k=limit)
+        return [item['id'].replace(f'{uid}-', '') for item in xc['matches']]
+
+    try:
+        _ensure_metadata_index(uid)
+        conversations_id = _query_metadata_index(
+            uid, starts_at, ends_at, people, topics, entities, has_structured_filters, limit, vector)
+        print('query_vectors_by_metadata result:', conversations_id)
+        return conversations_id
+    except Exception as e:
+        print('query_vectors_by_metadata: metadata index failed, scanning pinecone', e)
+        return _scan_vectors_by_metadata(uid, vector, dates_filter, people, topics, entities, dates, limit)
+
+
+def _scan_vectors_by_metadata(
+        uid: str, vector: List[float], dates_filter: List[datetime], people: List[str], topics: List[str],
     entities: List[str], dates: List[str], limit: int = 5,
 ):
+    """Full metadata scan on Pinecone, fallback for when the metadata index can't be used."""
     filter_data = {'$and': [
         {'uid': {'$eq': uid}},
     ]}
@@ -130,7 +281,10 @@ def query_vectors_by_metadata(
     return conversations_id[:limit] if len(conversations_id) > limit else conversations_id
 
 
-def delete_vector(conversation_id: str):
-    # TODO: does this work?
-    result = index.delete(ids=[conversation_id], namespace="ns1")
+def delete_vector(uid: str, conversation_id: str):
+    result = index.delete(ids=[f'{uid}-{conversation_id}'], namespace="ns1")
     print('delete_vector', result)
+    try:
+        redis_db.remove_conversation_vector_metadata(uid, conversation_id)
+    except Exception as e:
+        print('vector metadata index: could not remove', conversation_id, e)
@@ -0,0 +1,44 @@
+import time
+
+from google.cloud import firestore
+from google.cloud.firestore_v1 import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from database._client import db
+from database.conversations import compact_conversation_segments, conversations_collection
+
+
+def migration_compact_transcript_segments_log():
+    """
+    Conversations written before the transcript segments log keep their compressed blob and need no rewrite,
+    they start appending to the log on their next streaming update.
+    This folds any pending log entries back into the blob, e.g. before a rollback to the whole-blob writes.
+    """
+    user_offset = 0
+    user_limit = 400
+    while True:
+        print(f"running...user...{user_offset}")
+        users_ref = (
+            db.collection('users')
+            .order_by(FieldPath.document_id(), direction=firestore.Query.ASCENDING)
+        )
+        users_ref = users_ref.limit(user_limit).offset(user_offset)
+        users = list(users_ref.stream())
+        if not users or len(users) == 0:
+            print("no users")
+            break
+        for user in users:
+            conversations_ref = (
+                db.collection('users').document(user.id).collection(conversations_collection)
+                .where(filter=FieldFilter('transcript_segments_log_seq', '>', 0))
+                .select(['transcript_segments_log_seq', 'transcript_segments_log_base'])
+            )
+            for doc in conversations_ref.stream():
+                data = doc.to_dict()
+                if data.get('transcript_segments_log_seq', 0) <= data.get('transcript_segments_log_base', 0):
+                    continue
+                print(f"running...user...{user.id}...conversation...{doc.id}")
+                compact_conversation_segments(user.id, doc.id)
+            time.sleep(.01)
+
+        user_offset = user_offset + len(users)
@@ -34,24 +34,44 @@ class TranscriptSegment(BaseModel):
     def segments_as_string(segments, include_timestamps=False, user_name: str = None):
         if not user_name:
             user_name = 'User'
-        transcript = ''
         include_timestamps = include_timestamps and TranscriptSegment.can_display_seconds(segments)
+        lines = []
         for segment in segments:
             segment_text = segment.text.strip()
             timestamp_str = f'[{segment.get_timestamp_string()}] ' if include_timestamps else ''
-            transcript += f'{timestamp_str}{user_name if segment.is_user else f"Speaker {segment.speaker_id}"}: {segment_text}\n\n'
-        return transcript.strip()
+            lines.append(f'{timestamp_str}{user_name if segment.is_user else f"Speaker {segment.speaker_id}"}: {segment_text}\n\n')
+        return ''.join(lines).strip()
 
     @staticmethod
     def can_display_seconds(segments):
-        for i in range(len(segments)):
-            for j in range(i + 1, len(segments)):
-                if segments[i].start > segments[j].end or segments[i].end > segments[j].start:
-                    return False
+        # Every segment must start after all previous segments end (and not start before any previous start),
+        # comparing against the running maximums is equivalent to checking every pair
+        max_start = max_end = None
+        for segment in segments:
+            if max_start is not None and (max_start > segment.end or max_end > segment.start):
+                return False
+            max_start = segment.start if max_start is None else max(max_start, segment.start)
+            max_end = segment.end if max_end is None else max(max_end, segment.end)
         return True
 
+    @staticmethod
+    def _normalize_text(text: str) -> str:
+        # Speechmatics specific issue with punctuation
+        return (
+            text.strip()
+            .replace('  ', '')
+            .replace(' ,', ',')
+            .replace(' .', '.')
+            .replace(' ?', '?')
+        )
+
     @staticmethod
     def combine_segments(segments: [], new_segments: [], delta_seconds: int = 0):
+        """
+        Merges new STT segments into `segments` in place, returns the segments and the updated range [starts, ends).
+        Only the updated range is normalized, `segments` is expected to be the output of previous calls,
+        so the cost is proportional to the new batch rather than the whole transcript.
+        """
         if not new_segments or len(new_segments) == 0:
             return segments
 
@@ -85,15 +105,8 @@ class TranscriptSegment(BaseModel):
         segments.extend(joined_similar_segments)
         ends = len(segments)
 
-        # Speechmatics specific issue with punctuation
-        for i, segment in enumerate(segments):
-            segments[i].text = (
-                segments[i].text.strip()
-                .replace('  ', '')
-                .replace(' ,', ',')
-                .replace(' .', '.')
-                .replace(' ?', '?')
-            )
+        for i in range(starts, ends):
+            segments[i].text = TranscriptSegment._normalize_text(segments[i].text)
 
         return segments, (starts,ends)
 
@@ -21,7 +21,7 @@ from utils.apps import get_available_apps, get_available_app_by_id, get_approved
     get_available_app_by_id_with_reviews, set_app_review, get_app_reviews, add_tester, is_tester, \
     add_app_access_for_tester, remove_app_access_for_tester, upsert_app_payment_link, get_is_user_paid_app, \
     is_permit_payment_plan_get, generate_persona_prompt, generate_persona_desc, get_persona_by_uid, \
-    increment_username, generate_api_key, get_popular_apps
+    increment_username, generate_api_key, get_popular_apps, invalidate_apps_registry
 
 from database.memories import migrate_memories
 
@@ -343,6 +343,7 @@ def update_app(app_id: str, app_data: str = Form(...), file: UploadFile = File(N
     if app['approved'] and (app['private'] is None or app['private'] is False):
         delete_generic_cache('get_public_approved_apps_data')
     delete_app_cache_by_id(app_id)
+    invalidate_apps_registry()
     return {'status': 'ok'}
 
 
@@ -357,6 +358,7 @@ def delete_app(app_id: str, uid: str = Depends(auth.get_current_user_uid)):
     if app['approved']:
         delete_generic_cache('get_public_approved_apps_data')
     delete_app_cache_by_id(app_id)
+    invalidate_apps_registry()
     return {'status': 'ok'}
 
 
@@ -512,6 +514,7 @@ def change_app_visibility(app_id: str, private: bool, uid: str = Depends(auth.ge
         raise HTTPException(status_code=403, detail='You are not authorized to perform this action')
     update_app_visibility_in_db(app_id, private)
     delete_app_cache_by_id(app_id)
+    invalidate_apps_registry()
     return {'status': 'ok'}
 
 
@@ -774,6 +777,7 @@ def add_new_tester(data: dict, secret_key: str = Header(...)):
         raise HTTPException(status_code=422, detail='apps is required')
     data['added_at'] = datetime.now(timezone.utc).isoformat()
     add_tester(data)
+    invalidate_apps_registry(data['uid'])
     return {'status': 'ok'}
 
 
@@ -786,6 +790,7 @@ def add_app_access_tester(data: dict, secret_key: str = Header(...)):
     if not data.get('app_id'):
         raise HTTPException(status_code=422, detail='app_id is required')
     add_app_access_for_tester(data['app_id'], data['uid'])
+    invalidate_apps_registry(data['uid'])
     return {'status': 'ok'}
 
 
@@ -798,6 +803,7 @@ def remove_app_access_tester(data: dict, secret_key: str = Header(...)):
     if not data.get('app_id'):
         raise HTTPException(status_code=422, detail='app_id is required')
     remove_app_access_for_tester(data['app_id'], data['uid'])
+    invalidate_apps_registry(data['uid'])
     return {'status': 'ok'}
 
 
@@ -832,6 +838,7 @@ def approve_app(app_id: str, uid: str, secret_key: str = Header(...)):
         raise HTTPException(status_code=403, detail='You are not authorized to perform this action')
     change_app_approval_status(app_id, True)
     delete_app_cache_by_id(app_id)
+    invalidate_apps_registry()
     app = get_available_app_by_id(app_id, uid)
     token = get_token_only(uid)
     if token:
@@ -846,6 +853,7 @@ def reject_app(app_id: str, uid: str, secret_key: str = Header(...)):
         raise HTTPException(status_code=403, detail='You are not authorized to perform this action')
     change_app_approval_status(app_id, False)
     delete_app_cache_by_id(app_id)
+    invalidate_apps_registry()
     app = get_available_app_by_id(app_id, uid)
     token = get_token_only(uid)
     if token:
@@ -1,3 +1,5 @@
+import threading
+
 from fastapi import APIRouter, Depends, HTTPException
 
 import database.conversations as conversations_db
@@ -12,6 +14,7 @@ from utils.llm.conversation_processing import generate_summary_with_prompt
 from utils.other import endpoints as auth
 from utils.other.storage import get_conversation_recording_if_exists
 from utils.app_integrations import trigger_external_integrations
+from utils.apps import update_personas_async
 
 router = APIRouter()
 
@@ -103,7 +106,9 @@ def get_conversation_transcripts_by_models(conversation_id: str, uid: str = Depe
 def delete_conversation(conversation_id: str, uid: str = Depends(auth.get_current_user_uid)):
     print('delete_conversation', conversation_id, uid)
     conversations_db.delete_conversation(uid, conversation_id)
-    delete_vector(conversation_id)
+    delete_vector(uid, conversation_id)
+    # a deleted conversation has to leave the condensed persona context, which folding can't do
+    threading.Thread(target=update_personas_async, args=(uid,), kwargs={'rebuild': True}).start()
     return {"status": "Ok"}
 
 
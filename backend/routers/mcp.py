@@ -33,12 +33,14 @@ def create_memory(memory: Memory, uid: str = Header()):
 @router.delete("/v1/mcp/memories/{memory_id}", tags=["mcp"])
 def delete_memory(memory_id: str, uid: str = Header()):
     memories_db.delete_memory(uid, memory_id)
+    threading.Thread(target=update_personas_async, args=(uid,), kwargs={'rebuild': True}).start()
     return {"status": "ok"}
 
 
 @router.patch("/v1/mcp/memories/{memory_id}", tags=["mcp"])
 def edit_memory(memory_id: str, value: str, uid: str = Header()):
     memories_db.edit_memory(uid, memory_id, value)
+    threading.Thread(target=update_personas_async, args=(uid,), kwargs={'rebuild': True}).start()
     return {"status": "ok"}
 
 
@@ -36,12 +36,14 @@ def get_memories(limit: int = 100, offset: int = 0, uid: str = Depends(auth.get_
 @router.delete('/v3/memories/{memory_id}', tags=['memories'])
 def delete_memory(memory_id: str, uid: str = Depends(auth.get_current_user_uid)):
     memories_db.delete_memory(uid, memory_id)
+    threading.Thread(target=update_personas_async, args=(uid,), kwargs={'rebuild': True}).start()
     return {'status': 'ok'}
 
 
 @router.delete('/v3/memories', tags=['memories'])
 def delete_memories(uid: str = Depends(auth.get_current_user_uid)):
     memories_db.delete_all_memories(uid)
+    threading.Thread(target=update_personas_async, args=(uid,), kwargs={'rebuild': True}).start()
     return {'status': 'ok'}
 
 
@@ -59,6 +61,7 @@ def edit_memory(memory_id: str, value: str, uid: str = Depends(auth.get_current_
     #     value = value[len(first_word):].strip()
 
     memories_db.edit_memory(uid, memory_id, value)
+    threading.Thread(target=update_personas_async, args=(uid,), kwargs={'rebuild': True}).start()
     return {'status': 'ok'}
 
 
@@ -67,5 +70,6 @@ def update_memory_visibility(memory_id: str, value: str, uid: str = Depends(auth
     if value not in ['public', 'private']:
         raise HTTPException(status_code=400, detail='Invalid visibility value')
     memories_db.change_memory_visibility(uid, memory_id, value)
-    threading.Thread(target=update_personas_async, args=(uid,)).start()
+    # a memory made private has to leave the condensed persona context, which folding new memories can't do
+    threading.Thread(target=update_personas_async, args=(uid,), kwargs={'rebuild': value == 'private'}).start()
     return {'status': 'ok'}
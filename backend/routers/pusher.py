@@ -1,6 +1,7 @@
-import struct
+import os
 import asyncio
-import json
+from collections import deque
+from typing import Callable, Dict, Optional
 
 from fastapi import APIRouter
 from fastapi.websockets import WebSocketDisconnect, WebSocket
@@ -10,17 +11,158 @@ from utils.apps import is_audio_bytes_app_enabled
 from utils.app_integrations import trigger_realtime_integrations, trigger_realtime_audio_bytes
 from utils.webhooks import send_audio_bytes_developer_webhook, realtime_transcript_webhook, \
     get_audio_bytes_webhook_seconds
+from utils.other.audio_ring import AudioRingBuffer, AudioRingConsumer, AudioWindow
+from utils.other.ordered_executor import OrderedExecutor
+from utils.pusher_protocol import PROTOCOL_V2, PROTOCOL_MUX, AUDIO_BYTES, TRANSCRIPT_V1, TRANSCRIPT_V2, \
+    MUX_OPEN, MUX_DATA, MUX_CLOSE, MUX_WINDOW_BYTES, FrameError, TranscriptDecoder, read_frame, parse_mux, \
+    decode_mux_open, encode_mux, encode_mux_credit
 
 router = APIRouter()
 
+# Integrations and developer webhooks block on HTTP and Firestore: they run on their own bounded pool,
+# in order per user and kind, and are shed instead of piling up when apps can't keep up.
+integrations = OrderedExecutor(
+    max_workers=int(os.getenv('PUSHER_INTEGRATION_WORKERS', 64)),
+    max_pending=int(os.getenv('PUSHER_INTEGRATION_MAX_PENDING', 5000)),
+    max_pending_per_key=int(os.getenv('PUSHER_INTEGRATION_MAX_PENDING_PER_USER', 4)),
+    max_wait_seconds=float(os.getenv('PUSHER_INTEGRATION_MAX_WAIT_SECONDS', 30)),
+    name='pusher-integrations',
+)
+
+
+def _merge_segments(pending: Optional[list], new: Optional[list]) -> list:
+    # a segment sent again is an update of the one still pending: it takes its place, latest version wins
+    merged = list(pending or [])
+    positions = {segment.get('id'): i for i, segment in enumerate(merged) if segment.get('id') is not None}
+    for segment in new or []:
+        position = positions.get(segment.get('id')) if segment.get('id') is not None else None
+        if position is None:
+            if segment.get('id') is not None:
+                positions[segment['id']] = len(merged)
+            merged.append(segment)
+        else:
+            merged[position] = segment
+    return merged
+
+
+def _merge_transcript_integrations(pending: tuple, new: tuple) -> tuple:
+    uid, segments, _ = pending
+    return uid, _merge_segments(segments, new[1]), new[2]
+
+
+def _merge_transcript_webhook(pending: tuple, new: tuple) -> tuple:
+    return pending[0], _merge_segments(pending[1], new[1])
+
+
+# audio kept past the longest consumer interval, for sends still waiting on a worker
+audio_ring_headroom_seconds = int(os.getenv('PUSHER_AUDIO_RING_HEADROOM_SECONDS', 10))
+
+
+def _send_audio_window(send, uid: str, sample_rate: int, window: AudioWindow):
+    # the one copy of the window, on the worker thread
+    data = window.read()
+    if data is None:
+        print(f'audio bytes {send.__name__}: window overwritten before it was sent', uid)
+        return
+    send(uid, sample_rate, data)
+
+
+class _FrameJobs:
+    """Calls `done` once every job made from one frame is over (ran, failed, shed or merged into one that is)."""
+
+    def __init__(self, done: Optional[Callable]):
+        # held by the handling of the frame itself until it returns
+        self.pending = 1
+        self.done = done
+
+    def job(self) -> Optional[Callable]:
+        if self.done is None:
+            return None
+        self.pending += 1
+        return self.release
+
+    def release(self):
+        self.pending -= 1
+        if self.pending == 0 and self.done is not None:
+            self.done()
+
+
+class _TriggerSession:
+    """One listen session on the pusher: transcripts go to realtime integrations, audio to its ring consumers."""
+
+    def __init__(self, uid: str, sample_rate: int):
+        self.uid = uid
+        self.sample_rate = sample_rate
+        self.transcript_decoder = TranscriptDecoder()
+        self.malformed_frames = 0
+
+        # audio bytes, one ring per session, each consumer reads it at its own interval
+        audio_bytes_webhook_delay_seconds = get_audio_bytes_webhook_seconds(uid)
+        audio_bytes_trigger_delay_seconds = 5
+        has_audio_apps_enabled = is_audio_bytes_app_enabled(uid)
+
+        self.audio_consumers = []
+        intervals = {}
+        if has_audio_apps_enabled:
+            intervals['realtime_audio_bytes'] = (trigger_realtime_audio_bytes, audio_bytes_trigger_delay_seconds)
+        if audio_bytes_webhook_delay_seconds:
+            intervals['audio_bytes_webhook'] = (send_audio_bytes_developer_webhook,
+                                                audio_bytes_webhook_delay_seconds)
+        self.audio_ring = None
+        if intervals:
+            longest_seconds = max(seconds for _, seconds in intervals.values())
+            self.audio_ring = AudioRingBuffer(sample_rate * 2 * (longest_seconds + audio_ring_headroom_seconds))
+            for kind, (send, seconds) in intervals.items():
+                self.audio_consumers.append((kind, send, AudioRingConsumer(self.audio_ring, sample_rate * seconds * 2)))
+
+    def handle(self, data, done: Optional[Callable] = None):
+        """Handles one frame; `done()` once the jobs it made are over, the audio it carried is in the ring."""
+        jobs = _FrameJobs(done)
+        try:
+            self._handle(data, jobs)
+        finally:
+            jobs.release()
+
+    def _handle(self, data, jobs: _FrameJobs):
+        uid = self.uid
+        try:
+            header_type, frame = read_frame(data, self.transcript_decoder)
+        except FrameError as e:
+            # a bad frame is skipped, the session goes on
+            self.malformed_frames += 1
+            if self.malformed_frames == 1 or self.malformed_frames % 100 == 0:
+                print(f'Malformed pusher frame ({self.malformed_frames} so far): {e}', uid)
+            return
+
+        # Transcript
+        if header_type in (TRANSCRIPT_V1, TRANSCRIPT_V2):
+            segments, memory_id = frame
+            integrations.submit(uid, 'realtime_integrations', trigger_realtime_integrations,
+                                uid, segments, memory_id, merge=_merge_transcript_integrations, done=jobs.job())
+            integrations.submit(uid, 'realtime_transcript_webhook', realtime_transcript_webhook,
+                                uid, segments, merge=_merge_transcript_webhook, done=jobs.job())
+            return
+
+        # Audio bytes
+        if header_type == AUDIO_BYTES:
+            if self.audio_ring is None:
+                return
+            self.audio_ring.write(frame)
+            for kind, send, consumer in self.audio_consumers:
+                if consumer.due():
+                    integrations.submit(uid, kind, _send_audio_window, send, uid, self.sample_rate, consumer.take(),
+                                        done=jobs.job())
+
 
 async def _websocket_util_trigger(
         websocket: WebSocket, uid: str, sample_rate: int = 8000,
 ):
     print('_websocket_util_trigger', uid)
 
+    # backends that offer v2 framing get it, others keep sending v1
+    subprotocol = PROTOCOL_V2 if PROTOCOL_V2 in websocket.scope.get('subprotocols', []) else None
     try:
-        await websocket.accept()
+        await websocket.accept(subprotocol=subprotocol)
     except RuntimeError as e:
         print(e)
         await websocket.close(code=1011, reason="Dirty state")
@@ -29,50 +171,16 @@ async def _websocket_util_trigger(
     websocket_active = True
     websocket_close_code = 1000
 
-    loop = asyncio.get_event_loop()
-
-    # audio bytes
-    audio_bytes_webhook_delay_seconds = get_audio_bytes_webhook_seconds(uid)
-    audio_bytes_trigger_delay_seconds = 5
-    has_audio_apps_enabled = is_audio_bytes_app_enabled(uid)
+    session = _TriggerSession(uid, sample_rate)
 
     # task
     async def receive_tasks():
         nonlocal websocket_active
         nonlocal websocket_close_code
 
-        audiobuffer = bytearray()
-        trigger_audiobuffer = bytearray()
-
         try:
             while websocket_active:
-                data = await websocket.receive_bytes()
-                header_type = struct.unpack('<I', data[:4])[0]
-
-                # Transcript
-                if header_type == 102:
-                    res = json.loads(bytes(data[4:]).decode("utf-8"))
-                    segments = res.get('segments')
-                    memory_id = res.get('memory_id')
-                    asyncio.run_coroutine_threadsafe(trigger_realtime_integrations(uid, segments, memory_id), loop)
-                    asyncio.run_coroutine_threadsafe(realtime_transcript_webhook(uid, segments), loop)
-                    continue
-
-                # Audio bytes
-                if header_type == 101:
-                    audiobuffer.extend(data[4:])
-                    trigger_audiobuffer.extend(data[4:])
-                    if has_audio_apps_enabled and len(
-                            trigger_audiobuffer) > sample_rate * audio_bytes_trigger_delay_seconds * 2:
-                        asyncio.run_coroutine_threadsafe(
-                            trigger_realtime_audio_bytes(uid, sample_rate, trigger_audiobuffer.copy()), loop)
-                        trigger_audiobuffer = bytearray()
-                    if audio_bytes_webhook_delay_seconds and len(
-                            audiobuffer) > sample_rate * audio_bytes_webhook_delay_seconds * 2:
-                        asyncio.run_coroutine_threadsafe(
-                            send_audio_bytes_developer_webhook(uid, sample_rate, audiobuffer.copy()), loop)
-                        audiobuffer = bytearray()
-                    continue
+                session.handle(await websocket.receive_bytes())
 
         except WebSocketDisconnect:
             print("WebSocket disconnected")
@@ -97,8 +205,144 @@ async def _websocket_util_trigger(
                 print(f"Error closing WebSocket: {e}")
 
 
+class _MuxStream:
+    """A stream of a multiplexed connection: its session once opened, and the DATA bytes it owes credit for."""
+
+    def __init__(self):
+        self.session: Optional[_TriggerSession] = None
+        # DATA that came while the session was being opened, handled in order once it is
+        self.waiting = deque()
+        self.closed = False
+        # DATA bytes drained (see `_TriggerSession.handle`) and not yet credited back
+        self.drained = 0
+
+
+async def _websocket_util_multiplex(websocket: WebSocket):
+    """Many listen sessions over one backend connection, see `utils.pusher_protocol` for the framing."""
+    if PROTOCOL_MUX not in websocket.scope.get('subprotocols', []):
+        await websocket.close(code=1002, reason="Unsupported subprotocol")
+        return
+    try:
+        await websocket.accept(subprotocol=PROTOCOL_MUX)
+    except RuntimeError as e:
+        print(e)
+        await websocket.close(code=1011, reason="Dirty state")
+        return
+
+    print('_websocket_util_multiplex')
+    websocket_close_code = 1000
+    streams: Dict[int, _MuxStream] = {}
+    credit_every_bytes = MUX_WINDOW_BYTES // 4
+    malformed_messages = 0
+    # one writer for everything sent back: credits are granted from job callbacks, not from this loop
+    outgoing = asyncio.Queue()
+    opening = set()
+
+    async def write():
+        try:
+            while True:
+                await websocket.send_bytes(await outgoing.get())
+        except Exception as e:
+            print(f'Multiplexed WebSocket send failed: {e}')
+
+    def drained(stream_id: int, stream: _MuxStream, size: int):
+        # the bytes the pusher holds for a stream are its real backlog: credit only what its jobs are done with
+        if stream.closed:
+            return
+        stream.drained += size
+        if stream.drained >= credit_every_bytes:
+            outgoing.put_nowait(encode_mux_credit(stream_id, stream.drained))
+            stream.drained = 0
+
+    def handle(stream_id: int, stream: _MuxStream, body):
+        size = len(body)
+        stream.session.handle(body, done=lambda: drained(stream_id, stream, size))
+
+    async def open_stream(stream_id: int, stream: _MuxStream, uid: str, sample_rate: int):
+        try:
+            # the session looks up the user's audio settings, off the loop; other streams go on meanwhile
+            session = await asyncio.to_thread(_TriggerSession, uid, sample_rate)
+        except Exception as e:
+            print(f'Could not open multiplexed stream: {e}', uid)
+            if not stream.closed:
+                stream.closed = True
+                if streams.get(stream_id) is stream:
+                    del streams[stream_id]
+                outgoing.put_nowait(encode_mux(MUX_CLOSE, stream_id))
+            return
+        if stream.closed:
+            return
+        stream.session = session
+        while stream.waiting:
+            handle(stream_id, stream, stream.waiting.popleft())
+
+    writer = asyncio.create_task(write())
+    try:
+        while True:
+            data = await websocket.receive_bytes()
+            try:
+                kind, stream_id, body = parse_mux(data)
+                if kind == MUX_OPEN:
+                    uid, sample_rate = decode_mux_open(body)
+            except FrameError as e:
+                malformed_messages += 1
+                if malformed_messages == 1 or malformed_messages % 100 == 0:
+                    print(f'Malformed multiplex message ({malformed_messages} so far): {e}')
+                continue
+
+            if kind == MUX_OPEN:
+                previous = streams.get(stream_id)
+                if previous is not None:
+                    previous.closed = True
+                stream = streams[stream_id] = _MuxStream()
+                task = asyncio.create_task(open_stream(stream_id, stream, uid, sample_rate))
+                opening.add(task)
+                task.add_done_callback(opening.discard)
+            elif kind == MUX_DATA:
+                stream = streams.get(stream_id)
+                if stream is None:
+                    # never opened, or opened on a connection that is gone: the backend opens a new stream
+                    outgoing.put_nowait(encode_mux(MUX_CLOSE, stream_id))
+                elif stream.session is None:
+                    # bounded by the credit window, the backend doesn't send past it
+                    stream.waiting.append(body)
+                else:
+                    handle(stream_id, stream, body)
+            elif kind == MUX_CLOSE:
+                stream = streams.pop(stream_id, None)
+                if stream is not None:
+                    stream.closed = True
+
+    except WebSocketDisconnect:
+        print(f"Multiplexed WebSocket disconnected, {len(streams)} streams")
+    except Exception as e:
+        print(f'Multiplexed WebSocket failed: {e}')
+        websocket_close_code = 1011
+    finally:
+        for stream in streams.values():
+            stream.closed = True
+        for task in list(opening):
+            task.cancel()
+        writer.cancel()
+        if websocket.client_state == WebSocketState.CONNECTED:
+            try:
+                await websocket.close(code=websocket_close_code)
+            except Exception as e:
+                print(f"Error closing WebSocket: {e}")
+
+
+@router.get("/v1/trigger/metrics")
+async def integrations_metrics():
+    return integrations.metrics()
+
+
 @router.websocket("/v1/trigger/listen")
 async def websocket_endpoint_trigger(
         websocket: WebSocket, uid: str, sample_rate: int = 8000,
 ):
     await _websocket_util_trigger(websocket, uid, sample_rate)
+
+
+@router.websocket("/v1/trigger/multiplex")
+async def websocket_endpoint_multiplex(websocket: WebSocket):
+    await _websocket_util_multiplex(websocket)
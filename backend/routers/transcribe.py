@@ -1,9 +1,9 @@
 import os
 import uuid
 import asyncio
-import struct
 from datetime import datetime, timezone, timedelta, time
 from enum import Enum
+from typing import Optional
 
 import opuslib
 import webrtcvad
@@ -12,17 +12,18 @@ from fastapi.websockets import WebSocketDisconnect, WebSocket
 from pydub import AudioSegment
 from starlette.websockets import WebSocketState
 
-import database.conversations as conversations_db
+import database.conversations as conversations_sync_db
+import database.conversations_async as conversations_db
 import database.users as user_db
-from database import redis_db
-from database.redis_db import get_cached_user_geolocation
 from models.conversation import Conversation, TranscriptSegment, ConversationStatus, Structured, Geolocation
 from models.message_event import ConversationEvent, MessageEvent, MessageServiceStatusEvent, LastConversationEvent, \
-    TranslationEvent
+    TranslationEvent, ProcessingConversationStatusChanged
 from models.transcript_segment import Translation
 from utils.apps import is_audio_bytes_app_enabled
 from utils.conversations.location import get_google_maps_location
-from utils.conversations.process_conversation import process_conversation, retrieve_in_progress_conversation
+from utils.conversations.finalizer import get_conversation_finalizer
+from utils.conversations.process_conversation import process_conversation
+from utils.other.batch_buffer import BatchBuffer
 from utils.other.task import safe_create_task
 from utils.app_integrations import trigger_external_integrations
 from utils.stt.streaming import *
@@ -31,6 +32,7 @@ from utils.stt.streaming import process_audio_soniox, process_audio_dg, process_
     send_initial_file_path
 from utils.webhooks import get_audio_bytes_webhook_seconds
 from utils.pusher import connect_to_trigger_pusher
+from utils.pusher_protocol import TranscriptEncoder, negotiated_version, encode_audio, encode_transcript_v1
 from utils.translation import translate_text, detect_language
 from utils.translation_cache import TranscriptSegmentLanguageCache
 
@@ -39,6 +41,10 @@ from utils.other.storage import get_profile_audio_if_exists
 
 router = APIRouter()
 
+# backoff of the pusher consumers' reconnect attempts
+pusher_reconnect_min_seconds = 0.5
+pusher_reconnect_max_seconds = 5
+
 
 async def _listen(
         websocket: WebSocket, uid: str, language: str = 'en', sample_rate: int = 8000, codec: str = 'pcm8',
@@ -102,6 +108,11 @@ async def _listen(
     inactivity_timeout_seconds = 30
     last_audio_received_time = None
 
+    # STT results (deepgram calls back from its own thread) -> stream_transcript_process -> pusher consumers.
+    # Closing a buffer lets its consumer drain it and finish, which then closes the next ones.
+    realtime_segment_buffer = BatchBuffer(max_delay=0.05, capacity=5000, name=f'realtime segments {uid}')
+    pusher_buffers: List[BatchBuffer] = []
+
     # Send pong every 10s then handle it in the app \
     # since Starlette is not support pong automatically
     async def send_heartbeat():
@@ -142,6 +153,7 @@ async def _listen(
             websocket_close_code = 1011
         finally:
             websocket_active = False
+            realtime_segment_buffer.close()
 
     # Start heart beat
     heartbeat_task = asyncio.create_task(send_heartbeat())
@@ -161,7 +173,7 @@ async def _listen(
             await asyncio.sleep(delay_seconds)
 
             # recheck session
-            conversation = retrieve_in_progress_conversation(uid)
+            conversation = await conversations_db.retrieve_in_progress_conversation(uid)
             if not conversation or conversation['finished_at'] > finished_at:
                 print("_trigger_create_conversation_with_delay not conversation or not last session", uid)
                 return
@@ -169,34 +181,52 @@ async def _listen(
         except asyncio.CancelledError:
             pass
 
-    async def _create_conversation(conversation: dict):
-        conversation = Conversation(**conversation)
-        if conversation.status != ConversationStatus.processing:
-            _send_message_event(ConversationEvent(event_type="memory_processing_started", memory=conversation))
-            conversations_db.update_conversation_status(uid, conversation.id, ConversationStatus.processing)
-            conversation.status = ConversationStatus.processing
-
+    def _finalize_conversation(conversation: Conversation, geolocation: Optional[Geolocation]):
+        # blocking (LLM extraction, app triggers, vector upserts), runs on the conversation finalizer's threads
         try:
-            # Geolocation
-            geolocation = get_cached_user_geolocation(uid)
             if geolocation:
-                geolocation = Geolocation(**geolocation)
                 conversation.geolocation = get_google_maps_location(geolocation.latitude, geolocation.longitude)
 
             conversation = process_conversation(uid, language, conversation)
             messages = trigger_external_integrations(uid, conversation)
         except Exception as e:
             print(f"Error processing conversation: {e}", uid)
-            conversations_db.set_conversation_as_discarded(uid, conversation.id)
+            conversations_sync_db.set_conversation_as_discarded(uid, conversation.id)
             conversation.discarded = True
             messages = []
+        return conversation, messages
 
-        _send_message_event(ConversationEvent(event_type="memory_created", memory=conversation, messages=messages))
+    def _on_conversation_finalizer_status(conversation_id: str, status: str, result):
+        _send_message_event(ProcessingConversationStatusChanged(
+            event_type="processing_memory_status_changed", memory_id=conversation_id,
+            processing_memory_status=status))
+        if status == 'completed':
+            conversation, messages = result
+            _send_message_event(ConversationEvent(event_type="memory_created", memory=conversation, messages=messages))
+
+    async def _create_conversation(conversation: dict):
+        conversation = Conversation(**conversation)
+        if conversation.status != ConversationStatus.processing:
+            _send_message_event(ConversationEvent(event_type="memory_processing_started", memory=conversation))
+            await conversations_db.update_conversation_status(uid, conversation.id, ConversationStatus.processing)
+            conversation.status = ConversationStatus.processing
+
+        # Geolocation
+        geolocation = await conversations_db.get_cached_user_geolocation(uid)
+        if geolocation:
+            geolocation = Geolocation(**geolocation)
+
+        conversation_id = conversation.id
+        job = get_conversation_finalizer().submit(
+            conversation_id, _finalize_conversation, conversation, geolocation,
+            on_status=lambda status, result: _on_conversation_finalizer_status(conversation_id, status, result))
+        # the job finishes and reports even if this task is cancelled by a newer segment
+        await asyncio.shield(job)
 
     async def finalize_processing_conversations():
         # handle edge case of conversation was actually processing? maybe later, doesn't hurt really anyway.
         # also fix from getMemories endpoint?
-        processing = conversations_db.get_processing_conversations(uid)
+        processing = await conversations_db.get_processing_conversations(uid)
         print('finalize_processing_conversations len(processing):', len(processing), uid)
         if not processing or len(processing) == 0:
             return
@@ -211,7 +241,7 @@ async def _listen(
 
     # Send last completed conversation to client
     async def send_last_conversation():
-        last_conversation = conversations_db.get_last_completed_conversation(uid)
+        last_conversation = await conversations_db.get_last_completed_conversation(uid)
         if last_conversation:
             await _send_message_event(LastConversationEvent(memory_id=last_conversation['id']))
 
@@ -226,7 +256,7 @@ async def _listen(
         seconds_to_trim = None
         seconds_to_add = None
 
-        conversation = retrieve_in_progress_conversation(uid)
+        conversation = await conversations_db.retrieve_in_progress_conversation(uid)
         if not conversation or not conversation['transcript_segments']:
             return
         await _create_conversation(conversation)
@@ -239,12 +269,12 @@ async def _listen(
     conversation_creation_timeout = 120
 
     # Process existing conversations
-    def _process_in_progess_memories():
+    async def _process_in_progess_memories():
         nonlocal conversation_creation_task
         nonlocal seconds_to_add
         nonlocal conversation_creation_timeout
         # Determine previous disconnected socket seconds to add + start processing timer if a conversation in progress
-        if existing_conversation := retrieve_in_progress_conversation(uid):
+        if existing_conversation := await conversations_db.retrieve_in_progress_conversation(uid):
             # segments seconds alignment
             started_at = datetime.fromisoformat(existing_conversation['started_at'].isoformat())
             seconds_to_add = (datetime.now(timezone.utc) - started_at).total_seconds()
@@ -266,18 +296,32 @@ async def _listen(
 
     _send_message_event(
         MessageServiceStatusEvent(status="in_progress_memories_processing", status_text="Processing Memories"))
-    _process_in_progess_memories()
+    await _process_in_progess_memories()
+
+    # folding the segments log reads and rewrites the whole transcript: in the background, one at a time
+    compacting_conversations = set()
+
+    async def _compact_conversation_segments(conversation_id: str):
+        try:
+            await conversations_db.compact_conversation_segments(uid, conversation_id)
+        finally:
+            compacting_conversations.discard(conversation_id)
+
+    async def _append_conversation_segments(conversation_id: str, segments: List[dict]):
+        if await conversations_db.append_conversation_segments(uid, conversation_id, segments) \
+                and conversation_id not in compacting_conversations:
+            compacting_conversations.add(conversation_id)
+            safe_create_task(_compact_conversation_segments(conversation_id))
 
-    def _upsert_in_progress_conversation(segments: List[TranscriptSegment], finished_at: datetime):
-        if existing := retrieve_in_progress_conversation(uid):
+    async def _upsert_in_progress_conversation(segments: List[TranscriptSegment], finished_at: datetime):
+        if existing := await conversations_db.retrieve_in_progress_conversation(uid):
             conversation = Conversation(**existing)
             conversation.transcript_segments, (starts, ends) = TranscriptSegment.combine_segments(
                 conversation.transcript_segments, segments)
-            conversations_db.update_conversation_segments(uid, conversation.id,
-                                                          [segment.dict() for segment in
-                                                           conversation.transcript_segments])
-            conversations_db.update_conversation_finished_at(uid, conversation.id, finished_at)
-            redis_db.set_in_progress_conversation_id(uid, conversation.id)
+            await _append_conversation_segments(conversation.id, [segment.dict() for segment in
+                                                                  conversation.transcript_segments[starts:ends]])
+            await conversations_db.update_conversation_finished_at(uid, conversation.id, finished_at)
+            await conversations_db.set_in_progress_conversation_id(uid, conversation.id)
             return conversation, (starts, ends)
 
         # new
@@ -294,8 +338,8 @@ async def _listen(
             status=ConversationStatus.in_progress,
         )
         print('_get_in_progress_conversation new', conversation, uid)
-        conversations_db.upsert_conversation(uid, conversation_data=conversation.dict())
-        redis_db.set_in_progress_conversation_id(uid, conversation.id)
+        await conversations_db.upsert_conversation(uid, conversation_data=conversation.dict())
+        await conversations_db.set_in_progress_conversation_id(uid, conversation.id)
         return conversation, (0, len(segments))
 
     async def create_conversation_on_segment_received_task(finished_at: datetime):
@@ -329,11 +373,8 @@ async def _listen(
     deepgram_socket2 = None
     speech_profile_duration = 0
 
-    realtime_segment_buffers = []
-
     def stream_transcript(segments):
-        nonlocal realtime_segment_buffers
-        realtime_segment_buffers.extend(segments)
+        realtime_segment_buffer.put(segments)
 
     async def _process_stt():
         nonlocal websocket_close_code
@@ -415,73 +456,89 @@ async def _listen(
         pusher_ws = None
         pusher_connect_lock = asyncio.Lock()
         pusher_connected = False
+        # v2 framing state, one per connection
+        transcript_encoder = None
+        # reconnect attempts of both consumers, backing off while the pusher is down
+        pusher_reconnect_delay = 0
+        pusher_reconnect_at = 0
 
         # Transcript
-        segment_buffers = []
+        # a segment updated while waiting replaces its pending version, the buffer grows with new segments only
+        transcript_buffer = BatchBuffer(max_delay=0.05, capacity=1000, key=lambda segment: segment.get('id'),
+                                        name=f'pusher transcripts {uid}')
+        pusher_buffers.append(transcript_buffer)
         in_progress_conversation_id = None
 
         def transcript_send(segments, conversation_id):
-            nonlocal segment_buffers
             nonlocal in_progress_conversation_id
             in_progress_conversation_id = conversation_id
-            segment_buffers.extend(segments)
+            transcript_buffer.put(segments)
+
+        async def _ensure_connected(buffer: BatchBuffer) -> bool:
+            nonlocal pusher_reconnect_delay
+            nonlocal pusher_reconnect_at
+            # a batch waits in its (bounded) buffer while the pusher is reconnecting
+            loop = asyncio.get_running_loop()
+            while not pusher_connected and not buffer.closed and loop.time() < pusher_reconnect_at:
+                await asyncio.sleep(pusher_reconnect_at - loop.time())
+            if not pusher_connected:
+                # the next attempt, of either consumer, waits for the backoff unless this one succeeds
+                delay = min(max(pusher_reconnect_delay * 2, pusher_reconnect_min_seconds), pusher_reconnect_max_seconds)
+                pusher_reconnect_at = loop.time() + delay
+                await connect()
+                pusher_reconnect_delay = 0 if pusher_connected else delay
+                if pusher_connected:
+                    pusher_reconnect_at = 0
+            if not pusher_connected and buffer.closed:
+                print(f"Pusher not connected, dropping {len(buffer)} pending items", uid)
+                buffer.take()
+            return pusher_connected and pusher_ws is not None
 
         async def transcript_consume():
-            nonlocal websocket_active
-            nonlocal segment_buffers
-            nonlocal in_progress_conversation_id
-            nonlocal pusher_ws
             nonlocal pusher_connected
-            while websocket_active or len(segment_buffers) > 0:
-                await asyncio.sleep(1)
-                if pusher_connected and pusher_ws and len(segment_buffers) > 0:
-                    try:
-                        # 102|data
-                        data = bytearray()
-                        data.extend(struct.pack("I", 102))
-                        data.extend(
-                            bytes(json.dumps({"segments": segment_buffers, "memory_id": in_progress_conversation_id}),
-                                  "utf-8"))
-                        segment_buffers = []  # reset
-                        await pusher_ws.send(data)
-                    except websockets.exceptions.ConnectionClosed as e:
-                        print(f"Pusher transcripts Connection closed: {e}", uid)
+            while await transcript_buffer.wait():
+                if not await _ensure_connected(transcript_buffer):
+                    continue
+                try:
+                    segments = transcript_buffer.take()
+                    if transcript_encoder is not None:
+                        data = transcript_encoder.encode(segments, in_progress_conversation_id)
+                    else:
+                        data = encode_transcript_v1(segments, in_progress_conversation_id)
+                    # awaiting the send is the backpressure, segments coalesce meanwhile
+                    await pusher_ws.send(data)
+                except websockets.exceptions.ConnectionClosed as e:
+                    print(f"Pusher transcripts Connection closed: {e}", uid)
+                    pusher_connected = False
+                except Exception as e:
+                    print(f"Pusher transcripts failed: {e}", uid)
+                    if transcript_encoder is not None:
+                        # the pusher's v2 state may no longer match ours, start over on a new connection
                         pusher_connected = False
-                    except Exception as e:
-                        print(f"Pusher transcripts failed: {e}", uid)
-                if pusher_connected is False:
-                    await connect()
 
         # Audio bytes
-        audio_buffers = bytearray()
         audio_bytes_enabled = bool(get_audio_bytes_webhook_seconds(uid)) or is_audio_bytes_app_enabled(uid)
+        audio_bytes_per_second = sample_rate * 2
+        audio_buffer = BatchBuffer(max_delay=0.2, batch_size=audio_bytes_per_second // 2,
+                                   capacity=audio_bytes_per_second * 60, size_of=len, name=f'pusher audio {uid}')
+        if audio_bytes_enabled:
+            pusher_buffers.append(audio_buffer)
 
         def audio_bytes_send(audio_bytes):
-            nonlocal audio_buffers
-            audio_buffers.extend(audio_bytes)
+            audio_buffer.put([audio_bytes])
 
         async def audio_bytes_consume():
-            nonlocal websocket_active
-            nonlocal audio_buffers
-            nonlocal pusher_ws
             nonlocal pusher_connected
-            while websocket_active or len(audio_buffers) > 0:
-                await asyncio.sleep(1)
-                if pusher_connected and pusher_ws and len(audio_buffers) > 0:
-                    try:
-                        # 101|data
-                        data = bytearray()
-                        data.extend(struct.pack("I", 101))
-                        data.extend(audio_buffers.copy())
-                        audio_buffers = bytearray()  # reset
-                        await pusher_ws.send(data)
-                    except websockets.exceptions.ConnectionClosed as e:
-                        print(f"Pusher audio_bytes Connection closed: {e}", uid)
-                        pusher_connected = False
-                    except Exception as e:
-                        print(f"Pusher audio_bytes failed: {e}", uid)
-                if pusher_connected is False:
-                    await connect()
+            while await audio_buffer.wait():
+                if not await _ensure_connected(audio_buffer):
+                    continue
+                try:
+                    await pusher_ws.send(encode_audio(audio_buffer.take()))
+                except websockets.exceptions.ConnectionClosed as e:
+                    print(f"Pusher audio_bytes Connection closed: {e}", uid)
+                    pusher_connected = False
+                except Exception as e:
+                    print(f"Pusher audio_bytes failed: {e}", uid)
 
         async def connect():
             nonlocal pusher_connected
@@ -503,9 +560,11 @@ async def _listen(
         async def _connect():
             nonlocal pusher_ws
             nonlocal pusher_connected
+            nonlocal transcript_encoder
 
             try:
                 pusher_ws = await connect_to_trigger_pusher(uid, sample_rate)
+                transcript_encoder = TranscriptEncoder() if negotiated_version(pusher_ws.subprotocol) == 2 else None
                 pusher_connected = True
             except Exception as e:
                 print(f"Exception in connect: {e}")
@@ -590,23 +649,19 @@ async def _listen(
 
             # Update the conversation in the database to persist translations
             if len(translated_segments) > 0:
-                conversation = conversations_db.get_conversation(uid, conversation_id)
+                conversation = await conversations_db.get_conversation(uid, conversation_id)
                 if conversation:
-                    should_updates = False
+                    updated_segments = []
                     for segment in translated_segments:
                         for i, existing_segment in enumerate(conversation['transcript_segments']):
                             if existing_segment['id'] == segment.id:
                                 conversation['transcript_segments'][i]['translations'] = segment.dict()['translations']
-                                should_updates = True
+                                updated_segments.append(conversation['transcript_segments'][i])
                                 break
 
                     # Update the database
-                    if should_updates:
-                        conversations_db.update_conversation_segments(
-                            uid,
-                            conversation_id,
-                            conversation['transcript_segments']
-                        )
+                    if updated_segments:
+                        await _append_conversation_segments(conversation_id, updated_segments)
 
             # Send a translation event to the client with the translated segments
             if websocket_active and len(translated_segments) > 0:
@@ -619,24 +674,14 @@ async def _listen(
             print(f"Translation error: {e}", uid)
 
     async def stream_transcript_process():
-        nonlocal websocket_active
-        nonlocal realtime_segment_buffers
         nonlocal websocket
         nonlocal seconds_to_trim
         nonlocal current_conversation_id
         nonlocal including_combined_segments
         nonlocal translation_enabled
 
-        while websocket_active or len(realtime_segment_buffers) > 0:
+        while (segments := await realtime_segment_buffer.get()) is not None:
             try:
-                await asyncio.sleep(0.3)  # 300ms
-
-                if not realtime_segment_buffers or len(realtime_segment_buffers) == 0:
-                    continue
-
-                segments = realtime_segment_buffers.copy()
-                realtime_segment_buffers = []
-
                 # Align the start, end segment
                 if seconds_to_trim is None:
                     seconds_to_trim = segments[0]["start"]
@@ -661,7 +706,7 @@ async def _listen(
                                                                              segments])
 
                 # can trigger race condition? increase soniox utterance?
-                conversation, (starts, ends) = _upsert_in_progress_conversation(transcript_segments, finished_at)
+                conversation, (starts, ends) = await _upsert_in_progress_conversation(transcript_segments, finished_at)
                 current_conversation_id = conversation.id
 
                 # Send to client
@@ -683,6 +728,9 @@ async def _listen(
             except Exception as e:
                 print(f'Could not process transcript: error {e}', uid)
 
+        for buffer in pusher_buffers:
+            buffer.close()
+
     # Audio bytes
     #
     # # Initiate a separate vad for each websocket
@@ -766,6 +814,7 @@ async def _listen(
             websocket_close_code = 1011
         finally:
             websocket_active = False
+            realtime_segment_buffer.close()
 
     # Start
     #
@@ -15,6 +15,7 @@ from database.users import *
 from models.conversation import Geolocation, Conversation
 from models.other import Person, CreatePerson
 from models.users import WebhookType
+from utils import encryption
 from utils.apps import get_available_app_by_id
 from utils.llm.followup import followup_question_prompt
 from utils.other import endpoints as auth
@@ -52,6 +53,7 @@ def get_user_profile_endpoint(uid: str = Depends(auth.get_current_user_uid)):
 def delete_account(uid: str = Depends(auth.get_current_user_uid)):
     try:
         delete_user_data(uid)
+        encryption.clear_key_cache(uid)
         # delete user from firebase auth
         auth.delete_account(uid)
         return {'status': 'ok', 'message': 'Account deleted successfully'}
@@ -0,0 +1,173 @@
+# Firestore reads per realtime batch to find a user's enabled apps, before (`utils.apps.get_available_apps` on every
+# batch, filtered to the enabled ones) and after (`utils.apps.get_enabled_apps_registry`: built once, then kept in
+# process memory and redis under (global, user) versions).
+#
+# Runs against in-memory apps and testers collections patched into `utils.apps`, counting queries, document gets
+# and documents read, and a fakeredis for everything in `database.redis_db`. Every user has a few private apps,
+# there are public approved apps and a few public unapproved ones; each user enabled some of them.
+#
+# Checks, in order:
+# - both paths give the same enabled apps
+# - cold: the first batch of each user reads what `get_available_apps` reads; warm: later batches read nothing
+# - another instance (in-process registry empty) builds nothing, the redis entry is used and gives the same apps
+# - `invalidate_apps_registry(uid)` (an app enabled) rebuilds that user alone, with the new app;
+#   `invalidate_apps_registry()` (an app changed) rebuilds every user once
+#
+# Usage (from backend/):
+#   python -m testing.apps_registry_benchmark --users 20 --batches 50 --public-apps 200
+#
+# Prints one JSON line per path and phase, then the checks; exits with an error if one fails.
+import argparse
+import json
+import random
+from collections import Counter
+
+from testing.listen_load.server import configure_environment
+
+
+def _check(name: str, ok: bool, **data):
+    print(json.dumps({'check': name, 'ok': ok, **data}))
+    if not ok:
+        raise SystemExit(1)
+
+
+def _app(app_id: str, uid: str | None, private: bool, approved: bool) -> dict:
+    return {'id': app_id, 'name': app_id, 'uid': uid, 'private': private, 'approved': approved,
+            'category': 'productivity', 'author': 'omi', 'description': f'{app_id} app', 'image': '',
+            'capabilities': ['external_integration'],
+            'external_integration': {'triggers_on': 'transcript_processed', 'webhook_url': 'http://127.0.0.1:1/hook',
+                                     'setup_instructions_file_path': None}}
+
+
+class FakeApps:
+    """The apps and testers collections `utils.apps` reads, in memory. Counted as Firestore bills them: each query
+    or document get, and each document returned."""
+
+    def __init__(self, apps):
+        self.apps = apps
+        self.testers = {}
+        self.calls = Counter()
+
+    def _query(self, predicate):
+        self.calls['queries'] += 1
+        found = [dict(app) for app in self.apps if predicate(app)]
+        self.calls['documents_read'] += len(found)
+        return found
+
+    def _get(self, uid):
+        self.calls['gets'] += 1
+        self.calls['documents_read'] += 1
+        return self.testers.get(uid)
+
+    def install(self, apps_module):
+        fake = self
+        apps_module.get_private_apps_db = lambda uid: fake._query(lambda a: a['uid'] == uid and a['private'])
+        apps_module.get_public_approved_apps_db = lambda: fake._query(lambda a: a['approved'] and not a['private'])
+        apps_module.get_public_unapproved_apps_db = lambda uid: fake._query(
+            lambda a: not a['approved'] and a['uid'] == uid and not a['private'])
+        apps_module.is_tester_db = lambda uid: fake._get(uid) is not None
+        apps_module.get_apps_for_tester_db = lambda uid: fake._query(
+            lambda a: not a['approved'] and a['id'] in (fake._get(uid) or []))
+
+
+def _scenario(args):
+    rng = random.Random(args.seed)
+    users = [f'user-{i}' for i in range(args.users)]
+    apps = [_app(f'public-{i}', 'omi', False, True) for i in range(args.public_apps)]
+    for uid in users:
+        apps += [_app(f'{uid}-private-{i}', uid, True, False) for i in range(args.private_apps)]
+        apps.append(_app(f'{uid}-unapproved', uid, False, False))
+    enabled = {uid: rng.sample([app['id'] for app in apps if app['uid'] in ('omi', uid)], args.enabled_apps)
+               for uid in users}
+    return users, apps, enabled
+
+
+def _per_batch(calls: Counter, batches: int) -> dict:
+    return {key: round(value / batches, 2) for key, value in calls.items()}
+
+
+def _clear_generic_cache(redis_db):
+    for key in redis_db.r.scan_iter('cache:*'):
+        redis_db.r.delete(key)
+
+
+def run(args):
+    configure_environment('ws://127.0.0.1:1', 'deepgram')
+    import fakeredis
+
+    from database import redis_db
+    import utils.apps as apps_module
+
+    redis_db.r = fakeredis.FakeStrictRedis()
+    users, apps, enabled = _scenario(args)
+    for uid in users:
+        for app_id in enabled[uid]:
+            redis_db.enable_app(uid, app_id)
+    store = FakeApps(apps)
+    store.install(apps_module)
+
+    def legacy(uid):
+        return [app for app in apps_module.get_available_apps(uid) if app.enabled]
+
+    def batches(lookup) -> (Counter, dict):
+        before = Counter(store.calls)
+        found = {}
+        for _ in range(args.batches):
+            for uid in users:
+                found[uid] = sorted(app.id for app in lookup(uid))
+        return store.calls - before, found
+
+    total = args.batches * len(users)
+    _clear_generic_cache(redis_db)
+    legacy_calls, legacy_found = batches(legacy)
+    print(json.dumps({'path': 'get_available_apps', 'batches': total, 'per_batch': _per_batch(legacy_calls, total),
+                      **legacy_calls}))
+
+    _clear_generic_cache(redis_db)
+    apps_module._apps_registry.clear()
+    before = Counter(store.calls)
+    cold_found = {uid: sorted(app.id for app in apps_module.get_enabled_apps_registry(uid)) for uid in users}
+    cold_calls = store.calls - before
+    warm_calls, registry_found = batches(apps_module.get_enabled_apps_registry)
+    print(json.dumps({'path': 'registry', 'phase': 'cold', 'batches': len(users), **cold_calls}))
+    print(json.dumps({'path': 'registry', 'phase': 'warm', 'batches': total, **warm_calls}))
+
+    _check('same_apps', legacy_found == registry_found == cold_found
+           and all(registry_found[uid] == sorted(enabled[uid]) for uid in users),
+           users=len(users), enabled_apps=args.enabled_apps)
+    # the first batch of a user with an empty generic cache reads what `get_available_apps` reads
+    _check('cold_then_warm', cold_calls['queries'] == 2 * len(users) + 1 and not warm_calls,
+           cold_documents_read=cold_calls['documents_read'], warm_documents_read=warm_calls['documents_read'],
+           legacy_documents_read_per_batch=round(legacy_calls['documents_read'] / total, 2))
+
+    # another instance: nothing in process memory, the apps read back from redis as they were built
+    built = {uid: apps_module._apps_registry[uid][1] for uid in users}
+    apps_module._apps_registry.clear()
+    other_calls, other_found = batches(apps_module.get_enabled_apps_registry)
+    _check('other_instance', not other_calls and other_found == registry_found
+           and all(apps_module._apps_registry[uid][1] == built[uid] for uid in users), calls=dict(other_calls))
+
+    # a user enables an app: that user alone is rebuilt
+    uid = users[0]
+    new_app = next(app['id'] for app in apps if app['uid'] == 'omi' and app['id'] not in enabled[uid])
+    redis_db.enable_app(uid, new_app)
+    user_calls, user_found = batches(apps_module.get_enabled_apps_registry)
+    _check('user_invalidation', new_app in user_found[uid] and user_calls['gets'] == 1
+           and user_found == {**registry_found, uid: sorted(enabled[uid] + [new_app])}, calls=dict(user_calls))
+
+    # an app changes: every user is rebuilt once
+    apps_module.invalidate_apps_registry()
+    global_calls, _ = batches(apps_module.get_enabled_apps_registry)
+    _check('global_invalidation', global_calls['gets'] == len(users), calls=dict(global_calls),
+           per_batch=_per_batch(global_calls, total))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--batches', type=int, default=50, help='realtime batches per user')
+    parser.add_argument('--public-apps', type=int, default=200)
+    parser.add_argument('--private-apps', type=int, default=3, help='private apps per user')
+    parser.add_argument('--enabled-apps', type=int, default=5, help='apps each user enabled')
+    parser.add_argument('--seed', type=int, default=7)
+    run(parser.parse_args())
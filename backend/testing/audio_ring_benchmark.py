@@ -0,0 +1,194 @@
+# Boundary checks and a memory benchmark for `utils.other.audio_ring`, the pusher's audio bytes buffer.
+#
+# - checks: random frame sizes, capacities and intervals against a plain copy of the whole stream; writes of
+#   exactly the capacity, larger than it, wrapping windows, empty frames, overwritten windows, and a read on
+#   another thread while a write has copied its bytes but not yet published them
+# - benchmark: an hour of 16kHz PCM16 in 100ms frames through the previous per-consumer bytearrays and through
+#   the ring, with an audio bytes app (5s) and a developer webhook (`--webhook-seconds`), each consumer keeping
+#   `--pending` sends waiting for a worker; reports Python allocations (tracemalloc) and time on the loop
+#
+# Usage (from backend/):
+#   python -m testing.audio_ring_benchmark --minutes 60 --webhook-seconds 30
+import argparse
+import inspect
+import json
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+from utils.other.audio_ring import AudioRingBuffer, AudioRingConsumer
+
+
+# *****************************
+# *********** CHECKS **********
+# *****************************
+
+def _check_stream(rng: random.Random, capacity: int, intervals: list, frames: int):
+    ring = AudioRingBuffer(capacity)
+    consumers = [AudioRingConsumer(ring, interval) for interval in intervals]
+    stream = bytearray()
+    for _ in range(frames):
+        frame = bytes(rng.getrandbits(8) for _ in range(rng.choice([0, 1, 7, capacity // 3, capacity // 2])))
+        stream.extend(frame)
+        ring.write(frame)
+        assert ring.written == len(stream)
+        for consumer in consumers:
+            if consumer.due():
+                window = consumer.take()
+                assert len(window) > consumer.interval_bytes
+                assert window.end == len(stream)
+                assert window.read() == bytes(stream[window.start:window.end]), (capacity, intervals)
+                assert b''.join(window.views()) == bytes(stream[window.start:window.end])
+                assert len(window.views()) <= 2
+
+
+def _read_during_write():
+    """Pauses a write on another thread right before it publishes `written`, and reads meanwhile."""
+    ring = AudioRingBuffer(8)
+    ring.write(b'abcdefgh')
+    lines, first_line = inspect.getsourcelines(AudioRingBuffer.write)
+    publish_line = first_line + max(i for i, line in enumerate(lines) if line.strip().startswith('self.written'))
+    paused, resume = threading.Event(), threading.Event()
+
+    def trace(frame, event, arg):
+        if frame.f_code is not AudioRingBuffer.write.__code__:
+            return None
+
+        def line(frame, event, arg):
+            if event == 'line' and frame.f_lineno == publish_line:
+                paused.set()
+                resume.wait(5)
+            return line
+
+        return line
+
+    def writer():
+        sys.settrace(trace)
+        try:
+            ring.write(b'ijkl')
+        finally:
+            sys.settrace(None)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    assert paused.wait(5)
+    # 'abcd' is already overwritten with 'ijkl', only `written` doesn't say so yet
+    torn, intact = ring.read(0, 8), ring.read(4, 8)
+    resume.set()
+    thread.join()
+    assert torn is None, torn
+    assert intact == b'efgh'
+    assert ring.read(4, 12) == b'efghijkl'
+
+
+def check(seed: int = 7):
+    rng = random.Random(seed)
+    for capacity in [1, 2, 7, 64, 1000]:
+        for _ in range(20):
+            intervals = [rng.randint(0, capacity - 1) for _ in range(rng.randint(1, 3))]
+            _check_stream(rng, capacity, intervals, 50)
+
+    # exactly the capacity, then wrapping by one byte
+    ring = AudioRingBuffer(4)
+    ring.write(b'abcd')
+    assert ring.views(0, 4) == [memoryview(b'abcd')]
+    ring.write(b'e')
+    assert ring.views(0, 5) is None and ring.read(0, 5) is None
+    assert [bytes(v) for v in ring.views(1, 5)] == [b'bcd', b'e']
+    assert ring.read(3, 5) == b'de'
+    assert ring.views(5, 5) == []
+
+    # a frame larger than the ring keeps its tail
+    ring = AudioRingBuffer(4)
+    ring.write(b'0123456789')
+    assert ring.written == 10 and ring.read(6, 10) == b'6789'
+
+    # a window the ring wrapped over is never returned, even partially
+    ring = AudioRingBuffer(8)
+    consumer = AudioRingConsumer(ring, 3)
+    ring.write(b'abcd')
+    window = consumer.take()
+    ring.write(b'efgh')
+    assert window.read() == b'abcd'
+    ring.write(b'i')
+    assert window.read() is None and window.views() is None
+
+    _read_during_write()
+
+    for bad in [lambda: AudioRingBuffer(0), lambda: AudioRingConsumer(AudioRingBuffer(4), 5),
+                lambda: AudioRingBuffer(4).views(0, 1)]:
+        try:
+            bad()
+        except ValueError:
+            continue
+        raise AssertionError('expected ValueError')
+    return {'scenario': 'checks', 'ok': True}
+
+
+# *****************************
+# ********* BENCHMARK *********
+# *****************************
+
+def _previous(frames, sample_rate: int, intervals: list, pending: int):
+    buffers = [bytearray() for _ in intervals]
+    queues = [deque(maxlen=pending) for _ in intervals]
+    for data in frames:
+        for i, seconds in enumerate(intervals):
+            buffers[i].extend(data[4:])
+            if len(buffers[i]) > sample_rate * seconds * 2:
+                queues[i].append(buffers[i].copy())
+                buffers[i] = bytearray()
+
+
+def _ring(frames, sample_rate: int, intervals: list, pending: int, headroom_seconds: int = 10):
+    ring = AudioRingBuffer(sample_rate * 2 * (max(intervals) + headroom_seconds))
+    consumers = [AudioRingConsumer(ring, sample_rate * seconds * 2) for seconds in intervals]
+    queues = [deque(maxlen=pending) for _ in intervals]
+    for data in frames:
+        ring.write(memoryview(data)[4:])
+        for i, consumer in enumerate(consumers):
+            if consumer.due():
+                if len(queues[i]) == pending:
+                    # the oldest pending send reaches a worker, which copies its window
+                    queues[i].popleft().read()
+                queues[i].append(consumer.take())
+
+
+def benchmark(minutes: float, sample_rate: int, webhook_seconds: int, pending: int):
+    frame = b'\x65\x00\x00\x00' + bytes(sample_rate * 2 // 10)
+    frame_count = int(minutes * 60 * 10)
+    results = []
+    for name, fn in [('previous', _previous), ('ring', _ring)]:
+        frames = (frame for _ in range(frame_count))
+        tracemalloc.start()
+        started = time.perf_counter()
+        fn(frames, sample_rate, [5, webhook_seconds], pending)
+        elapsed = time.perf_counter() - started
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # untraced, for the time per frame
+        started = time.perf_counter()
+        fn((frame for _ in range(frame_count)), sample_rate, [5, webhook_seconds], pending)
+        untraced = time.perf_counter() - started
+        results.append({'scenario': 'memory', 'strategy': name, 'audio_minutes': minutes,
+                        'sample_rate': sample_rate, 'intervals_seconds': [5, webhook_seconds], 'pending': pending,
+                        'peak_mb': round(peak / 2 ** 20, 2), 'end_mb': round(current / 2 ** 20, 2),
+                        'us_per_frame': round(untraced / frame_count * 1e6, 2),
+                        'traced_seconds': round(elapsed, 2)})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--minutes', type=float, default=60)
+    parser.add_argument('--sample-rate', type=int, default=16000)
+    parser.add_argument('--webhook-seconds', type=int, default=30)
+    parser.add_argument('--pending', type=int, default=4, help='sends waiting for a worker, per consumer')
+    args = parser.parse_args()
+    print(json.dumps(check()))
+    for result in benchmark(args.minutes, args.sample_rate, args.webhook_seconds, args.pending):
+        print(json.dumps(result))
@@ -0,0 +1,117 @@
+# Event-loop lag of other listen sockets while conversations are finalized, before (`process_conversation` called
+# on the loop by `_create_conversation`) and after (`utils.conversations.finalizer.ConversationFinalizer`).
+#
+# Sockets are tasks waking up every `--tick-ms`, their lag is how late each wake-up is. Finalization is simulated
+# as `--llm-ms` of waiting on I/O (LLM, Firestore, Pinecone) plus `--cpu-ms` of Python work holding the GIL. Each
+# conversation is also submitted a second time while it is finalizing, and must still run only once.
+#
+# Usage (from backend/, the finalizer claims conversations in Redis):
+#   REDIS_DB_HOST=localhost FIRESTORE_EMULATOR_HOST=localhost:8080 GOOGLE_CLOUD_PROJECT=demo \
+#     python -m testing.conversation_finalizer_benchmark --sockets 200 --conversations 20
+#
+# Prints one JSON line per mode: lag percentiles with and without finalizations running, and status counts.
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+from collections import Counter
+
+from utils.conversations.finalizer import ConversationFinalizer
+
+
+def _ms(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {'p50': round(statistics.median(values) * 1000, 2),
+            'p99': round(values[min(int(len(values) * 0.99), len(values) - 1)] * 1000, 2),
+            'max': round(values[-1] * 1000, 2)}
+
+
+def _finalize(llm_seconds: float, cpu_seconds: float, runs: Counter, conversation_id: str):
+    runs[conversation_id] += 1
+    time.sleep(llm_seconds)
+    deadline = time.perf_counter() + cpu_seconds
+    n = 0
+    while time.perf_counter() < deadline:
+        n += 1
+    return conversation_id
+
+
+async def _socket(tick: float, lags: list, active: list):
+    expected = time.perf_counter() + tick
+    while active[0]:
+        await asyncio.sleep(max(expected - time.perf_counter(), 0))
+        now = time.perf_counter()
+        lags.append(now - expected)
+        expected = now + tick
+
+
+async def _measure(args, workload):
+    lags, active = [], [True]
+    sockets = [asyncio.create_task(_socket(args.tick_ms / 1000, lags, active)) for _ in range(args.sockets)]
+    await asyncio.sleep(1)
+    lags.clear()
+    await workload()
+    active[0] = False
+    await asyncio.gather(*sockets)
+    return lags
+
+
+async def run(args):
+    llm_seconds, cpu_seconds = args.llm_ms / 1000, args.cpu_ms / 1000
+
+    async def idle():
+        await asyncio.sleep(args.idle_seconds)
+
+    baseline = await _measure(args, idle)
+    print(json.dumps({'mode': 'idle', 'sockets': args.sockets, 'lag_ms': _ms(baseline)}))
+
+    for mode in args.modes.split(','):
+        runs, statuses = Counter(), Counter()
+        finalizer = ConversationFinalizer(max_workers=args.workers, name=f'benchmark-{mode}')
+        started = time.perf_counter()
+
+        async def finalizations():
+            async def one(i: int):
+                # conversations end at different times across the sockets
+                await asyncio.sleep(i * args.spacing_ms / 1000)
+                conversation_id = str(uuid.uuid4())
+                if mode == 'inline':
+                    _finalize(llm_seconds, cpu_seconds, runs, conversation_id)
+                    statuses['completed'] += 1
+                    return
+                on_status = lambda status, result: statuses.update([status])
+                job = finalizer.submit(conversation_id, _finalize, llm_seconds, cpu_seconds, runs, conversation_id,
+                                       on_status=on_status)
+                # e.g. the socket reconnecting and finalizing its processing conversations again
+                duplicate = finalizer.submit(conversation_id, _finalize, llm_seconds, cpu_seconds, runs,
+                                             conversation_id, on_status=on_status)
+                await asyncio.gather(job, duplicate)
+
+            await asyncio.gather(*[one(i) for i in range(args.conversations)])
+
+        lags = await _measure(args, finalizations)
+        print(json.dumps({
+            'mode': mode, 'sockets': args.sockets, 'conversations': args.conversations, 'workers': args.workers,
+            'lag_ms': _ms(lags), 'seconds': round(time.perf_counter() - started, 2),
+            'statuses': dict(statuses), 'max_runs_per_conversation': max(runs.values()) if runs else 0,
+            'finalizer': finalizer.metrics() if mode != 'inline' else None,
+        }))
+        finalizer.executor.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sockets', type=int, default=200)
+    parser.add_argument('--conversations', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--tick-ms', type=float, default=20, help='how often each socket wakes up')
+    parser.add_argument('--llm-ms', type=float, default=1500, help='waiting on LLM and storage per conversation')
+    parser.add_argument('--cpu-ms', type=float, default=20, help='Python work per conversation')
+    parser.add_argument('--spacing-ms', type=float, default=100, help='between conversations ending')
+    parser.add_argument('--idle-seconds', type=float, default=3)
+    parser.add_argument('--modes', default='inline,finalizer')
+    asyncio.run(run(parser.parse_args()))
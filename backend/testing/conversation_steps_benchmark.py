@@ -0,0 +1,268 @@
+# End-to-end latency and failure isolation of the post-conversation steps (`process_conversation`), against a
+# deterministic fake LLM and in-memory stores patched into `utils.conversations.process_conversation`.
+#
+# Every fake LLM call takes `--llm-ms` (x2 for structuring, `--llm-jitter` adds a stable per-conversation share)
+# and answers from a hash of its input; store calls take `--store-ms`. `--fail` makes the named steps raise on
+# every attempt, the conversation must still be saved, only their dependents skipped; `--slow` adds to the named
+# calls, e.g. apps slower than `--apps-timeout-ms` are left out of the saved conversation, and must not change it
+# once saved. Default apps are read from
+# the fake Firestore through the cached catalog, app selection goes through its cache: both are counted per
+# conversation.
+#
+# Usage (from backend/):
+#   python -m testing.conversation_steps_benchmark --conversations 100 --concurrency 20
+#   python -m testing.conversation_steps_benchmark --conversations 20 --fail memories,embedding
+#   python -m testing.conversation_steps_benchmark --conversations 20 --slow apps=2000 --apps-timeout-ms 500
+#
+# Prints one JSON line: time until the conversation is returned (saved) and until all steps settled, per-step
+# timings and statuses, and whether every conversation was saved with its app results.
+import argparse
+import hashlib
+import json
+import statistics
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from testing.listen_load.server import configure_environment
+
+
+def _ms(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {'p50': round(statistics.median(values) * 1000, 1),
+            'p99': round(values[min(int(len(values) * 0.99), len(values) - 1)] * 1000, 1),
+            'max': round(values[-1] * 1000, 1)}
+
+
+def _digest(value) -> int:
+    return int(hashlib.sha256(str(value).encode('utf-8')).hexdigest()[:8], 16)
+
+
+class _Fakes:
+    """Deterministic LLM, Firestore, Pinecone and Redis for `process_conversation`, counting calls."""
+
+    def __init__(self, llm_seconds: float, llm_jitter: float, store_seconds: float, fail: set, slow: dict):
+        self.llm_seconds = llm_seconds
+        self.llm_jitter = llm_jitter
+        self.store_seconds = store_seconds
+        self.fail = fail
+        self.slow = slow
+        self.calls = Counter()
+        self.saved = {}
+        self.vectors = set()
+        self.memories = defaultdict(list)
+        self.selections = {}
+
+    def _llm(self, kind: str, prompt, factor: float = 1):
+        self.calls[kind] += 1
+        if kind in self.fail:
+            raise RuntimeError(f'fake {kind} failure')
+        time.sleep(self.llm_seconds * factor + self.llm_jitter * (_digest(prompt) % 100) / 100
+                   + self.slow.get(kind, 0))
+        return _digest(prompt)
+
+    def _store(self, kind: str):
+        self.calls[kind] += 1
+        if kind in self.fail:
+            raise RuntimeError(f'fake {kind} failure')
+        time.sleep(self.store_seconds + self.slow.get(kind, 0))
+
+    def install(self, pc):
+        import utils.apps
+        import utils.llms.memory
+        from models.app import App
+        from models.conversation import CategoryEnum, Structured
+        from models.memories import Memory
+
+        fakes = self
+
+        class NotificationDb:
+            @staticmethod
+            def get_user_time_zone(uid):
+                return 'UTC'
+
+        class ConversationsDb:
+            @staticmethod
+            def upsert_conversation(uid, data):
+                fakes._store('saved')
+                fakes.saved[data['id']] = data
+
+            @staticmethod
+            def store_conversation_photos(uid, conversation_id, photos):
+                fakes._store('photos')
+
+        class MemoriesDb:
+            @staticmethod
+            def delete_memories_for_conversation(uid, conversation_id):
+                fakes._store('memories_delete')
+                fakes.memories.pop(conversation_id, None)
+
+            @staticmethod
+            def get_memories(uid, limit=100):
+                fakes._store('memories_context')
+                return []
+
+            @staticmethod
+            def save_memories(uid, memories):
+                fakes._store('memories_save')
+                for memory in memories:
+                    fakes.memories[memory['conversation_id']].append(memory)
+
+        class RedisDb:
+            @staticmethod
+            def get_enabled_apps(uid):
+                return []
+
+            @staticmethod
+            def enable_app(uid, app_id):
+                pass
+
+            @staticmethod
+            def get_apps_registry_version():
+                return 0
+
+            @staticmethod
+            def get_app_selection(signature):
+                return fakes.selections.get(signature)
+
+            @staticmethod
+            def set_app_selection(signature, app_id):
+                fakes.selections[signature] = app_id
+
+        def app(app_id: str):
+            return App(id=app_id, name=app_id, category='productivity', description=f'{app_id} app', author='omi',
+                       image='', capabilities={'memories'}, memory_prompt=f'Run {app_id}', enabled=True)
+
+        def get_apps_by_ids_db(app_ids):
+            fakes.calls['firestore_reads'] += len(app_ids)
+            time.sleep(fakes.store_seconds)
+            return [app(app_id).dict() for app_id in app_ids]
+
+        class Dispatcher:
+            @staticmethod
+            def submit(fn, *args):
+                fakes.calls['webhook'] += 1
+
+        def get_transcript_structure(transcript, started_at, language_code, tz):
+            n = fakes._llm('structured', transcript, 2)
+            categories = list(CategoryEnum)
+            return Structured(title=f'Conversation {n % 1000}', overview=f'About {n}', emoji='🧠',
+                              category=categories[n % len(categories)])
+
+        def new_memories_extractor(uid, segments):
+            n = fakes._llm('memories', ' '.join(segment.text for segment in segments))
+            return [Memory(content=f'Fact {n + i}') for i in range(n % 3)]
+
+        def upsert_vector2(uid, conversation, vector, metadata):
+            fakes._store('vector')
+            fakes.vectors.add(conversation.id)
+
+        pc.notification_db = NotificationDb
+        pc.conversations_db = ConversationsDb
+        pc.memories_db = MemoriesDb
+        pc.redis_db = RedisDb
+        pc.dispatcher = Dispatcher
+        pc.should_discard_conversation = lambda transcript: fakes._llm('discard', transcript) < 0
+        pc.get_transcript_structure = get_transcript_structure
+        # enabled apps come from the registry (its own cache), default apps from the catalog
+        pc.get_enabled_apps_registry = lambda uid: [app('user_app'), app('summary_assistant')]
+        utils.apps.get_apps_by_ids_db = get_apps_by_ids_db
+        utils.apps.get_apps_registry_version = RedisDb.get_apps_registry_version
+        pc.get_user_preferred_app = lambda uid: None
+        pc.select_best_app_for_conversation = lambda conversation, apps: (
+            apps[fakes._llm('app_selection', conversation.structured.category) % len(apps)])
+        pc.get_app_result = lambda transcript, app, language_code='en': f'{app.id}: {fakes._llm("apps", transcript)}'
+        pc.record_app_usage = lambda *args, **kwargs: None
+        pc.generate_embedding = lambda text: [fakes._llm('embedding', text) % 7 / 7] * 8
+        pc.retrieve_metadata_fields_from_transcript = lambda uid, created_at, segments, tz: {
+            'topics': [str(fakes._llm('vector_metadata', segments))]}
+        pc.upsert_vector2 = upsert_vector2
+        pc.new_memories_extractor = new_memories_extractor
+        # the dedupe pass reads the (cached) memories prompt context
+        utils.llms.memory.get_user_memories_version = lambda uid: 0
+        utils.llms.memory.memories_db = MemoriesDb
+        pc.update_personas_async = lambda uid: fakes._store('personas')
+
+
+def _conversation(i: int):
+    from models.conversation import Conversation, ConversationStatus, Structured
+    from models.transcript_segment import TranscriptSegment
+
+    now = datetime.now(timezone.utc)
+    segments = [TranscriptSegment(text=f'conversation {i} line {j} about the plan for next week',
+                                  speaker=f'SPEAKER_0{j % 2}', is_user=j % 2 == 0, start=j * 5, end=j * 5 + 4)
+                for j in range(40)]
+    return Conversation(id=str(uuid.uuid4()), created_at=now, started_at=now, finished_at=now,
+                        structured=Structured(), transcript_segments=segments, status=ConversationStatus.processing)
+
+
+def run(args):
+    configure_environment('ws://127.0.0.1:1', 'deepgram')
+    import utils.conversations.process_conversation as pc
+
+    fail = set(filter(None, args.fail.split(',')))
+    slow = {kind: float(ms) / 1000 for kind, ms in (item.split('=') for item in filter(None, args.slow.split(',')))}
+    fakes = _Fakes(args.llm_ms / 1000, args.llm_jitter_ms / 1000, args.store_ms / 1000, fail, slow)
+    fakes.install(pc)
+    pc.conversation_steps_executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='steps')
+    if args.apps_timeout_ms is not None:
+        pc.apps_timeout_seconds = args.apps_timeout_ms / 1000
+
+    returned, settled, objs = [], [], []
+    step_ms, statuses = defaultdict(list), defaultdict(Counter)
+
+    def one(i: int):
+        conversation = _conversation(i)
+        started = time.perf_counter()
+        steps = pc._conversation_steps('benchmark-uid', 'en', conversation).start()
+        steps.wait(['saved'])
+        returned.append(time.perf_counter() - started)
+        steps.wait()
+        settled.append(time.perf_counter() - started)
+        if steps.status['saved'] == 'completed':
+            objs.append(steps.result('saved'))
+        for name, timing in steps.timings().items():
+            statuses[name][timing['status']] += 1
+            if timing['ms'] is not None:
+                step_ms[name].append(timing['ms'] / 1000)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as sessions:
+        list(sessions.map(one, range(args.conversations)))
+
+    # late apps are done by now: none of them may have touched a saved conversation
+    time.sleep(max(slow.values(), default=0))
+    changed = sum(1 for obj in objs
+                  if [result.dict() for result in obj.apps_results] != fakes.saved[obj.id]['apps_results'])
+    saved = list(fakes.saved.values())
+    print(json.dumps({
+        'conversations': args.conversations, 'concurrency': args.concurrency, 'workers': args.workers,
+        'fail': sorted(fail), 'seconds': round(time.perf_counter() - started, 2),
+        'returned_ms': _ms(returned), 'settled_ms': _ms(settled),
+        'steps': {name: {'statuses': dict(statuses[name]), 'ms': _ms(step_ms[name])} for name in statuses},
+        'saved': len(saved), 'saved_completed': sum(1 for data in saved if data['status'] == 'completed'),
+        'saved_with_app_results': sum(1 for data in saved if data['apps_results']),
+        'changed_after_save': changed,
+        'vectors': len(fakes.vectors), 'conversations_with_memories': len(fakes.memories),
+        'calls': dict(fakes.calls),
+        'per_conversation': {kind: round(count / args.conversations, 2) for kind, count in fakes.calls.items()
+                             if kind in ('firestore_reads', 'app_selection', 'structured', 'apps', 'memories')},
+    }))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--conversations', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=20, help='conversations processed at once')
+    parser.add_argument('--workers', type=int, default=32, help='step executor threads')
+    parser.add_argument('--llm-ms', type=float, default=200)
+    parser.add_argument('--llm-jitter-ms', type=float, default=100)
+    parser.add_argument('--store-ms', type=float, default=20)
+    parser.add_argument('--fail', default='', help='comma separated fake calls that always raise, e.g. memories')
+    parser.add_argument('--slow', default='', help='comma separated kind=ms added to fake calls, e.g. apps=2000')
+    parser.add_argument('--apps-timeout-ms', type=float, help='how long the apps step waits for the apps')
+    run(parser.parse_args())
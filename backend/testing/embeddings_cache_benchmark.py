@@ -0,0 +1,73 @@
+# Measures the embeddings cache against the fake backend: concurrent callers ask for texts drawn from a skewed
+# distribution (retried questions, re-indexed conversations), with and without the cache.
+#
+# Usage (from backend/):
+#   python -m testing.embeddings_cache_benchmark --requests 2000 --threads 16 --latency 0.2
+#   REDIS_DB_HOST=localhost python -m testing.embeddings_cache_benchmark --redis
+import argparse
+import json
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.llm.embeddings_cache import CachedEmbeddings, FakeEmbeddings
+
+
+def _texts(requests: int, distinct: int, seed: int):
+    rng = random.Random(seed)
+    # zipf-like popularity, a few texts are asked for very often
+    weights = [1 / (rank + 1) for rank in range(distinct)]
+    pool = [f'what did I talk about with my team regarding topic {i}?' for i in range(distinct)]
+    return rng.choices(pool, weights=weights, k=requests)
+
+
+def _run(model, texts, threads: int):
+    latencies = []
+
+    def _call(text):
+        start = time.perf_counter()
+        vector = model.embed_query(text)
+        latencies.append(time.perf_counter() - start)
+        return vector
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        vectors = list(executor.map(_call, texts))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return vectors, {
+        'p50_ms': round(statistics.median(latencies) * 1000, 3),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+        'total_s': round(elapsed, 3),
+    }
+
+
+def run(requests: int, distinct: int, threads: int, latency: float, use_redis: bool, seed: int):
+    texts = _texts(requests, distinct, seed)
+
+    backend = FakeEmbeddings(size=3072, latency_seconds=latency)
+    uncached_vectors, uncached = _run(backend, texts, threads)
+    print(json.dumps({'strategy': 'uncached', 'backend_calls': backend.calls, 'backend_texts': backend.texts,
+                      **uncached}))
+
+    backend = FakeEmbeddings(size=3072, latency_seconds=latency)
+    cached = CachedEmbeddings(backend, namespace=f'benchmark-fake-3072:{seed}', use_redis=use_redis)
+    cached_vectors, timings = _run(cached, texts, threads)
+    for a, b in zip(uncached_vectors, cached_vectors):
+        assert max(abs(x - y) for x, y in zip(a, b)) < 1e-6, 'cached vector mismatch'
+    print(json.dumps({'strategy': 'cached', 'redis': use_redis, 'backend_calls': backend.calls,
+                      'backend_texts': backend.texts, **cached.stats(), **timings}))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--distinct', type=int, default=300)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.2, help='simulated seconds per backend call')
+    parser.add_argument('--redis', action='store_true')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    run(args.requests, args.distinct, args.threads, args.latency, args.redis, args.seed)
@@ -0,0 +1,100 @@
+# Benchmarks 100-item list reads (conversations, memories, chat messages) at each data protection level,
+# through the `prepare_for_read` decorator, with and without the batch decrypt path.
+#
+# Usage (from backend/, no Firestore access is needed but the clients are created on import):
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 GOOGLE_CLOUD_PROJECT=demo ENCRYPTION_SECRET=... \
+#     python -m testing.encryption_list_read_benchmark --items 100 --runs 50
+#
+# `per_item_uncached` re-derives the user key for every item, like the reads did before the key cache.
+import argparse
+import json
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone
+
+from database import conversations as conversations_db, memories as memories_db, chat as chat_db
+from database.helpers import prepare_for_read
+from utils import encryption
+
+
+def _conversation(i: int, level: str) -> dict:
+    now = datetime.now(timezone.utc)
+    segments = [
+        {'id': str(uuid.uuid4()), 'text': f'segment {j} of conversation {i}, talking about the plan for next week',
+         'speaker': f'SPEAKER_0{j % 2}', 'is_user': j % 2 == 0, 'start': j * 2.0, 'end': j * 2.0 + 1.5}
+        for j in range(40)
+    ]
+    return {'id': str(uuid.uuid4()), 'created_at': now, 'started_at': now, 'finished_at': now,
+            'structured': {'title': f'Conversation {i}', 'overview': 'An overview ' * 20},
+            'transcript_segments': segments, 'data_protection_level': level}
+
+
+def _memory(i: int, level: str) -> dict:
+    return {'id': str(uuid.uuid4()), 'content': f'User prefers coffee over tea, fact number {i}',
+            'category': 'interesting', 'user_review': None, 'data_protection_level': level}
+
+
+def _message(i: int, level: str) -> dict:
+    return {'id': str(uuid.uuid4()), 'text': f'Message {i}: what did I talk about yesterday afternoon? ' * 3,
+            'sender': 'human', 'memories_id': [], 'data_protection_level': level}
+
+
+KINDS = {
+    'conversations': ('transcript_segments', _conversation, conversations_db._prepare_conversation_for_write,
+                      conversations_db._prepare_conversation_for_read, conversations_db._prepare_conversations_for_read),
+    'memories': ('content', _memory, memories_db._prepare_data_for_write,
+                 memories_db._prepare_memory_for_read, memories_db._prepare_memories_for_read),
+    'messages': ('text', _message, chat_db._prepare_data_for_write,
+                 chat_db._prepare_message_for_read, chat_db._prepare_messages_for_read),
+}
+
+
+def _uncached(decrypt_func):
+    def wrapper(data, uid):
+        encryption.clear_key_cache(uid)
+        return decrypt_func(data, uid)
+
+    return wrapper
+
+
+def _timings(read, uid: str, stored: list, runs: int):
+    values = []
+    for _ in range(runs):
+        encryption.clear_key_cache()
+        start = time.perf_counter()
+        read(uid, stored)
+        values.append(time.perf_counter() - start)
+    return {'p50_ms': round(statistics.median(values) * 1000, 3), 'max_ms': round(max(values) * 1000, 3)}
+
+
+def run(uid: str, items: int, runs: int):
+    for kind, (field, make, prepare_for_write, decrypt_func, batch_decrypt_func) in KINDS.items():
+        for level in ['standard', 'enhanced']:
+            plain = [make(i, level) for i in range(items)]
+            stored = [prepare_for_write(item, uid, level) for item in plain]
+
+            strategies = {
+                'per_item_uncached': prepare_for_read(decrypt_func=_uncached(decrypt_func))(lambda uid, data: data),
+                'per_item': prepare_for_read(decrypt_func=decrypt_func)(lambda uid, data: data),
+                'batch': prepare_for_read(decrypt_func=decrypt_func, batch_decrypt_func=batch_decrypt_func)(
+                    lambda uid, data: data),
+            }
+            for name, read in strategies.items():
+                result = read(uid, stored)
+                assert [item[field] for item in result] == [item[field] for item in plain], \
+                    f'{kind} {level} {name} mismatch'
+
+            print(json.dumps({
+                'kind': kind, 'level': level, 'items': items,
+                **{name: _timings(read, uid, stored, runs) for name, read in strategies.items()},
+            }))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uid', default='benchmark-encryption')
+    parser.add_argument('--items', type=int, default=100)
+    parser.add_argument('--runs', type=int, default=50)
+    args = parser.parse_args()
+    run(args.uid, args.items, args.runs)
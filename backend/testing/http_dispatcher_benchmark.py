@@ -0,0 +1,222 @@
+# The webhook dispatcher (`utils.other.http_dispatcher.HttpDispatcher`) against local HTTP stubs that answer after
+# an injected latency, with an injected status code. Each check runs on its own dispatcher and its own stub (a host
+# of its own), so the circuit and the per-host slots of one don't leak into the next.
+#
+# Checks, in order:
+# - requests reach the stub over kept-alive connections and take the injected latency
+# - responses slower than `slow_seconds` count as failures and open the circuit; once open, nothing reaches the host
+# - 5xx responses open the circuit, 4xx don't
+# - after the cooldown the circuit is half-open: of concurrent requests, a single trial reaches the host; a failed
+#   trial opens it again, a successful one closes it
+# - no more than `max_per_host` requests in flight per host, the others wait for a slot then `HostBusyError`
+# - deadlines: a request never outlives its deadline, an expired one is not sent, `run_all` returns at its budget
+#
+# Usage (from backend/):
+#   python -m testing.http_dispatcher_benchmark --latency-ms 50 --requests 40
+#
+# Prints one JSON line per check, exits with an error if one fails.
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from utils.other.http_dispatcher import CircuitOpenError, HostBusyError, HttpDispatcher
+
+
+def _check(name: str, ok: bool, **data):
+    print(json.dumps({'check': name, 'ok': ok, **data}))
+    if not ok:
+        raise SystemExit(1)
+
+
+class _Stub:
+    """A local webhook receiver: answers `status` after `latency_seconds`, counts requests, connections and how
+    many were in flight at once."""
+
+    def __init__(self, latency_seconds: float = 0, status: int = 200):
+        self.latency_seconds = latency_seconds
+        self.status = status
+        self.requests = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                with stub._lock:
+                    stub.requests += 1
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                try:
+                    time.sleep(stub.latency_seconds)
+                    body = b'{}'
+                    self.send_response(stub.status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the dispatcher gave up on it (timeout)
+                    pass
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/webhook'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _post(dispatcher: HttpDispatcher, url: str, **kwargs) -> str:
+    """What became of one request: its status code, or the exception it raised."""
+    try:
+        return str(dispatcher.post(url, json={'segments': []}, **kwargs).status_code)
+    except (CircuitOpenError, HostBusyError, requests.RequestException) as e:
+        return type(e).__name__
+
+
+def _outcomes(futures) -> dict:
+    counts = {}
+    for future in futures:
+        counts[future.result()] = counts.get(future.result(), 0) + 1
+    return counts
+
+
+def _latency(args):
+    stub = _Stub(args.latency_ms / 1000)
+    dispatcher = HttpDispatcher(max_workers=8, max_per_host=4)
+    started = time.perf_counter()
+    outcomes = _outcomes(dispatcher.run_all(lambda _: _post(dispatcher, stub.url), range(args.requests)))
+    seconds = time.perf_counter() - started
+    # 4 slots: at least requests / 4 rounds of the injected latency
+    floor = args.requests / 4 * args.latency_ms / 1000
+    _check('latency', outcomes == {'200': args.requests} and stub.connections <= 4 and seconds >= floor * 0.9,
+           requests=args.requests, seconds=round(seconds, 3), floor_seconds=round(floor, 3),
+           connections=stub.connections, max_in_flight=stub.max_in_flight)
+    stub.close()
+
+
+def _slow_opens_circuit(args):
+    stub = _Stub(0.2)
+    dispatcher = HttpDispatcher(max_workers=4, failure_threshold=3, cooldown_seconds=60, slow_seconds=0.1)
+    outcomes = [_post(dispatcher, stub.url) for _ in range(5)]
+    _check('slow_opens_circuit', outcomes == ['200'] * 3 + ['CircuitOpenError'] * 2 and stub.requests == 3
+           and dispatcher.is_open(stub.url), outcomes=outcomes, reached_host=stub.requests)
+    stub.close()
+
+
+def _errors_open_circuit(args):
+    stub = _Stub(status=404)
+    dispatcher = HttpDispatcher(max_workers=4, failure_threshold=3, cooldown_seconds=60)
+    client_errors = [_post(dispatcher, stub.url) for _ in range(5)]
+    closed_on_4xx = not dispatcher.is_open(stub.url)
+    stub.status = 503
+    server_errors = [_post(dispatcher, stub.url) for _ in range(5)]
+    _check('5xx_open_circuit', closed_on_4xx and server_errors == ['503'] * 3 + ['CircuitOpenError'] * 2
+           and stub.requests == 8, client_errors=client_errors, server_errors=server_errors,
+           reached_host=stub.requests)
+    stub.close()
+
+
+def _half_open(args):
+    cooldown = 0.3
+    stub = _Stub(0.1, status=500)
+    dispatcher = HttpDispatcher(max_workers=8, failure_threshold=2, cooldown_seconds=cooldown)
+    opening = [_post(dispatcher, stub.url) for _ in range(2)]
+
+    # the trial fails: open again right away, for another cooldown
+    time.sleep(cooldown)
+    failed_trial = _outcomes(dispatcher.run_all(lambda _: _post(dispatcher, stub.url), range(5)))
+    reopened = dispatcher.is_open(stub.url)
+    reached_failed = stub.requests - 2
+
+    stub.status = 200
+    time.sleep(cooldown)
+    trial = _outcomes(dispatcher.run_all(lambda _: _post(dispatcher, stub.url), range(5)))
+    reached_trial = stub.requests - 2 - reached_failed
+    after = [_post(dispatcher, stub.url) for _ in range(3)]
+    _check('half_open', opening == ['500', '500'] and failed_trial == {'500': 1, 'CircuitOpenError': 4} and reopened
+           and trial == {'200': 1, 'CircuitOpenError': 4} and reached_failed == 1 and reached_trial == 1
+           and after == ['200'] * 3, failed_trial=failed_trial, trial=trial, after=after)
+    stub.close()
+
+
+def _host_cap(args):
+    stub = _Stub(0.3)
+    other = _Stub(0)
+    dispatcher = HttpDispatcher(max_workers=16, max_per_host=2)
+    # 2 slots, 0.3s a request, 0.45s to wait for a slot: two rounds answered, the last two shed
+    busy = [dispatcher.submit(_post, dispatcher, stub.url, timeout=0.45) for _ in range(6)]
+    # another host is not held up by the busy one
+    time.sleep(0.05)
+    started = time.perf_counter()
+    other_outcome = _post(dispatcher, other.url, timeout=1)
+    other_seconds = time.perf_counter() - started
+    outcomes = _outcomes(busy)
+    _check('host_cap', stub.max_in_flight == 2 and outcomes == {'200': 4, 'HostBusyError': 2}
+           and other_outcome == '200' and other_seconds < 0.1, outcomes=outcomes, max_in_flight=stub.max_in_flight,
+           other_host_seconds=round(other_seconds, 3))
+    stub.close()
+    other.close()
+
+
+def _deadline(args):
+    stub = _Stub(1.0)
+    dispatcher = HttpDispatcher(max_workers=8, failure_threshold=100)
+
+    started = time.perf_counter()
+    timed_out = _post(dispatcher, stub.url, timeout=30, deadline=time.monotonic() + 0.2)
+    timed_out_seconds = time.perf_counter() - started
+
+    expired = _post(dispatcher, stub.url, deadline=time.monotonic() - 1)
+    reached_expired = stub.requests - 1
+
+    started = time.perf_counter()
+    futures = dispatcher.run_all(lambda _: _post(dispatcher, stub.url, timeout=5), range(4), budget_seconds=0.2)
+    budget_seconds = time.perf_counter() - started
+    still_running = sum(not future.done() for future in futures)
+    wait(futures)
+    _check('deadline', timed_out in ('ReadTimeout', 'ConnectTimeout') and timed_out_seconds < 0.4
+           and expired == 'HostBusyError' and reached_expired == 0 and budget_seconds < 0.4 and still_running == 4,
+           timed_out=timed_out, timed_out_seconds=round(timed_out_seconds, 3), expired=expired,
+           run_all_seconds=round(budget_seconds, 3), still_running_at_budget=still_running)
+    stub.close()
+
+
+def run(args):
+    _latency(args)
+    _slow_opens_circuit(args)
+    _errors_open_circuit(args)
+    _half_open(args)
+    _host_cap(args)
+    _deadline(args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency-ms', type=float, default=50, help='injected latency of the stub')
+    parser.add_argument('--requests', type=int, default=40)
+    run(parser.parse_args())
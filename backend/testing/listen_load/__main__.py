@@ -0,0 +1,210 @@
+# Replays recorded PCM / opus streams over N concurrent `/v4/listen` websockets against local fakes and reports
+# end-to-end transcript latency per socket, server event loop lag, CPU and memory as JSON lines.
+#
+# Everything runs on this machine: `fakes` serves the Deepgram, Soniox and Speechmatics protocols and the pusher
+# (fakes.py), `server` runs the real listen router with conversations kept in memory in their stored encoding and
+# fakeredis (server.py), the replay client drives both (client.py). Nothing needs credentials.
+#
+# Usage (from backend/):
+#   python -m testing.listen_load --sockets 50 --seconds 120 --speed 1 --codec opus --stt deepgram
+#   python -m testing.listen_load --sockets 200 --speed 4 --audio recording.wav --codec pcm16 --output runs.jsonl
+#   python -m testing.listen_load encode-opus recording.wav recording.opus.bin   # 16kHz mono wav -> packets
+#
+# Each run prints one `socket` record per websocket and a `summary` record (git commit, config, latency, loop lag,
+# CPU, RSS, fake service counters); `--output` appends them, so runs of the same config can be compared over time.
+# Markers are words the fake STT emits every `--word-ms` of audio: latency is from sending the chunk that
+# completes a word's audio to reading it back on the listen socket (and at the pusher, `pusher_latency_ms`).
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import websockets
+
+BACKEND_DIR = Path(__file__).resolve().parents[2]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _wait_http(url: str, process: subprocess.Popen, timeout_seconds: float = 120):
+    deadline = time.time() + timeout_seconds
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{url} exited with {process.returncode}')
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(url)
+
+
+def _wait_ws(url: str, process: subprocess.Popen, timeout_seconds: float = 30):
+    async def probe():
+        async with websockets.connect(url):
+            pass
+
+    deadline = time.time() + timeout_seconds
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{url} exited with {process.returncode}')
+        try:
+            asyncio.run(probe())
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(url)
+
+
+def _spawn(args: list, log_path):
+    log = open(log_path, 'a') if log_path else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, '-m', 'testing.listen_load', *args], cwd=BACKEND_DIR,
+                            stdout=log, stderr=subprocess.STDOUT, env={**os.environ, 'PYTHONUNBUFFERED': '1'})
+
+
+def run(args):
+    from . import client
+
+    processes = []
+    fakes_url, server_url = args.fakes_url, args.server_url
+    try:
+        if not fakes_url:
+            port = _free_port()
+            fakes_url = f'ws://127.0.0.1:{port}'
+            processes.append(_spawn(['fakes', '--port', str(port), '--word-ms', str(args.word_ms),
+                                     '--turn-seconds', str(args.turn_seconds),
+                                     '--stt-delay-ms', str(args.stt_delay_ms)], args.fakes_log))
+            _wait_ws(f'{fakes_url}/stats', processes[-1])
+        if not server_url:
+            port = _free_port()
+            server_url = f'http://127.0.0.1:{port}'
+            processes.append(_spawn(['server', '--port', str(port), '--fakes-url', fakes_url, '--stt', args.stt,
+                                     '--redis', args.redis, '--level', args.level,
+                                     '--store-latency-ms', str(args.store_latency_ms),
+                                     '--process-seconds', str(args.process_seconds),
+                                     '--audio-bytes-seconds', str(args.audio_bytes_seconds)], args.server_log))
+            _wait_http(f'{server_url}/harness/metrics', processes[-1])
+
+        recording = client.load_recording(args.codec, args.audio, args.seconds, args.chunk_ms)
+        run_id = uuid.uuid4().hex[:8]
+        records, summary = asyncio.run(client.run(
+            server_url, fakes_url, args.admin_key, recording, args.sockets, args.speed, args.ramp_seconds,
+            args.drain_seconds, run_id, word_ms=args.word_ms))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+    summary = {
+        **summary, 'label': args.label, 'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_commit': _git_commit(),
+        'config': {key: getattr(args, key) for key in [
+            'sockets', 'seconds', 'speed', 'codec', 'audio', 'chunk_ms', 'stt', 'ramp_seconds', 'drain_seconds',
+            'word_ms', 'turn_seconds', 'stt_delay_ms', 'level', 'store_latency_ms', 'process_seconds',
+            'audio_bytes_seconds', 'redis']},
+    }
+    lines = [json.dumps(record) for record in records + [summary]]
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+    print('\n'.join(lines if args.verbose else lines[-1:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m testing.listen_load')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='replay against local fakes (default)')
+    run_parser.add_argument('--sockets', type=int, default=10)
+    run_parser.add_argument('--seconds', type=float, default=60, help='audio per socket, recordings are looped')
+    run_parser.add_argument('--speed', type=float, default=1, help='1 is real time, 4 sends 4x faster')
+    run_parser.add_argument('--codec', default='pcm16', choices=['pcm8', 'pcm16', 'opus', 'opus_fs320'])
+    run_parser.add_argument('--audio', help='16-bit mono wav at the codec rate, or an encode-opus packet file')
+    run_parser.add_argument('--chunk-ms', type=int, default=100, help='pcm message size')
+    run_parser.add_argument('--stt', default='deepgram', choices=['deepgram', 'soniox', 'speechmatics'])
+    run_parser.add_argument('--ramp-seconds', type=float, default=5, help='spread socket starts over this time')
+    run_parser.add_argument('--drain-seconds', type=float, default=3, help='wait for transcripts after the audio')
+    run_parser.add_argument('--word-ms', type=int, default=500, help='audio per marker word')
+    run_parser.add_argument('--turn-seconds', type=float, default=8, help='audio per speaker turn')
+    run_parser.add_argument('--stt-delay-ms', type=float, default=0, help='simulated STT processing time')
+    run_parser.add_argument('--level', default='standard', choices=['standard', 'enhanced'])
+    run_parser.add_argument('--store-latency-ms', type=float, default=0, help='simulated Firestore round trip')
+    run_parser.add_argument('--process-seconds', type=float, default=0, help='simulated process_conversation')
+    run_parser.add_argument('--audio-bytes-seconds', type=int, default=0, help='forward audio bytes to the pusher')
+    run_parser.add_argument('--redis', default='fake', choices=['fake', 'local'],
+                            help='local uses REDIS_DB_HOST / REDIS_DB_PORT')
+    run_parser.add_argument('--admin-key', default=os.getenv('ADMIN_KEY', 'listen-load-admin-key'))
+    run_parser.add_argument('--server-url', help='http://host:port of an already running `server`')
+    run_parser.add_argument('--fakes-url', help='ws://host:port of already running `fakes`')
+    run_parser.add_argument('--server-log')
+    run_parser.add_argument('--fakes-log')
+    run_parser.add_argument('--output', help='append the JSON lines to this file')
+    run_parser.add_argument('--label', help='free form tag stored in the summary')
+    run_parser.add_argument('--verbose', action='store_true', help='print the socket records too')
+
+    fakes_parser = subparsers.add_parser('fakes')
+    fakes_parser.add_argument('--host', default='127.0.0.1')
+    fakes_parser.add_argument('--port', type=int, default=8790)
+    fakes_parser.add_argument('--word-ms', type=int, default=500)
+    fakes_parser.add_argument('--turn-seconds', type=float, default=8)
+    fakes_parser.add_argument('--stt-delay-ms', type=float, default=0)
+
+    server_parser = subparsers.add_parser('server')
+    server_parser.add_argument('--host', default='127.0.0.1')
+    server_parser.add_argument('--port', type=int, default=8791)
+    server_parser.add_argument('--fakes-url', default='ws://127.0.0.1:8790')
+    server_parser.add_argument('--stt', default='deepgram', choices=['deepgram', 'soniox', 'speechmatics'])
+    server_parser.add_argument('--redis', default='fake', choices=['fake', 'local'])
+    server_parser.add_argument('--level', default='standard', choices=['standard', 'enhanced'])
+    server_parser.add_argument('--store-latency-ms', type=float, default=0)
+    server_parser.add_argument('--process-seconds', type=float, default=0)
+    server_parser.add_argument('--audio-bytes-seconds', type=int, default=0)
+
+    encode_parser = subparsers.add_parser('encode-opus')
+    encode_parser.add_argument('wav')
+    encode_parser.add_argument('output')
+    encode_parser.add_argument('--frame-size', type=int, default=160, choices=[160, 320])
+
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in subparsers.choices:
+        argv = ['run', *argv]
+    args = parser.parse_args(argv)
+
+    if args.command == 'fakes':
+        from . import fakes
+        asyncio.run(fakes.serve(args.host, args.port, args.word_ms, args.turn_seconds, args.stt_delay_ms / 1000))
+    elif args.command == 'server':
+        from . import server
+        server.serve(args.host, args.port, args.fakes_url, stt=args.stt, redis=args.redis, level=args.level,
+                     store_latency_seconds=args.store_latency_ms / 1000, process_seconds=args.process_seconds,
+                     audio_bytes_seconds=args.audio_bytes_seconds)
+    elif args.command == 'encode-opus':
+        from . import client
+        pcm = client._read_pcm(args.wav, 16000, 0, 0)
+        client.write_opus_packets(args.output, client.encode_opus(pcm, args.frame_size))
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
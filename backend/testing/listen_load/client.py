@@ -0,0 +1,302 @@
+"""
+Replay side of the listen load harness: N concurrent `/v4/listen` sockets streaming a recording at
+`speed` x real time, reading back transcripts and timing every marker word the fake STT put in them.
+"""
+import asyncio
+import bisect
+import json
+import math
+import random
+import statistics
+import struct
+import time
+import wave
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import websockets
+
+from .fakes import MARKER_RE, fetch_stats
+
+CODEC_SAMPLE_RATES = {'pcm8': 8000, 'pcm16': 16000, 'opus': 16000, 'opus_fs320': 16000}
+OPUS_FRAME_SIZES = {'opus': 160, 'opus_fs320': 320}
+
+
+# *****************************
+# ********* RECORDINGS ********
+# *****************************
+
+@dataclass
+class Recording:
+    codec: str
+    sample_rate: int
+    # (payload, audio ms covered once this chunk is sent), one websocket message each
+    chunks: List[tuple]
+
+    @property
+    def duration_ms(self) -> float:
+        return self.chunks[-1][1] if self.chunks else 0
+
+
+def _read_pcm(path: Optional[str], sample_rate: int, seconds: float, seed: int) -> bytes:
+    if not path:
+        # content doesn't matter to the fake STT, low noise is enough
+        rng = random.Random(seed)
+        return b''.join(struct.pack('<h', rng.randint(-300, 300)) for _ in range(int(seconds * sample_rate)))
+    with wave.open(path, 'rb') as wav:
+        if wav.getsampwidth() != 2 or wav.getnchannels() != 1 or wav.getframerate() != sample_rate:
+            raise ValueError(f'{path} must be 16-bit mono {sample_rate}Hz, e.g. ffmpeg -i in -ac 1 -ar {sample_rate} '
+                             f'-sample_fmt s16 out.wav')
+        return wav.readframes(wav.getnframes())
+
+
+def read_opus_packets(path: str) -> List[bytes]:
+    """Recorded opus stream: each packet as a little endian uint32 length followed by the packet."""
+    packets = []
+    with open(path, 'rb') as f:
+        while header := f.read(4):
+            packets.append(f.read(struct.unpack('<I', header)[0]))
+    return packets
+
+
+def write_opus_packets(path: str, packets: List[bytes]):
+    with open(path, 'wb') as f:
+        for packet in packets:
+            f.write(struct.pack('<I', len(packet)))
+            f.write(packet)
+
+
+def encode_opus(pcm: bytes, frame_size: int) -> List[bytes]:
+    import opuslib
+
+    encoder = opuslib.Encoder(16000, 1, opuslib.APPLICATION_VOIP)
+    step = frame_size * 2
+    return [encoder.encode(pcm[i:i + step], frame_size) for i in range(0, len(pcm) - step + 1, step)]
+
+
+def load_recording(codec: str, path: Optional[str], seconds: float, chunk_ms: int, seed: int = 7) -> Recording:
+    """PCM is cut in `chunk_ms` messages, opus is sent one packet per message (the frame size sets the duration)."""
+    sample_rate = CODEC_SAMPLE_RATES[codec]
+    if codec in OPUS_FRAME_SIZES:
+        frame_size = OPUS_FRAME_SIZES[codec]
+        if path and not path.endswith('.wav'):
+            packets = read_opus_packets(path)
+        else:
+            packets = encode_opus(_read_pcm(path, sample_rate, seconds, seed), frame_size)
+        frame_ms = frame_size * 1000 / sample_rate
+        chunks = [(packet, (i + 1) * frame_ms) for i, packet in enumerate(packets)]
+    else:
+        pcm = _read_pcm(path, sample_rate, seconds, seed)
+        step = int(sample_rate * chunk_ms / 1000) * 2
+        chunks = [(pcm[i:i + step], (i + len(pcm[i:i + step])) * 1000 / 2 / sample_rate)
+                  for i in range(0, len(pcm), step)]
+
+    # loop the recording up to the requested duration
+    if chunks and seconds * 1000 > chunks[-1][1]:
+        span = chunks[-1][1]
+        chunks = [(payload, audio_ms + span * k) for k in range(math.ceil(seconds * 1000 / span))
+                  for payload, audio_ms in chunks]
+    return Recording(codec=codec, sample_rate=sample_rate, chunks=chunks)
+
+
+# *****************************
+# *********** REPLAY **********
+# *****************************
+
+@dataclass
+class SocketResult:
+    index: int
+    uid: str
+    connect_ms: Optional[float] = None
+    ready_ms: Optional[float] = None
+    audio_ms: float = 0
+    sent_messages: int = 0
+    received_messages: int = 0
+    pings: int = 0
+    events: dict = field(default_factory=dict)
+    close_code: Optional[int] = None
+    error: Optional[str] = None
+    sends: List[tuple] = field(default_factory=list)  # (audio ms, time.time() sent)
+    markers: dict = field(default_factory=dict)  # marker ms -> time.time() first seen
+
+    def sent_at(self, marker_ms: int) -> Optional[float]:
+        i = bisect.bisect_left(self.sends, (marker_ms,))
+        return self.sends[i][1] if i < len(self.sends) else None
+
+    def latencies(self, seen: dict) -> List[float]:
+        values = []
+        for marker_ms, seen_at in seen.items():
+            sent_at = self.sent_at(int(marker_ms))
+            if sent_at is not None:
+                values.append(seen_at - sent_at)
+        return values
+
+
+def _summary(values: List[float], scale: float = 1000) -> Optional[dict]:
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(int(len(values) * q), len(values) - 1)]
+    return {'count': len(values), 'mean': round(statistics.fmean(values) * scale, 2),
+            'p50': round(pick(0.5) * scale, 2), 'p95': round(pick(0.95) * scale, 2),
+            'p99': round(pick(0.99) * scale, 2), 'max': round(values[-1] * scale, 2)}
+
+
+async def _replay(result: SocketResult, listen_url: str, admin_key: str, recording: Recording, speed: float,
+                  drain_seconds: float):
+    started = time.time()
+    ws = None
+    try:
+        async with websockets.connect(listen_url, extra_headers={'Authorization': f'{admin_key}{result.uid}'},
+                                      max_size=None, ping_interval=None) as ws:
+            result.connect_ms = (time.time() - started) * 1000
+
+            async def receive():
+                async for message in ws:
+                    now = time.time()
+                    result.received_messages += 1
+                    if message == 'ping':
+                        result.pings += 1
+                        continue
+                    data = json.loads(message)
+                    if isinstance(data, list):
+                        for segment in data:
+                            for marker in MARKER_RE.findall(segment.get('text', '')):
+                                result.markers.setdefault(int(marker), now)
+                        continue
+                    name = data.get('status') or data.get('type')
+                    result.events[name] = result.events.get(name, 0) + 1
+                    if data.get('status') == 'ready' and result.ready_ms is None:
+                        result.ready_ms = (now - started) * 1000
+
+            receiver = asyncio.create_task(receive())
+            stream_started = time.time()
+            for payload, audio_ms in recording.chunks:
+                delay = stream_started + audio_ms / 1000 / speed - time.time()
+                # sleep(0) still yields when behind schedule, so accelerated replays share the loop
+                await asyncio.sleep(max(delay, 0))
+                await ws.send(payload)
+                result.sends.append((audio_ms, time.time()))
+                result.sent_messages += 1
+                result.audio_ms = audio_ms
+
+            await asyncio.sleep(drain_seconds)
+            await ws.close()
+            receiver.cancel()
+    except Exception as e:
+        result.error = f'{type(e).__name__}: {e}'
+    finally:
+        if ws is not None:
+            result.close_code = ws.close_code
+
+
+async def _sample_server(metrics_url: str, samples: list, stop: asyncio.Event, interval_seconds: float = 1):
+    import urllib.request
+
+    def fetch():
+        with urllib.request.urlopen(metrics_url, timeout=5) as response:
+            return json.loads(response.read())
+
+    while True:
+        try:
+            samples.append(await asyncio.to_thread(fetch))
+        except Exception as e:
+            print(f'server metrics failed: {e}')
+        if stop.is_set():
+            return
+        try:
+            await asyncio.wait_for(stop.wait(), interval_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _client_loop_lag(samples: list, stop: asyncio.Event, interval_seconds: float = 0.05):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval_seconds)
+        samples.append(max(loop.time() - start - interval_seconds, 0))
+
+
+def _server_summary(samples: list) -> dict:
+    if not samples:
+        return {}
+    cpu_percent = [
+        (b['cpu_seconds'] - a['cpu_seconds']) / (b['time'] - a['time']) * 100
+        for a, b in zip(samples, samples[1:]) if b['time'] > a['time']
+    ]
+    lag = [value for sample in samples for value in sample['loop_lag_seconds']]
+    return {
+        'loop_lag_ms': _summary(lag),
+        'cpu_percent': {'mean': round(statistics.fmean(cpu_percent), 1), 'max': round(max(cpu_percent), 1)}
+        if cpu_percent else None,
+        'cpu_seconds': round(samples[-1]['cpu_seconds'] - samples[0]['cpu_seconds'], 3),
+        'rss_mb': {'start': round(samples[0]['rss_bytes'] / 2 ** 20, 1),
+                   'max': round(max(s['rss_bytes'] for s in samples) / 2 ** 20, 1),
+                   'end': round(samples[-1]['rss_bytes'] / 2 ** 20, 1)},
+        'tasks_max': max(s['tasks'] for s in samples),
+        'threads_max': max(s['threads'] for s in samples),
+    }
+
+
+async def run(server_url: str, fakes_url: Optional[str], admin_key: str, recording: Recording, sockets: int,
+              speed: float, ramp_seconds: float, drain_seconds: float, run_id: str, word_ms: int = 500,
+              language: str = 'en'):
+    """Returns (per socket records, summary record), both JSON serializable."""
+    listen_url = (f'{server_url.replace("http", "ws", 1)}/v4/listen?language={language}'
+                  f'&sample_rate={recording.sample_rate}&codec={recording.codec}&channels=1'
+                  f'&include_speech_profile=false')
+    results = [SocketResult(index=i, uid=f'listen-load-{run_id}-{i}') for i in range(sockets)]
+
+    if fakes_url:
+        await fetch_stats(fakes_url, reset=True)
+    stop = asyncio.Event()
+    server_samples, client_lag = [], []
+    monitors = [asyncio.create_task(_sample_server(f'{server_url}/harness/metrics', server_samples, stop)),
+                asyncio.create_task(_client_loop_lag(client_lag, stop))]
+
+    async def start(result: SocketResult):
+        if sockets > 1 and ramp_seconds:
+            await asyncio.sleep(ramp_seconds * result.index / (sockets - 1))
+        await _replay(result, listen_url, admin_key, recording, speed, drain_seconds)
+
+    started = time.time()
+    await asyncio.gather(*[start(result) for result in results])
+    elapsed = time.time() - started
+    stop.set()
+    await asyncio.gather(*monitors)
+
+    fakes = await fetch_stats(fakes_url) if fakes_url else {}
+    pusher_markers = fakes.get('pusher_markers', {})
+
+    records, all_latencies, all_pusher_latencies = [], [], []
+    for result in results:
+        expected = int(result.audio_ms // word_ms)
+        latencies = result.latencies(result.markers)
+        pusher_latencies = result.latencies(pusher_markers.get(result.uid, {}))
+        all_latencies.extend(latencies)
+        all_pusher_latencies.extend(pusher_latencies)
+        records.append({
+            'type': 'socket', 'run_id': run_id, 'index': result.index, 'uid': result.uid,
+            'connect_ms': round(result.connect_ms, 2) if result.connect_ms is not None else None,
+            'ready_ms': round(result.ready_ms, 2) if result.ready_ms is not None else None,
+            'audio_seconds': round(result.audio_ms / 1000, 2), 'sent_messages': result.sent_messages,
+            'received_messages': result.received_messages, 'pings': result.pings, 'events': result.events,
+            'markers_expected': expected, 'markers_received': len(result.markers),
+            'transcript_latency_ms': _summary(latencies), 'pusher_latency_ms': _summary(pusher_latencies),
+            'close_code': result.close_code, 'error': result.error,
+        })
+
+    summary = {
+        'type': 'summary', 'run_id': run_id, 'elapsed_seconds': round(elapsed, 2),
+        'sockets': {'total': sockets, 'failed': sum(1 for result in results if result.error)},
+        'markers': {'expected': sum(record['markers_expected'] for record in records),
+                    'received': sum(record['markers_received'] for record in records)},
+        'transcript_latency_ms': _summary(all_latencies),
+        'pusher_latency_ms': _summary(all_pusher_latencies),
+        'server': _server_summary(server_samples),
+        'client_loop_lag_ms': _summary(client_lag),
+        'fakes': fakes.get('counters', {}),
+    }
+    return records, summary
+
@@ -0,0 +1,228 @@
+"""
+Local stand-ins for the services `/v4/listen` talks to over websockets, on one port:
+
+  /v1/listen            Deepgram live protocol (what the SDK expects with DEEPGRAM_SELF_HOSTED_URL)
+  /soniox               Soniox realtime protocol (SONIOX_WS_URL)
+  /speechmatics         Speechmatics realtime protocol (SPEECHMATICS_WS_URL)
+  /v1/trigger/listen    pusher (HOSTED_PUSHER_API_URL)
+  /stats                sends the counters as JSON and closes
+
+The STT fakes don't recognize anything: every `word_ms` of audio received they emit one word `w<ms>`, where
+<ms> is the audio position it ends at. The replay client knows when it sent that position, so the word is
+a marker for end-to-end latency wherever it shows up (listen socket, pusher).
+"""
+import asyncio
+import json
+import re
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlparse, parse_qs
+
+import websockets
+
+from utils.pusher_protocol import PROTOCOL_V2, AUDIO_BYTES, FrameError, TranscriptDecoder, negotiated_version, \
+    read_frame
+
+MARKER_RE = re.compile(r'w(\d+)')
+
+
+class _Markers:
+    """Turns received PCM16 bytes into (marker_ms, start_s, end_s, speaker) words."""
+
+    def __init__(self, sample_rate: int, word_ms: int, turn_seconds: float):
+        # The backend always forwards linear16 (opus is decoded first), whatever format it declares
+        self.bytes_per_ms = sample_rate * 2 / 1000
+        self.word_ms = word_ms
+        self.turn_ms = max(int(turn_seconds * 1000), word_ms)
+        self.received = 0
+        self.next_ms = word_ms
+
+    def feed(self, size: int):
+        self.received += size
+        words = []
+        while self.received >= self.next_ms * self.bytes_per_ms:
+            end_ms = self.next_ms
+            speaker = (end_ms - 1) // self.turn_ms % 2
+            words.append((end_ms, (end_ms - self.word_ms) / 1000, end_ms / 1000, speaker))
+            self.next_ms += self.word_ms
+        return words
+
+
+class FakeServices:
+    def __init__(self, word_ms: int = 500, turn_seconds: float = 8, stt_delay_seconds: float = 0):
+        self.word_ms = word_ms
+        self.turn_seconds = turn_seconds
+        self.stt_delay_seconds = stt_delay_seconds
+        self.counters = defaultdict(int)
+        # uid -> {marker_ms: first time.time() seen in a 102 frame}
+        self.pusher_markers = defaultdict(dict)
+
+    async def _send(self, ws, message: dict):
+        if self.stt_delay_seconds:
+            await asyncio.sleep(self.stt_delay_seconds)
+        try:
+            await ws.send(json.dumps(message))
+        except websockets.ConnectionClosed:
+            pass
+
+    def _emit(self, ws, message: dict):
+        # Responses go out on their own task so a simulated delay never slows down receiving audio
+        asyncio.create_task(self._send(ws, message))
+
+    # *****************************
+    # ********** DEEPGRAM *********
+    # *****************************
+
+    async def _deepgram(self, ws, query: dict):
+        markers = _Markers(int(query.get('sample_rate', ['16000'])[0]), self.word_ms, self.turn_seconds)
+        request_id = str(uuid.uuid4())
+        async for message in ws:
+            if isinstance(message, str):
+                if json.loads(message).get('type') == 'CloseStream':
+                    break
+                continue
+            self.counters['deepgram_audio_bytes'] += len(message)
+            for end_ms, start, end, speaker in markers.feed(len(message)):
+                word = f'w{end_ms}'
+                self._emit(ws, {
+                    'type': 'Results', 'channel_index': [0, 1], 'start': start, 'duration': end - start,
+                    'is_final': True, 'speech_final': True,
+                    'channel': {'alternatives': [{'transcript': word, 'confidence': 0.99, 'words': [
+                        {'word': word, 'punctuated_word': word, 'start': start, 'end': end, 'confidence': 0.99,
+                         'speaker': speaker}]}]},
+                    'metadata': {'request_id': request_id, 'model_uuid': '',
+                                 'model_info': {'name': 'fake', 'version': '0', 'arch': 'fake'}},
+                })
+                self.counters['deepgram_words'] += 1
+
+    # *****************************
+    # *********** SONIOX **********
+    # *****************************
+
+    async def _soniox(self, ws):
+        config = json.loads(await ws.recv())
+        markers = _Markers(config.get('sample_rate', 16000), self.word_ms, self.turn_seconds)
+        speaker = None
+        async for message in ws:
+            if isinstance(message, str):
+                continue
+            self.counters['soniox_audio_bytes'] += len(message)
+            for end_ms, start, end, word_speaker in markers.feed(len(message)):
+                tokens = []
+                if word_speaker != speaker:
+                    speaker = word_speaker
+                    tokens.append({'text': f'spk:{speaker + 1}', 'start_ms': start * 1000, 'end_ms': start * 1000})
+                tokens.append({'text': f' w{end_ms}.', 'start_ms': start * 1000, 'end_ms': end * 1000,
+                               'confidence': 0.99})
+                self._emit(ws, {'tokens': tokens, 'final_audio_proc_ms': end_ms, 'total_audio_proc_ms': end_ms})
+                # an empty token list is the endpoint, it flushes the segment on the backend
+                self._emit(ws, {'tokens': []})
+                self.counters['soniox_words'] += 1
+
+    # *****************************
+    # ******** SPEECHMATICS *******
+    # *****************************
+
+    async def _speechmatics(self, ws):
+        request = json.loads(await ws.recv())
+        markers = _Markers(request['audio_format']['sample_rate'], self.word_ms, self.turn_seconds)
+        await ws.send(json.dumps({'message': 'RecognitionStarted', 'id': str(uuid.uuid4())}))
+        seq_no = 0
+        async for message in ws:
+            if isinstance(message, str):
+                if json.loads(message).get('message') == 'EndOfStream':
+                    await ws.send(json.dumps({'message': 'EndOfTranscript'}))
+                    break
+                continue
+            seq_no += 1
+            self.counters['speechmatics_audio_bytes'] += len(message)
+            self._emit(ws, {'message': 'AudioAdded', 'seq_no': seq_no})
+            for end_ms, start, end, speaker in markers.feed(len(message)):
+                word = f'w{end_ms}'
+                self._emit(ws, {
+                    'message': 'AddTranscript',
+                    'metadata': {'transcript': f'{word} ', 'start_time': start, 'end_time': end},
+                    'results': [{'type': 'word', 'start_time': start, 'end_time': end, 'alternatives': [
+                        {'content': word, 'confidence': 0.99, 'language': 'en', 'speaker': f'S{speaker + 1}'}]}],
+                })
+                self.counters['speechmatics_words'] += 1
+
+    # *****************************
+    # *********** PUSHER **********
+    # *****************************
+
+    async def _pusher(self, ws, query: dict):
+        uid = query.get('uid', [''])[0]
+        self.counters['pusher_connections'] += 1
+        self.counters[f'pusher_protocol_v{negotiated_version(ws.subprotocol)}'] += 1
+        decoder = TranscriptDecoder()
+        async for message in ws:
+            if isinstance(message, str):
+                self.counters['pusher_unknown_frames'] += 1
+                continue
+            try:
+                header_type, frame = read_frame(message, decoder)
+            except FrameError:
+                self.counters['pusher_malformed_frames'] += 1
+                continue
+            if header_type == AUDIO_BYTES:
+                self.counters['pusher_audio_frames'] += 1
+                self.counters['pusher_audio_bytes'] += len(frame)
+                continue
+
+            segments, _ = frame
+            now = time.time()
+            self.counters['pusher_transcript_frames'] += 1
+            self.counters['pusher_transcript_bytes'] += len(message)
+            seen = self.pusher_markers[uid]
+            for segment in segments:
+                self.counters['pusher_segments'] += 1
+                for marker in MARKER_RE.findall(segment.get('text', '')):
+                    seen.setdefault(int(marker), now)
+
+    # *****************************
+    # *********** SERVER **********
+    # *****************************
+
+    def stats(self) -> dict:
+        return {'counters': dict(self.counters),
+                'pusher_markers': {uid: {str(k): v for k, v in markers.items()}
+                                   for uid, markers in self.pusher_markers.items()}}
+
+    async def handler(self, ws):
+        parsed = urlparse(ws.path)
+        query = parse_qs(parsed.query)
+        path = parsed.path.rstrip('/')
+        self.counters[f'connections:{path}'] += 1
+        try:
+            if path == '/v1/listen':
+                await self._deepgram(ws, query)
+            elif path == '/soniox':
+                await self._soniox(ws)
+            elif path == '/speechmatics':
+                await self._speechmatics(ws)
+            elif path == '/v1/trigger/listen':
+                await self._pusher(ws, query)
+            elif path == '/stats':
+                await ws.send(json.dumps(self.stats()))
+                if 'reset' in query:
+                    self.counters.clear()
+                    self.pusher_markers.clear()
+            else:
+                await ws.close(code=1008, reason='unknown path')
+        except websockets.ConnectionClosed:
+            pass
+
+
+async def serve(host: str, port: int, word_ms: int, turn_seconds: float, stt_delay_seconds: float):
+    services = FakeServices(word_ms, turn_seconds, stt_delay_seconds)
+    async with websockets.serve(services.handler, host, port, max_size=None, ping_interval=None,
+                                subprotocols=[PROTOCOL_V2]):
+        print(f'fakes listening on ws://{host}:{port}', flush=True)
+        await asyncio.Future()
+
+
+async def fetch_stats(fakes_url: str, reset: bool = False) -> dict:
+    async with websockets.connect(f'{fakes_url}/stats{"?reset=1" if reset else ""}', max_size=None) as ws:
+        return json.loads(await ws.recv())
@@ -0,0 +1,282 @@
+"""
+Backend side of the listen load harness: the real `/v4/listen` router, pointed at the fakes, plus
+`GET /harness/metrics` (event loop lag samples, CPU seconds, RSS, task count) for the replay client.
+
+Environment is set up before anything from the backend is imported, so module level clients
+(Deepgram, pusher URL, Firestore, Redis) are created against the fakes. Google clients get anonymous
+credentials, a call that would leave the machine fails instead of hitting a real project.
+"""
+import asyncio
+import os
+import resource
+import threading
+import time
+from collections import defaultdict
+
+LOOP_LAG_INTERVAL_SECONDS = 0.05
+
+
+def configure_environment(fakes_url: str, stt: str):
+    """`fakes_url` is ws://host:port of `fakes.serve`."""
+    http_url = fakes_url.replace('ws', 'http', 1)
+    os.environ.update({
+        'DEEPGRAM_SELF_HOSTED_ENABLED': 'true',
+        # a ws:// url is kept as is by the SDK, http(s):// would be turned into wss://
+        'DEEPGRAM_SELF_HOSTED_URL': fakes_url,
+        'SONIOX_WS_URL': f'{fakes_url}/soniox',
+        'SPEECHMATICS_WS_URL': f'{fakes_url}/speechmatics',
+        'HOSTED_PUSHER_API_URL': http_url,
+        'STT_SERVICE_MODELS': 'soniox-stt-rt' if stt == 'soniox' else 'dg-nova-2',
+    })
+    for key, value in {
+        'DEEPGRAM_API_KEY': 'fake', 'SONIOX_API_KEY': 'fake', 'SPEECHMATICS_API_KEY': 'fake',
+        'OPENAI_API_KEY': 'fake', 'ADMIN_KEY': 'listen-load-admin-key', 'GOOGLE_CLOUD_PROJECT': 'listen-load',
+        'ENCRYPTION_SECRET': 'listen-load-harness-secret-not-for-production-use',
+    }.items():
+        os.environ.setdefault(key, value)
+
+    import google.auth
+    from google.auth.credentials import AnonymousCredentials
+    google.auth.default = lambda *args, **kwargs: (AnonymousCredentials(), os.environ['GOOGLE_CLOUD_PROJECT'])
+
+
+# *****************************
+# ********** STORAGE **********
+# *****************************
+
+class MemoryConversations:
+    """
+    In-memory stand-in for `database.conversations_async`. Documents are kept as they would be stored
+    (compressed / encrypted, appends in the segments log, compaction), so the encoding work is the same as
+    against Firestore; `latency_seconds` simulates the round trip. Redis backed helpers (in progress id,
+    geolocation) fall through to the real module.
+    """
+
+    def __init__(self, level: str = 'standard', latency_seconds: float = 0):
+        from database import conversations, conversations_async
+        self._module = conversations_async
+        self._conversations = conversations
+        self.level = level
+        self.latency_seconds = latency_seconds
+        self._docs = {}  # (uid, conversation_id) -> stored document
+        self._logs = defaultdict(list)  # (uid, conversation_id) -> log entries
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+    async def _round_trip(self):
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+
+    def _read(self, uid: str, conversation_id: str):
+        key = (uid, conversation_id)
+        if key not in self._docs:
+            return None
+        data = dict(self._docs[key])
+        if self._conversations._has_pending_segments_log(data):
+            base = data.get('transcript_segments_log_base', 0)
+            data['transcript_segments_log'] = [entry for entry in self._logs[key] if entry['seq'] >= base]
+        return self._conversations._prepare_conversation_for_read(data, uid)
+
+    def _query(self, uid: str, status: str):
+        return [conversation_id for (doc_uid, conversation_id), doc in self._docs.items()
+                if doc_uid == uid and doc.get('status') == status]
+
+    def put(self, uid: str, conversation_data: dict):
+        data = dict(conversation_data)
+        if data.get('data_protection_level') is None:
+            data['data_protection_level'] = self.level
+        data.pop('audio_base64_url', None)
+        data.pop('photos', None)
+        key = (uid, data['id'])
+        # the log seq only grows, a full write moves the base up to it
+        seq = self._docs.get(key, {}).get('transcript_segments_log_seq', 0)
+        self._docs[key] = self._conversations._prepare_conversation_for_write(data, uid, data['data_protection_level'])
+        if seq:
+            self._docs[key].update({'transcript_segments_log_seq': seq, 'transcript_segments_log_base': seq})
+        self._logs.pop(key, None)
+
+    async def upsert_conversation(self, uid: str, conversation_data: dict):
+        await self._round_trip()
+        self.put(uid, conversation_data)
+        return conversation_data
+
+    async def get_conversation(self, uid: str, conversation_id: str):
+        await self._round_trip()
+        return self._read(uid, conversation_id)
+
+    async def get_in_progress_conversation(self, uid: str):
+        await self._round_trip()
+        ids = self._query(uid, 'in_progress')
+        return self._read(uid, ids[0]) if ids else None
+
+    async def get_processing_conversations(self, uid: str):
+        await self._round_trip()
+        return [self._read(uid, conversation_id) for conversation_id in self._query(uid, 'processing')]
+
+    async def get_last_completed_conversation(self, uid: str):
+        await self._round_trip()
+        ids = self._query(uid, 'completed')
+        if not ids:
+            return None
+        return self._read(uid, max(ids, key=lambda conversation_id: self._docs[(uid, conversation_id)]['created_at']))
+
+    async def _update(self, uid: str, conversation_id: str, fields: dict):
+        await self._round_trip()
+        if (uid, conversation_id) in self._docs:
+            self._docs[(uid, conversation_id)].update(fields)
+
+    async def update_conversation_status(self, uid: str, conversation_id: str, status: str):
+        await self._update(uid, conversation_id, {'status': status})
+
+    async def set_conversation_as_discarded(self, uid: str, conversation_id: str):
+        await self._update(uid, conversation_id, {'discarded': True})
+
+    async def update_conversation_finished_at(self, uid: str, conversation_id: str, finished_at):
+        await self._update(uid, conversation_id, {'finished_at': finished_at})
+
+    async def append_conversation_segments(self, uid: str, conversation_id: str, segments: list) -> bool:
+        if not segments:
+            return False
+        await self._round_trip()
+        key = (uid, conversation_id)
+        doc = self._docs.get(key)
+        if doc is None:
+            return False
+        level = doc.get('data_protection_level', 'standard')
+        seq = doc.get('transcript_segments_log_seq', 0)
+        self._logs[key].append(self._conversations._prepare_segments_log_entry_for_write(segments, uid, level, seq))
+        doc['transcript_segments_log_seq'] = seq + 1
+        compact_every = self._conversations.transcript_segments_log_compact_every
+        return seq + 1 - doc.get('transcript_segments_log_base', 0) >= compact_every
+
+    async def compact_conversation_segments(self, uid: str, conversation_id: str) -> bool:
+        await self._round_trip()
+        key = (uid, conversation_id)
+        plain_data = self._read(uid, conversation_id)
+        if plain_data is None:
+            return False
+        doc = self._docs[key]
+        doc.update(self._conversations._prepare_conversation_for_write(
+            {'transcript_segments': plain_data.get('transcript_segments')}, uid, doc.get('data_protection_level')))
+        doc['transcript_segments_log_base'] = doc.get('transcript_segments_log_seq', 0)
+        self._logs[key] = []
+        return True
+
+    async def retrieve_in_progress_conversation(self, uid: str):
+        conversation_id = await self._module.get_in_progress_conversation_id(uid)
+        existing = None
+        if conversation_id:
+            existing = await self.get_conversation(uid, conversation_id)
+            if existing and existing['status'] != 'in_progress':
+                existing = None
+        if not existing:
+            existing = await self.get_in_progress_conversation(uid)
+        return existing
+
+
+# *****************************
+# ********** METRICS **********
+# *****************************
+
+class LoopLagMonitor:
+    """Samples how late a fixed interval sleep wakes up, i.e. how long the loop was busy elsewhere."""
+
+    def __init__(self, interval_seconds: float = LOOP_LAG_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self.samples = []
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval_seconds)
+            self.samples.append(max(loop.time() - start - self.interval_seconds, 0))
+
+    def drain(self):
+        samples, self.samples = self.samples, []
+        return samples
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # ru_maxrss is in KB on Linux, the peak is the best we have elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def process_metrics() -> dict:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        'time': time.time(),
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        'rss_bytes': _rss_bytes(),
+        'max_rss_bytes': usage.ru_maxrss * 1024,
+        'threads': threading.active_count(),
+    }
+
+
+# *****************************
+# *********** APP *************
+# *****************************
+
+def create_app(fakes_url: str, stt: str = 'deepgram', redis: str = 'fake', level: str = 'standard',
+               store_latency_seconds: float = 0, process_seconds: float = 0, audio_bytes_seconds: int = 0):
+    configure_environment(fakes_url, stt)
+
+    from fastapi import FastAPI
+
+    from database import redis_db, conversations_async
+    import database.users as users_db
+    from models.conversation import ConversationStatus
+    from routers import transcribe
+    from utils.stt.streaming import STTService
+
+    if redis == 'fake':
+        import fakeredis
+        server = fakeredis.FakeServer()
+        redis_db.r = fakeredis.FakeStrictRedis(server=server)
+        redis_db.ar = conversations_async.ar = fakeredis.aioredis.FakeRedis(server=server)
+
+    store = MemoryConversations(level=level, latency_seconds=store_latency_seconds)
+    transcribe.conversations_db = store
+    users_db.is_exists_user = lambda uid: True
+
+    def process_conversation(uid, language_code, conversation, *args, **kwargs):
+        # the real one is synchronous and runs on the loop, so is this one
+        if process_seconds:
+            time.sleep(process_seconds)
+        conversation.status = ConversationStatus.completed
+        store.put(uid, conversation.dict())
+        return conversation
+
+    transcribe.process_conversation = process_conversation
+    transcribe.trigger_external_integrations = lambda uid, conversation: []
+    transcribe.get_audio_bytes_webhook_seconds = lambda uid: audio_bytes_seconds or None
+    transcribe.is_audio_bytes_app_enabled = lambda uid: False
+    if stt == 'speechmatics':
+        # no language routes to speechmatics at the moment
+        transcribe.get_stt_service_for_language = lambda language: (STTService.speechmatics, language, None)
+
+    app = FastAPI()
+    app.include_router(transcribe.router)
+    monitor = LoopLagMonitor()
+
+    @app.on_event('startup')
+    async def start_monitor():
+        asyncio.create_task(monitor.run())
+
+    @app.get('/harness/metrics')
+    async def metrics():
+        return {**process_metrics(), 'tasks': len(asyncio.all_tasks()), 'loop_lag_seconds': monitor.drain()}
+
+    return app
+
+
+def serve(host: str, port: int, fakes_url: str, **kwargs):
+    import uvicorn
+
+    app = create_app(fakes_url, **kwargs)
+    uvicorn.run(app, host=host, port=port, log_level='warning', ws_max_size=16 * 1024 * 1024)
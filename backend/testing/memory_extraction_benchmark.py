@@ -0,0 +1,130 @@
+# Memory extraction around the LLM call for a synthetic heavy user: the prompt context (100 top memories and the
+# user name) and persisting what was extracted, over a run of conversations.
+#
+# - context: `get_prompt_memories` uncached (every call reads Firestore and Firebase auth, as before) and cached
+#   (`utils.llms.memory`, reloaded only after a memory write)
+# - persistence: the extracted memories of each conversation, a share of them rewordings of memories the user
+#   already has, written as extracted (as before) or after the dedupe pass
+# - seeding the user writes all its memories with one `save_memories`, in batches under Firestore's 500 writes
+#
+# Usage (from backend/, against the Firestore emulator and a local Redis):
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 GOOGLE_CLOUD_PROJECT=demo REDIS_DB_HOST=localhost ENCRYPTION_SECRET=... \
+#     python -m testing.memory_extraction_benchmark --memories 5000 --conversations 50
+#
+# Prints one JSON line per phase with latency percentiles, Firestore writes and memories dropped as duplicates.
+import argparse
+import json
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import database.memories as memories_db
+import utils.llms.memory as memory_context
+from database import auth
+from models.memories import Memory, MemoryDB, MemoryCategory
+
+WORDS = ('likes hiking coffee running jazz python startup sister berlin guitar vegan chess tennis reading '
+         'mornings cooking travel japan photography marathon podcasts design').split()
+
+
+def _ms(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {'p50': round(statistics.median(values) * 1000, 1),
+            'p99': round(values[min(int(len(values) * 0.99), len(values) - 1)] * 1000, 1),
+            'max': round(values[-1] * 1000, 1), 'total_s': round(sum(values), 2)}
+
+
+def _content(rng: random.Random) -> str:
+    return f'The user {" ".join(rng.sample(WORDS, 5))} and {rng.randint(0, 10 ** 6)}'
+
+
+def _memory_db(uid: str, content: str, conversation_id: str, created_at: datetime) -> dict:
+    memory = MemoryDB.from_memory(Memory(content=content, category=MemoryCategory.interesting), uid, conversation_id,
+                                  False)
+    memory.created_at = memory.updated_at = created_at
+    memory.scoring = MemoryDB.calculate_score(memory)
+    return memory.dict()
+
+
+def _seed(uid: str, count: int, rng: random.Random):
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    memories = [_memory_db(uid, _content(rng), str(uuid.uuid4()), now - timedelta(minutes=i)) for i in range(count)]
+    memories_db.save_memories(uid, memories)
+    return time.perf_counter() - started
+
+
+def _extracted(rng: random.Random, existing: list, duplicate_share: float):
+    memories = []
+    for _ in range(4):
+        if existing and rng.random() < duplicate_share:
+            # the same fact again, worded slightly differently
+            memories.append(Memory(content=rng.choice(existing).content.replace('The user', 'User') + '.'))
+        else:
+            memories.append(Memory(content=_content(rng)))
+    return memories
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    uid = f'memories-benchmark-{uuid.uuid4().hex[:8]}'
+    seed_seconds = _seed(uid, args.memories, rng)
+    print(json.dumps({'phase': 'seed', 'uid': uid, 'memories': args.memories, 'seconds': round(seed_seconds, 2)}))
+
+    user_name_lookups = [0]
+    get_user_name = auth.get_user_name
+
+    def counted_get_user_name(user_id, *a, **kw):
+        user_name_lookups[0] += 1
+        return get_user_name(user_id, *a, **kw)
+
+    memory_context.get_user_name = counted_get_user_name
+
+    for mode in ('uncached', 'cached'):
+        context_seconds, persist_seconds = [], []
+        writes = dropped = 0
+        user_name_lookups[0] = 0
+        memory_context._prompt_data.clear()
+        memory_context._user_names.clear()
+        for _ in range(args.conversations):
+            if mode == 'uncached':
+                memory_context._prompt_data.clear()
+                memory_context._user_names.clear()
+            started = time.perf_counter()
+            user_name, user_made, generated = memory_context.get_prompt_data(uid)
+            context_seconds.append(time.perf_counter() - started)
+
+            conversation_id = str(uuid.uuid4())
+            # conversations that extract nothing don't write, the next one finds the context cached
+            extracted = _extracted(rng, generated, args.duplicate_share) if rng.random() >= args.idle_share else []
+            started = time.perf_counter()
+            kept = extracted
+            if mode == 'cached':
+                kept = memory_context.dedupe_memories(uid, extracted, conversation_id)
+                dropped += len(extracted) - len(kept)
+            memories_db.save_memories(uid, [_memory_db(uid, memory.content, conversation_id,
+                                                       datetime.now(timezone.utc)) for memory in kept])
+            writes += len(kept)
+            if extracted:
+                persist_seconds.append(time.perf_counter() - started)
+
+        print(json.dumps({
+            'phase': mode, 'conversations': args.conversations, 'context_ms': _ms(context_seconds),
+            'persist_ms': _ms(persist_seconds), 'firestore_memory_writes': writes, 'duplicates_dropped': dropped,
+            'user_name_lookups': user_name_lookups[0],
+        }))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--memories', type=int, default=5000)
+    parser.add_argument('--conversations', type=int, default=50)
+    parser.add_argument('--duplicate-share', type=float, default=0.3,
+                        help='extracted memories that reword one the user has')
+    parser.add_argument('--idle-share', type=float, default=0.5, help='conversations without new memories')
+    parser.add_argument('--seed', type=int, default=7)
+    run(parser.parse_args())
@@ -0,0 +1,284 @@
+# LLM cost of keeping persona prompts up to date over a simulated week of conversations, before (every conversation
+# condensed all memories and conversations again, for each persona) and after (`utils.apps.update_personas_async`:
+# debounced per user, new memories and conversations folded into the stored summaries, rebuilt past the drift).
+#
+# Runs on a simulated clock against a fake LLM and in-memory stores patched into `utils.apps`, pending updates in a
+# fakeredis: the debounce timers fire in simulated time, the fake LLM counts calls and tokens (4 characters a token)
+# per prompt kind. Conversations happen during the day, each adds a few memories; some memories are made private,
+# which asks for a rebuild. One of the personas has Twitter connected.
+#
+# Usage (from backend/):
+#   python -m testing.persona_prompt_benchmark --days 7 --conversations-per-day 20 --personas 2
+#
+# Prints one JSON line per mode: LLM calls and tokens in/out per kind, persona prompt writes, and for the
+# incremental mode the rebuilds and the longest a conversation waited for the personas to include it. Then checks
+# that an update scheduled by an instance gone before its timer fired is run once, by the other instances' polls,
+# and that a deleted or edited memory leaves the summaries at the next update; exits with an error if one fails.
+import argparse
+import heapq
+import itertools
+import json
+import random
+import threading
+import types
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from testing.listen_load.server import configure_environment
+
+KINDS = (
+    ('condensing a detailed profile', 'condense_memories'),
+    ('maintaining a condensed profile', 'fold_memories'),
+    ('condensing context from the recent 100 conversations', 'condense_conversations'),
+    ('maintaining condensed context', 'fold_conversations'),
+    ('based on their tweets', 'condense_tweets'),
+)
+
+
+class _FakeLLM:
+    def __init__(self, summary_tokens: int):
+        self.summary_tokens = summary_tokens
+        self.calls, self.tokens_in, self.tokens_out = Counter(), Counter(), Counter()
+
+    def invoke(self, prompt):
+        kind = next((kind for marker, kind in KINDS if marker in prompt), 'other')
+        content = ' '.join(f'trait{i}' for i in range(self.summary_tokens * 4 // 7))
+        self.calls[kind] += 1
+        self.tokens_in[kind] += len(prompt) // 4
+        self.tokens_out[kind] += len(content) // 4
+        return types.SimpleNamespace(content=content)
+
+
+class _Clock:
+    now = datetime(2025, 1, 6, tzinfo=timezone.utc)
+
+
+class _SimulatedDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return _Clock.now
+
+
+class _Timers:
+    """`threading.Timer` firing in simulated time, run by `due`."""
+
+    def __init__(self):
+        self.queue = []
+        self.seq = itertools.count()
+
+    def Timer(self, interval, fn, args=()):
+        timers = self
+
+        class Timer:
+            daemon = False
+
+            def start(self):
+                heapq.heappush(timers.queue, (_Clock.now + timedelta(seconds=interval), next(timers.seq), fn, args))
+
+        return Timer()
+
+    def due(self, until: datetime | None):
+        while self.queue and (until is None or self.queue[0][0] <= until):
+            at, _, fn, args = heapq.heappop(self.queue)
+            _Clock.now = at
+            fn(*args)
+
+
+class _Store:
+    def __init__(self, uid: str, personas: int):
+        self.uid = uid
+        self.memories, self.conversations = [], []
+        self.state = None
+        self.prompt_writes = 0
+        self.personas = [{'id': f'persona-{i}', 'uid': uid, 'name': f'Persona {i}', 'persona_prompt': None,
+                          'connected_accounts': ['omi', 'twitter'] if i == 1 else ['omi'],
+                          **({'twitter': {'username': 'someone'}} if i == 1 else {})} for i in range(personas)]
+        self.included_at = {}
+        self.rebuilds = 0
+        self.updates = 0
+
+    def install(self, apps, threading_namespace):
+        store = self
+
+        def get_user_public_memories(uid, limit=100):
+            public = [memory for memory in store.memories if memory['visibility'] == 'public']
+            return sorted(public, key=lambda memory: memory['created_at'], reverse=True)[:limit]
+
+        def get_conversations(uid, limit=100):
+            return sorted(store.conversations, key=lambda c: c['created_at'], reverse=True)[:limit]
+
+        def get_persona_state_db(uid):
+            return dict(store.state) if store.state else None
+
+        def set_persona_state_db(uid, state):
+            store.updates += 1
+            if not store.state or store.state['rebuilt_at'] != state['rebuilt_at']:
+                store.rebuilds += 1
+            store.state = dict(state)
+            for conversation_id in state['conversation_ids']:
+                store.included_at.setdefault(conversation_id, _Clock.now)
+
+        def update_persona_in_db(persona):
+            store.prompt_writes += 1
+            next(p for p in store.personas if p['id'] == persona['id'])['persona_prompt'] = persona['persona_prompt']
+
+        async def get_twitter_timeline(username):
+            return types.SimpleNamespace(timeline=[types.SimpleNamespace(text=f'tweet {i}') for i in range(50)])
+
+        apps.get_user_public_memories = get_user_public_memories
+        apps.get_conversations = get_conversations
+        apps.get_persona_state_db = get_persona_state_db
+        apps.set_persona_state_db = set_persona_state_db
+        apps.get_user_name = lambda uid: 'Alex'
+        apps.get_omi_personas_by_uid_db = lambda uid: [dict(persona) for persona in store.personas]
+        apps.update_persona_in_db = update_persona_in_db
+        apps.delete_app_cache_by_id = lambda app_id: None
+        apps.get_twitter_timeline = get_twitter_timeline
+        apps.datetime = _SimulatedDatetime
+        apps.threading = threading_namespace
+
+
+def _events(args):
+    """(time, memories added, memory made private) for each conversation of the week."""
+    rng = random.Random(args.seed)
+    start = _Clock.now
+    events = []
+    for day in range(args.days):
+        for _ in range(args.conversations_per_day):
+            at = start + timedelta(days=day, hours=8 + rng.random() * 14)
+            events.append((at, rng.randint(0, 3), rng.random() < args.private_share))
+    return sorted(events)
+
+
+def _conversation(at: datetime, i: int):
+    from models.conversation import Conversation, Structured
+
+    structured = Structured(title=f'Conversation {i}', overview=f'Talked about topic {i % 17} and plan {i % 5}. ' * 4)
+    return Conversation(id=str(uuid.uuid4()), created_at=at, started_at=at, finished_at=at,
+                        structured=structured, transcript_segments=[]).dict()
+
+
+def _add_conversation(store: _Store, rng: random.Random, at: datetime, i: int, memories: int, private: bool):
+    store.conversations.append(_conversation(at, i))
+    for j in range(memories):
+        store.memories.append({'id': str(uuid.uuid4()), 'content': f'Alex {rng.choice(("likes", "works on", "met"))} '
+                                                                   f'thing {rng.randint(0, 10 ** 5)}',
+                               'visibility': 'public', 'created_at': at + timedelta(seconds=j)})
+    if private and store.memories:
+        rng.choice(store.memories)['visibility'] = 'private'
+
+
+def _check(name: str, ok: bool, **data):
+    print(json.dumps({'check': name, 'ok': ok, **data}))
+    if not ok:
+        raise SystemExit(1)
+
+
+def _restarts(apps, store: _Store, timers: _Timers, rng: random.Random, llm: _FakeLLM):
+    """Checks the pending updates kept in redis, after the simulated week of `store`."""
+    # the instance that scheduled the update is gone before its timer fires, two others poll
+    updates = store.updates
+    _add_conversation(store, rng, _Clock.now, 10 ** 6, 2, False)
+    apps.update_personas_async(store.uid)
+    apps.update_personas_async(store.uid)
+    timers.queue.clear()
+    _Clock.now += timedelta(seconds=apps.persona_update_debounce_seconds - 1)
+    apps.run_due_persona_updates()
+    early = store.updates - updates
+    _Clock.now += timedelta(seconds=2)
+    apps.run_due_persona_updates()
+    apps.run_due_persona_updates()
+    included = store.conversations[-1]['id'] in store.state['conversation_ids']
+    _check('restarted_instance', early == 0 and store.updates - updates == 1 and included,
+           updates_before_due=early, updates=store.updates - updates)
+
+    # a deleted memory: the next update condenses from scratch, without it
+    deleted = store.memories.pop(rng.randrange(len(store.memories)))
+    rebuilds, calls = store.rebuilds, llm.calls['condense_memories']
+    apps.update_personas_async(store.uid, rebuild=True)
+    timers.due(None)
+    _check('deleted_memory', store.rebuilds == rebuilds + 1 and llm.calls['condense_memories'] == calls + 1
+           and deleted['id'] not in store.state['memories'], rebuilds=store.rebuilds - rebuilds)
+
+    # an edited memory: condensed from scratch even when no rebuild was asked for
+    edited = rng.choice(store.memories)
+    edited['content'] = f"Alex no longer {edited['content'][len('Alex '):]}"
+    rebuilds = store.rebuilds
+    apps.update_personas_async(store.uid)
+    timers.due(None)
+    _check('edited_memory', store.rebuilds == rebuilds + 1, rebuilds=store.rebuilds - rebuilds)
+
+
+def run(args):
+    configure_environment('ws://127.0.0.1:1', 'deepgram')
+    import fakeredis
+
+    from database import redis_db
+    import utils.apps as apps
+    import utils.llm.persona as persona_llm
+    from models.conversation import Conversation
+
+    events = _events(args)
+    started_at = _Clock.now
+    for mode in ('full', 'incremental'):
+        _Clock.now = started_at
+        rng = random.Random(args.seed)
+        llm = _FakeLLM(args.summary_tokens)
+        persona_llm.llm_medium = llm
+        timers = _Timers()
+        store = _Store(f'persona-benchmark-{mode}', args.personas)
+        store.install(apps, types.SimpleNamespace(Timer=timers.Timer, Thread=threading.Thread, Lock=threading.Lock))
+        apps.persona_update_debounce_seconds = args.debounce_seconds
+        # polls are run by hand, in simulated time
+        apps.persona_update_poll_seconds = 0
+        redis_db.r = fakeredis.FakeStrictRedis()
+
+        for i, (at, memories, private) in enumerate(events):
+            timers.due(at)
+            _Clock.now = at
+            _add_conversation(store, rng, at, i, memories, private)
+            if mode == 'full':
+                # what every conversation did before, for each persona
+                for persona in store.personas:
+                    public = apps.get_user_public_memories(store.uid, limit=250)
+                    persona_llm.condense_conversations(
+                        [Conversation.conversations_to_string(apps.get_conversations(store.uid, limit=100))])
+                    if 'twitter' in persona:
+                        persona_llm.condense_tweets([f'tweet {j}' for j in range(50)], persona['name'])
+                    persona_llm.condense_memories([memory['content'] for memory in public], 'Alex')
+                    store.prompt_writes += 1
+                continue
+
+            apps.update_personas_async(store.uid, rebuild=private)
+        timers.due(None)
+
+        waits = [(store.included_at[conversation['id']] - conversation['created_at']).total_seconds()
+                 for conversation in store.conversations if conversation['id'] in store.included_at]
+
+        print(json.dumps({
+            'mode': mode, 'days': args.days, 'conversations': len(events), 'personas': args.personas,
+            'llm_calls': sum(llm.calls.values()), 'tokens_in': sum(llm.tokens_in.values()),
+            'tokens_out': sum(llm.tokens_out.values()),
+            'per_kind': {kind: {'calls': llm.calls[kind], 'tokens_in': llm.tokens_in[kind],
+                                'tokens_out': llm.tokens_out[kind]} for kind in llm.calls},
+            'persona_prompt_writes': store.prompt_writes,
+            'rebuilds': store.rebuilds if mode == 'incremental' else None,
+            'max_wait_s': max(waits) if waits else 0,
+        }))
+
+        if mode == 'incremental':
+            _restarts(apps, store, timers, rng, llm)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--conversations-per-day', type=int, default=20)
+    parser.add_argument('--personas', type=int, default=2)
+    parser.add_argument('--debounce-seconds', type=float, default=300)
+    parser.add_argument('--private-share', type=float, default=0.02, help='conversations followed by a memory made '
+                                                                           'private')
+    parser.add_argument('--summary-tokens', type=int, default=800, help='length of every fake LLM answer')
+    parser.add_argument('--seed', type=int, default=7)
+    run(parser.parse_args())
@@ -0,0 +1,185 @@
+# Chaos test for the backend -> pusher connections (`utils.pusher`): listen sessions stream transcript frames
+# through `connect_to_trigger_pusher` the way `routers/transcribe.py` does (a frame that fails to send is
+# dropped, the next one reconnects), into a local pusher whose realtime app points at a local HTTP stub.
+# Mid-stream the pusher is SIGKILLed and started again on the same port after `--down-seconds`.
+#
+# Reported as JSON: recovery time per session (pusher ready again -> its first segment at the stub), segments
+# lost (sent seqs the stub never saw), connections opened to the pusher, and connect failures.
+#
+# Usage (from backend/):
+#   python -m testing.pusher_chaos --sessions 200 --seconds 30 --kill-at 10 --down-seconds 3
+#   python -m testing.pusher_chaos --sessions 200 --legacy   # one connection per session, as before
+#
+# Recorded with `--sessions 200 --seconds 30 --kill-at 10 --down-seconds 3`, seeds 7 and 11 (the pusher takes
+# 7-10s to be back, its start up included). Recovery in ms p50 / p99, segments lost of produced (sent on a dead
+# connection), connections opened to the pusher:
+#
+#   pool (4), seed 7:   2054 / 4224   3597 of 10776, 33.4% (197)   8
+#   pool (4), seed 11:  1618 / 2646   3664 of 11000, 33.3% (271)   8
+#   legacy,   seed 7:   1674 / 3921   4049 of 10069, 40.2% (345)   400
+#   legacy,   seed 11:  2986 / 6122   3686 of 9917,  37.2% (319)   400
+#
+# Nearly all lost segments were produced while the pusher was down, the sessions drop what they can't send as
+# `routers/transcribe.py` does. The pool opens 8 connections instead of 400; recovery varies between runs in
+# both modes and is in the same range.
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import defaultdict
+
+from testing.pusher_integrations_soak import BACKEND_DIR, _AppStub, _free_port, _ms
+
+
+class _SeqStub(_AppStub):
+    """Keeps every seq the realtime app received, and when each user's first one arrived after a restart."""
+
+    def __init__(self):
+        super().__init__(0)
+        self.seqs = defaultdict(set)
+        self.recovered_at = {}
+        self.restarted_at = None
+
+    async def handle(self, request):
+        if request.match_info['group'] == 'app' and request.match_info['kind'] == 'integration':
+            uid = request.query.get('uid')
+            for segment in (await request.json()).get('segments') or []:
+                self.seqs[uid].add(segment['seq'])
+                if self.restarted_at is not None and segment['produced_at'] >= self.restarted_at:
+                    self.recovered_at.setdefault(uid, time.time())
+        return await super().handle(request)
+
+
+def _start_pusher(port: int, stub_url: str, log):
+    command = [sys.executable, '-m', 'testing.pusher_integrations_soak', 'server', '--port', str(port),
+               '--stub-url', stub_url, '--firestore-ms', '0']
+    return subprocess.Popen(command, cwd=BACKEND_DIR, stdout=log, stderr=subprocess.STDOUT,
+                            env={**os.environ, 'PYTHONUNBUFFERED': '1'})
+
+
+async def _wait_ready(url: str):
+    for _ in range(300):
+        try:
+            await asyncio.to_thread(lambda: urllib.request.urlopen(f'{url}/v1/trigger/metrics', timeout=1).read())
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError('pusher did not start')
+
+
+async def _session(uid: str, seconds: float, interval: float, rng: random.Random, stats: dict, sent: dict):
+    import websockets
+    from utils.pusher import connect_to_trigger_pusher
+    from utils.pusher_protocol import TranscriptEncoder, negotiated_version, encode_transcript_v1
+
+    ws, encoder, seq = None, None, 0
+    await asyncio.sleep(rng.random() * interval)
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        segments = [{'text': 'hello there', 'seq': seq, 'produced_at': time.time()}]
+        seq += 1
+        if ws is None:
+            try:
+                stats['connect_attempts'] += 1
+                ws = await connect_to_trigger_pusher(uid, 16000, retries=1)
+                encoder = TranscriptEncoder() if negotiated_version(ws.subprotocol) == 2 else None
+                stats['connects'] += 1
+            except Exception:
+                stats['connect_failures'] += 1
+                ws = None
+        if ws is not None:
+            try:
+                data = encoder.encode(segments, uid) if encoder else encode_transcript_v1(segments, uid)
+                await ws.send(data)
+                sent[uid].add(segments[0]['seq'])
+            except websockets.exceptions.ConnectionClosed:
+                stats['send_failures'] += 1
+                ws = None
+        await asyncio.sleep(interval)
+    stats['produced'] += seq
+    if ws is not None:
+        await ws.close()
+
+
+async def run(args):
+    stub_port, pusher_port = _free_port(), _free_port()
+    url = f'http://127.0.0.1:{pusher_port}'
+    os.environ['HOSTED_PUSHER_API_URL'] = url
+    os.environ['PUSHER_MULTIPLEX'] = 'false' if args.legacy else 'true'
+    os.environ['PUSHER_POOL_SIZE'] = str(args.pool_size)
+    import utils.pusher
+
+    stub = _SeqStub()
+    runner = await stub.start(stub_port)
+    stub_url = f'http://127.0.0.1:{stub_port}'
+    log = open(args.server_log, 'a') if args.server_log else subprocess.DEVNULL
+    process = _start_pusher(pusher_port, stub_url, log)
+    stats, sent = defaultdict(int), defaultdict(set)
+    restarted_at = None
+    try:
+        await _wait_ready(url)
+        rng = random.Random(args.seed)
+        uids = [f'user-{i}' for i in range(args.sessions)]
+        sessions = asyncio.gather(*[_session(uid, args.seconds, args.interval, random.Random(rng.random()), stats,
+                                             sent) for uid in uids])
+
+        await asyncio.sleep(args.kill_at)
+        process.send_signal(signal.SIGKILL)
+        process.wait()
+        killed_at = time.time()
+        await asyncio.sleep(args.down_seconds)
+        process = _start_pusher(pusher_port, stub_url, log)
+        await _wait_ready(url)
+        restarted_at = stub.restarted_at = time.time()
+
+        await sessions
+        await asyncio.sleep(args.drain_seconds)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        await runner.cleanup()
+
+    # sent on a connection the pusher never read from
+    lost_after_send = {uid: len(seqs - stub.seqs[uid]) for uid, seqs in sent.items()}
+    received = sum(len(seqs) for seqs in stub.seqs.values())
+    recovery = [stub.recovered_at[uid] - restarted_at for uid in sent if uid in stub.recovered_at]
+    pool = utils.pusher._pool
+    print(json.dumps({
+        'mode': 'legacy' if args.legacy else 'pool', 'pool_size': None if args.legacy else args.pool_size,
+        'sessions': args.sessions, 'seconds': args.seconds, 'interval': args.interval,
+        'down_seconds': round(restarted_at - killed_at, 2),
+        'segments_produced': stats['produced'], 'segments_received': received,
+        'segments_lost': stats['produced'] - received,
+        'segments_lost_after_send': sum(lost_after_send.values()),
+        'sessions_losing_sent_segments': sum(1 for value in lost_after_send.values() if value),
+        'send_failures': stats['send_failures'],
+        'sessions_recovered': len(recovery), 'recovery_ms': _ms(recovery),
+        'session_connects': stats['connects'], 'session_connect_failures': stats['connect_failures'],
+        'pusher_connections_opened': pool.stats['connects'] if pool else stats['connects'],
+        'pool': pool.stats if pool else None,
+    }))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between transcript frames')
+    parser.add_argument('--kill-at', type=float, default=10, help='seconds into the run the pusher is killed')
+    parser.add_argument('--down-seconds', type=float, default=3)
+    parser.add_argument('--drain-seconds', type=float, default=3)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--legacy', action='store_true', help='one pusher connection per session, as before')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--server-log')
+    asyncio.run(run(parser.parse_args()))
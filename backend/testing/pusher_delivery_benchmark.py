@@ -0,0 +1,224 @@
+# Compares the pusher hand-off in `routers/transcribe.py` before (consumers waking up every second to drain a
+# list) and after (`utils.other.batch_buffer.BatchBuffer`), against a local pusher stub:
+#
+# - latency: segments produced at random times are timed until the stub reads them
+# - idle: sessions with nothing to send, process CPU time and consumer wakeups over the same period
+# - slow pusher: audio bytes produced 100x faster than the link to the pusher carries them (each send is followed by
+#   the time the bytes take at `link_bytes_per_second`), buffered bytes stay under the capacity and the excess is
+#   counted as dropped; loopback sockets absorb everything, so the slow link is simulated on the sender
+# - slow transcripts: the open segment is updated every 5ms, the pusher is unreachable for the first 8 seconds and
+#   then each send takes 200ms; without the segment id as the buffer key the oldest updates are dropped past the
+#   capacity, with it they coalesce and the pusher ends up with the last version of every segment
+#
+# Usage (from backend/):
+#   python -m testing.pusher_delivery_benchmark --sessions 200 --seconds 20
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import struct
+import time
+
+import websockets
+
+from utils.other.batch_buffer import BatchBuffer
+
+
+class _Stub:
+    def __init__(self):
+        self.latencies = []
+        self.audio_bytes = 0
+        self.segments = {}
+
+    async def handler(self, ws):
+        try:
+            async for message in ws:
+                now = time.perf_counter()
+                header_type = struct.unpack('I', message[:4])[0]
+                if header_type == 102:
+                    for segment in json.loads(message[4:].decode('utf-8'))['segments']:
+                        self.latencies.append(now - segment['produced_at'])
+                        if 'id' in segment:
+                            self.segments[segment['id']] = segment['text']
+                elif header_type == 101:
+                    self.audio_bytes += len(message) - 4
+        except websockets.ConnectionClosed:
+            pass
+
+
+def _frame(header_type: int, payload: bytes) -> bytes:
+    return struct.pack('I', header_type) + payload
+
+
+class _Polling:
+    """The previous consumers: a list drained by a loop sleeping 1s (0.3s for the realtime stage)."""
+
+    def __init__(self, ws, interval: float = 1):
+        self.ws = ws
+        self.interval = interval
+        self.items = []
+        self.active = True
+        self.wakeups = 0
+
+    def put(self, items):
+        self.items.extend(items)
+
+    async def consume(self):
+        while self.active or self.items:
+            await asyncio.sleep(self.interval)
+            self.wakeups += 1
+            if self.items:
+                items, self.items = self.items, []
+                await self.ws.send(_frame(102, json.dumps({'segments': items}).encode('utf-8')))
+
+    def close(self):
+        self.active = False
+
+
+class _Buffered:
+    def __init__(self, ws):
+        self.ws = ws
+        self.buffer = BatchBuffer(max_delay=0.05, capacity=1000, name='benchmark')
+        self.wakeups = 0
+
+    def put(self, items):
+        self.buffer.put(items)
+
+    async def consume(self):
+        while (items := await self.buffer.get()) is not None:
+            self.wakeups += 1
+            await self.ws.send(_frame(102, json.dumps({'segments': items}).encode('utf-8')))
+
+    def close(self):
+        self.buffer.close()
+
+
+async def _sessions(url: str, strategy, sessions: int, seconds: float, rate: float, seed: int):
+    rng = random.Random(seed)
+    sockets = [await websockets.connect(url) for _ in range(sessions)]
+    consumers = [strategy(ws) for ws in sockets]
+    tasks = [asyncio.create_task(consumer.consume()) for consumer in consumers]
+
+    async def produce(consumer):
+        deadline = time.perf_counter() + seconds
+        while rate and time.perf_counter() < deadline:
+            await asyncio.sleep(rng.expovariate(rate))
+            consumer.put([{'text': 'hello there', 'produced_at': time.perf_counter()}])
+
+    cpu = time.process_time()
+    await asyncio.gather(*[produce(consumer) for consumer in consumers], asyncio.sleep(seconds))
+    cpu = time.process_time() - cpu
+    for consumer in consumers:
+        consumer.close()
+    await asyncio.gather(*tasks)
+    for ws in sockets:
+        await ws.close()
+    return cpu, sum(consumer.wakeups for consumer in consumers)
+
+
+def _percentiles(values):
+    values = sorted(values)
+    return {'p50_ms': round(statistics.median(values) * 1000, 2),
+            'p99_ms': round(values[int(len(values) * 0.99) - 1] * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2)}
+
+
+async def _slow_pusher(seconds: float, sample_rate: int = 16000):
+    link_bytes_per_second = sample_rate * 2 * 2
+    capacity = sample_rate * 2 * 60
+    stub = _Stub()
+    async with websockets.serve(stub.handler, '127.0.0.1', 0, max_size=None) as server:
+        ws = await websockets.connect(f'ws://127.0.0.1:{server.sockets[0].getsockname()[1]}', max_size=None)
+        buffer = BatchBuffer(max_delay=0.2, batch_size=sample_rate, capacity=capacity, size_of=len,
+                             name='slow pusher')
+        max_buffered, sends = 0, 0
+
+        async def consume():
+            nonlocal sends
+            while await buffer.wait():
+                data = bytearray(struct.pack('I', 101))
+                for chunk in buffer.take():
+                    data.extend(chunk)
+                await ws.send(data)
+                sends += 1
+                await asyncio.sleep(len(data) / link_bytes_per_second)
+
+        consumer = asyncio.create_task(consume())
+        chunk = bytes(sample_rate * 2 // 10)
+        produced = 0
+        deadline = time.perf_counter() + seconds
+        # 100x real time, the link carries 2x
+        while time.perf_counter() < deadline:
+            buffer.put([chunk] * 10)
+            produced += len(chunk) * 10
+            max_buffered = max(max_buffered, buffer.size)
+            await asyncio.sleep(0.01)
+        buffer.close()
+        await consumer
+        await ws.close()
+    return {'scenario': 'slow_pusher', 'produced_mb': round(produced / 2 ** 20, 1),
+            'delivered_mb': round(stub.audio_bytes / 2 ** 20, 1), 'sends': sends,
+            'max_buffered_mb': round(max_buffered / 2 ** 20, 2), 'capacity_mb': round(capacity / 2 ** 20, 2),
+            'dropped_chunks': buffer.dropped}
+
+
+async def _slow_transcripts(seconds: float, keyed: bool):
+    stub = _Stub()
+    async with websockets.serve(stub.handler, '127.0.0.1', 0, max_size=None) as server:
+        ws = await websockets.connect(f'ws://127.0.0.1:{server.sockets[0].getsockname()[1]}', max_size=None)
+        buffer = BatchBuffer(max_delay=0.05, capacity=1000, key=(lambda segment: segment['id']) if keyed else None,
+                             name='slow transcripts')
+        sends = 0
+
+        async def consume():
+            nonlocal sends
+            await asyncio.sleep(8)
+            while (items := await buffer.get()) is not None:
+                await ws.send(_frame(102, json.dumps({'segments': items}).encode('utf-8')))
+                sends += 1
+                await asyncio.sleep(0.2)
+
+        consumer = asyncio.create_task(consume())
+        produced = {}
+        updates = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            # a new segment every 20 updates, like interim results growing a sentence
+            segment_id = f'segment-{updates // 20}'
+            produced[segment_id] = f'{segment_id} update {updates}'
+            buffer.put([{'id': segment_id, 'text': produced[segment_id], 'produced_at': time.perf_counter()}])
+            updates += 1
+            await asyncio.sleep(0.005)
+        buffer.close()
+        await consumer
+        await ws.close()
+    return {'scenario': 'slow_transcripts', 'keyed': keyed, 'updates': updates, 'segments': len(produced),
+            'sends': sends, 'dropped': buffer.dropped, 'coalesced': buffer.coalesced,
+            'latest_delivered': sum(1 for segment_id, text in produced.items() if stub.segments.get(segment_id) == text)}
+
+
+async def run(sessions: int, seconds: float, rate: float, seed: int):
+    for name, strategy in [('polling', _Polling), ('batch_buffer', _Buffered)]:
+        stub = _Stub()
+        async with websockets.serve(stub.handler, '127.0.0.1', 0, max_size=None) as server:
+            url = f'ws://127.0.0.1:{server.sockets[0].getsockname()[1]}'
+            _, wakeups = await _sessions(url, strategy, sessions, seconds, rate, seed)
+            latency = _percentiles(stub.latencies)
+            idle_cpu, idle_wakeups = await _sessions(url, strategy, sessions, seconds, 0, seed)
+        print(json.dumps({'scenario': 'delivery', 'strategy': name, 'sessions': sessions, 'seconds': seconds,
+                          'segments': len(stub.latencies), 'consumer_wakeups': wakeups, **latency,
+                          'idle_cpu_s': round(idle_cpu, 3), 'idle_wakeups': idle_wakeups}))
+    print(json.dumps(await _slow_pusher(min(seconds, 10))))
+    for keyed in (False, True):
+        print(json.dumps(await _slow_transcripts(max(seconds, 10), keyed)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--rate', type=float, default=1, help='segments per second per session')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    asyncio.run(run(args.sessions, args.seconds, args.rate, args.seed))
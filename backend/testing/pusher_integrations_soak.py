@@ -0,0 +1,318 @@
+# Soak test for the pusher's integration fan-out (`routers/pusher.py`): thousands of simulated sessions stream
+# transcript frames (and audio bytes for a share of them) into a local pusher, whose realtime apps and developer
+# webhooks all point at a local HTTP stub that answers after `--app-latency-ms`.
+#
+# Reported as JSON: what the stub received and how late (per kind), ordering violations per user and kind,
+# websocket ping round trips to the pusher (event loop responsiveness), pusher RSS, and the executor metrics
+# from `GET /v1/trigger/metrics` (pending, shed, merged, queue wait).
+#
+# Usage (from backend/):
+#   python -m testing.pusher_integrations_soak --sessions 2000 --seconds 60 --app-latency-ms 300
+#   python -m testing.pusher_integrations_soak --sessions 500 --inline   # the previous on-loop execution
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import defaultdict
+from pathlib import Path
+
+import websockets
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# *****************************
+# *********** PUSHER **********
+# *****************************
+
+class _StubApp:
+    def __init__(self, app_id: str, webhook_url: str, audio: bool):
+        self.id = app_id
+        self.name = app_id
+        self.uid = None
+        self.enabled = True
+        self.audio = audio
+        self.external_integration = type('ExternalIntegration', (), {'webhook_url': webhook_url})()
+
+    def triggers_realtime(self):
+        return not self.audio
+
+    def triggers_realtime_audio_bytes(self):
+        return self.audio
+
+    def has_capability(self, capability: str):
+        return False
+
+
+def serve_pusher(port: int, stub_url: str, firestore_ms: float, inline: bool):
+    from testing.listen_load.server import configure_environment
+
+    configure_environment('ws://127.0.0.1:1', 'deepgram')
+    os.environ.setdefault('WEBHOOK_DISPATCHER_MAX_PER_HOST', '64')
+
+    import uvicorn
+    from fastapi import FastAPI
+
+    from routers import pusher
+    import utils.app_integrations as app_integrations
+    import utils.webhooks as webhooks
+
+    apps = [_StubApp('transcript-app', f'{stub_url}/app/integration', False),
+            _StubApp('audio-app', f'{stub_url}/app/audio', True)]
+
+    def get_token_only(uid):
+        # the token lookup is a Firestore read
+        time.sleep(firestore_ms / 1000)
+        return None
+
+    app_integrations.get_enabled_apps_registry = lambda uid: apps if uid.startswith('audio-') else apps[:1]
+    app_integrations.record_app_usage = lambda *args, **kwargs: None
+    app_integrations.notification_db.get_token_only = get_token_only
+    webhooks.user_webhook_status_db = lambda uid, webhook_type: True
+    webhooks.get_user_webhook_db = lambda uid, webhook_type: (
+        f'{stub_url}/webhook/audio,5' if webhook_type == 'audio_bytes' else f'{stub_url}/webhook/transcript')
+    pusher.get_audio_bytes_webhook_seconds = lambda uid: 5 if uid.startswith('audio-') else None
+    pusher.is_audio_bytes_app_enabled = lambda uid: uid.startswith('audio-')
+
+    if inline:
+        # what run_coroutine_threadsafe did with the blocking coroutines: run them on the pusher's own loop
+        async def blocking(fn, args, done):
+            try:
+                fn(*args)
+            finally:
+                if done is not None:
+                    done()
+
+        def submit(key, kind, fn, *args, merge=None, done=None):
+            asyncio.get_running_loop().create_task(blocking(fn, args, done))
+            return True
+
+        pusher.integrations.submit = submit
+
+    app = FastAPI()
+    app.include_router(pusher.router)
+    uvicorn.run(app, host='127.0.0.1', port=port, log_level='warning')
+
+
+# *****************************
+# ************ STUB ***********
+# *****************************
+
+class _AppStub:
+    def __init__(self, latency_seconds: float):
+        self.latency_seconds = latency_seconds
+        self.requests = defaultdict(int)
+        self.latencies = defaultdict(list)
+        self.audio_bytes = defaultdict(int)
+        self.last_seq = {}
+        self.order_violations = defaultdict(int)
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        kind = f'{request.match_info["group"]}_{request.match_info["kind"]}'
+        uid = request.query.get('uid')
+        self.requests[kind] += 1
+        if request.match_info['kind'] == 'audio':
+            self.audio_bytes[kind] += len(await request.read())
+        else:
+            now = time.time()
+            for segment in (await request.json()).get('segments') or []:
+                self.latencies[kind].append(now - segment['produced_at'])
+                key = (uid, kind)
+                if segment['seq'] < self.last_seq.get(key, -1):
+                    self.order_violations[kind] += 1
+                self.last_seq[key] = segment['seq']
+        await asyncio.sleep(self.latency_seconds)
+        return web.json_response({})
+
+    async def start(self, port: int):
+        from aiohttp import web
+
+        app = web.Application(client_max_size=64 * 2 ** 20)
+        app.router.add_post('/{group}/{kind}', self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port, backlog=4096).start()
+        return runner
+
+
+# *****************************
+# ********** SESSIONS *********
+# *****************************
+
+def _ms(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {'count': len(values), 'p50': round(statistics.median(values) * 1000, 1),
+            'p99': round(values[min(int(len(values) * 0.99), len(values) - 1)] * 1000, 1),
+            'max': round(values[-1] * 1000, 1)}
+
+
+async def _session(url: str, uid: str, seconds: float, interval: float, sample_rate: int, rng: random.Random,
+                   pings: list, stats: dict):
+    audio = uid.startswith('audio-')
+    chunk = bytes(sample_rate * 2 // 10)
+    try:
+        async with websockets.connect(f'{url}/v1/trigger/listen?uid={uid}&sample_rate={sample_rate}',
+                                      ping_interval=None, max_size=None) as ws:
+            deadline = time.monotonic() + seconds
+            seq = 0
+            next_transcript = time.monotonic() + rng.random() * interval
+            next_ping = time.monotonic() + rng.random() * 5
+            while time.monotonic() < deadline:
+                now = time.monotonic()
+                if now >= next_transcript:
+                    segments = [{'text': 'hello there', 'seq': seq, 'produced_at': time.time()}]
+                    seq += 1
+                    await ws.send(struct.pack('<I', 102) + json.dumps({'segments': segments, 'memory_id': uid}).encode())
+                    next_transcript += interval
+                if audio:
+                    await ws.send(struct.pack('<I', 101) + chunk)
+                if now >= next_ping:
+                    started = time.monotonic()
+                    try:
+                        await asyncio.wait_for(await ws.ping(), 10)
+                        pings.append(time.monotonic() - started)
+                    except asyncio.TimeoutError:
+                        stats['ping_timeouts'] += 1
+                    next_ping += 5
+                await asyncio.sleep(0.1 if audio else max(min(next_transcript, next_ping) - time.monotonic(), 0))
+            stats['segments'] += seq
+    except Exception as e:
+        stats['errors'] += 1
+        if stats['errors'] <= 5:
+            print(f'session {uid}: {type(e).__name__}: {e}', file=sys.stderr)
+
+
+def _rss_mb(pid: int):
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20, 1)
+    except OSError:
+        return None
+
+
+async def run(args):
+    stub_port, pusher_port = _free_port(), _free_port()
+    stub = _AppStub(args.app_latency_ms / 1000)
+    runner = await stub.start(stub_port)
+
+    command = [sys.executable, '-m', 'testing.pusher_integrations_soak', 'server', '--port', str(pusher_port),
+               '--stub-url', f'http://127.0.0.1:{stub_port}', '--firestore-ms', str(args.firestore_ms)]
+    if args.inline:
+        command.append('--inline')
+    log = open(args.server_log, 'a') if args.server_log else subprocess.DEVNULL
+    env = {**os.environ, 'PYTHONUNBUFFERED': '1'}
+    if args.workers:
+        env['PUSHER_INTEGRATION_WORKERS'] = env['WEBHOOK_DISPATCHER_MAX_WORKERS'] = str(args.workers)
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=log, stderr=subprocess.STDOUT, env=env)
+    url = f'http://127.0.0.1:{pusher_port}'
+    try:
+        for _ in range(300):
+            try:
+                urllib.request.urlopen(f'{url}/v1/trigger/metrics', timeout=1).read()
+                break
+            except OSError:
+                await asyncio.sleep(0.2)
+
+        rng = random.Random(args.seed)
+        audio_sessions = int(args.sessions * args.audio_share)
+        uids = [f'audio-{i}' for i in range(audio_sessions)] + \
+               [f'user-{i}' for i in range(args.sessions - audio_sessions)]
+        pings, stats, rss = [], defaultdict(int), []
+
+        async def start(i: int, uid: str):
+            await asyncio.sleep(args.ramp_seconds * i / max(len(uids), 1))
+            await _session(url.replace('http', 'ws', 1), uid, args.seconds, args.interval, args.sample_rate,
+                           random.Random(rng.random()), pings, stats)
+
+        async def sample_rss():
+            while True:
+                rss.append(_rss_mb(process.pid))
+                await asyncio.sleep(1)
+
+        sampler = asyncio.create_task(sample_rss())
+        started = time.monotonic()
+        await asyncio.gather(*[start(i, uid) for i, uid in enumerate(uids)])
+        await asyncio.sleep(args.drain_seconds)
+        sampler.cancel()
+        elapsed = time.monotonic() - started
+
+        metrics = None
+        if not args.inline:
+            metrics = await asyncio.to_thread(
+                lambda: json.loads(urllib.request.urlopen(f'{url}/v1/trigger/metrics', timeout=30).read()))
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            # a blocked loop never gets to its shutdown
+            process.kill()
+            process.wait()
+        await runner.cleanup()
+
+    rss = [value for value in rss if value is not None]
+    print(json.dumps({
+        'mode': 'inline' if args.inline else 'ordered_executor', 'workers': args.workers,
+        'sessions': args.sessions, 'audio_sessions': audio_sessions, 'seconds': args.seconds,
+        'elapsed_seconds': round(elapsed, 1), 'session_errors': stats['errors'], 'ping_timeouts': stats['ping_timeouts'],
+        'segments_sent': stats['segments'],
+        'stub_requests': dict(stub.requests), 'stub_audio_mb': {k: round(v / 2 ** 20, 1) for k, v in
+                                                                stub.audio_bytes.items()},
+        'delivery_latency_ms': {kind: _ms(values) for kind, values in stub.latencies.items()},
+        'order_violations': dict(stub.order_violations),
+        'pusher_ping_ms': _ms(pings),
+        'pusher_rss_mb': {'max': max(rss), 'end': rss[-1]} if rss else None,
+        'executor': metrics,
+    }))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    server_parser = subparsers.add_parser('server')
+    server_parser.add_argument('--port', type=int, required=True)
+    server_parser.add_argument('--stub-url', required=True)
+    server_parser.add_argument('--firestore-ms', type=float, default=20)
+    server_parser.add_argument('--inline', action='store_true')
+
+    run_parser = subparsers.add_parser('run')
+    run_parser.add_argument('--sessions', type=int, default=2000)
+    run_parser.add_argument('--seconds', type=float, default=60)
+    run_parser.add_argument('--interval', type=float, default=1, help='seconds between transcript frames')
+    run_parser.add_argument('--audio-share', type=float, default=0.05, help='sessions also streaming audio bytes')
+    run_parser.add_argument('--sample-rate', type=int, default=16000)
+    run_parser.add_argument('--app-latency-ms', type=float, default=300)
+    run_parser.add_argument('--firestore-ms', type=float, default=20, help='simulated token lookup')
+    run_parser.add_argument('--ramp-seconds', type=float, default=10)
+    run_parser.add_argument('--drain-seconds', type=float, default=5)
+    run_parser.add_argument('--seed', type=int, default=7)
+    run_parser.add_argument('--inline', action='store_true', help='run integrations on the loop, as before')
+    run_parser.add_argument('--workers', type=int, help='integration and webhook dispatcher threads')
+    run_parser.add_argument('--server-log')
+
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in subparsers.choices:
+        argv = ['run', *argv]
+    args = parser.parse_args(argv)
+    if args.command == 'server':
+        serve_pusher(args.port, args.stub_url, args.firestore_ms, args.inline)
+    else:
+        asyncio.run(run(args))
@@ -0,0 +1,211 @@
+# Multiplexed backend -> pusher streams (`utils.pusher.PusherPool` -> `routers.pusher._websocket_util_multiplex`)
+# over one connection to a pusher running in this process. The realtime integration and transcript webhook are
+# replaced by functions that record what they got, and can be held to make the apps slow.
+#
+# Checks, in order:
+# - open_off_the_loop: opening a stream whose session setup is slow (`--open-ms` of Firestore and Redis lookups)
+#   doesn't stall the other streams on the connection; the frames it was sent meanwhile are handled, in order,
+#   once it is open
+# - credit_is_backlog: with the apps held, a stream sends its credit window and then waits; once the apps are
+#   released its jobs drain, credit comes back and the stream goes on
+# - merge_keeps_latest: frames queued behind a held app are merged into one job; a segment sent again replaces
+#   its pending version instead of being delivered twice
+#
+# Usage (from backend/):
+#   python -m testing.pusher_multiplex_benchmark --open-ms 500
+#
+# Prints one JSON line per check, exits with an error if one fails.
+import argparse
+import asyncio
+import json
+import threading
+import time
+from typing import Optional
+
+from testing.listen_load.server import configure_environment
+from testing.pusher_integrations_soak import _free_port
+
+
+def _check(name: str, ok: bool, **data):
+    print(json.dumps({'check': name, 'ok': ok, **data}))
+    if not ok:
+        raise SystemExit(1)
+
+
+class _Apps:
+    """Stands in for the realtime integration and transcript webhook: when each user's seqs got there."""
+
+    def __init__(self):
+        self.arrivals = {}
+        self.segments = {}
+        self.released = threading.Event()
+        self.released.set()
+        self._lock = threading.Lock()
+
+    def integrations(self, uid, segments, memory_id):
+        self.released.wait()
+        now = time.monotonic()
+        with self._lock:
+            self.arrivals.setdefault(uid, []).extend((segment['seq'], now) for segment in segments or [])
+            self.segments.setdefault(uid, []).append([(segment['id'], segment['text']) for segment in segments or []])
+
+    def webhook(self, uid, segments):
+        self.released.wait()
+
+
+def _serve(port: int, apps: _Apps, open_seconds: float):
+    import uvicorn
+    from fastapi import FastAPI
+
+    from routers import pusher
+
+    def is_audio_bytes_app_enabled(uid):
+        # the session's Firestore and Redis lookups
+        if uid.startswith('slow-'):
+            time.sleep(open_seconds)
+        return False
+
+    pusher.is_audio_bytes_app_enabled = is_audio_bytes_app_enabled
+    pusher.get_audio_bytes_webhook_seconds = lambda uid: None
+    pusher.trigger_realtime_integrations = apps.integrations
+    pusher.realtime_transcript_webhook = apps.webhook
+
+    app = FastAPI()
+    app.include_router(pusher.router)
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    for _ in range(300):
+        if server.started:
+            return server
+        time.sleep(0.05)
+    raise RuntimeError('pusher did not start')
+
+
+def _frame(encoder, seq: int, text: str = 'hello there', segment_id: Optional[str] = None):
+    return encoder.encode([{'id': segment_id or f'segment-{seq}', 'text': text, 'seq': seq}], 'conversation')
+
+
+async def _open_off_the_loop(pool, apps: _Apps, args):
+    from utils.pusher_protocol import TranscriptEncoder
+
+    fast = await pool.open_stream('fast-0', 16000)
+    fast_encoder = TranscriptEncoder()
+    frames = int(args.seconds / 0.02)
+    slow_opened_at = None
+
+    async def stream_fast():
+        for seq in range(frames):
+            await fast.send(_frame(fast_encoder, seq))
+            await asyncio.sleep(0.02)
+
+    async def open_slow():
+        nonlocal slow_opened_at
+        await asyncio.sleep(args.seconds / 4)
+        slow_opened_at = time.monotonic()
+        slow = await pool.open_stream('slow-0', 16000)
+        slow_encoder = TranscriptEncoder()
+        # sent before the pusher has the session, kept for it
+        for seq in range(5):
+            await slow.send(_frame(slow_encoder, seq))
+        return slow
+
+    _, slow = await asyncio.gather(stream_fast(), open_slow())
+    await asyncio.sleep(args.open_ms / 1000 + 0.2)
+    fast_times = [at for _, at in apps.arrivals.get('fast-0', [])]
+    gaps = [b - a for a, b in zip(fast_times, fast_times[1:])]
+    slow_arrivals = apps.arrivals.get('slow-0', [])
+    slow_seqs = [seq for seq, _ in slow_arrivals]
+    slow_seconds = slow_arrivals[0][1] - slow_opened_at if slow_arrivals else None
+    _check('open_off_the_loop', len(fast_times) == frames and max(gaps) < args.open_ms / 1000 / 2
+           and slow_seqs == list(range(5)) and slow_seconds >= args.open_ms / 1000 * 0.9,
+           fast_frames=len(fast_times), fast_max_gap_ms=round(max(gaps) * 1000, 1), slow_seqs=slow_seqs,
+           slow_first_ms=round(slow_seconds * 1000, 1) if slow_seconds is not None else None)
+    await fast.close()
+    await slow.close()
+
+
+async def _credit_is_backlog(pool, apps: _Apps, args):
+    from utils.pusher_protocol import MUX_WINDOW_BYTES, TranscriptEncoder
+
+    stream = await pool.open_stream('held-0', 16000)
+    encoder = TranscriptEncoder(compress_min_bytes=2 ** 30)
+    apps.released.clear()
+    sent_bytes, seq = 0, 0
+    # a frame is encoded once: the encoder keeps the state of the connection
+    frame = _frame(encoder, seq, text=f'{seq} ' + 'x' * 16000)
+    try:
+        while sent_bytes < 4 * MUX_WINDOW_BYTES:
+            try:
+                await asyncio.wait_for(stream.send(frame), 0.5)
+            except asyncio.TimeoutError:
+                break
+            sent_bytes += len(frame)
+            seq += 1
+            frame = _frame(encoder, seq, text=f'{seq} ' + 'x' * 16000)
+        held_bytes = sent_bytes
+    finally:
+        apps.released.set()
+
+    # released: the blocked frame and the next window go through
+    started = time.monotonic()
+    while sent_bytes < held_bytes + MUX_WINDOW_BYTES:
+        await asyncio.wait_for(stream.send(frame), 5)
+        sent_bytes += len(frame)
+        seq += 1
+        frame = _frame(encoder, seq, text=f'{seq} ' + 'x' * 16000)
+    resumed_seconds = time.monotonic() - started
+    await asyncio.sleep(0.5)
+    received = sorted(s for s, _ in apps.arrivals.get('held-0', []))
+    _check('credit_is_backlog', MUX_WINDOW_BYTES <= held_bytes <= MUX_WINDOW_BYTES + 20000
+           and received == list(range(seq)), window_bytes=MUX_WINDOW_BYTES, sent_while_held=held_bytes,
+           resumed_seconds=round(resumed_seconds, 3), frames=seq, received=len(received))
+    await stream.close()
+
+
+async def _merge_keeps_latest(pool, apps: _Apps, args):
+    from utils.pusher_protocol import TranscriptEncoder
+
+    stream = await pool.open_stream('merged-0', 16000)
+    encoder = TranscriptEncoder()
+    apps.released.clear()
+    try:
+        # the first job takes the app and waits there, the next frames queue up behind it
+        await stream.send(_frame(encoder, 0))
+        await asyncio.sleep(0.2)
+        await stream.send(_frame(encoder, 1, text='hello', segment_id='segment-1'))
+        await stream.send(_frame(encoder, 2, text='hello there', segment_id='segment-1'))
+        await stream.send(_frame(encoder, 3))
+        await asyncio.sleep(0.2)
+    finally:
+        apps.released.set()
+    await asyncio.sleep(0.3)
+    jobs = apps.segments.get('merged-0', [])
+    _check('merge_keeps_latest', jobs == [[('segment-0', 'hello there')],
+                                          [('segment-1', 'hello there'), ('segment-3', 'hello there')]], jobs=jobs)
+    await stream.close()
+
+
+async def _run(args, port):
+    from utils.pusher import PusherPool
+
+    apps = _Apps()
+    server = _serve(port, apps, args.open_ms / 1000)
+    pool = PusherPool(f'ws://127.0.0.1:{port}', 1)
+    try:
+        await _open_off_the_loop(pool, apps, args)
+        await _credit_is_backlog(pool, apps, args)
+        await _merge_keeps_latest(pool, apps, args)
+    finally:
+        server.should_exit = True
+
+
+def run(args):
+    configure_environment('ws://127.0.0.1:1', 'deepgram')
+    asyncio.run(_run(args, _free_port()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--open-ms', type=float, default=500, help='session setup of the slow stream')
+    parser.add_argument('--seconds', type=float, default=2, help='how long the other stream streams')
+    run(parser.parse_args())
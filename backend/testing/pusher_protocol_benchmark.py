@@ -0,0 +1,188 @@
+# Encode / decode benchmark and fuzzing for the backend -> pusher frames (`utils.pusher_protocol`), including
+# `read_frame`, which is what `routers/pusher.py` runs on every message.
+#
+# - benchmark: a realistic stream (1-3 segments per flush, speakers changing every few segments) and a large
+#   flush (200 segments, e.g. after a reconnect), v1 JSON vs v2 deltas + msgpack (+ zlib past 1KB);
+#   bytes per frame and microseconds to encode / decode, and a round trip check
+# - fuzz: random bytes, truncated and bit flipped valid frames, random msgpack documents under a v2 header;
+#   `read_frame` must return or raise FrameError, never anything else, and a decoder that saw garbage must
+#   still decode the next valid frame correctly
+#
+# Usage (from backend/):
+#   python -m testing.pusher_protocol_benchmark --frames 20000 --fuzz 200000
+import argparse
+import json
+import random
+import struct
+import time
+import uuid
+import zlib
+
+import msgpack
+
+from utils.pusher_protocol import FrameError, TranscriptDecoder, TranscriptEncoder, encode_transcript_v1, \
+    read_frame, TRANSCRIPT_V2
+
+WORDS = 'so I was thinking we could meet tomorrow around noon and go over the plan for the launch'.split()
+
+
+def _stream(rng: random.Random, frames: int, per_frame=(1, 3)):
+    speaker, position, memory_id = 0, 0.0, str(uuid.UUID(int=rng.getrandbits(128)))
+    for i in range(frames):
+        batch = []
+        for _ in range(rng.randint(*per_frame)):
+            if rng.random() < 0.2:
+                speaker = rng.randint(0, 2)
+            duration = round(rng.uniform(0.5, 6), 3)
+            batch.append({
+                'id': str(uuid.UUID(int=rng.getrandbits(128))),
+                'text': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 25))),
+                'speaker': f'SPEAKER_{speaker:02d}', 'speaker_id': speaker, 'is_user': speaker == 0,
+                'person_id': None, 'start': position, 'end': round(position + duration, 3), 'translations': [],
+            })
+            position = round(position + duration, 3)
+        if i and i % 500 == 0:
+            memory_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        yield batch, memory_id
+
+
+def _bench(name: str, batches: list):
+    frames_v1 = []
+    started = time.perf_counter()
+    for segments, memory_id in batches:
+        frames_v1.append(encode_transcript_v1(segments, memory_id))
+    encode_v1 = time.perf_counter() - started
+
+    decoder = TranscriptDecoder()
+    started = time.perf_counter()
+    decoded_v1 = [read_frame(frame, decoder)[1] for frame in frames_v1]
+    decode_v1 = time.perf_counter() - started
+
+    encoder = TranscriptEncoder()
+    started = time.perf_counter()
+    frames_v2 = [encoder.encode(segments, memory_id) for segments, memory_id in batches]
+    encode_v2 = time.perf_counter() - started
+
+    decoder = TranscriptDecoder()
+    started = time.perf_counter()
+    decoded_v2 = [read_frame(frame, decoder)[1] for frame in frames_v2]
+    decode_v2 = time.perf_counter() - started
+
+    assert decoded_v1 == batches and decoded_v2 == batches, f'{name}: round trip mismatch'
+    n = len(batches)
+    size_v1 = sum(map(len, frames_v1))
+    size_v2 = sum(map(len, frames_v2))
+    return {'scenario': name, 'frames': n,
+            'segments': sum(len(segments) for segments, _ in batches),
+            'v1': {'bytes_per_frame': round(size_v1 / n, 1), 'encode_us': round(encode_v1 / n * 1e6, 2),
+                   'decode_us': round(decode_v1 / n * 1e6, 2)},
+            'v2': {'bytes_per_frame': round(size_v2 / n, 1), 'encode_us': round(encode_v2 / n * 1e6, 2),
+                   'decode_us': round(decode_v2 / n * 1e6, 2),
+                   'compressed_frames': sum(1 for frame in frames_v2 if frame[4] & 1)},
+            'size_ratio': round(size_v2 / size_v1, 3)}
+
+
+def benchmark(frames: int, seed: int):
+    rng = random.Random(seed)
+    return [_bench('stream', list(_stream(rng, frames))),
+            _bench('large_flush', list(_stream(rng, max(frames // 200, 1), per_frame=(200, 200))))]
+
+
+# *****************************
+# ************ FUZZ ***********
+# *****************************
+
+def _random_value(rng: random.Random, depth: int = 0):
+    kinds = ['int', 'neg', 'float', 'str', 'bytes', 'none', 'bool']
+    if depth < 3:
+        kinds += ['list', 'map']
+    kind = rng.choice(kinds)
+    if kind == 'int':
+        return rng.randint(0, 2 ** 64 - 1)
+    if kind == 'neg':
+        return rng.randint(-2 ** 63, -1)
+    if kind == 'float':
+        return rng.uniform(-1e9, 1e9)
+    if kind == 'str':
+        return ''.join(chr(rng.randint(0, 0x2FF)) for _ in range(rng.randint(0, 8)))
+    if kind == 'bytes':
+        return rng.randbytes(rng.randint(0, 8))
+    if kind == 'none':
+        return None
+    if kind == 'bool':
+        return rng.random() < 0.5
+    if kind == 'list':
+        return [_random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    keys = [rng.choice([-1, 0, 1, 5, 9, 10, 1000]) if rng.random() < 0.7 else _random_value(rng, 3)
+            for _ in range(rng.randint(0, 4))]
+    return {key if isinstance(key, (int, str, bytes, float, bool, type(None))) else str(key):
+                _random_value(rng, depth + 1) for key in keys}
+
+
+def _random_frame(rng: random.Random, valid: list) -> bytes:
+    choice = rng.random()
+    if choice < 0.2:
+        return rng.randbytes(rng.randint(0, 64))
+    if choice < 0.4:
+        frame = rng.choice(valid)
+        return frame[:rng.randint(0, len(frame))]
+    if choice < 0.6:
+        frame = bytearray(rng.choice(valid))
+        for _ in range(rng.randint(1, 4)):
+            frame[rng.randrange(len(frame))] ^= 1 << rng.randrange(8)
+        return bytes(frame)
+    body = {0: [_random_value(rng) for _ in range(rng.randint(0, 3))]} if rng.random() < 0.7 \
+        else _random_value(rng)
+    payload = msgpack.packb(body, use_bin_type=True)
+    flags = 0
+    if rng.random() < 0.3:
+        flags, payload = 1, zlib.compress(payload)
+    if rng.random() < 0.05:
+        flags = rng.randint(0, 255)
+    return struct.pack('<I', rng.choice([TRANSCRIPT_V2, TRANSCRIPT_V2, 102, 101, rng.getrandbits(32)])) \
+        + bytes((flags,)) + payload
+
+
+def fuzz(iterations: int, seed: int):
+    rng = random.Random(seed)
+    encoder = TranscriptEncoder(compress_min_bytes=64)
+    batches = list(_stream(rng, 50))
+    valid = [encoder.encode(segments, memory_id) for segments, memory_id in batches]
+    valid += [encode_transcript_v1(segments, memory_id) for segments, memory_id in batches[:10]]
+
+    outcomes = {'ok': 0, 'frame_error': 0}
+    decoder = TranscriptDecoder()
+    for i in range(iterations):
+        frame = _random_frame(rng, valid)
+        try:
+            read_frame(frame, decoder)
+            outcomes['ok'] += 1
+        except FrameError:
+            outcomes['frame_error'] += 1
+        except Exception as e:
+            raise AssertionError(f'{type(e).__name__}: {e} for frame {frame!r}')
+
+    # garbage before and between valid frames doesn't corrupt the state
+    for _ in range(200):
+        encoder, decoder = TranscriptEncoder(compress_min_bytes=64), TranscriptDecoder()
+        for segments, memory_id in batches[:10]:
+            frame = encoder.encode(segments, memory_id)
+            for _ in range(rng.randint(0, 3)):
+                try:
+                    read_frame(_random_frame(rng, valid), TranscriptDecoder())
+                    read_frame(frame[:rng.randint(4, len(frame) - 1)], decoder)
+                except FrameError:
+                    pass
+            assert read_frame(frame, decoder)[1] == (segments, memory_id)
+    return {'scenario': 'fuzz', 'iterations': iterations, **outcomes}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--fuzz', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    for result in benchmark(args.frames, args.seed):
+        print(json.dumps(result))
+    print(json.dumps(fuzz(args.fuzz, args.seed)))
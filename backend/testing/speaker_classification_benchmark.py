@@ -0,0 +1,203 @@
+# Speaker classification of a conversation's segments on CPU, before (`classify_segments` of the speech profile
+# service: the wav read again and a temp file exported for every 30 seconds chunk, `model.verify_files` embedding the
+# chunk and the whole speech profile again for every candidate) and after (`utils.stt.speaker_embeddings`: candidate
+# embeddings computed once, the audio read once and its chunks embedded in batches).
+#
+# Runs on generated audio: speakers are harmonic voices with their own pitch and formants, the speech profile and the
+# people's samples are recordings of them, the conversation alternates them in segments from half a second to a few
+# minutes. Both paths must assign every segment to the same speaker.
+#
+# `--encoder ecapa` uses the speechbrain model (torch and speechbrain installed, downloads the model once),
+# `--encoder spectral` a deterministic numpy embedding (log band energies) that runs anywhere.
+#
+# Usage (from backend/):
+#   python -m testing.speaker_classification_benchmark --encoder spectral --segments 60 --people 2
+#   python -m testing.speaker_classification_benchmark --encoder ecapa --segments 20
+#
+# Prints one JSON line per path with the time, encoder calls and seconds of audio embedded, then the parity check.
+import argparse
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+from pydub import AudioSegment
+
+from utils.stt import speaker_embeddings
+from utils.stt.speaker_embeddings import audio_samples, classify_segments, verification_threshold
+
+SAMPLE_RATE = 16000
+
+
+def _voice(rng: random.Random, pitch: float, formants, seconds: float) -> np.ndarray:
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    # syllables: pitch drifting and amplitude going up and down a few times a second
+    f0 = pitch * (1 + 0.02 * np.sin(2 * math.pi * rng.uniform(0.5, 2) * t))
+    phase = 2 * math.pi * np.cumsum(f0) / SAMPLE_RATE
+    signal = np.zeros_like(t)
+    for harmonic in range(1, 30):
+        frequency = pitch * harmonic
+        gain = sum(math.exp(-((frequency - formant) / 150) ** 2) for formant in formants) + 0.02
+        signal += gain * np.sin(harmonic * phase)
+    envelope = 0.6 + 0.4 * np.sin(2 * math.pi * rng.uniform(3, 5) * t)
+    noise = np.random.default_rng(rng.randint(0, 2 ** 31)).normal(0, 0.02, len(t))
+    return signal / np.max(np.abs(signal)) * envelope * 0.5 + noise
+
+
+def _voices(rng: random.Random, count: int):
+    """(pitch, formants) of `count` speakers, pitches apart and none a harmonic of another, formants shifted."""
+    return [(95 * 1.33 ** i + rng.uniform(0, 3), [formant * (1 + 0.15 * i) + rng.uniform(-50, 50)
+                                                  for formant in (500, 1500, 2500)]) for i in range(count)]
+
+
+def _write_wav(path: str, samples: np.ndarray):
+    data = (np.clip(samples, -1, 1) * 32767).astype(np.int16)
+    AudioSegment(data.tobytes(), frame_rate=SAMPLE_RATE, sample_width=2, channels=1).export(path, format='wav')
+
+
+def _spectral_encoder(calls: dict) -> speaker_embeddings.Encoder:
+    edges = np.linspace(80, 4000, 257)
+
+    def encode(batch: np.ndarray) -> np.ndarray:
+        calls['calls'] += 1
+        calls['seconds'] += batch.shape[0] * batch.shape[1] / SAMPLE_RATE
+        embeddings = []
+        for samples in batch:
+            frames = samples[:len(samples) // 1024 * 1024].reshape(-1, 1024) if len(samples) >= 1024 else samples[None]
+            power = (np.abs(np.fft.rfft(frames * np.hanning(frames.shape[1]), axis=1)) ** 2).mean(axis=0)
+            frequencies = np.fft.rfftfreq(frames.shape[1], 1 / SAMPLE_RATE)
+            bands = np.array([power[(frequencies >= low) & (frequencies < high)].sum() + 1e-9
+                              for low, high in zip(edges[:-1], edges[1:])])
+            # where the energy is (pitch harmonics, formants), centered so unrelated voices score around 0
+            bands = np.sqrt(bands / bands.sum())
+            embeddings.append(bands - bands.mean())
+        return np.array(embeddings, dtype=np.float32)
+
+    return encode
+
+
+def _counted(encode: speaker_embeddings.Encoder, calls: dict) -> speaker_embeddings.Encoder:
+    def counted(batch: np.ndarray) -> np.ndarray:
+        calls['calls'] += 1
+        calls['seconds'] += batch.shape[0] * batch.shape[1] / SAMPLE_RATE
+        return encode(batch)
+
+    return counted
+
+
+def legacy_classify_segments(encode, audio_file_path: str, profile_path: str, people, segments):
+    """
+    The speech profile service's `classify_segments`, `model.verify_files` done with `encode`; segments that no
+    chunk matched stay unassigned, as they do now.
+    """
+
+    def verify_files(path_x: str, path_y: str) -> float:
+        try:
+            x = encode(audio_samples(AudioSegment.from_wav(path_x))[None, :])[0]
+            y = encode(audio_samples(AudioSegment.from_wav(path_y))[None, :])[0]
+            score = float(x @ y / (max(np.linalg.norm(x), 1e-6) * max(np.linalg.norm(y), 1e-6)))
+            return score if score > verification_threshold else 0
+        except Exception as e:
+            print(e)
+            return 0
+
+    matches = [{'is_user': False, 'person_id': None}] * len(segments)
+    file_name = os.path.basename(audio_file_path)
+    directory = os.path.dirname(audio_file_path)
+    for i, segment in enumerate(segments):
+        duration = segment['end'] - segment['start']
+        by_chunk_matches = defaultdict(float)
+        for j in range(0, int(duration), 30):
+            start = segment['start'] + j
+            end = min(segment['end'], start + 30)
+            temporal_file = f"{directory}/{file_name}_{start}_{end}.wav"
+            AudioSegment.from_wav(audio_file_path)[start * 1000:end * 1000].export(temporal_file, format="wav")
+            by_chunk_matches['user'] += verify_files(temporal_file, profile_path)
+            for person in people:
+                by_chunk_matches[person['id']] += verify_files(temporal_file, person['path'])
+            os.remove(temporal_file)
+        if not any(by_chunk_matches.values()):
+            # before, segments nobody matched went to the user (the first key), see `classify_segments`
+            continue
+        max_match = max(by_chunk_matches, key=by_chunk_matches.get)
+        matches[i] = {'is_user': max_match == 'user', 'person_id': None if max_match == 'user' else max_match}
+    return matches
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    voices = _voices(rng, args.people + 1)
+    keys = ['user'] + [f'person-{i}' for i in range(args.people)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        # speech profile and people's samples
+        sample_paths = {}
+        for key, (pitch, formants) in zip(keys, voices):
+            sample_paths[key] = f'{directory}/{key}.wav'
+            _write_wav(sample_paths[key], _voice(rng, pitch, formants, args.profile_seconds))
+
+        # the conversation
+        segments, parts, position, expected = [], [], 0.0, []
+        for i in range(args.segments):
+            speaker = rng.randrange(len(keys))
+            seconds = rng.choice([rng.uniform(0.5, 3), rng.uniform(3, 30), rng.uniform(30, args.max_segment_seconds)])
+            pitch, formants = voices[speaker]
+            parts.append(_voice(rng, pitch, formants, seconds))
+            parts.append(np.zeros(int(0.3 * SAMPLE_RATE)))
+            segments.append({'start': round(position, 3), 'end': round(position + seconds, 3), 'text': f'segment {i}'})
+            expected.append(keys[speaker])
+            position += seconds + 0.3
+        audio_path = f'{directory}/conversation.wav'
+        _write_wav(audio_path, np.concatenate(parts))
+
+        calls = {'calls': 0, 'seconds': 0.0}
+        if args.encoder == 'ecapa':
+            encode = _counted(speaker_embeddings.get_encoder(), calls)
+        else:
+            encode = _spectral_encoder(calls)
+
+        people = [{'id': key, 'path': sample_paths[key]} for key in keys[1:]]
+        started = time.perf_counter()
+        legacy = legacy_classify_segments(encode, audio_path, sample_paths['user'], people, segments)
+        legacy_seconds = time.perf_counter() - started
+        print(json.dumps({'path': 'legacy', 'audio_seconds': round(position, 1), 'segments': args.segments,
+                          'candidates': len(keys), 'seconds': round(legacy_seconds, 2),
+                          'encoder_calls': calls['calls'], 'embedded_seconds': round(calls['seconds'])}))
+
+        for mode in ('cold', 'warm'):
+            calls.update(calls=0, seconds=0.0)
+            started = time.perf_counter()
+            if mode == 'cold':
+                # what a cache miss does: one embedding per candidate from its samples
+                candidates = {key: encode(audio_samples(AudioSegment.from_wav(sample_paths[key]))[None, :])[0]
+                              for key in keys}
+            batched = classify_segments(audio_path, candidates, segments, encode)
+            seconds = time.perf_counter() - started
+            print(json.dumps({'path': f'batched_{mode}', 'seconds': round(seconds, 2),
+                              'speedup': round(legacy_seconds / seconds, 1), 'encoder_calls': calls['calls'],
+                              'embedded_seconds': round(calls['seconds'])}))
+
+        mismatches = [i for i, (a, b) in enumerate(zip(legacy, batched)) if a != b]
+        predicted = ['user' if match['is_user'] else match['person_id'] for match in batched]
+        assigned = [i for i, segment in enumerate(segments) if int(segment['end'] - segment['start']) >= 1]
+        print(json.dumps({
+            'parity': not mismatches, 'mismatched_segments': mismatches,
+            'accuracy': round(sum(predicted[i] == expected[i] for i in assigned) / max(len(assigned), 1), 3),
+        }))
+        if mismatches:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--encoder', choices=['spectral', 'ecapa'], default='spectral')
+    parser.add_argument('--segments', type=int, default=60)
+    parser.add_argument('--people', type=int, default=2, help='people with speech samples, besides the user')
+    parser.add_argument('--profile-seconds', type=float, default=40)
+    parser.add_argument('--max-segment-seconds', type=float, default=150)
+    parser.add_argument('--seed', type=int, default=7)
+    run(parser.parse_args())
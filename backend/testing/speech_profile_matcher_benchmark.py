@@ -0,0 +1,196 @@
+# The local speech profile matcher (`SPEECH_PROFILE_MATCHER=local`, `utils.stt.speech_profile`) end to end on
+# generated audio, without network: the speech profiles bucket is an in-memory fake patched into
+# `utils.other.storage`, the hosted service call raises if reached.
+#
+# Checks, in order:
+# - the predictions have the hosted service's shape ({'is_user', 'person_id'} per segment), defaults without a
+#   speech profile, and assign the segments to who spoke them
+# - samples are downloaded once per blob generation and the speaker embedding computed once; after a restart
+#   (in-process caches cleared) the stored embedding is used, nothing downloaded or embedded
+# - a new recording added to the speech profile is downloaded alone, the embedding computed again
+# - conversations matched concurrently go through the bounded pool: time for all vs one by one
+#
+# `--encoder ecapa` uses the speechbrain model (torch and speechbrain installed), `--encoder spectral` the numpy
+# embedding of `testing.speaker_classification_benchmark`.
+#
+# Usage (from backend/):
+#   python -m testing.speech_profile_matcher_benchmark --conversations 8 --workers 2
+#
+# Prints one JSON line per check, exits with an error if one fails.
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+from testing.listen_load.server import configure_environment
+from testing.speaker_classification_benchmark import SAMPLE_RATE, _voice, _voices, _write_wav, \
+    _spectral_encoder
+
+
+class _FakeBucket:
+    """The speech profiles bucket functions `utils.stt.speaker_embeddings` uses, counting downloads."""
+
+    def __init__(self):
+        self.blobs = {}
+        self.generation = 0
+        self.calls = Counter()
+
+    def put(self, name: str, path: str):
+        self.generation += 1
+        with open(path, 'rb') as f:
+            self.blobs[name] = (self.generation, f.read())
+
+    def install(self, storage):
+        bucket = self
+
+        def get_speech_profile_generations(uid):
+            main = bucket.blobs.get(f'{uid}/speech_profile.wav')
+            if not main:
+                return []
+            prefix = f'{uid}/additional_profile_recordings/'
+            additional = sorted(name for name in bucket.blobs if name.startswith(prefix))
+            return [(f'{uid}/speech_profile.wav', main[0])] + [(name, bucket.blobs[name][0]) for name in additional]
+
+        def download_speech_profile_sample(blob_name, generation, file_path):
+            bucket.calls['downloads'] += 1
+            stored_generation, data = bucket.blobs[blob_name]
+            assert stored_generation == generation, 'stale generation requested'
+            with open(file_path, 'wb') as f:
+                f.write(data)
+
+        def get_speaker_embedding(uid, key):
+            bucket.calls['embedding_reads'] += 1
+            data = bucket.blobs.get(f'{uid}/speaker_embeddings/{key}.json')
+            return json.loads(data[1]) if data else None
+
+        def upload_speaker_embedding(uid, key, data):
+            bucket.calls['embedding_writes'] += 1
+            bucket.blobs[f'{uid}/speaker_embeddings/{key}.json'] = (0, json.dumps(data).encode())
+
+        storage.get_speech_profile_generations = get_speech_profile_generations
+        storage.download_speech_profile_sample = download_speech_profile_sample
+        storage.get_speaker_embedding = get_speaker_embedding
+        storage.upload_speaker_embedding = upload_speaker_embedding
+        storage.get_user_people_ids = lambda uid: []
+
+
+def _check(name: str, ok: bool, **data):
+    print(json.dumps({'check': name, 'ok': ok, **data}))
+    if not ok:
+        raise SystemExit(1)
+
+
+def _conversation(rng: random.Random, directory: str, voices, i: int):
+    segments, parts, expected, position = [], [], [], 0.0
+    for j in range(rng.randint(8, 16)):
+        speaker = rng.randrange(len(voices))
+        seconds = rng.uniform(1.5, 40)
+        parts += [_voice(rng, *voices[speaker], seconds), np.zeros(int(0.3 * SAMPLE_RATE))]
+        segments.append({'start': round(position, 3), 'end': round(position + seconds, 3), 'text': f'segment {j}'})
+        expected.append(speaker == 0)
+        position += seconds + 0.3
+    path = f'{directory}/conversation-{i}.wav'
+    _write_wav(path, np.concatenate(parts))
+    return path, segments, expected
+
+
+def run(args):
+    configure_environment('ws://127.0.0.1:1', 'deepgram')
+    from concurrent.futures import ThreadPoolExecutor
+
+    import utils.other.storage as storage
+    import utils.stt.speaker_embeddings as speaker_embeddings
+    import utils.stt.speech_profile as speech_profile
+
+    def no_network(*a, **kw):
+        raise AssertionError('the hosted speech profile service was called')
+
+    speech_profile.requests.post = no_network
+    speech_profile.speech_profile_matcher = 'local'
+    speech_profile.speech_profile_matcher_executor = ThreadPoolExecutor(max_workers=args.workers)
+
+    calls = {'calls': 0, 'seconds': 0.0}
+    if args.encoder == 'ecapa':
+        encoder = speaker_embeddings.get_encoder()
+
+        def encode(batch):
+            calls['calls'] += 1
+            calls['seconds'] += batch.shape[0] * batch.shape[1] / SAMPLE_RATE
+            return encoder(batch)
+    else:
+        encode = _spectral_encoder(calls)
+    speaker_embeddings._encoder = encode
+
+    rng = random.Random(args.seed)
+    uid = 'matcher-benchmark'
+    voices = _voices(rng, 3)
+    bucket = _FakeBucket()
+    bucket.install(storage)
+
+    with tempfile.TemporaryDirectory() as directory:
+        speaker_embeddings.samples_cache_dir = f'{directory}/_speech_profiles'
+        for name, seconds in ((f'{uid}/speech_profile.wav', 30), (f'{uid}/additional_profile_recordings/a.wav', 10)):
+            path = f'{directory}/sample.wav'
+            _write_wav(path, _voice(rng, *voices[0], seconds))
+            bucket.put(name, path)
+        conversations = [_conversation(rng, directory, voices, i) for i in range(args.conversations)]
+
+        path, segments, expected = conversations[0]
+        without_profile = speech_profile.get_speech_profile_matching_predictions('no-profile', path, segments)
+        _check('no_profile_defaults', without_profile == [{'is_user': False, 'person_id': None}] * len(segments))
+
+        started = time.perf_counter()
+        predictions = speech_profile.get_speech_profile_matching_predictions(uid, path, segments)
+        first_seconds = time.perf_counter() - started
+        shaped = len(predictions) == len(segments) and all(set(p) == {'is_user', 'person_id'} for p in predictions)
+        accuracy = sum(p['is_user'] == e for p, e in zip(predictions, expected)) / len(segments)
+        _check('contract', shaped and accuracy >= 0.9, accuracy=round(accuracy, 3),
+               seconds=round(first_seconds, 2), downloads=bucket.calls['downloads'])
+        _check('downloaded_once', bucket.calls['downloads'] == 2 and bucket.calls['embedding_writes'] == 1,
+               calls=dict(bucket.calls))
+
+        # a new process: nothing in memory, samples still on disk
+        speaker_embeddings._embeddings.clear()
+        encoded_before, downloads_before = calls['calls'], bucket.calls['downloads']
+        speaker_embeddings.get_user_speaker_embedding(uid)
+        _check('stored_embedding_reused', calls['calls'] == encoded_before
+               and bucket.calls['downloads'] == downloads_before, calls=dict(bucket.calls))
+
+        _write_wav(f'{directory}/sample.wav', _voice(rng, *voices[0], 10))
+        bucket.put(f'{uid}/additional_profile_recordings/b.wav', f'{directory}/sample.wav')
+        writes_before = bucket.calls['embedding_writes']
+        speech_profile.get_speech_profile_matching_predictions(uid, path, segments)
+        _check('new_sample_invalidates', bucket.calls['downloads'] == downloads_before + 1
+               and bucket.calls['embedding_writes'] == writes_before + 1, calls=dict(bucket.calls),
+               cached_files=len(os.listdir(speaker_embeddings.samples_cache_dir)))
+
+        started = time.perf_counter()
+        for path, segments, _ in conversations:
+            speech_profile.get_speech_profile_matching_predictions(uid, path, segments)
+        serial_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(conversations)) as sessions:
+            results = list(sessions.map(
+                lambda c: speech_profile.get_speech_profile_matching_predictions(uid, c[0], c[1]), conversations))
+        concurrent_seconds = time.perf_counter() - started
+        correct = sum(p['is_user'] == e for result, (_, _, expected) in zip(results, conversations)
+                      for p, e in zip(result, expected))
+        total = sum(len(segments) for _, segments, _ in conversations)
+        _check('concurrent', correct / total >= 0.9, conversations=len(conversations), workers=args.workers,
+               serial_seconds=round(serial_seconds, 2), concurrent_seconds=round(concurrent_seconds, 2),
+               accuracy=round(correct / total, 3), downloads=bucket.calls['downloads'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--encoder', choices=['spectral', 'ecapa'], default='spectral')
+    parser.add_argument('--conversations', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=2, help='matcher pool size')
+    parser.add_argument('--seed', type=int, default=7)
+    run(parser.parse_args())
@@ -0,0 +1,277 @@
+# Merging an offline sync's transcripts into the user's conversations, before (`process_segment`: for each segment,
+# a query for the closest conversation, then a read and a rewrite of it, or a new conversation) and after
+# (`utils.conversations.sync_local_files.submit_transcript_merges`: one query, the transcripts grouped by the
+# conversation they go to, one conditional write per conversation).
+#
+# Runs against an in-memory conversations store patched into the module, counting queries, documents read and
+# written, and conversations created. The user had a few conversations recorded live during the offline window; the
+# upload's transcripts are minutes apart, some next to those conversations, some chaining into new ones.
+#
+# Checks, in order:
+# - both paths give the same conversations with the same transcripts, byte for byte
+# - the batched path does one query and one write per conversation; documents read and written before and after
+# - a conversation written concurrently (the live transcript adding a segment) between the read and the write: the
+#   write is rejected, the conversation read and merged again, nothing lost
+#
+# Usage (from backend/):
+#   python -m testing.sync_conversation_merge_benchmark --segments 50 --live-conversations 5
+#
+# Prints one JSON line per path, then the checks; exits with an error if one fails.
+import argparse
+import copy
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from testing.listen_load.server import configure_environment
+
+
+def _check(name: str, ok: bool, **data):
+    print(json.dumps({'check': name, 'ok': ok, **data}))
+    if not ok:
+        raise SystemExit(1)
+
+
+class FakeConversations:
+    """
+    The conversations functions `utils.conversations.sync_local_files` uses, in memory. Documents read and written
+    are counted as Firestore would: a query reads every document it returns, `update_conversation_segments` reads
+    the document before writing it.
+    """
+
+    def __init__(self):
+        self.conversations = {}
+        self.versions = Counter()
+        self.calls = Counter()
+        self.before_conditional_write = None
+        self._lock = threading.Lock()
+
+    def add(self, conversation_id: str, started_at: datetime, finished_at: datetime, segments):
+        self.conversations[conversation_id] = {'id': conversation_id, 'started_at': started_at,
+                                               'finished_at': finished_at, 'transcript_segments': segments}
+        self.versions[conversation_id] += 1
+
+    def _read(self, conversation_id: str) -> dict:
+        self.calls['documents_read'] += 1
+        conversation = copy.deepcopy(self.conversations[conversation_id])
+        conversation['update_time'] = self.versions[conversation_id]
+        return conversation
+
+    def _query(self, start_timestamp, end_timestamp):
+        self.calls['queries'] += 1
+        found = [conversation for conversation in self.conversations.values()
+                 if conversation['finished_at'].timestamp() >= start_timestamp - 120
+                 and conversation['started_at'].timestamp() <= end_timestamp + 120]
+        # newest first: created later, inserted later
+        return [self._read(conversation['id']) for conversation in reversed(found)]
+
+    def install(self, module):
+        from database.conversations import closest_conversation_to_timestamps
+
+        store = self
+
+        def get_closest_conversation_to_timestamps(uid, start_timestamp, end_timestamp):
+            with store._lock:
+                conversations = store._query(start_timestamp, end_timestamp)
+            return closest_conversation_to_timestamps(conversations, start_timestamp, end_timestamp)
+
+        def update_conversation_segments(uid, conversation_id, segments):
+            with store._lock:
+                store._read(conversation_id)
+                store.calls['documents_written'] += 1
+                store.conversations[conversation_id]['transcript_segments'] = copy.deepcopy(segments)
+                store.versions[conversation_id] += 1
+
+        def get_conversations_near_timestamps(uid, start_timestamp, end_timestamp):
+            with store._lock:
+                return store._query(start_timestamp, end_timestamp)
+
+        def get_conversation_for_update(uid, conversation_id):
+            with store._lock:
+                return store._read(conversation_id) if conversation_id in store.conversations else None
+
+        def update_conversation_segments_if_unchanged(uid, conversation, segments):
+            if store.before_conditional_write:
+                store.before_conditional_write(conversation['id'])
+            with store._lock:
+                if store.versions[conversation['id']] != conversation['update_time']:
+                    store.calls['writes_rejected'] += 1
+                    return False
+                store.calls['documents_written'] += 1
+                store.conversations[conversation['id']]['transcript_segments'] = copy.deepcopy(segments)
+                store.versions[conversation['id']] += 1
+                return True
+
+        def process_conversation(uid, language, create_memory):
+            with store._lock:
+                store.calls['documents_written'] += 1
+                store.calls['conversations_created'] += 1
+                conversation_id = str(uuid.uuid4())
+                store.add(conversation_id, create_memory.started_at, create_memory.finished_at,
+                          [segment.dict() for segment in create_memory.transcript_segments])
+            return type('Conversation', (), {'id': conversation_id})
+
+        module.get_closest_conversation_to_timestamps = get_closest_conversation_to_timestamps
+        module.update_conversation_segments = update_conversation_segments
+        module.get_conversations_near_timestamps = get_conversations_near_timestamps
+        module.get_conversation_for_update = get_conversation_for_update
+        module.update_conversation_segments_if_unchanged = update_conversation_segments_if_unchanged
+        module.process_conversation = process_conversation
+
+    def snapshot(self):
+        """Conversations by start, ids left out (new ones differ between runs)."""
+        return sorted(json.dumps({key: value for key, value in conversation.items() if key != 'id'}, default=str,
+                                 sort_keys=True) for conversation in self.conversations.values())
+
+    def texts(self) -> Counter:
+        return Counter(segment['text'] for conversation in self.conversations.values()
+                       for segment in conversation['transcript_segments'])
+
+
+def legacy_merge_segment_transcript(module, uid: str, timestamp: int, transcript_segments, language):
+    """`process_segment` after the transcription, as it was."""
+    closest_memory = module.get_closest_conversation_to_timestamps(
+        uid, timestamp, timestamp + transcript_segments[-1].end)
+
+    if not closest_memory:
+        create_memory = module.CreateConversation(
+            started_at=datetime.fromtimestamp(timestamp),
+            finished_at=datetime.fromtimestamp(timestamp + transcript_segments[-1].end),
+            transcript_segments=transcript_segments
+        )
+        module.process_conversation(uid, language, create_memory)
+        return
+
+    transcript_segments = [s.dict() for s in transcript_segments]
+    for segment in transcript_segments:
+        segment['timestamp'] = timestamp + segment['start']
+    for segment in closest_memory['transcript_segments']:
+        segment['timestamp'] = closest_memory['started_at'].timestamp() + segment['start']
+
+    segments = closest_memory['transcript_segments'] + transcript_segments
+    segments.sort(key=lambda x: x['timestamp'])
+    for segment in segments:
+        duration = segment['end'] - segment['start']
+        segment['start'] = segment['timestamp'] - closest_memory['started_at'].timestamp()
+        segment['end'] = segment['start'] + duration
+    for segment in segments:
+        segment.pop('timestamp')
+    module.update_conversation_segments(uid, closest_memory['id'], segments)
+
+
+def _scenario(args):
+    """(live conversations, transcripts) of the offline window."""
+    from models.transcript_segment import TranscriptSegment
+
+    rng = random.Random(args.seed)
+    window_starts_at = int(time.time()) - 12 * 3600
+    live = []
+    for i in range(args.live_conversations):
+        started_at = window_starts_at + rng.uniform(0, 10 * 3600)
+        seconds = rng.uniform(300, 1800)
+        segments, position = [], 0.0
+        while position < seconds:
+            length = rng.uniform(2, 20)
+            segments.append(TranscriptSegment(text=f'live {i} {len(segments)}', speaker='SPEAKER_01', is_user=True,
+                                              start=round(position, 2), end=round(position + length, 2)).dict())
+            position += length + rng.uniform(0.5, 5)
+        live.append((f'live-{i}', started_at, started_at + seconds, segments))
+
+    transcripts, timestamp = [], window_starts_at
+    for i in range(args.segments):
+        # minutes apart: some chain into the same new conversation, some go next to a live one
+        timestamp += int(rng.choice([rng.uniform(30, 150), rng.uniform(150, 1200)]))
+        segments, position = [], 0.0
+        for k in range(rng.randint(1, 5)):
+            length = rng.uniform(2, 20)
+            segments.append(TranscriptSegment(text=f'synced {i} {k}', speaker=f'SPEAKER_0{k % 2}', is_user=False,
+                                              start=round(position, 2), end=round(position + length, 2)))
+            position += length + rng.uniform(0.5, 5)
+        transcripts.append((timestamp, segments, 'en'))
+    return live, transcripts
+
+
+def _store(live) -> FakeConversations:
+    store = FakeConversations()
+    for conversation_id, started_at, finished_at, segments in live:
+        store.add(conversation_id, datetime.fromtimestamp(started_at), datetime.fromtimestamp(finished_at),
+                  copy.deepcopy(segments))
+    return store
+
+
+def _batched(sync, uid, transcripts):
+    results = []
+    for indexes, job in sync.submit_transcript_merges(uid, transcripts):
+        results.append((job.result(), indexes))
+    return results
+
+
+def run(args):
+    configure_environment('ws://127.0.0.1:1', 'deepgram')
+    import utils.conversations.sync_local_files as sync
+
+    uid = 'sync-merge-benchmark'
+    live, transcripts = _scenario(args)
+
+    legacy = _store(live)
+    legacy.install(sync)
+    started = time.perf_counter()
+    for timestamp, segments, language in transcripts:
+        legacy_merge_segment_transcript(sync, uid, timestamp, segments, language)
+    legacy_seconds = time.perf_counter() - started
+    print(json.dumps({'path': 'per_segment', 'segments': len(transcripts), 'seconds': round(legacy_seconds, 3),
+                      'conversations': len(legacy.conversations), **legacy.calls}))
+
+    batched = _store(live)
+    batched.install(sync)
+    started = time.perf_counter()
+    results = _batched(sync, uid, transcripts)
+    batched_seconds = time.perf_counter() - started
+    print(json.dumps({'path': 'batched', 'segments': len(transcripts), 'seconds': round(batched_seconds, 3),
+                      'conversations': len(batched.conversations), **batched.calls}))
+
+    identical = legacy.snapshot() == batched.snapshot()
+    _check('identical_transcripts', identical, conversations=len(batched.conversations),
+           new=batched.calls['conversations_created'], updated=sum(kind == 'updated' for (kind, _), _ in results))
+    _check('one_write_per_conversation', batched.calls['queries'] == 1
+           and batched.calls['documents_written'] == len(results) and not batched.calls['writes_rejected'],
+           documents_read=[legacy.calls['documents_read'], batched.calls['documents_read']],
+           documents_written=[legacy.calls['documents_written'], batched.calls['documents_written']])
+
+    # the live transcript of every updated conversation adds a segment between the read and the write, once
+    concurrent = _store(live)
+    concurrent.install(sync)
+    written = set()
+
+    def live_update(conversation_id):
+        if conversation_id in written:
+            return
+        written.add(conversation_id)
+        with concurrent._lock:
+            conversation = concurrent.conversations[conversation_id]
+            conversation['transcript_segments'] = conversation['transcript_segments'] + [
+                {'id': f'{conversation_id}-live', 'text': f'{conversation_id} live update', 'speaker': 'SPEAKER_01',
+                 'speaker_id': 1, 'is_user': True, 'person_id': None, 'start': 0.0, 'end': 1.0, 'translations': []}]
+            concurrent.versions[conversation_id] += 1
+
+    concurrent.before_conditional_write = live_update
+    _batched(sync, uid, transcripts)
+    texts = concurrent.texts()
+    synced = Counter(segment.text for _, segments, _ in transcripts for segment in segments)
+    kept = all(texts[text] == count for text, count in synced.items()) \
+        and all(texts[f'{conversation_id} live update'] == 1 for conversation_id in written)
+    _check('concurrent_write', kept and concurrent.calls['writes_rejected'] == len(written),
+           writes_rejected=concurrent.calls['writes_rejected'], documents_read=concurrent.calls['documents_read'],
+           documents_written=concurrent.calls['documents_written'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--segments', type=int, default=50, help='transcribed voice segments in the upload')
+    parser.add_argument('--live-conversations', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=7)
+    run(parser.parse_args())
@@ -0,0 +1,270 @@
+# /v1/sync-local-files (`routers.sync.sync_local_files`, `utils.conversations.sync_local_files`) end to end on
+# synthetic opus files, without network: a device back from hours offline uploads its length-prefixed opus recordings,
+# each with a few talks separated by long silences.
+#
+# Fakes patched into the modules: the transcriber (fal's whisper) returns words for the seconds of audio it is given,
+# after `--transcribe-ms`, and counts how many run at once; the temporal sync bucket, the conversations store
+# (`testing.sync_conversation_merge_benchmark`) and the Redis job store and VAD cache are in memory.
+# `--vad energy` finds voice by frame energy, `--vad silero` runs `utils.stt.vad` (torch installed).
+#
+# Checks, in order:
+# - the last file failing to transcribe leaves the upload `failed`, the other files `completed`
+# - transcriptions never exceed the pool size; peak traced memory vs the size of the decoded audio
+# - no local file or uploaded blob is left once the request returns
+# - uploading the same files again transcribes and merges only what was missing: every talk once, nothing twice
+# - the same upload sent again while it runs returns its progress (`running`), without processing it twice
+# - the progress endpoint returns the job
+#
+# Usage (from backend/):
+#   python -m testing.sync_local_files_benchmark --files 4 --minutes 30 --workers 5
+#
+# Needs opuslib (libopus). Prints one JSON line per check, exits with an error if one fails.
+import argparse
+import json
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+import tracemalloc
+import wave
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from testing.listen_load.server import configure_environment
+from testing.speaker_classification_benchmark import SAMPLE_RATE, _voice, _voices
+from testing.sync_conversation_merge_benchmark import FakeConversations
+
+FRAME_SIZE = 160
+
+
+def _check(name: str, ok: bool, **data):
+    print(json.dumps({'check': name, 'ok': ok, **data}))
+    if not ok:
+        raise SystemExit(1)
+
+
+def _opus_file(rng: random.Random, path: str, voices, minutes: float) -> int:
+    """Writes a device recording: talks of 1 to 3 minutes, 3 to 6 minutes apart. Returns how many talks."""
+    from opuslib import Encoder
+
+    encoder = Encoder(SAMPLE_RATE, 1, 'voip')
+    talks, position = 0, rng.uniform(10, 60)
+    plan = []
+    while position + 60 < minutes * 60:
+        seconds = rng.uniform(60, 180)
+        plan.append((position, min(position + seconds, minutes * 60)))
+        position += seconds + rng.uniform(180, 360)
+    with open(path, 'wb') as f:
+        cursor = 0.0
+        for start, end in plan + [(minutes * 60, minutes * 60)]:
+            parts = [np.zeros(int((start - cursor) * SAMPLE_RATE))]
+            if end > start:
+                talks += 1
+                parts.append(_voice(rng, *rng.choice(voices), end - start))
+            pcm = (np.clip(np.concatenate(parts), -1, 1) * 32767).astype(np.int16)
+            for i in range(0, len(pcm) - FRAME_SIZE + 1, FRAME_SIZE):
+                packet = encoder.encode(pcm[i:i + FRAME_SIZE].tobytes(), FRAME_SIZE)
+                f.write(struct.pack('<I', len(packet)) + packet)
+            cursor = end
+    return talks
+
+
+def _energy_vad(file_path, return_segments=False, cache=False):
+    """Voice as frames of 20ms above an energy threshold, 300ms apart at least, read in one minute windows."""
+    segments, offset = [], 0.0
+    with wave.open(file_path, 'rb') as wav:
+        frame = wav.getframerate() // 50
+        while data := wav.readframes(wav.getframerate() * 60):
+            samples = np.frombuffer(data, dtype=np.int16)[:len(data) // 2 // frame * frame] / 32768.0
+            loud = np.sqrt((samples.reshape(-1, frame) ** 2).mean(axis=1)) > 0.02
+            for i in np.flatnonzero(loud):
+                start = offset + i / 50
+                if segments and start - segments[-1]['end'] < 0.3:
+                    segments[-1]['end'] = start + 0.02
+                else:
+                    segments.append({'start': start, 'end': start + 0.02})
+            offset += len(data) / 2 / wav.getframerate()
+    for segment in segments:
+        segment['duration'] = segment['end'] - segment['start']
+    return segments if return_segments else not segments
+
+
+class _Fakes:
+    def __init__(self, transcribe_ms: float):
+        self.transcribe_ms = transcribe_ms
+        self.calls = Counter()
+        self.blobs = set()
+        self.store = FakeConversations()
+        self.redis = {}
+        self.claims = {}
+        self.transcribing = 0
+        self.max_transcribing = 0
+        self.transcribed = []
+        self._lock = threading.Lock()
+
+    def install(self, sync, vad_fn):
+        fakes = self
+
+        def get_syncing_file_temporal_signed_url(path):
+            with fakes._lock:
+                fakes.calls['uploads'] += 1
+                fakes.blobs.add(path)
+            return f'fake://{path}'
+
+        def delete_syncing_temporal_file(path):
+            with fakes._lock:
+                fakes.blobs.remove(path)
+
+        def fal_whisperx(url, speakers_count=None, attempts=0, return_language=False):
+            path = url[len('fake://'):]
+            with fakes._lock:
+                fakes.transcribing += 1
+                fakes.max_transcribing = max(fakes.max_transcribing, fakes.transcribing)
+            try:
+                time.sleep(fakes.transcribe_ms / 1000)
+                with wave.open(path, 'rb') as wav:
+                    seconds = int(wav.getnframes() / wav.getframerate())
+                segment = os.path.basename(path)[:-len('.wav')]
+                with fakes._lock:
+                    fakes.transcribed.append(segment)
+                words = [{'timestamp': [i, i + 0.8], 'text': f'{segment}/{i}', 'speaker': 'SPEAKER_00'}
+                         for i in range(seconds)]
+                return words, 'en'
+            finally:
+                with fakes._lock:
+                    fakes.transcribing -= 1
+
+        def claim_sync_job(uid, job_id, token, ttl=600):
+            with fakes._lock:
+                return fakes.claims.setdefault((uid, job_id), token) == token
+
+        def release_sync_job(uid, job_id, token):
+            with fakes._lock:
+                if fakes.claims.get((uid, job_id)) == token:
+                    del fakes.claims[(uid, job_id)]
+
+        sync.get_syncing_file_temporal_signed_url = get_syncing_file_temporal_signed_url
+        sync.delete_syncing_temporal_file = delete_syncing_temporal_file
+        sync.fal_whisperx = fal_whisperx
+        self.store.install(sync)
+        sync.vad_is_empty = vad_fn
+        sync.redis_db.set_sync_job = lambda uid, job_id, job, ttl=None: fakes.redis.__setitem__(
+            (uid, job_id), json.dumps(job))
+        sync.redis_db.get_sync_job = lambda uid, job_id: json.loads(fakes.redis[(uid, job_id)]) \
+            if (uid, job_id) in fakes.redis else None
+        sync.redis_db.claim_sync_job = claim_sync_job
+        sync.redis_db.extend_sync_job_claim = lambda uid, job_id, token, ttl=None: None
+        sync.redis_db.release_sync_job = release_sync_job
+        sync.redis_db.get_generic_cache = lambda path: None
+        sync.redis_db.set_generic_cache = lambda path, data, ttl=None: None
+
+
+
+def _upload(paths):
+    from fastapi import UploadFile
+
+    return [UploadFile(file=open(path, 'rb'), filename=os.path.basename(path)) for path in paths]
+
+
+def run(args):
+    configure_environment('ws://127.0.0.1:1', 'deepgram')
+    import routers.sync as router
+    import utils.conversations.sync_local_files as sync
+
+    vad_fn = _energy_vad
+    if args.vad == 'silero':
+        from utils.stt.vad import vad_is_empty as vad_fn
+    fakes = _Fakes(args.transcribe_ms)
+    fakes.install(sync, vad_fn)
+    router.get_sync_job = sync.redis_db.get_sync_job
+    sync.sync_transcription_executor = ThreadPoolExecutor(max_workers=args.workers)
+
+    rng = random.Random(args.seed)
+    voices = _voices(rng, 3)
+    uid = 'sync-benchmark'
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        os.makedirs('device')
+        paths, talks = [], 0
+        started_at = int(time.time() - args.files * args.minutes * 60 - 3600)
+        for i in range(args.files):
+            paths.append(f'device/audio_fs{FRAME_SIZE}_{started_at + int(i * args.minutes * 60)}.bin')
+            talks += _opus_file(rng, paths[-1], voices, args.minutes)
+        audio_mb = args.files * args.minutes * 60 * SAMPLE_RATE * 2 / 2 ** 20
+        upload_mb = sum(os.path.getsize(path) for path in paths) / 2 ** 20
+
+        last_file = os.path.basename(paths[-1])
+        last_file_starts_at = started_at + int((args.files - 1) * args.minutes * 60)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        failing = {}
+
+        def fail_last(url, *a, **kw):
+            # the last file can't be transcribed the first time; segment files are named by their timestamp
+            if int(os.path.basename(url).split('.')[0]) >= last_file_starts_at:
+                failing['calls'] = failing.get('calls', 0) + 1
+                raise RuntimeError('fal unavailable')
+            return transcriber(url, *a, **kw)
+
+        transcriber = sync.fal_whisperx
+        sync.fal_whisperx = fail_last
+        first = router.sync_local_files(files=_upload(paths), uid=uid)
+        sync.fal_whisperx = transcriber
+        first_seconds = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        statuses = {name: file['status'] for name, file in first['files'].items()}
+        others_ok = all(status == 'completed' for name, status in statuses.items() if name != last_file)
+        _check('failed_file', first['status'] == 'failed' and statuses[last_file] == 'failed' and others_ok,
+               statuses=statuses, failed_transcriptions=failing.get('calls', 0))
+        _check('bounded', fakes.max_transcribing <= args.workers, max_transcribing=fakes.max_transcribing,
+               workers=args.workers, files=args.files, audio_mb=round(audio_mb), upload_mb=round(upload_mb, 1),
+               peak_traced_mb=round(peak / 2 ** 20, 1), seconds=round(first_seconds, 2))
+        leftovers = [os.path.join(root, name) for root, _, names in os.walk('syncing') for name in names]
+        _check('cleanup', not leftovers and not fakes.blobs, local_files=len(leftovers), blobs=len(fakes.blobs))
+
+        transcribed_before = len(fakes.transcribed)
+        second = router.sync_local_files(files=_upload(paths), uid=uid)
+        texts = fakes.store.texts()
+        transcribed = Counter(fakes.transcribed)
+        _check('resumed', second['status'] == 'completed'
+               and all(file['status'] == 'completed' for file in second['files'].values())
+               and sum(file['merged'] for file in second['files'].values()) == talks
+               and max(transcribed.values()) == 1 and max(texts.values()) == 1,
+               talks=talks, transcribed_first=transcribed_before,
+               transcribed_second=len(fakes.transcribed) - transcribed_before,
+               conversations=len(fakes.store.conversations), calls={**fakes.calls, **fakes.store.calls})
+
+        # the same upload, twice at once
+        fakes.store = FakeConversations()
+        fakes.store.install(sync)
+        fakes.redis.clear()
+        fakes.transcribe_ms = max(args.transcribe_ms, 200)
+        with ThreadPoolExecutor(max_workers=2) as devices:
+            running = devices.submit(router.sync_local_files, files=_upload(paths), uid=uid)
+            time.sleep(0.5 + args.files * 0.05)
+            retry = router.sync_local_files(files=_upload(paths), uid=uid)
+            done = running.result()
+        _check('retry_while_running', retry['status'] == 'running' and done['status'] == 'completed'
+               and max(fakes.store.texts().values()) == 1,
+               retry_progress={name: file['status'] for name, file in retry['files'].items()})
+
+        progress = router.get_sync_local_files_job(done['job_id'], uid=uid)
+        _check('progress', progress == done, job_id=done['job_id'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--minutes', type=float, default=30, help='length of each recording')
+    parser.add_argument('--workers', type=int, default=5, help='transcription pool size')
+    parser.add_argument('--transcribe-ms', type=float, default=50, help='latency of the fake transcriber')
+    parser.add_argument('--vad', choices=['energy', 'silero'], default='energy')
+    parser.add_argument('--seed', type=int, default=7)
+    run(parser.parse_args())
@@ -0,0 +1,155 @@
+# Checks that the TranscriptSegment helpers match the previous (quadratic) implementation on random sessions,
+# then micro-benchmarks both.
+#
+# Usage (from backend/):
+#   python -m testing.transcript_segment_benchmark --batches 3000 --runs 200
+import argparse
+import json
+import random
+import time
+
+from models.transcript_segment import TranscriptSegment
+
+TOKENS = ['hello', 'world', ',', '.', '?', ' ', '  ', 'ok', 'so', 'yes', 'no', 'the', 'plan', '\n']
+
+
+# Previous implementation, kept as the reference
+def legacy_segments_as_string(segments, include_timestamps=False, user_name: str = None):
+    if not user_name:
+        user_name = 'User'
+    transcript = ''
+    include_timestamps = include_timestamps and legacy_can_display_seconds(segments)
+    for segment in segments:
+        segment_text = segment.text.strip()
+        timestamp_str = f'[{segment.get_timestamp_string()}] ' if include_timestamps else ''
+        transcript += f'{timestamp_str}{user_name if segment.is_user else f"Speaker {segment.speaker_id}"}: {segment_text}\n\n'
+    return transcript.strip()
+
+
+def legacy_can_display_seconds(segments):
+    for i in range(len(segments)):
+        for j in range(i + 1, len(segments)):
+            if segments[i].start > segments[j].end or segments[i].end > segments[j].start:
+                return False
+    return True
+
+
+def legacy_combine_segments(segments: [], new_segments: [], delta_seconds: int = 0):
+    if not new_segments or len(new_segments) == 0:
+        return segments
+
+    joined_similar_segments = []
+    for new_segment in new_segments:
+        if delta_seconds > 0:
+            new_segment.start += delta_seconds
+            new_segment.end += delta_seconds
+
+        if (joined_similar_segments and
+                (joined_similar_segments[-1].speaker == new_segment.speaker or
+                 (joined_similar_segments[-1].is_user and new_segment.is_user))):
+            joined_similar_segments[-1].text += f' {new_segment.text}'
+            joined_similar_segments[-1].end = new_segment.end
+        else:
+            joined_similar_segments.append(new_segment)
+
+    starts = len(segments)
+    ends = 0
+
+    if (segments and
+            (segments[-1].speaker == joined_similar_segments[0].speaker or
+             (segments[-1].is_user and joined_similar_segments[0].is_user)) and
+            (joined_similar_segments[0].start - segments[-1].end < 30)):
+        segments[-1].text += f' {joined_similar_segments[0].text}'
+        segments[-1].end = joined_similar_segments[0].end
+        joined_similar_segments.pop(0)
+        starts = len(segments) - 1
+
+    segments.extend(joined_similar_segments)
+    ends = len(segments)
+
+    for i, segment in enumerate(segments):
+        segments[i].text = (
+            segments[i].text.strip()
+            .replace('  ', '')
+            .replace(' ,', ',')
+            .replace(' .', '.')
+            .replace(' ?', '?')
+        )
+
+    return segments, (starts, ends)
+
+
+def _random_batches(rng: random.Random, batches: int, overlapping: bool):
+    t = 0.0
+    result = []
+    for _ in range(batches):
+        batch = []
+        for _ in range(rng.randint(1, 4)):
+            speaker = rng.randint(0, 2)
+            duration = rng.uniform(0.2, 3)
+            start = t - rng.uniform(0, 2) if overlapping and rng.random() < 0.05 else t
+            batch.append(dict(
+                id=f'{len(result)}-{len(batch)}',
+                text=''.join(rng.choice(TOKENS) + rng.choice(['', ' ']) for _ in range(rng.randint(1, 8))),
+                speaker=f'SPEAKER_{speaker:02d}', is_user=speaker == 0 and rng.random() < 0.8,
+                start=start, end=start + duration,
+            ))
+            t += duration + rng.uniform(0, 40 if rng.random() < 0.05 else 1)
+        result.append(batch)
+    return result
+
+
+def _session(combine, batches):
+    segments = []
+    ranges = []
+    start = time.perf_counter()
+    for batch in batches:
+        segments, updated = combine(segments, [TranscriptSegment(**s) for s in batch])
+        ranges.append(updated)
+    return segments, ranges, time.perf_counter() - start
+
+
+def check_parity(runs: int, batches: int, seed: int):
+    rng = random.Random(seed)
+    for run in range(runs):
+        session = _random_batches(rng, rng.randint(1, batches), overlapping=run % 2 == 1)
+        new, new_ranges, _ = _session(TranscriptSegment.combine_segments, session)
+        old, old_ranges, _ = _session(legacy_combine_segments, session)
+        assert [s.dict() for s in new] == [s.dict() for s in old], f'combine_segments mismatch, run {run}'
+        assert new_ranges == old_ranges, f'combine_segments ranges mismatch, run {run}'
+        assert TranscriptSegment.can_display_seconds(new) == legacy_can_display_seconds(old), f'run {run}'
+        for include_timestamps in [False, True]:
+            assert TranscriptSegment.segments_as_string(new, include_timestamps, 'Me') == \
+                   legacy_segments_as_string(old, include_timestamps, 'Me'), f'segments_as_string mismatch, run {run}'
+
+
+def benchmark(batches: int, seed: int):
+    session = _random_batches(random.Random(seed), batches, overlapping=False)
+    new, _, new_seconds = _session(TranscriptSegment.combine_segments, session)
+    old, _, old_seconds = _session(legacy_combine_segments, session)
+
+    def _timed(func, *args):
+        start = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - start
+
+    return {
+        'batches': batches,
+        'segments': len(new),
+        'combine_segments_s': {'new': round(new_seconds, 4), 'legacy': round(old_seconds, 4)},
+        'can_display_seconds_s': {'new': round(_timed(TranscriptSegment.can_display_seconds, new), 4),
+                                  'legacy': round(_timed(legacy_can_display_seconds, old), 4)},
+        'segments_as_string_s': {'new': round(_timed(TranscriptSegment.segments_as_string, new, True), 4),
+                                 'legacy': round(_timed(legacy_segments_as_string, old, True), 4)},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batches', type=int, default=3000)
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    check_parity(args.runs, 60, args.seed)
+    print(json.dumps(benchmark(args.batches, args.seed)))
@@ -0,0 +1,147 @@
+# Compares whole-blob segment rewrites with the append-only transcript segments log over a simulated session.
+#
+# Usage (from backend/, against the Firestore emulator):
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 GOOGLE_CLOUD_PROJECT=demo ENCRYPTION_SECRET=... \
+#     python -m testing.transcript_segments_log_benchmark --hours 2 --level standard
+#
+# Prints one JSON line per strategy with bytes written and per-batch latency percentiles; compactions run off the
+# append path (as the listen session does, in the background) and are timed apart. Then checks that a full write
+# of the conversation keeps the log seq and that entries appended after it are kept.
+import argparse
+import json
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone
+
+from database import conversations as conversations_db
+from models.transcript_segment import TranscriptSegment
+
+WORDS = 'the quick brown fox jumps over a lazy dog while we talk about plans for the next week'.split()
+
+
+def _simulated_batches(hours: float, batch_seconds: float = 1.5):
+    t = 0.0
+    speaker = 0
+    while t < hours * 3600:
+        if random.random() < 0.08:
+            speaker = (speaker + 1) % 3
+        words = random.randint(2, 12)
+        yield [TranscriptSegment(
+            text=' '.join(random.choice(WORDS) for _ in range(words)),
+            speaker=f'SPEAKER_{speaker:02d}', is_user=speaker == 0, start=t, end=t + batch_seconds,
+        )]
+        t += batch_seconds
+
+
+def _percentiles(values):
+    values = sorted(values)
+    return {
+        'p50_ms': round(statistics.median(values) * 1000, 3),
+        'p99_ms': round(values[int(len(values) * 0.99) - 1] * 1000, 3),
+        'total_s': round(sum(values), 3),
+    }
+
+
+def _payload_size(payload: dict) -> int:
+    return sum(len(v) for v in payload.values() if isinstance(v, (bytes, str)))
+
+
+def run(uid: str, hours: float, level: str, seed: int):
+    random.seed(seed)
+    batches = list(_simulated_batches(hours))
+    results = {}
+
+    for strategy in ['rewrite', 'append']:
+        conversation_id = str(uuid.uuid4())
+        now = datetime.now(timezone.utc)
+        conversations_db.upsert_conversation(uid, {
+            'id': conversation_id, 'created_at': now, 'started_at': now, 'finished_at': now,
+            'transcript_segments': [], 'status': 'in_progress', 'data_protection_level': level,
+        })
+
+        segments = []
+        bytes_written = 0
+        latencies = []
+        compactions = []
+        for batch in batches:
+            segments, (starts, ends) = TranscriptSegment.combine_segments(
+                segments, [s.copy() for s in batch])
+            start = time.perf_counter()
+            if strategy == 'rewrite':
+                data = [s.dict() for s in segments]
+                bytes_written += _payload_size(
+                    conversations_db._prepare_conversation_for_write({'transcript_segments': data}, uid, level))
+                conversations_db.update_conversation_segments(uid, conversation_id, data)
+            else:
+                data = [s.dict() for s in segments[starts:ends]]
+                bytes_written += _payload_size(
+                    conversations_db._prepare_conversation_for_write({'transcript_segments': data}, uid, level))
+                due = conversations_db.append_conversation_segments(uid, conversation_id, data)
+                latencies.append(time.perf_counter() - start)
+                if due:
+                    bytes_written += _payload_size(conversations_db._prepare_conversation_for_write(
+                        {'transcript_segments': [s.dict() for s in segments]}, uid, level))
+                    start = time.perf_counter()
+                    conversations_db.compact_conversation_segments(uid, conversation_id)
+                    compactions.append(time.perf_counter() - start)
+                continue
+            latencies.append(time.perf_counter() - start)
+
+        stored = conversations_db.get_conversation(uid, conversation_id)
+        assert stored['transcript_segments'] == [s.dict() for s in segments], f'{strategy} transcript mismatch'
+        conversations_db.delete_conversation(uid, conversation_id)
+
+        results[strategy] = {
+            'strategy': strategy, 'level': level, 'hours': hours, 'batches': len(batches),
+            'segments': len(segments), 'bytes_written': bytes_written, **_percentiles(latencies),
+            'compactions': {'count': len(compactions), **_percentiles(compactions)} if compactions else None,
+        }
+        print(json.dumps(results[strategy]))
+    check_full_write(uid, level)
+    return results
+
+
+def _log_state(uid: str, conversation_id: str) -> tuple:
+    doc = conversations_db.db.collection('users').document(uid).collection(
+        conversations_db.conversations_collection).document(conversation_id).get()
+    data = doc.to_dict()
+    return data.get('transcript_segments_log_seq', 0), data.get('transcript_segments_log_base', 0)
+
+
+def check_full_write(uid: str, level: str):
+    """A full write keeps the log seq and only supersedes the entries before it."""
+    conversation_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    conversation = {'id': conversation_id, 'created_at': now, 'started_at': now, 'finished_at': now,
+                    'transcript_segments': [], 'status': 'in_progress', 'data_protection_level': level}
+    conversations_db.upsert_conversation(uid, dict(conversation))
+    segments = [TranscriptSegment(id=f'segment-{i}', text=f'segment {i}', speaker='SPEAKER_00', is_user=True,
+                                  start=i, end=i + 1).dict() for i in range(4)]
+    for segment in segments[:3]:
+        conversations_db.append_conversation_segments(uid, conversation_id, [segment])
+    seq_before, _ = _log_state(uid, conversation_id)
+
+    conversations_db.upsert_conversation(uid, {**conversation, 'transcript_segments': segments[:3]})
+    seq_after, base_after = _log_state(uid, conversation_id)
+    conversations_db.append_conversation_segments(uid, conversation_id, [segments[3]])
+    stored = conversations_db.get_conversation(uid, conversation_id)
+    conversations_db.delete_conversation(uid, conversation_id)
+
+    ok = seq_after == base_after == seq_before == 3 and stored['transcript_segments'] == segments
+    print(json.dumps({'check': 'full_write_keeps_log_seq', 'ok': ok, 'seq_before': seq_before,
+                      'seq_after': seq_after, 'base_after': base_after,
+                      'segments': len(stored['transcript_segments'])}))
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uid', default='benchmark-transcript-segments-log')
+    parser.add_argument('--hours', type=float, default=2)
+    parser.add_argument('--level', default='standard', choices=['standard', 'enhanced'])
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    run(args.uid, args.hours, args.level, args.seed)
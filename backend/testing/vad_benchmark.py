@@ -0,0 +1,125 @@
+# CPU throughput of the in-process VAD (`utils.stt.vad.vad_is_empty` with `VAD_SERVICE=local`: silero on the bounded
+# `vad_executor`, results cached by the file's content) on long files.
+#
+# Runs on generated 16kHz wavs: harmonic voices (`testing.speaker_classification_benchmark`) talking in bursts of a
+# few seconds separated by pauses, and one silent file. The redis generic cache is an in-memory fake patched into
+# `database.redis_db`, the hosted service call raises if reached. Needs torch (and onnxruntime with `VAD_ONNX=true`,
+# the default); the silero model is downloaded by torch.hub on first run.
+#
+# Reported, per pool size: seconds of audio analyzed per second of wall time with the files submitted at once, cold
+# (cache empty) and warm (the same files again, and a copy of each under another path); speech found vs generated.
+#
+# Usage (from backend/):
+#   python -m testing.vad_benchmark --files 4 --minutes 30 --workers 1 2 4
+#
+# Prints one JSON line per pool size, then the checks; exits with an error if one fails.
+import argparse
+import json
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from testing.listen_load.server import configure_environment
+from testing.speaker_classification_benchmark import SAMPLE_RATE, _voice, _voices, _write_wav
+
+
+def _check(name: str, ok: bool, **data):
+    print(json.dumps({'check': name, 'ok': ok, **data}))
+    if not ok:
+        raise SystemExit(1)
+
+
+def _long_file(rng: random.Random, path: str, voices, minutes: float) -> float:
+    """Writes the file, returns the seconds of speech in it."""
+    parts, speech, position = [], 0.0, 0.0
+    while position < minutes * 60:
+        seconds, pause = rng.uniform(1, 8), rng.uniform(0.5, 4)
+        parts += [_voice(rng, *rng.choice(voices), seconds), np.zeros(int(pause * SAMPLE_RATE))]
+        speech += seconds
+        position += seconds + pause
+    _write_wav(path, np.concatenate(parts))
+    return speech
+
+
+def _overlap(segments, truth) -> float:
+    return sum(max(0.0, min(s['end'], t['end']) - max(s['start'], t['start'])) for s in segments for t in truth)
+
+
+def run(args):
+    configure_environment('ws://127.0.0.1:1', 'deepgram')
+    from database import redis_db
+    import utils.stt.vad as vad
+
+    cache = {}
+    redis_db.get_generic_cache = lambda path: json.loads(cache[path]) if path in cache else None
+    redis_db.set_generic_cache = lambda path, data, ttl=None: cache.__setitem__(path, json.dumps(data))
+
+    def no_network(*a, **kw):
+        raise AssertionError('the hosted VAD service was called')
+
+    vad.requests.post = no_network
+    vad.vad_service = 'local'
+
+    rng = random.Random(args.seed)
+    voices = _voices(rng, 3)
+    with tempfile.TemporaryDirectory() as directory:
+        paths, speech = [], {}
+        for i in range(args.files):
+            paths.append(f'{directory}/long-{i}.wav')
+            speech[paths[-1]] = _long_file(rng, paths[-1], voices, args.minutes)
+        silent = f'{directory}/silent.wav'
+        _write_wav(silent, np.random.default_rng(args.seed).normal(0, 0.002, int(60 * SAMPLE_RATE)))
+        audio_seconds = args.files * args.minutes * 60
+
+        # model load is not part of the runs
+        vad.get_speech_segments(silent)
+        results = {}
+        for workers in args.workers:
+            cache.clear()
+            vad.vad_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='vad')
+            with ThreadPoolExecutor(max_workers=len(paths)) as callers:
+                started = time.perf_counter()
+                results = dict(zip(paths, callers.map(lambda p: vad.vad_is_empty(p, return_segments=True), paths)))
+                cold_seconds = time.perf_counter() - started
+
+                copies = [shutil.copy(path, f'{path}.copy.wav') for path in paths]
+                started = time.perf_counter()
+                warm = list(callers.map(lambda p: vad.vad_is_empty(p, return_segments=True), paths + copies))
+                warm_seconds = time.perf_counter() - started
+            _check('cached_by_content', warm == [results[path] for path in paths] * 2 and len(cache) == len(paths),
+                   workers=workers, cache_entries=len(cache))
+
+            found = sum(segment['duration'] for segments in results.values() for segment in segments)
+            print(json.dumps({
+                'workers': workers, 'files': args.files, 'audio_seconds': audio_seconds,
+                'cold_seconds': round(cold_seconds, 2), 'cold_x_realtime': round(audio_seconds / cold_seconds, 1),
+                'warm_seconds': round(warm_seconds, 3),
+                'speech_seconds': round(sum(speech.values())), 'found_seconds': round(found),
+                'segments': sum(len(segments) for segments in results.values()),
+            }))
+
+        shaped = all(set(segment) == {'start', 'end', 'duration'} and segment['end'] > segment['start']
+                     for segments in results.values() for segment in segments)
+        _check('shape', shaped and vad.vad_is_empty(paths[0]) is False)
+        _check('silent_is_empty', vad.vad_is_empty(silent, cache=False) is True)
+
+        # windows don't change the result: speech across a window boundary is one segment
+        window_seconds = vad.vad_window_seconds
+        vad.vad_window_seconds = 45
+        windowed = vad.get_speech_segments(paths[0])
+        vad.vad_window_seconds = window_seconds
+        agreement = _overlap(windowed, results[paths[0]]) / max(_overlap(results[paths[0]], results[paths[0]]), 1e-6)
+        _check('windows', agreement >= 0.97, agreement=round(agreement, 3), segments=len(windowed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--minutes', type=float, default=30, help='length of each file')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='VAD pool sizes to compare')
+    parser.add_argument('--seed', type=int, default=7)
+    run(parser.parse_args())
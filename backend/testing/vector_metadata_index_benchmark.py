@@ -0,0 +1,113 @@
+# Compares the Redis metadata index behind `query_vectors_by_metadata` with the previous path, a top_k=10000
+# Pinecone scan returning every matching vector's metadata and scored in Python, on synthetic users.
+#
+# Usage (from backend/, against a local Redis):
+#   REDIS_DB_HOST=localhost python -m testing.vector_metadata_index_benchmark --users 3 --conversations 10000
+#
+# The scan side is replayed in memory (filter + scoring + the JSON size Pinecone would send back), so its latency
+# is a lower bound that leaves out the network and Pinecone's own filtering.
+import argparse
+import json
+import random
+import statistics
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from database import redis_db
+from database.vector_db import _query_metadata_index
+
+PEOPLE = [f'person {i}' for i in range(200)]
+TOPICS = [f'topic {i}' for i in range(500)]
+ENTITIES = [f'entity {i}' for i in range(800)]
+
+
+def _synthetic_metadata(rng: random.Random, conversations: int):
+    now = int(datetime.now(timezone.utc).timestamp())
+    return [{
+        'uid': 'benchmark', 'memory_id': f'conversation-{i}', 'created_at': now - rng.randint(0, 365 * 86400),
+        'people': rng.sample(PEOPLE, rng.randint(0, 3)), 'topics': rng.sample(TOPICS, rng.randint(1, 5)),
+        'entities': rng.sample(ENTITIES, rng.randint(0, 5)), 'dates': [],
+    } for i in range(conversations)]
+
+
+def _scan(metadata: list, starts_at, ends_at, people, topics, entities, limit):
+    """Pinecone side of the previous path, replayed in memory."""
+    matches = [
+        item for item in metadata
+        if (set(people) & set(item['people']) or set(topics) & set(item['topics'])
+            or set(entities) & set(item['entities']))
+        and (starts_at is None or starts_at <= item['created_at'] <= ends_at)
+    ]
+    response_bytes = len(json.dumps([{'id': item['memory_id'], 'metadata': item} for item in matches]))
+
+    counts = defaultdict(int)
+    for item in matches:
+        for field, values in [('people', people), ('topics', topics), ('entities', entities)]:
+            for value in values:
+                if value in item[field]:
+                    counts[item['memory_id']] += 1
+    ranked = sorted(matches, key=lambda item: (counts[item['memory_id']], item['created_at'], item['memory_id']),
+                    reverse=True)
+    return [item['memory_id'] for item in ranked[:limit]], response_bytes
+
+
+def _percentiles(values):
+    values = sorted(values)
+    return {'p50_ms': round(statistics.median(values) * 1000, 3),
+            'p99_ms': round(values[int(len(values) * 0.99) - 1] * 1000, 3)}
+
+
+def run(users: int, conversations: int, queries: int, limit: int, seed: int):
+    rng = random.Random(seed)
+    for u in range(users):
+        uid = f'benchmark-vector-metadata-{seed}-{u}'
+        metadata = _synthetic_metadata(rng, conversations)
+
+        start = time.perf_counter()
+        items = [(item['memory_id'], item['created_at'], item) for item in metadata]
+        for i in range(0, len(items), 500):
+            redis_db.set_conversations_vector_metadata(uid, items[i:i + 500])
+        build_seconds = time.perf_counter() - start
+
+        index_latencies, scan_latencies, scan_bytes = [], [], []
+        for _ in range(queries):
+            people = rng.sample(PEOPLE, rng.randint(0, 1))
+            topics = rng.sample(TOPICS, rng.randint(1, 3))
+            entities = rng.sample(ENTITIES, rng.randint(0, 2))
+            starts_at, ends_at = None, None
+            if rng.random() < 0.3:
+                ends_at = int(datetime.now(timezone.utc).timestamp()) - rng.randint(0, 180 * 86400)
+                starts_at = ends_at - 90 * 86400
+
+            start = time.perf_counter()
+            result = _query_metadata_index(uid, starts_at, ends_at, people, topics, entities, True, limit)
+            index_latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            expected, response_bytes = _scan(metadata, starts_at, ends_at, people, topics, entities, limit)
+            scan_latencies.append(time.perf_counter() - start)
+            scan_bytes.append(response_bytes)
+
+            if expected:
+                assert result == expected, f'ranking mismatch for {uid}'
+
+        for item in metadata:
+            redis_db.remove_conversation_vector_metadata(uid, item['memory_id'])
+
+        print(json.dumps({
+            'uid': uid, 'conversations': conversations, 'queries': queries, 'index_build_s': round(build_seconds, 3),
+            'index': _percentiles(index_latencies),
+            'scan': {**_percentiles(scan_latencies), 'response_kb_p50': round(statistics.median(scan_bytes) / 1024, 1)},
+        }))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--conversations', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    run(args.users, args.conversations, args.queries, args.limit, args.seed)
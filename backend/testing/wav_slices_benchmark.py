@@ -0,0 +1,105 @@
+# Checks that `utils.audio.export_wav_slices` writes the same bytes as slicing and concatenating
+# `AudioSegment.from_wav` (the previous speech profile / post-processing trims) on generated audio,
+# then times both on a long recording.
+#
+# Usage (from backend/):
+#   python -m testing.wav_slices_benchmark --runs 200 --minutes 60
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import wave
+
+from pydub import AudioSegment
+
+from utils.audio import export_wav_slices
+
+
+def _generate_wav(path: str, rng: random.Random, seconds: float, frame_rate: int, sample_width: int, channels: int):
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(sample_width)
+        wav.setframerate(frame_rate)
+        nframes = int(seconds * frame_rate)
+        chunk = frame_rate * 10
+        for i in range(0, nframes, chunk):
+            wav.writeframes(rng.randbytes(min(chunk, nframes - i) * sample_width * channels))
+
+
+def _random_slices(rng: random.Random, duration_ms: float):
+    slices = []
+    for _ in range(rng.randint(1, 12)):
+        start = rng.uniform(-min(500, duration_ms), duration_ms + 1500)
+        end = start + rng.uniform(-200, 5000) if rng.random() < 0.9 else float('inf')
+        slices.append((start, end))
+    # speech profile shape: ordered segments with the second after each one
+    if rng.random() < 0.5:
+        starts = sorted(rng.uniform(0, duration_ms) for _ in range(rng.randint(1, 8)))
+        slices = []
+        for i, start in enumerate(starts):
+            end = start + rng.uniform(100, 3000)
+            slices.append((start, end))
+            if i < len(starts) - 1:
+                slices.append((end, end + 1000))
+    return slices
+
+
+def legacy_export_wav_slices(file_path: str, dest_file_path: str, slices_ms):
+    trimmed_aseg = AudioSegment.empty()
+    for start, end in slices_ms:
+        trimmed_aseg += AudioSegment.from_wav(file_path)[start:end]
+    trimmed_aseg.export(dest_file_path, format="wav")
+
+
+def check_parity(runs: int, seed: int):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        source, expected, actual = [os.path.join(tmp, name) for name in ['source.wav', 'expected.wav', 'actual.wav']]
+        for run in range(runs):
+            frame_rate = rng.choice([8000, 16000, 44100])
+            sample_width = rng.choice([1, 2, 2, 4])
+            channels = rng.choice([1, 1, 2])
+            seconds = rng.uniform(0.01, 20)
+            _generate_wav(source, rng, seconds, frame_rate, sample_width, channels)
+            slices = _random_slices(rng, seconds * 1000)
+
+            legacy_export_wav_slices(source, expected, slices)
+            export_wav_slices(source, actual, slices)
+            with open(expected, 'rb') as e, open(actual, 'rb') as a:
+                assert e.read() == a.read(), f'run {run}: {frame_rate}Hz {sample_width}B {channels}ch {slices}'
+
+
+def benchmark(minutes: float, segments: int, seed: int):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        source, expected, actual = [os.path.join(tmp, name) for name in ['source.wav', 'expected.wav', 'actual.wav']]
+        _generate_wav(source, rng, minutes * 60, 16000, 2, 1)
+        starts = sorted(rng.uniform(0, minutes * 60 * 1000) for _ in range(segments))
+        slices = [(start, start + 2000) for start in starts]
+
+        start = time.perf_counter()
+        legacy_export_wav_slices(source, expected, slices)
+        legacy_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        export_wav_slices(source, actual, slices)
+        new_seconds = time.perf_counter() - start
+
+        with open(expected, 'rb') as e, open(actual, 'rb') as a:
+            assert e.read() == a.read(), 'benchmark output mismatch'
+    return {'minutes': minutes, 'segments': segments,
+            'legacy_s': round(legacy_seconds, 3), 'streaming_s': round(new_seconds, 3)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--minutes', type=float, default=60)
+    parser.add_argument('--segments', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    check_parity(args.runs, args.seed)
+    print(json.dumps(benchmark(args.minutes, args.segments, args.seed)))
@@ -1,4 +1,3 @@
-import threading
 from typing import List
 import os
 import requests
@@ -14,8 +13,9 @@ from models.app import App, UsageHistoryType
 from models.chat import Message
 from models.conversation import Conversation, ConversationSource
 from models.notification_message import NotificationMessage
-from utils.apps import get_available_apps
+from utils.apps import get_enabled_apps_registry
 from utils.notifications import send_notification
+from utils.other.http_dispatcher import dispatcher
 from utils.llm.clients import generate_embedding
 from utils.llm.proactive_notification import get_proactive_message
 from database.vector_db import query_vectors_by_metadata
@@ -75,14 +75,14 @@ def trigger_external_integrations(uid: str, conversation: Conversation) -> list:
     if not conversation or conversation.discarded:
         return []
 
-    apps: List[App] = get_available_apps(uid)
+    apps: List[App] = get_enabled_apps_registry(uid)
     filtered_apps = [app for app in apps if
                      app.triggers_on_conversation_creation() and app.enabled]
     if not filtered_apps:
         return []
 
-    threads = []
     results = {}
+    deadline = time.monotonic() + 30
 
     def _single(app: App):
         if not app.external_integration.webhook_url:
@@ -101,7 +101,7 @@ def trigger_external_integrations(uid: str, conversation: Conversation) -> list:
             url += '?uid=' + uid
 
         try:
-            response = requests.post(url, json=conversation_dict, timeout=30, )  # TODO: failing?
+            response = dispatcher.post(url, json=conversation_dict, timeout=30, deadline=deadline)
             if response.status_code != 200:
                 print('App integration failed', app.id, 'status:', response.status_code, 'result:', response.text[:100])
                 return
@@ -121,21 +121,17 @@ def trigger_external_integrations(uid: str, conversation: Conversation) -> list:
             print(f"Plugin integration error: {e}")
             return
 
-    for app in filtered_apps:
-        threads.append(threading.Thread(target=_single, args=(app,)))
-
-    [t.start() for t in threads]
-    [t.join() for t in threads]
+    dispatcher.run_all(_single, filtered_apps, budget_seconds=30)
 
     messages = []
-    for key, message in results.items():
+    for key, message in list(results.items()):
         if not message:
             continue
         messages.append(add_app_message(message, key, uid, conversation.id))
     return messages
 
 
-async def trigger_realtime_integrations(uid: str, segments: list[dict], conversation_id: str | None):
+def trigger_realtime_integrations(uid: str, segments: list[dict], conversation_id: str | None):
     print("trigger_realtime_integrations", uid)
     """REALTIME STREAMING"""
     # TODO: don't retrieve token before knowing if to notify
@@ -143,7 +139,7 @@ async def trigger_realtime_integrations(uid: str, segments: list[dict], conversa
     _trigger_realtime_integrations(uid, token, segments, conversation_id)
 
 
-async def trigger_realtime_audio_bytes(uid: str, sample_rate: int, data: bytearray):
+def trigger_realtime_audio_bytes(uid: str, sample_rate: int, data: bytearray):
     print("trigger_realtime_audio_bytes", uid)
     """REALTIME AUDIO STREAMING"""
     _trigger_realtime_audio_bytes(uid, sample_rate, data)
@@ -245,7 +241,7 @@ def _process_proactive_notification(uid: str, token: str, app: App, data):
 
 
 def _trigger_realtime_audio_bytes(uid: str, sample_rate: int, data: bytearray):
-    apps: List[App] = get_available_apps(uid)
+    apps: List[App] = get_enabled_apps_registry(uid)
     filtered_apps = [
         app for app in apps if
         app.triggers_realtime_audio_bytes() and app.enabled
@@ -253,8 +249,8 @@ def _trigger_realtime_audio_bytes(uid: str, sample_rate: int, data: bytearray):
     if not filtered_apps:
         return {}
 
-    threads = []
     results = {}
+    deadline = time.monotonic() + 15
 
     def _single(app: App):
         if not app.external_integration.webhook_url:
@@ -263,23 +259,20 @@ def _trigger_realtime_audio_bytes(uid: str, sample_rate: int, data: bytearray):
         url = app.external_integration.webhook_url
         url += f'?sample_rate={sample_rate}&uid={uid}'
         try:
-            response = requests.post(url, data=data, headers={'Content-Type': 'application/octet-stream'}, timeout=15)
+            response = dispatcher.post(url, data=data, headers={'Content-Type': 'application/octet-stream'},
+                                       timeout=15, deadline=deadline)
             print('trigger_realtime_audio_bytes', app.id, 'status:', response.status_code)
         except Exception as e:
             print(f"Plugin integration error: {e}")
             return
 
-    for app in filtered_apps:
-        threads.append(threading.Thread(target=_single, args=(app,)))
-
-    [t.start() for t in threads]
-    [t.join() for t in threads]
+    dispatcher.run_all(_single, filtered_apps, budget_seconds=15)
 
     return results
 
 
 def _trigger_realtime_integrations(uid: str, token: str, segments: List[dict], conversation_id: str | None) -> dict:
-    apps: List[App] = get_available_apps(uid)
+    apps: List[App] = get_enabled_apps_registry(uid)
     filtered_apps = [
         app for app in apps if
         app.triggers_realtime() and app.enabled
@@ -287,8 +280,8 @@ def _trigger_realtime_integrations(uid: str, token: str, segments: List[dict], c
     if not filtered_apps:
         return {}
 
-    threads = []
     results = {}
+    deadline = time.monotonic() + 30
 
     def _single(app: App):
         if not app.external_integration.webhook_url:
@@ -301,7 +294,8 @@ def _trigger_realtime_integrations(uid: str, token: str, segments: List[dict], c
             url += '?uid=' + uid
 
         try:
-            response = requests.post(url, json={"session_id": uid, "segments": segments}, timeout=30)
+            response = dispatcher.post(url, json={"session_id": uid, "segments": segments}, timeout=30,
+                                       deadline=deadline)
             if response.status_code != 200:
                 print('trigger_realtime_integrations', app.id, 'status: ', response.status_code, 'results:',
                       response.text[:100])
@@ -333,13 +327,9 @@ def _trigger_realtime_integrations(uid: str, token: str, segments: List[dict], c
             print(f"App integration error: {e}")
             return
 
-    for app in filtered_apps:
-        threads.append(threading.Thread(target=_single, args=(app,)))
-
-    [t.start() for t in threads]
-    [t.join() for t in threads]
+    dispatcher.run_all(_single, filtered_apps, budget_seconds=30)
     messages = []
-    for key, message in results.items():
+    for key, message in list(results.items()):
         if not message:
             continue
         messages.append(add_app_message(message, key, uid))
@@ -1,7 +1,8 @@
 import os
 import threading
+import time
 from collections import defaultdict
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from typing import List, Tuple, Dict, Any
 import hashlib
 import secrets
@@ -12,7 +13,8 @@ from database.apps import get_private_apps_db, get_public_unapproved_apps_db, \
     add_tester_db, add_app_access_for_tester_db, remove_app_access_for_tester_db, remove_tester_db, \
     is_tester_db, can_tester_access_app_db, get_apps_for_tester_db, get_app_chat_message_sent_usage_count_db, \
     update_app_in_db, get_audio_apps_count, get_persona_by_uid_db, update_persona_in_db, \
-    get_omi_personas_by_uid_db, get_api_key_by_hash_db, get_popular_apps_db
+    get_omi_personas_by_uid_db, get_api_key_by_hash_db, get_popular_apps_db, get_apps_by_ids_db, get_persona_state_db, \
+    set_persona_state_db
 from database.auth import get_user_name
 from database.conversations import get_conversations
 from database.memories import get_memories, get_user_public_memories
@@ -20,12 +22,16 @@ from database.redis_db import get_enabled_apps, get_app_reviews, get_generic_cac
     set_generic_cache, set_app_usage_history_cache, get_app_usage_history_cache, get_app_money_made_cache, \
     set_app_money_made_cache, get_apps_installs_count, get_apps_reviews, get_app_cache_by_id, set_app_cache_by_id, \
     set_app_review_cache, get_app_usage_count_cache, set_app_money_made_amount_cache, get_app_money_made_amount_cache, \
-    set_app_usage_count_cache, set_user_paid_app, get_user_paid_app, delete_app_cache_by_id, is_username_taken
+    set_app_usage_count_cache, set_user_paid_app, get_user_paid_app, delete_app_cache_by_id, is_username_taken, \
+    get_apps_registry_versions, get_user_apps_registry, set_user_apps_registry, bump_apps_registry_version, \
+    bump_user_apps_registry_version, get_apps_registry_version, schedule_persona_update, get_due_persona_updates, \
+    claim_persona_update
 from database.users import get_stripe_connect_account_id
 from models.app import App, UsageHistoryItem, UsageHistoryType
 from models.conversation import Conversation
 from utils import stripe
-from utils.llm.persona import condense_conversations, condense_memories, generate_persona_description, condense_tweets
+from utils.llm.persona import condense_conversations, condense_memories, generate_persona_description, \
+    condense_tweets, fold_memories_into_summary, fold_conversations_into_summary
 from utils.social import get_twitter_timeline, TwitterProfile, get_twitter_profile
 
 MarketplaceAppReviewUIDs = os.getenv('MARKETPLACE_APP_REVIEWERS').split(',') if os.getenv(
@@ -146,6 +152,62 @@ def get_available_apps(uid: str, include_reviews: bool = False) -> List[App]:
     return apps
 
 
+# ********************************
+# ******** APPS REGISTRY *********
+# ********************************
+
+# Enabled apps per user for the realtime paths, held in process memory and redis.
+# Entries are tagged with (global, user) versions from redis: enabling/disabling an app bumps the user version,
+# app updates and reviews bump the global one, so a steady-state lookup is a single redis MGET.
+_apps_registry: Dict[str, Tuple[Tuple[int, int], List[App]]] = {}
+_apps_registry_max_users = 10000
+
+
+def get_enabled_apps_registry(uid: str) -> List[App]:
+    versions = get_apps_registry_versions(uid)
+    cached = _apps_registry.get(uid)
+    if cached and cached[0] == versions:
+        return cached[1]
+
+    registry = get_user_apps_registry(uid)
+    if registry and tuple(registry['versions']) == versions:
+        apps = [App(**app) for app in registry['apps']]
+    else:
+        apps = [app for app in get_available_apps(uid) if app.enabled]
+        set_user_apps_registry(uid, versions, [app.model_dump(mode='json') for app in apps])
+
+    if uid not in _apps_registry and len(_apps_registry) >= _apps_registry_max_users:
+        _apps_registry.pop(next(iter(_apps_registry)), None)
+    _apps_registry[uid] = (versions, apps)
+    return apps
+
+
+def invalidate_apps_registry(uid: str | None = None):
+    """Invalidates the registry of a single user, or of every user when an app itself changed."""
+    if uid:
+        bump_user_apps_registry_version(uid)
+    else:
+        bump_apps_registry_version()
+
+
+# Default apps conversations are summarized with, in process memory under the global registry version: app updates
+# (`invalidate_apps_registry()`) reload them, a steady-state lookup is a single redis GET.
+_default_apps_catalog: Tuple[int, Tuple[str, ...], List[App]] | None = None
+
+
+def get_default_apps_catalog(app_ids: List[str]) -> List[App]:
+    global _default_apps_catalog
+    version = get_apps_registry_version()
+    key = tuple(app_ids)
+    cached = _default_apps_catalog
+    if cached and cached[0] == version and cached[1] == key:
+        return list(cached[2])
+
+    apps = [App(**app) for app in get_apps_by_ids_db(list(key))]
+    _default_apps_catalog = (version, key, apps)
+    return list(apps)
+
+
 def get_available_app_by_id(app_id: str, uid: str | None) -> dict | None:
     cached_app = get_app_cache_by_id(app_id)
     if cached_app:
@@ -490,28 +552,156 @@ def generate_persona_desc(uid: str, persona_name: str):
     return persona_description
 
 
-def update_personas_async(uid: str):
-    print(f"[PERSONAS] Starting persona updates in background thread for uid={uid}")
+persona_update_debounce_seconds = float(os.getenv('PERSONA_UPDATE_DEBOUNCE_SECONDS', 300))
+persona_update_poll_seconds = float(os.getenv('PERSONA_UPDATE_POLL_SECONDS', 60))
+persona_rebuild_drift = 0.3
+persona_rebuild_max_age = timedelta(days=7)
+persona_tweets_max_age = timedelta(hours=24)
+
+_persona_updates_poller: threading.Thread | None = None
+_persona_updates_poller_lock = threading.Lock()
+
+
+def update_personas_async(uid: str, rebuild: bool = False):
+    """
+    Schedules the update of the user's personas in `persona_update_debounce_seconds`, requests until then are
+    coalesced into that update. `rebuild` condenses from scratch, e.g. when a memory was deleted.
+
+    The pending update is kept in redis and runs once, on whichever instance claims it first: this one when its
+    timer fires, or any instance polling for due updates if this one is gone by then.
+    """
+    due_at = datetime.now(timezone.utc).timestamp() + persona_update_debounce_seconds
+    try:
+        scheduled = schedule_persona_update(uid, due_at, rebuild=rebuild)
+    except Exception as e:
+        print(f"[PERSONAS] Error scheduling persona updates for uid={uid}: {str(e)}")
+        return
+    _start_persona_updates_poller()
+    if scheduled:
+        timer = threading.Timer(persona_update_debounce_seconds, _run_persona_update, args=(uid,))
+        timer.daemon = True
+        timer.start()
+
+
+def _start_persona_updates_poller():
+    global _persona_updates_poller
+    if persona_update_poll_seconds <= 0:
+        return
+    with _persona_updates_poller_lock:
+        if _persona_updates_poller is not None:
+            return
+        _persona_updates_poller = threading.Thread(target=_poll_persona_updates, name='persona-updates', daemon=True)
+    _persona_updates_poller.start()
+
+
+def _poll_persona_updates():
+    while True:
+        time.sleep(persona_update_poll_seconds)
+        try:
+            run_due_persona_updates()
+        except Exception as e:
+            print(f"[PERSONAS] Error polling persona updates: {str(e)}")
+
+
+def run_due_persona_updates():
+    """Runs the updates past their due time that no instance claimed, e.g. scheduled by an instance since gone."""
+    for uid in get_due_persona_updates(datetime.now(timezone.utc).timestamp()):
+        _run_persona_update(uid)
+
+
+def _run_persona_update(uid: str):
+    rebuild = claim_persona_update(uid)
+    if rebuild is None:
+        # another instance ran it
+        return
+    _update_personas(uid, rebuild=rebuild)
+
+
+def _update_personas(uid: str, rebuild: bool = False):
+    print(f"[PERSONAS] Starting persona updates for uid={uid}")
     personas = get_omi_personas_by_uid_db(uid)
-    if personas:
-        threads = []
-        for persona in personas:
-            threads.append(threading.Thread(target=sync_update_persona_prompt, args=(persona,)))
+    if not personas:
+        print(f"[PERSONAS] No personas found for uid={uid}")
+        return
+
+    try:
+        state = get_persona_context(uid, rebuild=rebuild)
+    except Exception as e:
+        print(f"[PERSONAS] Error condensing persona context for uid={uid}: {str(e)}")
+        return
+    for persona in personas:
+        sync_update_persona_prompt(persona, state)
+    set_persona_state_db(uid, state)
+    print(f"[PERSONAS] Finished persona updates for uid={uid}")
+
+
+def _memory_digest(memory: dict) -> str:
+    return hashlib.sha256(memory['content'].encode('utf-8')).hexdigest()[:12]
 
-        [t.start() for t in threads]
-        [t.join() for t in threads]
-        print(f"[PERSONAS] Finished persona updates in background thread for uid={uid}")
+
+def get_persona_context(uid: str, rebuild: bool = False) -> dict:
+    """
+    The condensed memories and conversations shared by the user's personas, see `database.apps.get_persona_state_db`.
+
+    Memories and conversations that are new since the last update are folded into the stored summaries. They are
+    condensed from scratch when there are none yet, when `rebuild`, when a memory they were built from was edited,
+    when the summaries are older than `persona_rebuild_max_age` or when what changed since (new or gone) exceeds
+    `persona_rebuild_drift` of what they were built from. Folding only adds: what is gone may have only dropped out
+    of the most recent ones, so deleting a memory or a conversation, or making a memory private, asks for a rebuild
+    (`update_personas_async(uid, rebuild=True)`).
+    """
+    state = get_persona_state_db(uid) or {}
+    now = datetime.now(timezone.utc)
+
+    memories = get_user_public_memories(uid, limit=250)
+    conversations = get_conversations(uid, limit=100)
+    memory_digests = {memory['id']: _memory_digest(memory) for memory in memories}
+    conversation_ids = [conversation['id'] for conversation in conversations]
+
+    folded_memories = state.get('memories', {})
+    folded_conversations = set(state.get('conversation_ids', []))
+    new_memories = [memory for memory in memories if memory['id'] not in folded_memories]
+    new_conversations = [conversation for conversation in conversations
+                         if conversation['id'] not in folded_conversations]
+    gone_memories = sum(1 for memory_id in folded_memories if memory_id not in memory_digests)
+    edited_memories = sum(1 for memory_id, digest in folded_memories.items()
+                          if memory_id in memory_digests and memory_digests[memory_id] != digest)
+    gone_conversations = len(folded_conversations - set(conversation_ids))
+    changed = state.get('changed_since_rebuild', 0) + len(new_memories) + len(new_conversations) + gone_memories \
+              + gone_conversations
+
+    rebuilt_at = state.get('rebuilt_at')
+    if rebuild or edited_memories or not state.get('memories_summary') or not rebuilt_at \
+            or now - rebuilt_at > persona_rebuild_max_age \
+            or changed > persona_rebuild_drift * max(state.get('size_at_rebuild', 0), 1):
+        user_name = get_user_name(uid)
+        state['memories_summary'] = condense_memories([memory['content'] for memory in memories], user_name)
+        state['conversations_summary'] = condense_conversations([Conversation.conversations_to_string(conversations)])
+        state['changed_since_rebuild'] = 0
+        state['size_at_rebuild'] = len(memories) + len(conversations)
+        state['rebuilt_at'] = now
     else:
-        print(f"[PERSONAS] No personas found for uid={uid}")
+        if new_memories:
+            state['memories_summary'] = fold_memories_into_summary(
+                state['memories_summary'], [memory['content'] for memory in new_memories], get_user_name(uid))
+        if new_conversations:
+            state['conversations_summary'] = fold_conversations_into_summary(
+                state['conversations_summary'], [Conversation.conversations_to_string(new_conversations)])
+        state['changed_since_rebuild'] = changed
+
+    state['memories'] = memory_digests
+    state['conversation_ids'] = conversation_ids
+    state['updated_at'] = now
+    return state
 
 
-def sync_update_persona_prompt(persona: dict):
+def sync_update_persona_prompt(persona: dict, state: dict | None = None):
     """Synchronous wrapper for update_persona_prompt"""
     import asyncio
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     try:
-        return loop.run_until_complete(update_persona_prompt(persona))
+        return loop.run_until_complete(update_persona_prompt(persona, state))
     except Exception as e:
         print(f"Error in update_persona_prompt for persona {persona.get('id', 'unknown')}: {str(e)}")
         return None
@@ -519,29 +709,47 @@ def sync_update_persona_prompt(persona: dict):
         loop.close()
 
 
-async def update_persona_prompt(persona: dict):
-    """Update a persona's chat prompt with latest memories and conversations."""
-    # Get latest memories and user info
-    memories = get_user_public_memories(persona['uid'], limit=250)
-    user_name = get_user_name(persona['uid'])
+async def update_persona_prompt(persona: dict, state: dict | None = None):
+    """
+    Update a persona's chat prompt with latest memories and conversations.
 
-    # Get and condense recent conversations
-    conversations = get_conversations(persona['uid'], limit=100)
-    conversation_history = Conversation.conversations_to_string(conversations)
-    conversation_history = condense_conversations([conversation_history])
+    `state` is the user's `get_persona_context`, computed (and stored) here when not given; the persona's
+    condensed tweets are kept in it and refreshed every `persona_tweets_max_age`.
+    """
+    store_state = state is None
+    if state is None:
+        state = get_persona_context(persona['uid'])
+    user_name = get_user_name(persona['uid'])
 
     condensed_tweets = None
-    # Condense tweets
     if "twitter" in persona['connected_accounts'] and 'twitter' in persona:
-        # Get latest tweets
-        timeline = await get_twitter_timeline(persona['twitter']['username'])
-        tweets = [tweet.text for tweet in timeline.timeline]
-        condensed_tweets = condense_tweets(tweets, persona['name'])
+        tweets_state = state.setdefault('tweets', {})
+        cached = tweets_state.get(persona['id'])
+        now = datetime.now(timezone.utc)
+        if cached and now - cached['condensed_at'] < persona_tweets_max_age:
+            condensed_tweets = cached['summary']
+        else:
+            timeline = await get_twitter_timeline(persona['twitter']['username'])
+            tweets = [tweet.text for tweet in timeline.timeline]
+            condensed_tweets = condense_tweets(tweets, persona['name'])
+            tweets_state[persona['id']] = {'summary': condensed_tweets, 'condensed_at': now}
+
+    persona_prompt = _persona_prompt(user_name, state['memories_summary'], state['conversations_summary'],
+                                     condensed_tweets)
+    if store_state:
+        set_persona_state_db(persona['uid'], state)
+    if persona.get('persona_prompt') == persona_prompt:
+        return
 
-    # Condense memories
-    memories_text = condense_memories([memory['content'] for memory in memories], user_name)
+    persona['persona_prompt'] = persona_prompt
+    persona['updated_at'] = datetime.now(timezone.utc)
 
-    # Generate updated chat prompt
+    update_persona_in_db(persona)
+    delete_app_cache_by_id(persona['id'])
+
+
+def _persona_prompt(user_name: str, memories_summary: str, conversations_summary: str,
+                    condensed_tweets: str | None) -> str:
     persona_prompt = f"""
 You are {user_name} AI. Your objective is to personify {user_name} as accurately as possible for 1:1 cloning.
 
@@ -586,21 +794,16 @@ You have:
 You have all the necessary condensed facts and contextual knowledge. Begin personifying {user_name} now.
 
 Personal Facts and Context:
-{memories_text}
+{memories_summary}
 
 Recent Conversations:
-{conversation_history}
+{conversations_summary}
 
 Recent Tweets:
 {condensed_tweets}
 
 Use these facts, conversations and tweets to shape your personality. Responses should help the conversation go deeper. You have strong opinions, slightly controversial."""
-
-    persona['persona_prompt'] = persona_prompt
-    persona['updated_at'] = datetime.now(timezone.utc)
-
-    update_persona_in_db(persona)
-    delete_app_cache_by_id(persona['id'])
+    return persona_prompt
 
 
 def increment_username(username: str):
@@ -1,8 +1,15 @@
+import os
 import wave
+from typing import List, Tuple
 
 from pydub import AudioSegment
 from pyogg import OpusDecoder
 
+from utils.other.audio_frames import slice_frames
+
+# frames copied per read/write when streaming wav slices, keeps memory flat for multi-hour files
+wav_stream_chunk_frames = 16000 * 30
+
 
 def merge_wav_files(dest_file_path: str, source_files: [str], silent_seconds: [int]):
     if len(source_files) == 0 or not dest_file_path:
@@ -17,6 +24,61 @@ def merge_wav_files(dest_file_path: str, source_files: [str], silent_seconds: [i
     combined_sounds.export(dest_file_path, format="wav")
 
 
+def get_wav_params(file_path: str) -> wave._wave_params:
+    """Header of a PCM wav (channels, sample width, frame rate, frames), without reading the audio."""
+    with wave.open(file_path, 'rb') as wav:
+        return wav.getparams()
+
+
+def get_wav_duration_seconds(file_path: str) -> float:
+    params = get_wav_params(file_path)
+    return params.nframes / params.framerate
+
+
+def export_wav_slices(file_path: str, dest_file_path: str, slices_ms: List[Tuple[float, float]]):
+    """
+    Writes the concatenation of `AudioSegment.from_wav(file_path)[start:end]` for each (start, end) in slices_ms,
+    byte for byte, to dest_file_path (which may be file_path itself).
+    The source is read once, through a single handle, and streamed in bounded chunks instead of decoded
+    into memory for every slice.
+    """
+    tmp_path = f'{dest_file_path}.{os.getpid()}.tmp'
+    try:
+        _write_wav_slices(file_path, tmp_path, slices_ms)
+        os.replace(tmp_path, dest_file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _write_wav_slices(file_path: str, dest_file_path: str, slices_ms: List[Tuple[float, float]]):
+    with wave.open(file_path, 'rb') as source, wave.open(dest_file_path, 'wb') as dest:
+        params = source.getparams()
+        dest.setnchannels(params.nchannels)
+        dest.setsampwidth(params.sampwidth)
+        dest.setframerate(params.framerate)
+        frame_width = params.nchannels * params.sampwidth
+        # 8 bit wav is unsigned, its silence is 0x80
+        silence = (b'\x80' if params.sampwidth == 1 else b'\x00' * params.sampwidth) * params.nchannels
+
+        for start_ms, end_ms in slices_ms:
+            start, end = slice_frames(params.nframes, params.framerate, start_ms, end_ms)
+            copied = 0
+            if start < params.nframes:
+                source.setpos(start)
+                position = start
+                while position < min(end, params.nframes):
+                    data = source.readframes(min(wav_stream_chunk_frames, min(end, params.nframes) - position))
+                    if not data:
+                        break
+                    dest.writeframesraw(data)
+                    position += len(data) // frame_width
+                copied = position - start
+            # like pydub, pads rounding gaps at the end of the audio with silence
+            if 0 < copied < end - start:
+                dest.writeframesraw(silence * (end - start - copied))
+
+
 # frames is 2darray
 def create_wav_from_bytes(
         file_path: str, frames: [], codec: str, frame_rate: int = 16000, channels: int = 1, sample_width: int = 2
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import statistics
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import database.conversations_async as conversations_db
+
+
+class ConversationFinalizer:
+    """
+    Runs conversation finalization (`process_conversation`, integrations) off the event loop.
+
+    - at most `max_workers` conversations are finalized at once, on a dedicated thread pool; the others wait
+      in `queued` without holding a thread
+    - one job per conversation id: submitting a conversation that is already queued or running returns the same
+      task, and a Redis claim keeps other sockets and instances from finalizing it at the same time (`skipped`)
+    - `on_status(status, result)` is called on the event loop for `queued`, `running`, `completed` (result is
+      what `fn` returned), `failed` (result is the exception) and `skipped`
+
+    The queue itself is in memory; the conversation's Firestore status (`processing`, set before `submit`) is
+    what survives a restart, `finalize_processing_conversations` submits those again on the user's next session.
+    `submit` must be called from the event loop.
+    """
+
+    def __init__(self, max_workers: int = 8, claim_ttl_seconds: int = 10 * 60, name: str = 'conversation-finalizer'):
+        self.max_workers = max_workers
+        self.claim_ttl_seconds = claim_ttl_seconds
+        self.name = name
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = asyncio.Semaphore(max_workers)
+        self._jobs: Dict[str, asyncio.Task] = {}
+        self._running = 0
+        self._counters = defaultdict(int)
+        self._wait_seconds = deque(maxlen=2000)
+        self._run_seconds = deque(maxlen=2000)
+
+    def submit(self, conversation_id: str, fn: Callable, *args,
+               on_status: Optional[Callable] = None) -> asyncio.Task:
+        """Queues fn(*args) for the conversation, or returns the job already queued or running for it."""
+        self._counters['submitted'] += 1
+        job = self._jobs.get(conversation_id)
+        if job is not None:
+            self._counters['deduplicated'] += 1
+            return job
+
+        job = asyncio.create_task(self._run(conversation_id, fn, args, on_status or (lambda status, result: None)))
+        self._jobs[conversation_id] = job
+        job.add_done_callback(lambda _: self._jobs.pop(conversation_id, None))
+        return job
+
+    async def _run(self, conversation_id: str, fn: Callable, args: tuple, on_status: Callable):
+        token = uuid.uuid4().hex
+        if not await self._claim(conversation_id, token):
+            self._counters['skipped'] += 1
+            self._notify(on_status, 'skipped', None)
+            return None
+
+        try:
+            self._notify(on_status, 'queued', None)
+            enqueued_at = time.monotonic()
+            async with self._slots:
+                started = time.monotonic()
+                self._wait_seconds.append(started - enqueued_at)
+                self._notify(on_status, 'running', None)
+                self._running += 1
+                try:
+                    result = await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+                except Exception as e:
+                    self._counters['failed'] += 1
+                    print(f'{self.name}: {conversation_id} failed: {e}')
+                    self._notify(on_status, 'failed', e)
+                    return None
+                finally:
+                    self._running -= 1
+                    self._run_seconds.append(time.monotonic() - started)
+
+            self._counters['completed'] += 1
+            self._notify(on_status, 'completed', result)
+            return result
+        finally:
+            await self._release(conversation_id, token)
+
+    async def _claim(self, conversation_id: str, token: str) -> bool:
+        try:
+            return await conversations_db.claim_conversation_processing(conversation_id, token,
+                                                                        ttl=self.claim_ttl_seconds)
+        except Exception as e:
+            # finalizing twice is better than not finalizing
+            print(f'{self.name}: could not claim {conversation_id}: {e}')
+            return True
+
+    async def _release(self, conversation_id: str, token: str):
+        try:
+            await conversations_db.release_conversation_processing(conversation_id, token)
+        except Exception as e:
+            print(f'{self.name}: could not release {conversation_id}: {e}')
+
+    def _notify(self, on_status: Callable, status: str, result):
+        try:
+            on_status(status, result)
+        except Exception as e:
+            print(f'{self.name}: status callback failed on {status}: {e}')
+
+    def metrics(self) -> dict:
+        def _ms(values):
+            if not values:
+                return None
+            values = sorted(values)
+            return {'p50': round(statistics.median(values) * 1000, 1),
+                    'p99': round(values[min(int(len(values) * 0.99), len(values) - 1)] * 1000, 1),
+                    'max': round(values[-1] * 1000, 1)}
+
+        return {
+            'workers': self.max_workers,
+            'running': self._running,
+            'jobs': len(self._jobs),
+            'queue_wait_ms': _ms(self._wait_seconds),
+            'run_ms': _ms(self._run_seconds),
+            **self._counters,
+        }
+
+
+_finalizer = None
+
+
+def get_conversation_finalizer() -> ConversationFinalizer:
+    global _finalizer
+    if _finalizer is None:
+        _finalizer = ConversationFinalizer(max_workers=int(os.getenv('CONVERSATION_FINALIZER_WORKERS', 8)))
+    return _finalizer
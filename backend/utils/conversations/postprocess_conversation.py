@@ -3,11 +3,10 @@ import os
 import threading
 import time
 
-from pydub import AudioSegment
-
 import database.conversations as conversations_db
 from database.users import get_user_store_recording_permission
 from models.conversation import *
+from utils.audio import get_wav_params, export_wav_slices
 from utils.conversations.process_conversation import process_conversation, process_user_emotion
 from utils.other.storage import upload_postprocessing_audio, \
     delete_postprocessing_audio, upload_conversation_recording
@@ -32,8 +31,9 @@ def postprocess_conversation(conversation_id: str, file_path: str, uid: str, emo
         print(f'postprocess_conversation: Conversation can\'t be post-processed again {conversation.postprocessing.status}')
         return 400, "Conversation can't be post-processed again"
 
-    aseg = AudioSegment.from_wav(file_path)
-    if aseg.duration_seconds < 10:  # TODO: validate duration more accurately, segment.last.end - segment.first.start - 10
+    # header only, the audio is streamed once below when trimmed
+    wav_params = get_wav_params(file_path)
+    if wav_params.nframes / wav_params.framerate < 10:  # TODO: validate duration more accurately, segment.last.end - segment.first.start - 10
         # TODO: fix app, sometimes audio uploaded is wrong, is too short.
         print('postprocess_conversation: Audio duration is too short, seems wrong.')
         conversations_db.set_postprocessing_status(uid, conversation.id, PostProcessingStatus.canceled)
@@ -48,23 +48,24 @@ def postprocess_conversation(conversation_id: str, file_path: str, uid: str, emo
             start = vad_segments[0]['start']
             end = vad_segments[-1]['end']
             print('vad_is_empty file result segments:', start, end)
-            aseg = AudioSegment.from_wav(file_path)
-            aseg = aseg[max(0, (start - 1) * 1000):min((end + 1) * 1000, aseg.duration_seconds * 1000)]
-            aseg.export(file_path, format="wav")
+            duration_seconds = wav_params.nframes / wav_params.framerate
+            export_wav_slices(file_path, file_path, [
+                (max(0, (start - 1) * 1000), min((end + 1) * 1000, duration_seconds * 1000)),
+            ])
     except Exception as e:
         print(e)
 
     try:
-        aseg = AudioSegment.from_wav(file_path)
+        wav_params = get_wav_params(file_path)
         signed_url = upload_postprocessing_audio(file_path)
         threading.Thread(target=_delete_postprocessing_audio, args=(file_path,)).start()
 
-        if aseg.frame_rate == 16000 and get_user_store_recording_permission(uid):
+        if wav_params.framerate == 16000 and get_user_store_recording_permission(uid):
             upload_conversation_recording(file_path, uid, conversation_id)
 
         speakers_count = len(set([segment.speaker for segment in conversation.transcript_segments]))
         words = fal_whisperx(signed_url, speakers_count)
-        fal_segments = fal_postprocessing(words, aseg.duration_seconds)
+        fal_segments = fal_postprocessing(words, wav_params.nframes / wav_params.framerate)
 
         # if new transcript is 90% shorter than the original, cancel post-processing, smth wrong with audio or FAL
         count = len(''.join([segment.text.strip() for segment in conversation.transcript_segments]))
@@ -74,9 +75,9 @@ def postprocess_conversation(conversation_id: str, file_path: str, uid: str, emo
         fal_failed = not fal_segments or new_count < (count * 0.85)
 
         if fal_failed:
-            _handle_segment_embedding_matching(uid, file_path, conversation.transcript_segments, aseg)
+            _handle_segment_embedding_matching(uid, file_path, conversation.transcript_segments, wav_params.framerate)
         else:
-            _handle_segment_embedding_matching(uid, file_path, fal_segments, aseg)
+            _handle_segment_embedding_matching(uid, file_path, fal_segments, wav_params.framerate)
 
         # Store both models results.
         conversations_db.store_model_segments_result(uid, conversation.id, streaming_model, conversation.transcript_segments)
@@ -134,8 +135,8 @@ async def _process_user_emotion(uid: str, language_code: str, conversation: Conv
     process_user_emotion(uid, language_code, conversation, urls)
 
 
-def _handle_segment_embedding_matching(uid: str, file_path: str, segments: List[TranscriptSegment], aseg: AudioSegment):
-    if aseg.frame_rate == 16000:
+def _handle_segment_embedding_matching(uid: str, file_path: str, segments: List[TranscriptSegment], frame_rate: int):
+    if frame_rate == 16000:
         matches = get_speech_profile_matching_predictions(uid, file_path, [s.dict() for s in segments])
         for i, segment in enumerate(segments):
             segment.is_user = matches[i]['is_user']
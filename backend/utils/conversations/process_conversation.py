@@ -1,8 +1,11 @@
 import os
 import datetime
+import hashlib
 import random
 import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timezone
 from typing import Union, Tuple, List, Optional
 
@@ -14,7 +17,7 @@ import database.conversations as conversations_db
 import database.notifications as notification_db
 import database.tasks as tasks_db
 import database.trends as trends_db
-from database.apps import record_app_usage, get_omi_personas_by_uid_db, get_app_by_id_db
+from database.apps import record_app_usage, get_omi_personas_by_uid_db
 from database.redis_db import get_user_preferred_app
 from database.vector_db import upsert_vector2, update_vector_metadata
 from models.app import App, UsageHistoryType
@@ -24,11 +27,13 @@ from models.conversation import ExternalIntegrationCreateConversation, Conversat
 from models.task import Task, TaskStatus, TaskAction, TaskActionProvider
 from models.trend import Trend
 from models.notification_message import NotificationMessage
-from utils.apps import get_available_apps, update_personas_async, sync_update_persona_prompt
+from utils.apps import update_personas_async, sync_update_persona_prompt, get_default_apps_catalog, \
+    get_enabled_apps_registry
 from utils.llm.conversation_processing import get_transcript_structure, \
     get_app_result, should_discard_conversation, select_best_app_for_conversation, \
     get_reprocess_transcript_structure
 from utils.llm.memories import extract_memories_from_text, new_memories_extractor
+from utils.llms.memory import dedupe_memories
 from utils.llm.external_integrations import summarize_experience_text
 from utils.llm.openglass import summarize_open_glass
 from utils.llm.trends import trends_extractor
@@ -39,11 +44,13 @@ from utils.notifications import send_notification
 from utils.other.hume import get_hume, HumeJobCallbackModel, HumeJobModelPredictionResponseModel
 from utils.retrieval.rag import retrieve_rag_conversation_context
 from utils.webhooks import conversation_created_webhook
+from utils.other.http_dispatcher import dispatcher
+from utils.other.step_graph import StepGraph, COMPLETED, FAILED
 
 
 def _get_structured(
         uid: str, language_code: str, conversation: Union[Conversation, CreateConversation, ExternalIntegrationCreateConversation],
-        force_process: bool = False
+        force_process: bool = False, transcript: Optional[str] = None
 ) -> Tuple[Structured, bool]:
     try:
         tz = notification_db.get_user_time_zone(uid)
@@ -69,16 +76,19 @@ def _get_structured(
             return summarize_open_glass(conversation.photos), False
 
         # from Omi
+        if transcript is None:
+            transcript = conversation.get_transcript(False)
+
         if force_process:
             # reprocess endpoint
 
-            return get_reprocess_transcript_structure(conversation.get_transcript(False), conversation.started_at, language_code, tz, conversation.structured.title), False
+            return get_reprocess_transcript_structure(transcript, conversation.started_at, language_code, tz, conversation.structured.title), False
 
-        discarded = should_discard_conversation(conversation.get_transcript(False))
+        discarded = should_discard_conversation(transcript)
         if discarded:
             return Structured(emoji=random.choice(['🧠', '🎉'])), True
 
-        return get_transcript_structure(conversation.get_transcript(False), conversation.started_at, language_code, tz), False
+        return get_transcript_structure(transcript, conversation.started_at, language_code, tz), False
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail="Error processing conversation, please try again later")
@@ -121,16 +131,47 @@ CONVERSATION_SUMMARIZED_APP_IDS = os.getenv('CONVERSATION_SUMMARIZED_APP_IDS', '
 
 # Function to get default memory apps
 def get_default_conversation_summarized_apps():
-    default_apps = []
-    for app_id in CONVERSATION_SUMMARIZED_APP_IDS:
-        app_data = get_app_by_id_db(app_id.strip())
-        if app_data:
-            default_apps.append(App(**app_data))
-
-    return default_apps
-
-def _trigger_apps(uid: str, conversation: Conversation, is_reprocess: bool = False, app_id: Optional[str] = None, language_code: str = 'en'):
-    apps: List[App] = get_available_apps(uid)
+    return get_default_apps_catalog([app_id.strip() for app_id in CONVERSATION_SUMMARIZED_APP_IDS])
+
+
+def _app_selection_signature(conversation: Conversation, apps: List[App]) -> str:
+    # conversations alike in shape get the same app, until the candidates or any app change
+    structured = conversation.structured
+    parts = [
+        str(redis_db.get_apps_registry_version()),
+        structured.category.value if structured.category else '',
+        str(bool(structured.action_items)),
+        str(bool(structured.events)),
+        *sorted(app.id for app in apps),
+    ]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _select_best_app(conversation: Conversation, apps: List[App]) -> Optional[App]:
+    if not apps:
+        return None
+    if len(apps) == 1:
+        return apps[0]
+
+    signature = _app_selection_signature(conversation, apps)
+    selected_app_id = redis_db.get_app_selection(signature)
+    if selected_app_id is not None:
+        return next((app for app in apps if app.id == selected_app_id), None)
+
+    best_app = select_best_app_for_conversation(conversation, apps)
+    # None is also what a failed LLM call returns, only a selection is cached
+    if best_app:
+        redis_db.set_app_selection(signature, best_app.id)
+    return best_app
+
+
+def _trigger_apps(uid: str, conversation: Conversation, is_reprocess: bool = False, app_id: Optional[str] = None, language_code: str = 'en',
+                  transcript: Optional[str] = None, timeout: Optional[float] = None) -> List[AppResult]:
+    """
+    Sets the apps results of `conversation`, and returns those that came within `timeout` seconds: the apps still
+    running go on in their own threads, their results only reach `conversation`.
+    """
+    apps: List[App] = get_enabled_apps_registry(uid)
     conversation_apps = [app for app in apps if app.works_with_memories() and app.enabled]
     filtered_apps = []
 
@@ -142,14 +183,15 @@ def _trigger_apps(uid: str, conversation: Conversation, is_reprocess: bool = Fal
 
         # Extend with default apps
         default_apps = get_default_conversation_summarized_apps()
-        filtered_apps.extend(default_apps)
+        enabled_ids = {app.id for app in filtered_apps}
+        filtered_apps.extend(app for app in default_apps if app.id not in enabled_ids)
 
         # Select the best app for this conversation
         if filtered_apps and len(filtered_apps) > 0:
             # Check if the user has a preferred app
             preferred_app_id = get_user_preferred_app(uid)
             if preferred_app_id is None:
-                best_app = select_best_app_for_conversation(conversation, filtered_apps)
+                best_app = _select_best_app(conversation, filtered_apps)
             else:
                 best_app = next((app for app in filtered_apps if app.id == preferred_app_id), None)
 
@@ -170,9 +212,11 @@ def _trigger_apps(uid: str, conversation: Conversation, is_reprocess: bool = Fal
     conversation.apps_results = []
 
     threads = []
+    if transcript is None:
+        transcript = conversation.get_transcript(False)
 
     def execute_app(app):
-        result = get_app_result(conversation.get_transcript(False), app, language_code=language_code).strip()
+        result = get_app_result(transcript, app, language_code=language_code).strip()
         conversation.apps_results.append(AppResult(app_id=app.id, content=result))
         if not is_reprocess:
             record_app_usage(uid, app.id, UsageHistoryType.memory_created_prompt, conversation_id=conversation.id)
@@ -181,7 +225,13 @@ def _trigger_apps(uid: str, conversation: Conversation, is_reprocess: bool = Fal
         threads.append(threading.Thread(target=execute_app, args=(app,)))
 
     [t.start() for t in threads]
-    [t.join() for t in threads]
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for t in threads:
+        t.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+    late = sum(1 for t in threads if t.is_alive())
+    if late:
+        print(f'{late} apps did not answer in {timeout}s, left out', uid)
+    return list(conversation.apps_results)
 
 
 def _extract_memories(uid: str, conversation: Conversation):
@@ -200,6 +250,8 @@ def _extract_memories(uid: str, conversation: Conversation):
         # For regular conversations with transcript segments
         new_memories = new_memories_extractor(uid, conversation.transcript_segments)
 
+    new_memories = dedupe_memories(uid, new_memories, conversation.id)
+
     parsed_memories = []
     for memory in new_memories:
         parsed_memories.append(MemoryDB.from_memory(memory, uid, conversation.id, False))
@@ -233,8 +285,7 @@ def _extract_trends(conversation: Conversation):
     trends_db.save_trends(conversation, parsed)
 
 
-def save_structured_vector(uid: str, conversation: Conversation, update_only: bool = False):
-    vector = generate_embedding(str(conversation.structured)) if not update_only else None
+def _get_vector_metadata(uid: str, conversation: Conversation) -> dict:
     tz = notification_db.get_user_time_zone(uid)
 
     metadata = {}
@@ -255,6 +306,15 @@ def save_structured_vector(uid: str, conversation: Conversation, update_only: bo
         metadata = retrieve_metadata_fields_from_transcript(uid, conversation.created_at, segments, tz)
 
     metadata['created_at'] = int(conversation.created_at.timestamp())
+    return metadata
+
+
+def save_structured_vector(uid: str, conversation: Conversation, update_only: bool = False,
+                           vector: Optional[List[float]] = None, metadata: Optional[dict] = None):
+    if vector is None and not update_only:
+        vector = generate_embedding(str(conversation.structured))
+    if metadata is None:
+        metadata = _get_vector_metadata(uid, conversation)
 
     if not update_only:
         print('save_structured_vector creating vector')
@@ -277,25 +337,112 @@ def _update_personas_async(uid: str):
         print(f"[PERSONAS] Finished persona updates in background thread for uid={uid}")
 
 
-def process_conversation(
+# Post-conversation steps of every process_conversation in the process share these workers
+conversation_steps_executor = ThreadPoolExecutor(max_workers=int(os.getenv('CONVERSATION_STEPS_WORKERS', 32)),
+                                                 thread_name_prefix='conversation-steps')
+# apps that take longer are left out of the saved conversation instead of holding a worker
+apps_timeout_seconds = 110
+
+
+def _conversation_steps(
         uid: str, language_code: str, conversation: Union[Conversation, CreateConversation, ExternalIntegrationCreateConversation],
         force_process: bool = False, is_reprocess: bool = False, app_id: Optional[str] = None
-) -> Conversation:
-    structured, discarded = _get_structured(uid, language_code, conversation, force_process)
-    conversation = _get_conversation_obj(uid, structured, conversation)
+) -> StepGraph:
+    """
+    transcript -> structured -> conversation -> apps -> saved -> webhook, personas
+                                             -> embedding, vector_metadata -> vector
+                                             -> memories
+
+    A failing step only skips its dependents: the conversation is saved whatever the apps, vector and memories did.
+    """
+    graph = StepGraph(f'process_conversation {uid}', conversation_steps_executor)
+
+    def structured_step(transcript: str):
+        return _get_structured(uid, language_code, conversation, force_process, transcript=transcript)
+
+    def conversation_step(structured_result: Tuple[Structured, bool]):
+        return _get_conversation_obj(uid, structured_result[0], conversation)
+
+    def apps_step(structured_result: Tuple[Structured, bool], obj: Conversation, transcript: str):
+        if structured_result[1]:
+            return None
+        # on a copy, `saved` takes the results once the step completed: a late app never touches what it writes
+        return _trigger_apps(uid, obj.model_copy(), is_reprocess=is_reprocess, app_id=app_id,
+                             language_code=language_code, transcript=transcript, timeout=apps_timeout_seconds)
+
+    def saved_step(obj: Conversation, apps_results: Optional[List[AppResult]]):
+        if apps_results is not None:
+            obj.apps_results = apps_results
+        obj.status = ConversationStatus.completed
+        conversations_db.upsert_conversation(uid, obj.dict())
+        return obj
+
+    def embedding_step(structured_result: Tuple[Structured, bool], obj: Conversation):
+        if structured_result[1] or is_reprocess:
+            return None
+        return generate_embedding(str(obj.structured))
+
+    def vector_metadata_step(structured_result: Tuple[Structured, bool], obj: Conversation):
+        if structured_result[1] or is_reprocess:
+            return None
+        return _get_vector_metadata(uid, obj)
+
+    def vector_step(obj: Conversation, vector: Optional[List[float]], metadata: Optional[dict]):
+        if vector is None:
+            return
+        save_structured_vector(uid, obj, vector=vector, metadata=metadata)
+
+    def memories_step(structured_result: Tuple[Structured, bool], obj: Conversation):
+        if structured_result[1]:
+            return
+        _extract_memories(uid, obj)
+
+    def webhook_step(obj: Conversation):
+        if not is_reprocess:
+            dispatcher.submit(conversation_created_webhook, uid, obj)
 
-    if not discarded:
-        _trigger_apps(uid, conversation, is_reprocess=is_reprocess, app_id=app_id, language_code=language_code)
-        threading.Thread(target=save_structured_vector, args=(uid, conversation,)).start() if not is_reprocess else None
-        threading.Thread(target=_extract_memories, args=(uid, conversation)).start()
+    def personas_step(obj: Conversation):
+        # Update persona prompts with new conversation
+        if not is_reprocess:
+            update_personas_async(uid)
+
+    graph.add('transcript', lambda: conversation.get_transcript(False))
+    graph.add('structured', structured_step, requires=['transcript'], timeout=120)
+    graph.add('conversation', conversation_step, requires=['structured'], timeout=30)
+    # the apps step returns at `apps_timeout_seconds` without the late apps, the step timeout is a backstop
+    graph.add('apps', apps_step, requires=['structured', 'conversation', 'transcript'],
+              timeout=apps_timeout_seconds + 10)
+    graph.add('saved', saved_step, requires=['conversation'], uses=['apps'], timeout=30, retries=2,
+              retry_timeouts=False)
+    graph.add('embedding', embedding_step, requires=['structured', 'conversation'], timeout=30, retries=2)
+    graph.add('vector_metadata', vector_metadata_step, requires=['structured', 'conversation'], timeout=60,
+              retries=1)
+    graph.add('vector', vector_step, requires=['conversation', 'embedding', 'vector_metadata'], timeout=30,
+              retries=2, retry_timeouts=False)
+    graph.add('memories', memories_step, requires=['structured', 'conversation'], timeout=120, retries=1,
+              retry_timeouts=False)
+    graph.add('webhook', webhook_step, requires=['saved'])
+    graph.add('personas', personas_step, requires=['saved'], timeout=300)
+    return graph
 
-    conversation.status = ConversationStatus.completed
-    conversations_db.upsert_conversation(uid, conversation.dict())
 
-    if not is_reprocess:
-        threading.Thread(target=conversation_created_webhook, args=(uid, conversation,)).start()
-        # Update persona prompts with new conversation
-        threading.Thread(target=update_personas_async, args=(uid,)).start()
+def process_conversation(
+        uid: str, language_code: str, conversation: Union[Conversation, CreateConversation, ExternalIntegrationCreateConversation],
+        force_process: bool = False, is_reprocess: bool = False, app_id: Optional[str] = None
+) -> Conversation:
+    run = _conversation_steps(uid, language_code, conversation, force_process, is_reprocess, app_id).start()
+
+    # the conversation is returned once saved, vectors, memories and personas go on in the background
+    run.wait(['saved'])
+    if run.status['saved'] != COMPLETED:
+        for name in ('transcript', 'structured', 'conversation', 'saved'):
+            if run.status[name] == FAILED:
+                # the step's own error (e.g. the structured step's HTTPException)
+                run.result(name)
+            if run.status[name] != COMPLETED:
+                print(f'process_conversation {uid}: step {name} {run.status[name]}')
+                raise HTTPException(status_code=500, detail="Error processing conversation, please try again later")
+    conversation = run.result('saved')
 
     # TODO: trigger external integrations here too
 
@@ -0,0 +1,446 @@
+"""
+Offline sync of the device's local files (/v1/sync-local-files): length-prefixed opus recordings decoded, cut into
+voice segments, transcribed and merged into the user's conversations.
+
+An upload is a job identified by the content of its files. Each file is decoded to wav frame by frame and its voice
+segments cut out of it in a streaming pass (`export_wav_slices`), so memory does not grow with the length of the
+recording; the segments are transcribed on a pool shared by all uploads, then grouped by the conversation they go
+to and each conversation written once (`submit_transcript_merges`). The job's progress per file, and the segments already merged, are kept in Redis: uploading the
+same files again (the device retrying after a timeout) reports the progress of the job if it is still running, and
+resumes it otherwise, without merging a segment twice.
+"""
+import hashlib
+import os
+import re
+import struct
+import threading
+import uuid
+import wave
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from opuslib import Decoder
+
+from database import redis_db
+from database.conversations import closest_conversation_to_timestamps, get_conversation_for_update, \
+    get_conversations_near_timestamps, update_conversation_segments_if_unchanged
+from models.conversation import CreateConversation
+from models.transcript_segment import TranscriptSegment
+from utils.audio import export_wav_slices, get_wav_duration_seconds
+from utils.conversations.process_conversation import process_conversation
+from utils.other.storage import get_syncing_file_temporal_signed_url, delete_syncing_temporal_file
+from utils.stt.pre_recorded import fal_whisperx, fal_postprocessing
+from utils.stt.vad import vad_is_empty
+
+# shared by all uploads of the instance, FAL has a 10 RPS limit
+sync_transcription_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('SYNC_TRANSCRIPTION_WORKERS', 5)), thread_name_prefix='sync-transcription')
+# conversations being written at once, across uploads
+sync_merge_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('SYNC_MERGE_WORKERS', 2)), thread_name_prefix='sync-merge')
+
+sync_job_claim_ttl = 10 * 60
+# decoded opus frames buffered before they are written to the wav
+decode_flush_frames = 500
+# voice segments closer than this are transcribed as one
+segments_join_gap_seconds = 120
+# conditional writes of a conversation's merged segments, before giving up on it
+merge_attempts = 5
+
+# (timestamp the transcript started at, its segments, language)
+Transcript = Tuple[int, List[TranscriptSegment], Optional[str]]
+
+
+def get_timestamp_from_path(path: str):
+    timestamp = int(path.split('/')[-1].split('_')[-1].split('.')[0])
+    if timestamp > 1e10:
+        return int(timestamp / 1000)
+    return timestamp
+
+
+def get_frame_size_from_path(path: str, default: int = 160) -> int:
+    filename = os.path.basename(path)
+    match = re.search(r'_fs(\d+)', filename)
+    if match:
+        try:
+            frame_size = int(match.group(1))
+            print(f"Found frame size {frame_size} in filename: {filename}")
+            return frame_size
+        except ValueError:
+            print(f"Invalid frame size format in filename: {filename}, using default {default}")
+    return default
+
+
+def decode_opus_file_to_wav(opus_file_path, wav_file_path, sample_rate=16000, channels=1, frame_size: int = 160) -> int:
+    """Decodes the length-prefixed opus frames to a 16 bit wav as they are read, returns the frames decoded."""
+    decoder = Decoder(sample_rate, channels)
+    wav_file = None
+    pcm_data = []
+    frame_count = 0
+
+    def flush():
+        nonlocal wav_file
+        if wav_file is None:
+            wav_file = wave.open(wav_file_path, 'wb')
+            wav_file.setnchannels(channels)
+            wav_file.setsampwidth(2)  # 16-bit audio
+            wav_file.setframerate(sample_rate)
+        wav_file.writeframes(b''.join(pcm_data))
+        pcm_data.clear()
+
+    try:
+        with open(opus_file_path, 'rb') as f:
+            while True:
+                length_bytes = f.read(4)
+                if not length_bytes:
+                    print("End of file reached.")
+                    break
+                if len(length_bytes) < 4:
+                    print("Incomplete length prefix at the end of the file.")
+                    break
+
+                frame_length = struct.unpack('<I', length_bytes)[0]
+                opus_data = f.read(frame_length)
+                if len(opus_data) < frame_length:
+                    print(f"Unexpected end of file at frame {frame_count}.")
+                    break
+                try:
+                    pcm_data.append(decoder.decode(opus_data, frame_size=frame_size))
+                    frame_count += 1
+                except Exception as e:
+                    print(f"Error decoding frame {frame_count}: {e}")
+                    break
+                if len(pcm_data) >= decode_flush_frames:
+                    flush()
+            if pcm_data:
+                flush()
+    finally:
+        if wav_file is not None:
+            wav_file.close()
+
+    if frame_count:
+        print(f"Decoded audio saved to {wav_file_path}")
+    else:
+        print("No PCM data was decoded.")
+    return frame_count
+
+
+def get_sync_job_id(paths: List[str]) -> str:
+    """Same files, same job: sha256 of their names and contents."""
+    digest = hashlib.sha256()
+    for path in sorted(paths, key=os.path.basename):
+        digest.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as f:
+            while block := f.read(1 << 20):
+                digest.update(block)
+    return digest.hexdigest()[:32]
+
+
+def get_voice_segments(wav_path: str) -> List[dict]:
+    """Voice segments of the file, closer than `segments_join_gap_seconds` joined, shorter than a second dropped."""
+    voice_segments = vad_is_empty(wav_path, return_segments=True, cache=True)
+
+    # edge case, multiple small segments that map towards the same memory .-.
+    # so ... let's merge them if distance < 120 seconds
+    # a better option would be to keep here 1s, and merge them like that after transcribing
+    # but FAL has 10 RPS limit, **let's merge it here for simplicity for now**
+    segments = []
+    for segment in voice_segments:
+        if segments and (segment['start'] - segments[-1]['end']) < segments_join_gap_seconds:
+            segments[-1]['end'] = segment['end']
+        else:
+            segments.append(dict(segment))
+    return [segment for segment in segments if (segment['end'] - segment['start']) >= 1]
+
+
+def transcribe_segment(path: str) -> Tuple[List[TranscriptSegment], Optional[str]]:
+    """Transcript of the segment's wav, the local and uploaded files deleted once transcribed."""
+    try:
+        url = get_syncing_file_temporal_signed_url(path)
+        try:
+            words, language = fal_whisperx(url, 3, 2, True)
+        finally:
+            try:
+                delete_syncing_temporal_file(path)
+            except Exception as e:
+                print('transcribe_segment delete', path, e)
+        return fal_postprocessing(words, 0), language
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _merge_transcript(segments: List[dict], started_at: float, timestamp: float,
+                      transcript_segments: List[dict]) -> List[dict]:
+    """The segments of a conversation started at `started_at` with the transcript started at `timestamp` merged in."""
+    segments = [dict(segment) for segment in segments]
+    transcript_segments = [dict(segment) for segment in transcript_segments]
+
+    # assign timestamps to each segment
+    for segment in transcript_segments:
+        segment['timestamp'] = timestamp + segment['start']
+    for segment in segments:
+        segment['timestamp'] = started_at + segment['start']
+
+    # merge and sort segments by start timestamp
+    segments = segments + transcript_segments
+    segments.sort(key=lambda x: x['timestamp'])
+
+    # fix segment.start .end to be relative to the memory
+    for segment in segments:
+        duration = segment['end'] - segment['start']
+        segment['start'] = segment['timestamp'] - started_at
+        segment['end'] = segment['start'] + duration
+
+    # remove timestamp field
+    for segment in segments:
+        segment.pop('timestamp')
+    return segments
+
+
+def _write_conversation_transcripts(uid: str, conversation: dict, transcripts: List[Transcript]) -> Tuple[str, str]:
+    if conversation['id'] is None:
+        timestamp, transcript_segments, language = transcripts[0]
+        segments = [s.dict() for s in transcript_segments]
+        for timestamp, transcript_segments, _ in transcripts[1:]:
+            segments = _merge_transcript(segments, conversation['started_at'].timestamp(), timestamp,
+                                         [s.dict() for s in transcript_segments])
+        create_memory = CreateConversation(
+            started_at=conversation['started_at'],
+            finished_at=conversation['finished_at'],
+            transcript_segments=[TranscriptSegment(**segment) for segment in segments]
+        )
+        created = process_conversation(uid, language, create_memory)
+        return 'new', created.id
+
+    conversation_id = conversation['id']
+    for _ in range(merge_attempts):
+        segments = conversation['transcript_segments']
+        for timestamp, transcript_segments, _ in transcripts:
+            segments = _merge_transcript(segments, conversation['started_at'].timestamp(), timestamp,
+                                         [s.dict() for s in transcript_segments])
+        if update_conversation_segments_if_unchanged(uid, conversation, segments):
+            return 'updated', conversation['id']
+        # written since it was read (e.g. the live transcript), merged again on top of it
+        print('sync_local_files conflict', conversation_id)
+        conversation = get_conversation_for_update(uid, conversation_id)
+        if conversation is None:
+            # deleted meanwhile, nothing to write, as `update_conversation_segments`
+            return 'updated', conversation_id
+    raise Exception(f'sync_local_files: conversation changed {merge_attempts} times while merging')
+
+
+def submit_transcript_merges(uid: str, transcripts: List[Transcript]) -> List[Tuple[List[int], Future]]:
+    """
+    Merges the transcripts ((timestamp they started at, segments, language), in timestamp order) into the user's
+    conversations: each goes to the conversation that adding them one at a time to the closest one, or creating it,
+    would give, and the same transcripts result. The candidates are read in one query, and each conversation is
+    written once, on `sync_merge_executor`; the write is conditional on the conversation not changing since it was
+    read, it is read and merged again if it did.
+
+    Returns the indexes of the transcripts that went to each conversation, and the future of its write:
+    ('new' or 'updated', conversation id).
+    """
+    if not transcripts:
+        return []
+    candidates = get_conversations_near_timestamps(
+        uid, transcripts[0][0], max(timestamp + segments[-1].end for timestamp, segments, _ in transcripts))
+
+    groups = {}
+    for i, (timestamp, transcript_segments, _) in enumerate(transcripts):
+        end_timestamp = timestamp + transcript_segments[-1].end
+        closest = closest_conversation_to_timestamps(candidates, timestamp, end_timestamp)
+        if closest is None:
+            # the conversation this one creates, a candidate for the next ones (newest first, as queried)
+            closest = {'id': None, 'started_at': datetime.fromtimestamp(timestamp),
+                       'finished_at': datetime.fromtimestamp(end_timestamp)}
+            candidates.insert(0, closest)
+        groups.setdefault(id(closest), (closest, []))[1].append(i)
+
+    return [(indexes, sync_merge_executor.submit(_write_conversation_transcripts, uid, conversation,
+                                                 [transcripts[i] for i in indexes]))
+            for conversation, indexes in groups.values()]
+
+
+class SyncLocalFilesJob:
+    """
+    The upload of `paths` (the device's .bin files, in a directory of their own that the caller removes). `run`
+    processes it and returns its state:
+
+    - status: `running` (another request is processing the same files), `completed`, or `failed` when a file or
+      segment failed; uploading the same files again resumes it
+    - files: progress of each file by name, its status (`received`, `segmented`, `completed`, `skipped` when
+      shorter than a second, `failed`), duration, voice segments, and how many are transcribed and merged
+    - new_memories, updated_memories: ids of the conversations the job created and added to
+    """
+
+    def __init__(self, uid: str, paths: List[str]):
+        self.uid = uid
+        self.paths = sorted(paths, key=get_timestamp_from_path)
+        self.job_id = get_sync_job_id(paths)
+        self._lock = threading.Lock()
+        self._token = uuid.uuid4().hex
+
+        self.state = redis_db.get_sync_job(uid, self.job_id) or {
+            'job_id': self.job_id, 'status': 'received', 'files': {}, 'merged': [],
+            'new_memories': [], 'updated_memories': [],
+        }
+        for path in self.paths:
+            self.state['files'].setdefault(os.path.basename(path), {
+                'status': 'received', 'duration': None, 'segments': None, 'transcribed': 0, 'merged': 0,
+            })
+
+    def run(self) -> dict:
+        if not self._claim():
+            # the device retried while the first request is still at it
+            return self.response(redis_db.get_sync_job(self.uid, self.job_id) or self.state)
+
+        transcriptions: List[Tuple[dict, Future]] = []
+        try:
+            self.state['status'] = 'running'
+            self._save()
+            for path in self.paths:
+                for segment in self._segment_file(path):
+                    job = sync_transcription_executor.submit(transcribe_segment, segment['path'])
+                    job.add_done_callback(lambda _, name=segment['file']: self._progress(name, 'transcribed'))
+                    transcriptions.append((segment, job))
+
+            transcriptions.sort(key=lambda item: item[0]['timestamp'])
+            segments, transcripts = [], []
+            for segment, job in transcriptions:
+                if transcript := self._transcript(segment, job):
+                    segments.append(segment)
+                    transcripts.append(transcript)
+            self._merge(segments, transcripts)
+
+            failed = any(file['status'] == 'failed' for file in self.state['files'].values())
+            self.state['status'] = 'failed' if failed else 'completed'
+            self._save()
+            return self.response(self.state)
+        except Exception:
+            self.state['status'] = 'failed'
+            self._save()
+            raise
+        finally:
+            # nothing left running on the job's files once it returns
+            for _, job in transcriptions:
+                job.cancel()
+            wait([job for _, job in transcriptions])
+            self._release()
+
+    @staticmethod
+    def response(state: dict) -> dict:
+        return {key: value for key, value in state.items() if key != 'merged'}
+
+    def _segment_file(self, path: str) -> List[dict]:
+        """Decodes the file and cuts its voice segments that are not merged yet, each to a wav of its own."""
+        name = os.path.basename(path)
+        progress = self.state['files'][name]
+        wav_path = path.replace('.bin', '.wav')
+        try:
+            frames = decode_opus_file_to_wav(path, wav_path, frame_size=get_frame_size_from_path(path))
+            os.remove(path)
+            duration = get_wav_duration_seconds(wav_path) if frames else 0
+            progress['duration'] = duration
+            if duration < 1:
+                progress['status'] = 'skipped'
+                return []
+
+            start_timestamp = get_timestamp_from_path(path)
+            voice_segments = get_voice_segments(wav_path)
+            print(path, voice_segments)
+
+            segments = []
+            for segment in voice_segments:
+                key = f"{name}:{segment['start']:.2f}"
+                if key in self.state['merged']:
+                    continue
+                segment_timestamp = start_timestamp + segment['start']
+                segment_path = f'{os.path.dirname(path)}/{segment_timestamp}.wav'
+                export_wav_slices(wav_path, segment_path, [(segment['start'] * 1000, segment['end'] * 1000)])
+                segments.append({'file': name, 'key': key, 'path': segment_path, 'timestamp': int(segment_timestamp)})
+            progress['segments'] = len(voice_segments)
+            progress['transcribed'] = progress['merged'] = len(voice_segments) - len(segments)
+            progress['status'] = 'segmented' if segments else 'completed'
+            return segments
+        except Exception as e:
+            print('sync_local_files', path, e)
+            progress['status'] = 'failed'
+            return []
+        finally:
+            if os.path.exists(wav_path):
+                os.remove(wav_path)
+            self._save()
+
+    def _transcript(self, segment: dict, job: Future) -> Optional[Transcript]:
+        try:
+            transcript_segments, language = job.result()
+        except Exception as e:
+            print('sync_local_files', segment['path'], e)
+            self._failed([segment])
+            return None
+        if not transcript_segments:
+            print('failed to get fal segments')
+            self._merged(segment)
+            return None
+        return segment['timestamp'], transcript_segments, language
+
+    def _merge(self, segments: List[dict], transcripts: List[Transcript]):
+        try:
+            merges = submit_transcript_merges(self.uid, transcripts)
+        except Exception as e:
+            print('sync_local_files merge', e)
+            self._failed(segments)
+            return
+        for indexes, job in merges:
+            try:
+                kind, conversation_id = job.result()
+            except Exception as e:
+                print('sync_local_files merge', e)
+                self._failed([segments[i] for i in indexes])
+                continue
+            with self._lock:
+                memories = self.state['new_memories' if kind == 'new' else 'updated_memories']
+                if conversation_id not in memories:
+                    memories.append(conversation_id)
+            for i in indexes:
+                self._merged(segments[i])
+
+    def _merged(self, segment: dict):
+        with self._lock:
+            self.state['merged'].append(segment['key'])
+        self._progress(segment['file'], 'merged')
+
+    def _failed(self, segments: List[dict]):
+        with self._lock:
+            for segment in segments:
+                self.state['files'][segment['file']]['status'] = 'failed'
+        self._save()
+
+    def _progress(self, name: str, counter: str):
+        with self._lock:
+            progress = self.state['files'][name]
+            progress[counter] += 1
+            if progress['merged'] == progress['segments'] and progress['status'] == 'segmented':
+                progress['status'] = 'completed'
+        self._save()
+
+    def _save(self):
+        with self._lock:
+            redis_db.set_sync_job(self.uid, self.job_id, self.state)
+        redis_db.extend_sync_job_claim(self.uid, self.job_id, self._token, ttl=sync_job_claim_ttl)
+
+    def _claim(self) -> bool:
+        try:
+            return redis_db.claim_sync_job(self.uid, self.job_id, self._token, ttl=sync_job_claim_ttl)
+        except Exception as e:
+            # syncing without the claim is better than not syncing
+            print(f'sync_local_files: could not claim {self.job_id}: {e}')
+            return True
+
+    def _release(self):
+        try:
+            redis_db.release_sync_job(self.uid, self.job_id, self._token)
+        except Exception as e:
+            print(f'sync_local_files: could not release {self.job_id}: {e}')
@@ -1,5 +1,9 @@
 import base64
 import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
@@ -27,15 +31,55 @@ def derive_key(uid: str) -> bytes:
     return hkdf.derive(ENCRYPTION_SECRET)
 
 
-def encrypt(data: str, uid: str) -> str:
+# *********************************
+# ******* DERIVED KEY CACHE *******
+# *********************************
+
+# uid -> (cipher, expires_at), least recently used first
+_cipher_cache: 'OrderedDict[str, Tuple[AESGCM, float]]' = OrderedDict()
+_cipher_cache_lock = threading.Lock()
+_cipher_cache_max_size = int(os.getenv('ENCRYPTION_KEY_CACHE_SIZE', 1000))
+_cipher_cache_ttl_seconds = int(os.getenv('ENCRYPTION_KEY_CACHE_TTL_SECONDS', 300))
+
+
+def _get_cipher(uid: str) -> AESGCM:
     """
-    Encrypts a string using a user-specific key.
-    Returns a base64 encoded string containing nonce + ciphertext + tag.
+    AES-GCM cipher for the user's derived key. The key is derived once per uid and the cipher cached for a short
+    TTL. AESGCM keeps its own immutable copy of the key, so evicting or clearing an entry only drops the
+    reference: the key bytes are freed by the garbage collector, never overwritten.
     """
-    if not data:
-        return data
-    key = derive_key(uid)
-    aesgcm = AESGCM(key)
+    now = time.monotonic()
+    with _cipher_cache_lock:
+        cached = _cipher_cache.get(uid)
+        if cached is not None:
+            if cached[1] > now:
+                _cipher_cache.move_to_end(uid)
+                return cached[0]
+            del _cipher_cache[uid]
+
+    cipher = AESGCM(derive_key(uid))
+    with _cipher_cache_lock:
+        _cipher_cache.pop(uid, None)
+        _cipher_cache[uid] = (cipher, now + _cipher_cache_ttl_seconds)
+        while len(_cipher_cache) > _cipher_cache_max_size:
+            _cipher_cache.popitem(last=False)
+    return cipher
+
+
+def clear_key_cache(uid: Optional[str] = None):
+    """Drops the cached cipher of a user, or of every user when uid is None."""
+    with _cipher_cache_lock:
+        if uid is None:
+            _cipher_cache.clear()
+        else:
+            _cipher_cache.pop(uid, None)
+
+
+# *****************************
+# ********* ENCRYPT ***********
+# *****************************
+
+def _encrypt(aesgcm: AESGCM, data: str) -> str:
     nonce = os.urandom(12)  # GCM standard nonce size
 
     # Data must be bytes
@@ -49,17 +93,8 @@ def encrypt(data: str, uid: str) -> str:
     return base64.b64encode(encrypted_payload).decode('utf-8')
 
 
-def decrypt(encrypted_data: str, uid: str) -> str:
-    """
-    Decrypts a base64 encoded string using a user-specific key.
-    """
-    if not encrypted_data or not isinstance(encrypted_data, str):
-        return encrypted_data
-
+def _decrypt(aesgcm: AESGCM, encrypted_data: str, uid: str) -> str:
     try:
-        key = derive_key(uid)
-        aesgcm = AESGCM(key)
-
         encrypted_payload = base64.b64decode(encrypted_data.encode('utf-8'))
 
         # Extract nonce and ciphertext
@@ -75,3 +110,38 @@ def decrypt(encrypted_data: str, uid: str) -> str:
         # to log this error.
         print(f"Decryption failed for user {uid}: {e}")
         return encrypted_data
+
+
+def encrypt(data: str, uid: str) -> str:
+    """
+    Encrypts a string using a user-specific key.
+    Returns a base64 encoded string containing nonce + ciphertext + tag.
+    """
+    if not data:
+        return data
+    return _encrypt(_get_cipher(uid), data)
+
+
+def decrypt(encrypted_data: str, uid: str) -> str:
+    """
+    Decrypts a base64 encoded string using a user-specific key.
+    """
+    if not encrypted_data or not isinstance(encrypted_data, str):
+        return encrypted_data
+    return _decrypt(_get_cipher(uid), encrypted_data, uid)
+
+
+def encrypt_batch(items: List[str], uid: str) -> List[str]:
+    """Same as `encrypt` for each item, with a single key lookup for the whole list."""
+    if not any(items):
+        return list(items)
+    aesgcm = _get_cipher(uid)
+    return [_encrypt(aesgcm, data) if data else data for data in items]
+
+
+def decrypt_batch(items: List[str], uid: str) -> List[str]:
+    """Same as `decrypt` for each item, with a single key lookup for the whole list."""
+    if not any(item and isinstance(item, str) for item in items):
+        return list(items)
+    aesgcm = _get_cipher(uid)
+    return [_decrypt(aesgcm, item, uid) if item and isinstance(item, str) else item for item in items]
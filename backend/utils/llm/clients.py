@@ -6,6 +6,7 @@ from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 import tiktoken
 
 from models.conversation import Structured
+from utils.llm.embeddings_cache import CachedEmbeddings, FakeEmbeddings
 
 llm_mini = ChatOpenAI(model='gpt-4o-mini')
 llm_mini_stream = ChatOpenAI(model='gpt-4o-mini', streaming=True)
@@ -32,7 +33,21 @@ llm_persona_medium_stream = ChatOpenAI(
     default_headers={"X-Title": "Omi Chat"},
     streaming=True,
 )
-embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
+
+# Embeddings go through a content-addressed cache, bump EMBEDDINGS_CACHE_VERSION to drop every cached vector.
+# EMBEDDINGS_BACKEND=fake swaps the model for deterministic offline vectors (tests, load runs).
+embeddings_model = 'text-embedding-3-large'
+if os.getenv('EMBEDDINGS_BACKEND') == 'fake':
+    embeddings_model = 'fake-3072'
+    _embeddings_backend = FakeEmbeddings(
+        size=3072, latency_seconds=float(os.getenv('FAKE_EMBEDDINGS_LATENCY_SECONDS', 0)))
+else:
+    _embeddings_backend = OpenAIEmbeddings(model=embeddings_model)
+embeddings = CachedEmbeddings(
+    _embeddings_backend,
+    namespace=f"{embeddings_model}:{os.getenv('EMBEDDINGS_CACHE_VERSION', 'v1')}",
+    max_local_items=int(os.getenv('EMBEDDINGS_CACHE_LOCAL_ITEMS', 2048)),
+)
 parser = PydanticOutputParser(pydantic_object=Structured)
 
 encoding = tiktoken.encoding_for_model('gpt-4')
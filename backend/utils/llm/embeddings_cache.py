@@ -0,0 +1,229 @@
+"""
+Content-addressed cache in front of an embeddings model.
+
+Vectors are keyed by sha256 of the text under a model/version namespace, stored as packed float32
+(`array('f')`, 12KB for 3072 dims instead of ~60KB of JSON) in an in-process LRU and in Redis.
+Concurrent misses are coalesced: texts requested while a batch is being collected go out in a single
+`embed_documents` call, and a text already on its way to the model is waited on instead of re-embedded.
+"""
+import hashlib
+import math
+import random
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+from database import redis_db
+
+
+def _encode(vector: List[float]) -> bytes:
+    return array('f', vector).tobytes()
+
+
+def _decode(data: bytes) -> List[float]:
+    vector = array('f')
+    vector.frombytes(data)
+    return vector.tolist()
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic offline backend (unit vectors seeded by the text) for tests and load runs,
+    with a simulated per-call latency. Counts calls and embedded texts.
+    """
+
+    def __init__(self, size: int = 3072, latency_seconds: float = 0):
+        self.size = size
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, text: str) -> List[float]:
+        rng = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+        vector = [rng.gauss(0, 1) for _ in range(self.size)]
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.calls += 1
+            self.texts += len(texts)
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Drop-in `Embeddings` wrapper. `namespace` must change whenever the model (or its dimensions) does,
+    cached vectors of another model are never returned. Vectors are always returned through the float32
+    encoding, so a hit and a miss give the same values.
+    """
+
+    def __init__(self, backend: Embeddings, namespace: str, max_local_items: int = 2048,
+                 redis_ttl: int = 60 * 60 * 24 * 30, batch_window_seconds: float = 0.005,
+                 max_batch_size: int = 256, use_redis: bool = True):
+        self.backend = backend
+        self.namespace = namespace
+        self.max_local_items = max_local_items
+        self.redis_ttl = redis_ttl
+        self.batch_window_seconds = batch_window_seconds
+        self.max_batch_size = max_batch_size
+        self.use_redis = use_redis
+
+        self._local: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending: Dict[str, tuple] = {}  # key -> (text, future), waiting for the next batch
+        self._in_flight: Dict[str, Future] = {}  # key -> future, being embedded
+        self._flush_scheduled = False
+        self._stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0, 'coalesced': 0, 'backend_calls': 0}
+
+    def _key(self, text: str) -> str:
+        return f'{self.namespace}:{hashlib.sha256(text.encode("utf-8")).hexdigest()}'
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['local_hits'] + stats['redis_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['local_hits'] + stats['redis_hits']) / lookups, 4) if lookups else 0
+        return stats
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    # *****************************
+    # ********** LOOKUP ***********
+    # *****************************
+
+    def _store_local(self, values: Dict[str, bytes]):
+        with self._lock:
+            for key, value in values.items():
+                self._local[key] = value
+                self._local.move_to_end(key)
+            while len(self._local) > self.max_local_items:
+                self._local.popitem(last=False)
+
+    def _get_redis(self, keys: List[str]) -> Dict[str, bytes]:
+        if not self.use_redis or not keys:
+            return {}
+        try:
+            return {key: value for key, value in zip(keys, redis_db.get_cached_embeddings(keys)) if value}
+        except Exception as e:
+            print('embeddings cache: redis get failed', e)
+            return {}
+
+    def _set_redis(self, values: Dict[str, bytes]):
+        if not self.use_redis or not values:
+            return
+        try:
+            redis_db.set_cached_embeddings(values, ttl=self.redis_ttl)
+        except Exception as e:
+            print('embeddings cache: redis set failed', e)
+
+    # *****************************
+    # ******** COALESCING *********
+    # *****************************
+
+    def _flush(self):
+        with self._lock:
+            batch = self._pending
+            self._pending = {}
+            self._flush_scheduled = False
+            for key, (_, future) in batch.items():
+                self._in_flight[key] = future
+
+        keys = list(batch.keys())
+        try:
+            texts = [batch[key][0] for key in keys]
+            vectors = []
+            for i in range(0, len(texts), self.max_batch_size):
+                with self._lock:
+                    self._stats['backend_calls'] += 1
+                vectors.extend(self.backend.embed_documents(texts[i:i + self.max_batch_size]))
+            values = {key: _encode(vector) for key, vector in zip(keys, vectors)}
+            self._store_local(values)
+            self._set_redis(values)
+            for key in keys:
+                batch[key][1].set_result(values[key])
+        except Exception as e:
+            for key in keys:
+                if not batch[key][1].done():
+                    batch[key][1].set_exception(e)
+        finally:
+            with self._lock:
+                for key in keys:
+                    self._in_flight.pop(key, None)
+
+    def _embed_missing(self, missing: Dict[str, str]) -> Dict[str, bytes]:
+        futures = {}
+        leader = False
+        with self._lock:
+            for key, text in missing.items():
+                future = self._in_flight.get(key) or self._pending.get(key, (None, None))[1]
+                if future is not None:
+                    self._stats['coalesced'] += 1
+                else:
+                    future = Future()
+                    self._pending[key] = (text, future)
+                futures[key] = future
+            if self._pending and not self._flush_scheduled:
+                self._flush_scheduled = True
+                leader = True
+
+        # The first caller collects whatever else arrives during the window and embeds it all in one call
+        if leader:
+            if self.batch_window_seconds > 0:
+                time.sleep(self.batch_window_seconds)
+            self._flush()
+        return {key: future.result() for key, future in futures.items()}
+
+    # *****************************
+    # ********* EMBEDDINGS ********
+    # *****************************
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        values: Dict[str, bytes] = {}
+        missing: Dict[str, str] = {}
+
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in values or key in missing:
+                    continue
+                value = self._local.get(key)
+                if value is not None:
+                    self._local.move_to_end(key)
+                    self._stats['local_hits'] += 1
+                    values[key] = value
+                else:
+                    missing[key] = text
+
+        if missing:
+            from_redis = self._get_redis(list(missing.keys()))
+            if from_redis:
+                self._store_local(from_redis)
+                values.update(from_redis)
+                for key in from_redis:
+                    missing.pop(key)
+
+            with self._lock:
+                self._stats['redis_hits'] += len(from_redis)
+                self._stats['misses'] += len(missing)
+
+        if missing:
+            values.update(self._embed_missing(missing))
+
+        return [_decode(values[key]) for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
@@ -67,6 +67,30 @@ Facts:
     return response.content
 
 
+def fold_memories_into_summary(summary, memories, name):
+    """Updates a `condense_memories` profile with new facts, without re-reading the facts it was built from."""
+    combined_memories = "\n".join(memories)
+    prompt = f"""
+You are an AI maintaining a condensed profile of {name}, used to replicate their personality, communication style, decision-making patterns, and contextual knowledge for 1:1 cloning.
+
+Update the profile with the new facts below:
+1. Merge each new fact into the category it belongs to, grouping it with related facts.
+2. When a new fact contradicts or updates the profile, keep the new fact.
+3. Discard new facts that are trivial or already covered by the profile.
+4. Keep the profile's format and its level of conciseness, do not drop existing details unless they are superseded.
+
+**Output Format (No Extra Text):** the full updated profile, in the same format as the current profile. Absolutely no introductory or closing statements, explanations, or any unnecessary text.
+
+Current profile:
+{summary}
+
+New facts:
+{combined_memories}
+    """
+    response = llm_medium.invoke(prompt)
+    return response.content
+
+
 def generate_persona_description(memories, name):
     prompt = f"""Based on these facts about a person, create a concise, engaging description that captures their unique personality and characteristics (max 250 characters).
 
@@ -116,6 +140,30 @@ Conversations:
     return response.content
 
 
+def fold_conversations_into_summary(summary, conversations):
+    """Updates a `condense_conversations` context with new conversations."""
+    combined_conversations = "\n".join(conversations)
+    prompt = f"""
+You are an AI maintaining condensed context from the recent conversations of a user, used to replicate their communication style, personality, decision-making patterns, and contextual knowledge for 1:1 cloning.
+
+Update the context with the new conversations below:
+1. Reinforce themes, interests and patterns the new conversations confirm, add the ones they introduce.
+2. Update the contextual continuity for ongoing discussions, projects, or relationships, new information wins.
+3. Let low-impact details of older context fade when the new conversations make room for more relevant ones.
+4. Keep the context's format and its level of conciseness.
+
+**Output Format (No Extra Text):** the full updated context, in the same format as the current context. Absolutely no introductory or closing statements, explanations, or any unnecessary text.
+
+Current context:
+{summary}
+
+New conversations:
+{combined_conversations}
+    """
+    response = llm_medium.invoke(prompt)
+    return response.content
+
+
 def condense_tweets(tweets, name):
     prompt = f"""
 You are tasked with generating context to enable 1:1 cloning of {name} based on their tweets. The objective is to extract and condense the most relevant information while preserving {name}'s core identity, personality, communication style, and thought patterns.  
@@ -1,9 +1,23 @@
-from typing import List, Tuple, Optional
+import re
+import time
+from typing import Dict, FrozenSet, List, Tuple, Optional
 
 import database.memories as memories_db
 from database.auth import get_user_name
+from database.redis_db import get_user_memories_version
 from models.memories import Memory, MemoryCategory
 
+# What the extraction prompts know about a user, in process memory. Memories are tagged with the user's memories
+# version (bumped by every write in `database.memories`), the name is refreshed every `_user_name_ttl_seconds`;
+# a steady-state lookup is a single redis GET.
+_prompt_data: Dict[str, Tuple[int, 'PromptContext']] = {}
+_user_names: Dict[str, Tuple[float, str]] = {}
+_prompt_data_max_users = 10000
+_user_name_ttl_seconds = 60 * 60
+
+# share of words two memories must have in common to be the same memory
+near_duplicate_threshold = 0.8
+
 
 def get_prompt_memories(uid: str) -> str:
     user_name, user_made_memories, generated_memories = get_prompt_data(uid)
@@ -34,8 +48,46 @@ def safe_create_memory(memory_data):
         raise
 
 
+class PromptContext:
+    __slots__ = ('user_made', 'generated', 'existing')
+
+    def __init__(self, user_made: List[Memory], generated: List[Memory], existing: List[Tuple[str, FrozenSet[str]]]):
+        self.user_made = user_made
+        self.generated = generated
+        # (conversation id, words) of every memory above, for `dedupe_memories`
+        self.existing = existing
+
+
 def get_prompt_data(uid: str) -> Tuple[str, List[Memory], List[Memory]]:
-    # TODO: cache this
+    context = _get_prompt_context(uid)
+    return _get_user_name(uid), context.user_made, context.generated
+
+
+def _get_user_name(uid: str) -> str:
+    cached = _user_names.get(uid)
+    if cached and time.monotonic() < cached[0]:
+        return cached[1]
+    user_name = get_user_name(uid)
+    if uid not in _user_names and len(_user_names) >= _prompt_data_max_users:
+        _user_names.pop(next(iter(_user_names)), None)
+    _user_names[uid] = (time.monotonic() + _user_name_ttl_seconds, user_name)
+    return user_name
+
+
+def _get_prompt_context(uid: str) -> PromptContext:
+    version = get_user_memories_version(uid)
+    cached = _prompt_data.get(uid)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    context = _load_prompt_context(uid)
+    if uid not in _prompt_data and len(_prompt_data) >= _prompt_data_max_users:
+        _prompt_data.pop(next(iter(_prompt_data)), None)
+    _prompt_data[uid] = (version, context)
+    return context
+
+
+def _load_prompt_context(uid: str) -> PromptContext:
     existing_memories = memories_db.get_memories(uid, limit=100)
     
     # Use a safer approach to create Memory objects from existing memories
@@ -55,7 +107,34 @@ def get_prompt_data(uid: str) -> Tuple[str, List[Memory], List[Memory]]:
                 generated.append(safe_create_memory(memory))
             except Exception as e:
                 print(f"Error creating memory from generated memory: {e}")
-    
-    user_name = get_user_name(uid)
-    # print('get_prompt_data', user_name, len(user_made), len(generated))
-    return user_name, user_made, generated
+
+    existing = [(memory.get('conversation_id') or memory.get('memory_id'), _memory_words(memory.get('content') or ''))
+                for memory in existing_memories]
+    # print('get_prompt_data', len(user_made), len(generated))
+    return PromptContext(user_made, generated, existing)
+
+
+def _memory_words(content: str) -> FrozenSet[str]:
+    return frozenset(re.findall(r'\w+', content.lower()))
+
+
+def _is_near_duplicate(words: FrozenSet[str], other: FrozenSet[str]) -> bool:
+    return len(words & other) >= near_duplicate_threshold * len(words | other)
+
+
+def dedupe_memories(uid: str, memories: List[Memory], conversation_id: Optional[str] = None) -> List[Memory]:
+    """
+    Drops memories near-identical to one the user already has, or to an earlier one in `memories`. Memories of
+    `conversation_id` itself don't count, they are the ones being replaced.
+    """
+    seen = [words for memory_conversation_id, words in _get_prompt_context(uid).existing
+            if conversation_id is None or memory_conversation_id != conversation_id]
+    kept = []
+    for memory in memories:
+        words = _memory_words(memory.content)
+        if not words or any(_is_near_duplicate(words, other) for other in seen):
+            print('dedupe_memories: dropping', memory.content)
+            continue
+        seen.append(words)
+        kept.append(memory)
+    return kept
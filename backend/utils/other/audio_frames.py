@@ -0,0 +1,13 @@
+from typing import Tuple
+
+
+def slice_frames(nframes: int, frame_rate: int, start_ms: float, end_ms: float) -> Tuple[int, int]:
+    """First and last frame of `[start_ms:end_ms]` in audio of `nframes` frames, the same positions as
+    `AudioSegment[start_ms:end_ms]`. No audio dependency, for the speech profile service image too."""
+    length_ms = round(1000 * (nframes / frame_rate))
+    positions = []
+    for ms in [min(start_ms, length_ms), min(end_ms, length_ms)]:
+        if ms < 0:
+            ms = length_ms - abs(ms)
+        positions.append(int(ms * (frame_rate / 1000.0)))
+    return positions[0], positions[1]
@@ -0,0 +1,103 @@
+from typing import List, Optional
+
+
+class AudioRingBuffer:
+    """
+    Fixed size ring of audio bytes for one session, written once per incoming frame.
+
+    Positions are absolute byte offsets since the session started (`written` only grows), so a window
+    handed to a consumer stays valid until the ring wraps over it, and that is cheap to check.
+
+    Readers on other threads go by `writing` (a seqlock): a write moves it past the bytes it is about to
+    overwrite before copying them, and publishes them in `written` once they are copied.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError('capacity must be positive')
+        self.capacity = capacity
+        self.written = 0
+        self.writing = 0
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        end = self.written + len(data)
+        if len(data) > self.capacity:
+            # only the tail can be kept
+            data = data[-self.capacity:]
+        self.writing = end
+        start = (end - len(data)) % self.capacity
+        first = min(len(data), self.capacity - start)
+        self._view[start:start + first] = data[:first]
+        if first < len(data):
+            self._view[:len(data) - first] = data[first:]
+        self.written = end
+
+    def is_intact(self, start: int) -> bool:
+        """Whether [start, ...) is neither overwritten nor being overwritten."""
+        return self.writing - start <= self.capacity
+
+    def views(self, start: int, end: int) -> Optional[List[memoryview]]:
+        """Zero-copy views of [start, end), one or two when it wraps; None once overwritten."""
+        if end > self.written or start > end:
+            raise ValueError(f'window {start}:{end} outside of 0:{self.written}')
+        if not self.is_intact(start):
+            return None
+        if start == end:
+            return []
+        offset = start % self.capacity
+        size = end - start
+        if offset + size <= self.capacity:
+            return [self._view[offset:offset + size]]
+        return [self._view[offset:], self._view[:size - (self.capacity - offset)]]
+
+    def read(self, start: int, end: int) -> Optional[bytes]:
+        """
+        Copy of [start, end), None once overwritten. Safe to call from another thread while the owner keeps
+        writing: the window is checked again after the copy, against the bytes a write was copying meanwhile.
+        """
+        views = self.views(start, end)
+        if views is None:
+            return None
+        data = b''.join(views)
+        return data if self.is_intact(start) else None
+
+
+class AudioWindow:
+    __slots__ = ('ring', 'start', 'end')
+
+    def __init__(self, ring: AudioRingBuffer, start: int, end: int):
+        self.ring = ring
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def views(self) -> Optional[List[memoryview]]:
+        return self.ring.views(self.start, self.end)
+
+    def read(self) -> Optional[bytes]:
+        return self.ring.read(self.start, self.end)
+
+
+class AudioRingConsumer:
+    """Reads the ring every `interval_bytes`, e.g. one audio bytes app or webhook with its own interval."""
+
+    def __init__(self, ring: AudioRingBuffer, interval_bytes: int):
+        if interval_bytes > ring.capacity:
+            raise ValueError(f'interval {interval_bytes} larger than the ring ({ring.capacity})')
+        self.ring = ring
+        self.interval_bytes = interval_bytes
+        self.position = ring.written
+
+    def due(self) -> bool:
+        return self.ring.written - self.position > self.interval_bytes
+
+    def take(self) -> AudioWindow:
+        """Everything since the last take, at least `interval_bytes` once `due`."""
+        window = AudioWindow(self.ring, max(self.position, self.ring.written - self.ring.capacity), self.ring.written)
+        self.position = self.ring.written
+        return window
@@ -0,0 +1,148 @@
+import asyncio
+from collections import deque
+from typing import Callable, List, Optional
+
+
+class BatchBuffer:
+    """
+    Bounded hand-off from producers to a single asyncio consumer, without polling.
+
+    - `put` is safe from any thread (STT SDK callbacks run on their own threads)
+    - the consumer wakes up when a batch is ready: `batch_size` reached, or `max_delay` seconds
+      after the oldest pending item; an idle buffer costs no wakeups
+    - while the consumer is busy (e.g. a slow socket send) items keep coalescing into the next batch,
+      past `capacity` the oldest are dropped and counted in `dropped`
+    - with `key`, an item whose key is already pending replaces that item in place (counted in `coalesced`),
+      so updates of the same thing take no room; items keyed None are always appended
+    - after `close`, the consumer still gets what is left, then `None`
+
+    Sizes are item counts, or whatever `size_of` returns (e.g. `len` for byte chunks).
+    Must be created on the consumer's event loop.
+    """
+
+    def __init__(self, max_delay: float = 0.05, batch_size: Optional[int] = None, capacity: Optional[int] = None,
+                 size_of: Optional[Callable] = None, key: Optional[Callable] = None, name: str = 'buffer'):
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.capacity = capacity
+        self.size_of = size_of
+        self.key = key
+        self.name = name
+        self.dropped = 0
+        self.coalesced = 0
+
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        self._items = deque()
+        self._size = 0
+        # key -> position of its pending item, counted from the first item put since the last take
+        self._positions = {}
+        self._head = 0
+        self._first_at: Optional[float] = None
+        self._closed = False
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def put(self, items: List):
+        if not items:
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._put(items)
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._put, list(items))
+        except RuntimeError:
+            # loop already closed, the session is over
+            pass
+
+    def _put(self, items: List):
+        if self._closed:
+            return
+        for item in items:
+            item_key = self.key(item) if self.key else None
+            position = self._positions.get(item_key) if item_key is not None else None
+            if position is not None:
+                index = position - self._head
+                self._size += self._size_of(item) - self._size_of(self._items[index])
+                self._items[index] = item
+                self.coalesced += 1
+                continue
+            if item_key is not None:
+                self._positions[item_key] = self._head + len(self._items)
+            self._items.append(item)
+            self._size += self._size_of(item)
+        if self._first_at is None:
+            self._first_at = self._loop.time()
+
+        if self.capacity is not None and self._size > self.capacity:
+            dropped = 0
+            while self._size > self.capacity and len(self._items) > 1:
+                item = self._items.popleft()
+                self._head += 1
+                self._size -= self._size_of(item)
+                if self.key:
+                    self._positions.pop(self.key(item), None)
+                dropped += 1
+            if dropped:
+                if self.dropped == 0 or self.dropped // 1000 != (self.dropped + dropped) // 1000:
+                    print(f'{self.name}: full, dropped {self.dropped + dropped} items so far')
+                self.dropped += dropped
+        self._event.set()
+
+    def _size_of(self, item) -> int:
+        return self.size_of(item) if self.size_of else 1
+
+    def _ready(self) -> bool:
+        return self.batch_size is not None and self._size >= self.batch_size
+
+    async def wait(self) -> bool:
+        """Waits for a batch. False once closed and drained."""
+        while True:
+            if self._items:
+                if self._closed or self._ready():
+                    return True
+                remaining = self._first_at + self.max_delay - self._loop.time()
+                if remaining <= 0:
+                    return True
+                self._event.clear()
+                try:
+                    await asyncio.wait_for(self._event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return True
+                continue
+
+            if self._closed:
+                return False
+            self._event.clear()
+            await self._event.wait()
+
+    def take(self) -> List:
+        items = list(self._items)
+        self._items.clear()
+        self._size = 0
+        self._positions.clear()
+        self._head = 0
+        self._first_at = None
+        return items
+
+    async def get(self) -> Optional[List]:
+        if not await self.wait():
+            return None
+        return self.take()
+
+    def close(self):
+        self._closed = True
+        self._event.set()
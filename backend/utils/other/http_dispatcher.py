@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class HostBusyError(Exception):
+    pass
+
+
+class _HostState:
+    def __init__(self, max_concurrency: int):
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+
+class HttpDispatcher:
+    """
+    Shared, bounded dispatcher for app and developer webhooks.
+
+    - one bounded worker pool for the whole process instead of a thread per app or event
+    - keep-alive connection pools per host (a `requests.Session` with a sized adapter)
+    - per-host concurrency caps, a request waits for a slot at most until its deadline
+    - per-host circuit breaker, opened after consecutive failures or slow responses,
+      half-open after a cooldown to let a single trial request through
+    """
+
+    def __init__(self, max_workers: int = 64, max_per_host: int = 8, failure_threshold: int = 5,
+                 cooldown_seconds: float = 30, slow_seconds: float = 10):
+        self.max_per_host = max_per_host
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.slow_seconds = slow_seconds
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='http-dispatcher')
+        self._session = requests.Session()
+        self._session.mount('http://', HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_per_host))
+        self._session.mount('https://', HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_per_host))
+        self._hosts: Dict[str, _HostState] = {}
+        self._hosts_lock = threading.Lock()
+
+    def _host(self, url: str) -> _HostState:
+        host = urlsplit(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = _HostState(self.max_per_host)
+            return self._hosts[host]
+
+    def _before_request(self, state: _HostState):
+        with state.lock:
+            if state.opened_at is None:
+                return
+            if time.monotonic() - state.opened_at < self.cooldown_seconds or state.trial_in_flight:
+                raise CircuitOpenError()
+            # half-open
+            state.trial_in_flight = True
+
+    def _after_request(self, state: _HostState, ok: bool):
+        with state.lock:
+            state.trial_in_flight = False
+            if ok:
+                state.failures = 0
+                state.opened_at = None
+                return
+            state.failures += 1
+            if state.opened_at is not None or state.failures >= self.failure_threshold:
+                state.opened_at = time.monotonic()
+
+    def is_open(self, url: str) -> bool:
+        state = self._host(url)
+        with state.lock:
+            return state.opened_at is not None and time.monotonic() - state.opened_at < self.cooldown_seconds
+
+    def post(self, url: str, timeout: float = 30, deadline: Optional[float] = None, **kwargs) -> requests.Response:
+        """
+        Blocking POST on the shared connection pools, in the calling thread.
+        `deadline` is an absolute `time.monotonic()` budget, the request timeout never exceeds it.
+        Raises CircuitOpenError / HostBusyError when the host is shed, and the usual requests errors.
+        """
+        state = self._host(url)
+        if self.is_open(url):
+            raise CircuitOpenError(urlsplit(url).netloc)
+
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0 or not state.semaphore.acquire(timeout=timeout):
+            raise HostBusyError(urlsplit(url).netloc)
+
+        try:
+            self._before_request(state)
+            start = time.monotonic()
+            if deadline is not None:
+                timeout = min(timeout, deadline - start)
+            try:
+                response = self._session.post(url, timeout=max(timeout, 0.001), **kwargs)
+            except Exception:
+                self._after_request(state, False)
+                raise
+            self._after_request(state, response.status_code < 500 and time.monotonic() - start < self.slow_seconds)
+            return response
+        finally:
+            state.semaphore.release()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def run_all(self, fn: Callable, items: List, budget_seconds: Optional[float] = None) -> List[Future]:
+        """Runs fn(item) for each item on the pool, waits for all of them up to the budget."""
+        futures = [self.executor.submit(fn, item) for item in items]
+        done, not_done = wait(futures, timeout=budget_seconds)
+        if not_done:
+            print(f'http dispatcher: {len(not_done)}/{len(futures)} tasks still running after {budget_seconds}s')
+        return futures
+
+
+dispatcher = HttpDispatcher(
+    max_workers=int(os.getenv('WEBHOOK_DISPATCHER_MAX_WORKERS', 64)),
+    max_per_host=int(os.getenv('WEBHOOK_DISPATCHER_MAX_PER_HOST', 8)),
+)
@@ -1,6 +1,5 @@
 import asyncio
 import concurrent.futures
-import threading
 from datetime import datetime
 from datetime import time
 
@@ -13,6 +12,7 @@ from models.notification_message import NotificationMessage
 from utils.llm.external_integrations import get_conversation_summary
 from utils.notifications import send_notification, send_bulk_notification
 from utils.webhooks import day_summary_webhook
+from utils.other.http_dispatcher import dispatcher
 
 
 async def start_cron_job():
@@ -69,7 +69,7 @@ def _send_summary_notification(user_data: tuple):
         navigate_to="/chat/omi",  # omi ~ no select
     )
     chat_db.add_summary_message(summary, uid)
-    threading.Thread(target=day_summary_webhook, args=(uid, summary)).start()
+    dispatcher.submit(day_summary_webhook, uid, summary)
     send_notification(fcm_token, daily_summary_title, summary, NotificationMessage.get_message_as_dict(ai_message))
 
 
@@ -0,0 +1,150 @@
+import asyncio
+import statistics
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional
+
+
+class _Job:
+    __slots__ = ('fn', 'args', 'merge', 'done', 'enqueued_at')
+
+    def __init__(self, fn: Callable, args: tuple, merge: Optional[Callable], done: Optional[Callable]):
+        self.fn = fn
+        self.args = args
+        self.merge = merge
+        # callbacks of this job and of the jobs merged into it
+        self.done = [done] if done is not None else []
+        self.enqueued_at = time.monotonic()
+
+    def finish(self):
+        for done in self.done:
+            done()
+        self.done = []
+
+
+class OrderedExecutor:
+    """
+    Bounded execution of blocking jobs (webhooks, Firestore) for an asyncio service.
+
+    - jobs run on a dedicated pool of `max_workers` threads, never on the event loop or its default executor
+    - jobs with the same (key, kind) run one at a time, in submission order; other keys run concurrently
+    - a job that is still pending can absorb the next one of its kind (`merge(old_args, new_args) -> args`)
+    - shedding: past `max_pending_per_key` the oldest pending job of that key is dropped, past `max_pending`
+      in total new jobs are refused, jobs that waited more than `max_wait_seconds` for a worker are dropped;
+      all counted per kind in `metrics()`
+    - `done()` is called on the loop once the job is over: it ran, failed, was shed, or was merged into a job
+      that is over
+
+    `submit` must be called from the event loop.
+    """
+
+    def __init__(self, max_workers: int = 32, max_pending: int = 5000, max_pending_per_key: int = 4,
+                 max_wait_seconds: Optional[float] = None, name: str = 'ordered-executor'):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_pending_per_key = max_pending_per_key
+        self.max_wait_seconds = max_wait_seconds
+        self.name = name
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        # jobs wait for a worker here, in their key's queue where they can still merge, not in the pool's queue
+        self._slots = asyncio.Semaphore(max_workers)
+        self._queues: Dict[Hashable, deque] = {}
+        self._tasks = set()
+        self._pending = 0
+        self._running = 0
+        self._max_pending_seen = 0
+        self._counters = defaultdict(lambda: defaultdict(int))  # kind -> event -> count
+        self._wait_seconds = deque(maxlen=2000)
+        self._run_seconds = deque(maxlen=2000)
+
+    def submit(self, key: Hashable, kind: str, fn: Callable, *args, merge: Optional[Callable] = None,
+               done: Optional[Callable] = None) -> bool:
+        """Queues fn(*args) behind the pending jobs of (key, kind). False if it was shed."""
+        counters = self._counters[kind]
+        counters['submitted'] += 1
+
+        queue = self._queues.get((key, kind))
+        if queue and merge is not None and queue[-1].merge is merge:
+            queue[-1].args = merge(queue[-1].args, args)
+            if done is not None:
+                queue[-1].done.append(done)
+            counters['merged'] += 1
+            return True
+
+        if self._pending >= self.max_pending:
+            self._shed(kind, 'shed_overflow')
+            if done is not None:
+                done()
+            return False
+
+        if queue is None:
+            queue = self._queues[(key, kind)] = deque()
+            task = asyncio.create_task(self._drain((key, kind), queue, kind))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        elif len(queue) >= self.max_pending_per_key:
+            queue.popleft().finish()
+            self._pending -= 1
+            self._shed(kind, 'shed_stale')
+
+        queue.append(_Job(fn, args, merge, done))
+        self._pending += 1
+        self._max_pending_seen = max(self._max_pending_seen, self._pending)
+        return True
+
+    def _shed(self, kind: str, reason: str):
+        counters = self._counters[kind]
+        counters[reason] += 1
+        if counters[reason] == 1 or counters[reason] % 1000 == 0:
+            print(f'{self.name}: {kind} {reason} {counters[reason]} jobs so far, {self._pending} pending')
+
+    async def _drain(self, queue_key: Hashable, queue: deque, kind: str):
+        loop = asyncio.get_running_loop()
+        counters = self._counters[kind]
+        try:
+            while queue:
+                async with self._slots:
+                    job = queue.popleft()
+                    self._pending -= 1
+                    started = time.monotonic()
+                    self._wait_seconds.append(started - job.enqueued_at)
+                    if self.max_wait_seconds is not None and started - job.enqueued_at > self.max_wait_seconds:
+                        self._shed(kind, 'shed_expired')
+                        job.finish()
+                        continue
+                    self._running += 1
+                    try:
+                        await loop.run_in_executor(self.executor, job.fn, *job.args)
+                        counters['completed'] += 1
+                    except Exception as e:
+                        counters['failed'] += 1
+                        print(f'{self.name}: {kind} failed: {e}')
+                    finally:
+                        self._running -= 1
+                        self._run_seconds.append(time.monotonic() - started)
+                        job.finish()
+        finally:
+            if self._queues.get(queue_key) is queue:
+                del self._queues[queue_key]
+
+    def metrics(self) -> dict:
+        def _ms(values):
+            if not values:
+                return None
+            values = sorted(values)
+            return {'p50': round(statistics.median(values) * 1000, 1),
+                    'p99': round(values[min(int(len(values) * 0.99), len(values) - 1)] * 1000, 1),
+                    'max': round(values[-1] * 1000, 1)}
+
+        return {
+            'workers': self.max_workers,
+            'running': self._running,
+            'pending': self._pending,
+            'max_pending': self._max_pending_seen,
+            'keys': len(self._queues),
+            'queue_wait_ms': _ms(self._wait_seconds),
+            'run_ms': _ms(self._run_seconds),
+            'kinds': {kind: dict(counters) for kind, counters in self._counters.items()},
+        }
@@ -0,0 +1,186 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+PENDING = 'pending'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+TIMED_OUT = 'timed_out'
+SKIPPED = 'skipped'
+
+_SETTLED = (COMPLETED, FAILED, TIMED_OUT, SKIPPED)
+
+
+class StepError(Exception):
+    pass
+
+
+class _Step:
+    __slots__ = ('name', 'fn', 'requires', 'after', 'uses', 'timeout', 'retries', 'retry_delay', 'retry_timeouts')
+
+    def __init__(self, name: str, fn: Callable, requires: Sequence[str], after: Sequence[str], uses: Sequence[str],
+                 timeout: Optional[float], retries: int, retry_delay: float, retry_timeouts: bool):
+        self.name = name
+        self.fn = fn
+        self.requires = tuple(requires)
+        self.after = tuple(after)
+        self.uses = tuple(uses)
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.retry_timeouts = retry_timeouts
+
+
+class StepGraph:
+    """
+    Blocking steps with dependencies, run on a bounded executor.
+
+    - a step runs once its `requires` completed, with their results as positional arguments; it is skipped if one
+      of them did not complete, which skips its own dependents in turn, and nothing else
+    - `after` steps only order: the step waits for them to settle, whatever their outcome
+    - `uses` steps are waited for like `after`, their results are passed after the `requires` ones: None unless
+      they completed (a result an abandoned attempt comes up with later is never seen)
+    - `timeout` seconds per attempt (the attempt's thread is abandoned, not interrupted), then up to `retries`
+      more attempts `retry_delay * attempt` seconds apart, for exceptions and timeouts alike; with
+      `retry_timeouts=False` (writes) only for exceptions, a timed out attempt may still be writing
+
+    Steps are scheduled by one driver thread per run that never holds an executor worker, so steps waiting on
+    each other cannot exhaust the pool.
+    """
+
+    def __init__(self, name: str, executor: Executor):
+        self.name = name
+        self.executor = executor
+        self.steps: Dict[str, _Step] = {}
+
+    def add(self, name: str, fn: Callable, requires: Sequence[str] = (), after: Sequence[str] = (),
+            uses: Sequence[str] = (), timeout: Optional[float] = None, retries: int = 0, retry_delay: float = 1,
+            retry_timeouts: bool = True):
+        for dependency in (*requires, *after, *uses):
+            if dependency not in self.steps:
+                raise ValueError(f'{self.name}: step {name} depends on unknown step {dependency}')
+        self.steps[name] = _Step(name, fn, requires, after, uses, timeout, retries, retry_delay, retry_timeouts)
+
+    def start(self) -> 'StepRun':
+        run = StepRun(self)
+        threading.Thread(target=run._drive, name=f'{self.name}-steps', daemon=True).start()
+        return run
+
+    def run(self) -> 'StepRun':
+        run = self.start()
+        run.wait()
+        return run
+
+
+class StepRun:
+    def __init__(self, graph: StepGraph):
+        self.graph = graph
+        self.status: Dict[str, str] = {name: PENDING for name in graph.steps}
+        self.attempts: Dict[str, int] = {name: 0 for name in graph.steps}
+        self.seconds: Dict[str, float] = {}
+        self.started_at = time.monotonic()
+        self._results = {}
+        self._errors: Dict[str, BaseException] = {}
+        self._settled = {name: threading.Event() for name in graph.steps}
+
+    def wait(self, names: Optional[Iterable[str]] = None, timeout: Optional[float] = None) -> bool:
+        """Blocks until the steps (all by default) settled, False if `timeout` passed first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for name in names if names is not None else self.graph.steps:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not self._settled[name].wait(remaining):
+                return False
+        return True
+
+    def result(self, name: str):
+        """The step's result; its own exception if it failed, StepError if it timed out, was skipped or runs."""
+        status = self.status[name]
+        if status == COMPLETED:
+            return self._results[name]
+        if status == FAILED:
+            raise self._errors[name]
+        raise StepError(f'{self.graph.name}: step {name} {status}')
+
+    def timings(self) -> Dict[str, dict]:
+        return {name: {'status': self.status[name], 'attempts': self.attempts[name],
+                       'ms': round(self.seconds[name] * 1000, 1) if name in self.seconds else None}
+                for name in self.graph.steps}
+
+    def _settle(self, name: str, status: str, started: Optional[float] = None):
+        self.status[name] = status
+        if started is not None:
+            self.seconds[name] = time.monotonic() - started
+        self._settled[name].set()
+
+    def _attempt(self, step: _Step, args: tuple, attempt: int):
+        if attempt:
+            time.sleep(step.retry_delay * attempt)
+        return step.fn(*args)
+
+    def _submit(self, step: _Step, running: Dict[Future, str], deadlines: Dict[Future, float]):
+        args = tuple(self._results[dependency] for dependency in step.requires) + \
+            tuple(self._results[used] if self.status[used] == COMPLETED else None for used in step.uses)
+        attempt = self.attempts[step.name]
+        self.attempts[step.name] += 1
+        future = self.graph.executor.submit(self._attempt, step, args, attempt)
+        running[future] = step.name
+        if step.timeout is not None:
+            deadlines[future] = time.monotonic() + step.timeout + (step.retry_delay * attempt if attempt else 0)
+
+    def _drive(self):
+        steps = self.graph.steps
+        pending: List[str] = list(steps)
+        running: Dict[Future, str] = {}
+        deadlines: Dict[Future, float] = {}
+        started: Dict[str, float] = {}
+
+        def retry_or_settle(name: str, status: str):
+            retry = status != TIMED_OUT or steps[name].retry_timeouts
+            if retry and self.attempts[name] <= steps[name].retries:
+                print(f'{self.graph.name}: step {name} {status}, retrying')
+                self._submit(steps[name], running, deadlines)
+                return
+            self._settle(name, status, started[name])
+
+        while pending or running:
+            # schedule what is ready, in order, so skips reach dependents in the same pass
+            for name in list(pending):
+                step = steps[name]
+                if any(self.status[dependency] in (FAILED, TIMED_OUT, SKIPPED) for dependency in step.requires):
+                    pending.remove(name)
+                    self._settle(name, SKIPPED)
+                elif all(self.status[dependency] in _SETTLED
+                         for dependency in (*step.requires, *step.after, *step.uses)):
+                    pending.remove(name)
+                    self.status[name] = RUNNING
+                    started[name] = time.monotonic()
+                    self._submit(step, running, deadlines)
+            if not running:
+                continue
+
+            timeout = None
+            if deadlines:
+                timeout = max(min(deadlines.values()) - time.monotonic(), 0)
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = running.pop(future)
+                deadlines.pop(future, None)
+                try:
+                    self._results[name] = future.result()
+                    self._settle(name, COMPLETED, started[name])
+                except Exception as e:
+                    print(f'{self.graph.name}: step {name} failed: {e}')
+                    self._errors[name] = e
+                    retry_or_settle(name, FAILED)
+
+            now = time.monotonic()
+            for future in [future for future, deadline in deadlines.items() if deadline <= now]:
+                name = running.pop(future)
+                del deadlines[future]
+                future.cancel()
+                retry_or_settle(name, TIMED_OUT)
+
+        print(f'{self.graph.name}: {round((time.monotonic() - self.started_at) * 1000, 1)}ms {self.timings()}')
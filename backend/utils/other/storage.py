@@ -1,7 +1,7 @@
 import datetime
 import json
 import os
-from typing import List
+from typing import List, Tuple
 
 from google.cloud import storage
 from google.oauth2 import service_account
@@ -138,6 +138,46 @@ def get_user_person_speech_samples(uid: str, person_id: str, download: bool = Fa
     return [_get_signed_url(blob, 60) for blob in blobs]
 
 
+# ********************************************
+# ************ SPEAKER EMBEDDINGS ************
+# ********************************************
+
+def get_speech_profile_generations(uid: str) -> List[Tuple[str, int]]:
+    """(blob name, generation) of the speech profile and its additional recordings, without downloading them."""
+    bucket = storage_client.bucket(speech_profiles_bucket)
+    main = bucket.get_blob(f'{uid}/speech_profile.wav')
+    if not main:
+        return []
+    blobs = bucket.list_blobs(prefix=f'{uid}/additional_profile_recordings/')
+    return [(main.name, main.generation)] + [(blob.name, blob.generation) for blob in blobs]
+
+
+def get_user_person_speech_samples_generations(uid: str, person_id: str) -> List[Tuple[str, int]]:
+    bucket = storage_client.bucket(speech_profiles_bucket)
+    blobs = bucket.list_blobs(prefix=f'{uid}/people_profiles/{person_id}/')
+    return [(blob.name, blob.generation) for blob in blobs]
+
+
+def download_speech_profile_sample(blob_name: str, generation: int, file_path: str):
+    bucket = storage_client.bucket(speech_profiles_bucket)
+    bucket.blob(blob_name, generation=generation).download_to_filename(file_path)
+
+
+def get_speaker_embedding(uid: str, key: str) -> dict | None:
+    """Embedding of the speech profile (`key` 'user') or of a person's samples, see `upload_speaker_embedding`."""
+    bucket = storage_client.bucket(speech_profiles_bucket)
+    blob = bucket.blob(f'{uid}/speaker_embeddings/{key}.json')
+    if not blob.exists():
+        return None
+    return json.loads(blob.download_as_text())
+
+
+def upload_speaker_embedding(uid: str, key: str, data: dict):
+    bucket = storage_client.bucket(speech_profiles_bucket)
+    blob = bucket.blob(f'{uid}/speaker_embeddings/{key}.json')
+    blob.upload_from_string(json.dumps(data), content_type='application/json')
+
+
 # ********************************************
 # ************* POST PROCESSING **************
 # ********************************************
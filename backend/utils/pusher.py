@@ -1,12 +1,31 @@
 import os
+import time
 import random
 import asyncio
+from typing import Dict, List
+
 import websockets
 
+from utils.pusher_protocol import PROTOCOL_V2, PROTOCOL_MUX, MUX_DATA, MUX_CLOSE, MUX_CREDIT, MUX_WINDOW_BYTES, \
+    FrameError, encode_mux, encode_mux_open, parse_mux, decode_mux_credit
+
 PusherAPI = os.getenv('HOSTED_PUSHER_API_URL')
 
+# listen sessions share a few long-lived connections to the pusher instead of one connection each
+pusher_multiplex_enabled = os.getenv('PUSHER_MULTIPLEX', 'true').lower() == 'true'
+pusher_pool_size = int(os.getenv('PUSHER_POOL_SIZE', 4))
+# a pusher without the multiplex endpoint is asked again after this long
+pusher_multiplex_recheck_seconds = 300
+
+
 async def connect_to_trigger_pusher(uid: str, sample_rate: int = 8000, retries: int = 3):
     print("connect_to_trigger_pusher", uid)
+    if pusher_multiplex_enabled:
+        try:
+            return await _pusher_pool().open_stream(uid, sample_rate, retries)
+        except MultiplexUnsupportedError as e:
+            print(f'Pusher multiplexing unavailable, using a dedicated connection: {e}', uid)
+
     for attempt in range(retries):
         try:
             return await _connect_to_trigger_pusher(uid, sample_rate)
@@ -24,8 +43,9 @@ async def _connect_to_trigger_pusher(uid: str, sample_rate: int = 8000):
     try:
         print("Connecting to Pusher transcripts trigger WebSocket...", uid)
         ws_host = PusherAPI.replace("http", "ws")
+        # a pusher without v2 doesn't pick a subprotocol, `socket.subprotocol` is then None
         socket = await websockets.connect(f"{ws_host}/v1/trigger/listen?uid={uid}&sample_rate={sample_rate}",
-                                          ping_interval=15,)
+                                          ping_interval=15, subprotocols=[PROTOCOL_V2])
         print("Connected to Pusher transcripts trigger WebSocket.", uid)
         return socket
     except Exception as e:
@@ -38,3 +58,226 @@ def calculate_backoff_with_jitter(attempt, base_delay=1000, max_delay=15000):
     jitter = random.random() * base_delay
     backoff = min(((2 ** attempt) * base_delay) + jitter, max_delay)
     return backoff
+
+
+# *****************************
+# ********* MULTIPLEX *********
+# *****************************
+
+class MultiplexUnsupportedError(Exception):
+    pass
+
+
+class PusherUnavailableError(Exception):
+    pass
+
+
+class PusherStream:
+    """
+    One listen session on a pooled connection, used like the websocket it replaces: `send`, `close` and
+    `subprotocol`. Raises ConnectionClosed once the stream or its connection is gone, the caller reconnects.
+    """
+    subprotocol = PROTOCOL_V2
+
+    def __init__(self, connection: '_PusherConnection', stream_id: int, uid: str):
+        self.connection = connection
+        self.stream_id = stream_id
+        self.uid = uid
+        self.closed = False
+        # DATA bytes the pusher lets us send before it credits more
+        self._credit = MUX_WINDOW_BYTES
+        self._credit_available = asyncio.Event()
+        self._credit_available.set()
+
+    async def send(self, data):
+        while True:
+            if self.closed:
+                raise websockets.exceptions.ConnectionClosedError(None, None)
+            # a frame goes out while there is any credit left, even if it is larger
+            if self._credit > 0:
+                break
+            self._credit_available.clear()
+            await self._credit_available.wait()
+        self._credit -= len(data)
+        await self.connection.send(encode_mux(MUX_DATA, self.stream_id, data))
+
+    async def close(self, code: int = 1000):
+        if self.closed:
+            return
+        self._set_closed()
+        await self.connection.close_stream(self)
+
+    def _add_credit(self, size: int):
+        self._credit += size
+        if self._credit > 0:
+            self._credit_available.set()
+
+    def _set_closed(self):
+        self.closed = True
+        self._credit_available.set()
+
+
+class _PusherConnection:
+    def __init__(self, ws):
+        self.ws = ws
+        self.streams: Dict[int, PusherStream] = {}
+        self._next_stream_id = 1
+        self.reader = asyncio.create_task(self._read())
+
+    @property
+    def alive(self) -> bool:
+        return self.ws.open
+
+    async def open_stream(self, uid: str, sample_rate: int) -> PusherStream:
+        stream = PusherStream(self, self._next_stream_id, uid)
+        self._next_stream_id += 1
+        self.streams[stream.stream_id] = stream
+        try:
+            await self.ws.send(encode_mux_open(stream.stream_id, uid, sample_rate))
+        except Exception:
+            self.streams.pop(stream.stream_id, None)
+            stream._set_closed()
+            raise
+        return stream
+
+    async def send(self, message: bytes):
+        await self.ws.send(message)
+
+    async def close_stream(self, stream: PusherStream):
+        self.streams.pop(stream.stream_id, None)
+        if not self.alive:
+            return
+        try:
+            await self.ws.send(encode_mux(MUX_CLOSE, stream.stream_id))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def _read(self):
+        try:
+            async for message in self.ws:
+                if isinstance(message, str):
+                    continue
+                try:
+                    kind, stream_id, body = parse_mux(message)
+                    stream = self.streams.get(stream_id)
+                    if stream is None:
+                        continue
+                    if kind == MUX_CREDIT:
+                        stream._add_credit(decode_mux_credit(body))
+                    elif kind == MUX_CLOSE:
+                        # e.g. the pusher doesn't know the stream, the session opens a new one
+                        self.streams.pop(stream_id, None)
+                        stream._set_closed()
+                except FrameError as e:
+                    print(f'Malformed multiplex message from pusher: {e}')
+        except websockets.exceptions.ConnectionClosed as e:
+            print(f'Pusher multiplexed connection closed: {e}')
+        except Exception as e:
+            print(f'Pusher multiplexed connection failed: {e}')
+        finally:
+            # every session on it reconnects, on another connection
+            streams = list(self.streams.values())
+            self.streams.clear()
+            for stream in streams:
+                stream._set_closed()
+            if streams:
+                print(f'Pusher multiplexed connection lost with {len(streams)} streams')
+            await self.ws.close()
+
+
+class PusherPool:
+    """
+    Up to `size` connections to the pusher for the whole process, opened on demand and shared by all listen
+    sessions; a new stream goes to the connection with the fewest. Connecting is serialized and backs off
+    after a failure, so a pusher restart costs `size` reconnects instead of one per session.
+    """
+
+    def __init__(self, url: str, size: int):
+        self.url = url
+        self.size = max(size, 1)
+        self.connections: List[_PusherConnection] = []
+        self.stats = {'connects': 0, 'connect_failures': 0, 'streams': 0}
+        self._connect_lock = asyncio.Lock()
+        self._failures = 0
+        self._retry_at = 0.0
+        self._unsupported_until = 0.0
+
+    async def open_stream(self, uid: str, sample_rate: int, retries: int = 3) -> PusherStream:
+        for attempt in range(retries):
+            try:
+                connection = await self._connection()
+                stream = await connection.open_stream(uid, sample_rate)
+                self.stats['streams'] += 1
+                return stream
+            except PusherUnavailableError as e:
+                if attempt == retries - 1:
+                    raise
+                await asyncio.sleep(e.args[1])
+            except websockets.exceptions.ConnectionClosed:
+                # the connection died between picking it and opening the stream
+                if attempt == retries - 1:
+                    raise
+
+    def _least_loaded(self):
+        self.connections = [connection for connection in self.connections if connection.alive]
+        if not self.connections:
+            return None
+        return min(self.connections, key=lambda connection: len(connection.streams))
+
+    async def _connection(self) -> _PusherConnection:
+        if time.monotonic() < self._unsupported_until:
+            raise MultiplexUnsupportedError('pusher has no multiplex endpoint')
+        connection = self._least_loaded()
+        if connection is not None and len(self.connections) >= self.size:
+            return connection
+
+        async with self._connect_lock:
+            connection = self._least_loaded()
+            if connection is not None and len(self.connections) >= self.size:
+                return connection
+            now = time.monotonic()
+            if now < self._retry_at:
+                if connection is not None:
+                    return connection
+                raise PusherUnavailableError('pusher unavailable', self._retry_at - now)
+
+            try:
+                ws = await websockets.connect(f'{self.url}/v1/trigger/multiplex', subprotocols=[PROTOCOL_MUX],
+                                              ping_interval=15)
+            except websockets.exceptions.InvalidStatusCode as e:
+                # a pusher that predates multiplexing rejects the route
+                print(f'Pusher rejected multiplexing: {e}')
+                self._unsupported_until = now + pusher_multiplex_recheck_seconds
+                raise MultiplexUnsupportedError(str(e))
+            except Exception as e:
+                self._failures += 1
+                self.stats['connect_failures'] += 1
+                # one probe for all sessions, so it can come back sooner than a session's own retries
+                self._retry_at = now + calculate_backoff_with_jitter(self._failures - 1, base_delay=250,
+                                                                     max_delay=2000) / 1000
+                print(f'Could not connect to pusher ({self._failures} in a row): {e}')
+                if connection is not None:
+                    return connection
+                raise PusherUnavailableError(str(e), self._retry_at - now)
+
+            if ws.subprotocol != PROTOCOL_MUX:
+                await ws.close()
+                self._unsupported_until = now + pusher_multiplex_recheck_seconds
+                raise MultiplexUnsupportedError('pusher did not accept the multiplex subprotocol')
+
+            self._failures = 0
+            self.stats['connects'] += 1
+            connection = _PusherConnection(ws)
+            self.connections.append(connection)
+            print(f'Pusher multiplexed connection {len(self.connections)}/{self.size} opened')
+            return connection
+
+
+_pool = None
+
+
+def _pusher_pool() -> PusherPool:
+    global _pool
+    if _pool is None:
+        _pool = PusherPool(PusherAPI.replace("http", "ws"), pusher_pool_size)
+    return _pool
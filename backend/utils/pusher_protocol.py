@@ -0,0 +1,260 @@
+"""
+Backend -> pusher frames.
+
+Every frame starts with a little endian uint32 type:
+
+- 101: audio bytes, raw PCM16 after the header (batches of chunks are concatenated by the sender)
+- 102: transcript, v1: JSON `{"segments": [...], "memory_id": ...}`
+- 103: transcript, v2: one flags byte (bit 0: zlib) then msgpack `{0: [segment deltas], 1: memory_id}`
+
+v2 is negotiated as the websocket subprotocol `PROTOCOL_V2`: the backend offers it, a pusher that knows it
+accepts it, and either side falls back to 102 when the other doesn't. v2 state lives for one connection:
+each segment is sent as the fields that differ from the previous segment on that connection (known fields
+by index, removed keys under -1), and `memory_id` only when it changed.
+
+Multiplexed connections (`/v1/trigger/multiplex`, subprotocol `PROTOCOL_MUX`) carry many sessions, each
+message is a `<BI` (kind, stream id) header then:
+
+- MUX_OPEN: JSON `{"uid": ..., "sample_rate": ...}`, starts a session on the stream (v2 framing)
+- MUX_DATA: one of the frames above, for that stream's session
+- MUX_CLOSE: nothing, ends the stream (either side)
+- MUX_CREDIT: pusher -> backend, uint32 bytes of DATA the stream may send again
+"""
+import json
+import struct
+import zlib
+from typing import Any, List, Optional, Tuple
+
+import msgpack
+
+PROTOCOL_V2 = 'omi-pusher.v2'
+PROTOCOL_MUX = 'omi-pusher.mux.v1'
+
+AUDIO_BYTES = 101
+TRANSCRIPT_V1 = 102
+TRANSCRIPT_V2 = 103
+
+FLAG_ZLIB = 0x01
+COMPRESS_MIN_BYTES = 1024
+MAX_DECOMPRESSED_BYTES = 16 * 1024 * 1024
+
+# segment fields by index, append only
+SEGMENT_FIELDS = ['id', 'text', 'speaker', 'speaker_id', 'is_user', 'person_id', 'start', 'end', 'translations',
+                  'speech_profile_processed']
+_FIELD_INDEX = {name: i for i, name in enumerate(SEGMENT_FIELDS)}
+_REMOVED = -1
+_SEGMENTS = 0
+_MEMORY_ID = 1
+
+MUX_OPEN = 1
+MUX_DATA = 2
+MUX_CLOSE = 3
+MUX_CREDIT = 4
+MUX_WINDOW_BYTES = 1024 * 1024
+
+_header = struct.Struct('<I')
+_mux_header = struct.Struct('<BI')
+_credit = struct.Struct('<I')
+_MISSING = object()
+
+
+class FrameError(ValueError):
+    pass
+
+
+def negotiated_version(subprotocol: Optional[str]) -> int:
+    return 2 if subprotocol == PROTOCOL_V2 else 1
+
+
+def parse_frame(data: bytes) -> Tuple[int, memoryview]:
+    if len(data) < 4:
+        raise FrameError(f'frame of {len(data)} bytes has no header')
+    view = memoryview(data)
+    return _header.unpack_from(view)[0], view[4:]
+
+
+def encode_audio(chunks: List[bytes]) -> bytearray:
+    data = bytearray(_header.pack(AUDIO_BYTES))
+    for chunk in chunks:
+        data.extend(chunk)
+    return data
+
+
+def encode_transcript_v1(segments: List[dict], memory_id: Optional[str]) -> bytes:
+    return _header.pack(TRANSCRIPT_V1) + json.dumps({"segments": segments, "memory_id": memory_id}).encode('utf-8')
+
+
+def decode_transcript_v1(payload) -> Tuple[List[dict], Optional[str]]:
+    try:
+        res = json.loads(bytes(payload).decode('utf-8'))
+    except ValueError as e:
+        raise FrameError(f'bad transcript frame: {e}')
+    if not isinstance(res, dict):
+        raise FrameError('transcript frame is not an object')
+    segments = res.get('segments')
+    if not isinstance(segments, list) or not all(isinstance(segment, dict) for segment in segments):
+        raise FrameError('transcript frame segments are not a list of objects')
+    return segments, res.get('memory_id')
+
+
+class TranscriptEncoder:
+    """v2 encoder for one connection, pairs with a `TranscriptDecoder` on the other end."""
+
+    def __init__(self, compress_min_bytes: int = COMPRESS_MIN_BYTES):
+        self.compress_min_bytes = compress_min_bytes
+        self._last: dict = {}
+        self._memory_id = None
+
+    def encode(self, segments: List[dict], memory_id: Optional[str]) -> bytes:
+        deltas = []
+        for segment in segments:
+            delta = {}
+            for key, value in segment.items():
+                last = self._last.get(key, _MISSING)
+                # 1 == 1.0 == True, the decoder must get the same type back
+                if type(last) is not type(value) or last != value:
+                    delta[_FIELD_INDEX.get(key, key)] = value
+            removed = [_FIELD_INDEX.get(key, key) for key in self._last if key not in segment]
+            if removed:
+                delta[_REMOVED] = removed
+            deltas.append(delta)
+            self._last = dict(segment)
+
+        body = {_SEGMENTS: deltas}
+        if memory_id != self._memory_id:
+            body[_MEMORY_ID] = memory_id
+            self._memory_id = memory_id
+        payload = msgpack.packb(body, use_bin_type=True)
+
+        flags = 0
+        if len(payload) >= self.compress_min_bytes:
+            compressed = zlib.compress(payload, 1)
+            if len(compressed) < len(payload):
+                flags, payload = FLAG_ZLIB, compressed
+        return _header.pack(TRANSCRIPT_V2) + bytes((flags,)) + payload
+
+
+def read_frame(data, decoder: 'TranscriptDecoder') -> Tuple[int, Any]:
+    """
+    What the pusher does with every binary message: (AUDIO_BYTES, payload) or
+    (TRANSCRIPT_V1 / TRANSCRIPT_V2, (segments, memory_id)). FrameError for anything else.
+    """
+    header_type, payload = parse_frame(data)
+    if header_type == AUDIO_BYTES:
+        return header_type, payload
+    if header_type == TRANSCRIPT_V2:
+        return header_type, decoder.decode(payload)
+    if header_type == TRANSCRIPT_V1:
+        return header_type, decode_transcript_v1(payload)
+    raise FrameError(f'unknown frame type {header_type}')
+
+
+class TranscriptDecoder:
+    """
+    v2 decoder for one connection. Raises FrameError on anything malformed; the state is only
+    updated by frames that decode completely.
+    """
+
+    def __init__(self):
+        self._last: dict = {}
+        self._memory_id = None
+
+    def decode(self, payload) -> Tuple[List[dict], Optional[str]]:
+        if len(payload) < 1:
+            raise FrameError('transcript frame has no flags')
+        flags = payload[0]
+        body = bytes(payload[1:])
+        if flags & ~FLAG_ZLIB:
+            raise FrameError(f'unknown flags {flags}')
+        if flags & FLAG_ZLIB:
+            decompressor = zlib.decompressobj()
+            try:
+                body = decompressor.decompress(body, MAX_DECOMPRESSED_BYTES)
+            except zlib.error as e:
+                raise FrameError(f'bad compressed transcript frame: {e}')
+            if decompressor.unconsumed_tail:
+                raise FrameError('transcript frame too large')
+            if not decompressor.eof:
+                raise FrameError('truncated compressed transcript frame')
+        try:
+            res = msgpack.unpackb(body, raw=False, strict_map_key=False)
+        except Exception as e:
+            raise FrameError(f'bad transcript frame: {e}')
+        if not isinstance(res, dict) or not isinstance(res.get(_SEGMENTS), list):
+            raise FrameError('transcript frame has no segments')
+
+        last = self._last
+        segments = []
+        for delta in res[_SEGMENTS]:
+            if not isinstance(delta, dict):
+                raise FrameError('segment delta is not a map')
+            segment = dict(last)
+            for key, value in delta.items():
+                if key == _REMOVED:
+                    if not isinstance(value, list):
+                        raise FrameError('removed keys are not a list')
+                    for removed in value:
+                        segment.pop(self._field(removed), None)
+                    continue
+                segment[self._field(key)] = value
+            segments.append(segment)
+            last = segment
+
+        # returned segments are the caller's to change
+        if _MEMORY_ID in res and res[_MEMORY_ID] is not None and not isinstance(res[_MEMORY_ID], str):
+            raise FrameError('memory id is not a string')
+        self._last = dict(last)
+        if _MEMORY_ID in res:
+            self._memory_id = res[_MEMORY_ID]
+        return segments, self._memory_id
+
+    @staticmethod
+    def _field(key) -> str:
+        if isinstance(key, int):
+            if 0 <= key < len(SEGMENT_FIELDS):
+                return SEGMENT_FIELDS[key]
+            raise FrameError(f'unknown field {key}')
+        if isinstance(key, str):
+            return key
+        raise FrameError(f'bad field key {key!r}')
+
+
+# *****************************
+# ********* MULTIPLEX *********
+# *****************************
+
+def encode_mux(kind: int, stream_id: int, body=b'') -> bytes:
+    return _mux_header.pack(kind, stream_id) + bytes(body)
+
+
+def encode_mux_open(stream_id: int, uid: str, sample_rate: int) -> bytes:
+    return encode_mux(MUX_OPEN, stream_id, json.dumps({'uid': uid, 'sample_rate': sample_rate}).encode('utf-8'))
+
+
+def encode_mux_credit(stream_id: int, size: int) -> bytes:
+    return encode_mux(MUX_CREDIT, stream_id, _credit.pack(size))
+
+
+def parse_mux(data) -> Tuple[int, int, memoryview]:
+    if len(data) < _mux_header.size:
+        raise FrameError(f'mux message of {len(data)} bytes has no header')
+    view = memoryview(data)
+    kind, stream_id = _mux_header.unpack_from(view)
+    return kind, stream_id, view[_mux_header.size:]
+
+
+def decode_mux_open(body) -> Tuple[str, int]:
+    try:
+        res = json.loads(bytes(body).decode('utf-8'))
+        uid, sample_rate = res['uid'], int(res.get('sample_rate', 8000))
+    except (ValueError, TypeError, KeyError) as e:
+        raise FrameError(f'bad stream open: {e}')
+    if not isinstance(uid, str) or not uid:
+        raise FrameError('stream open has no uid')
+    return uid, sample_rate
+
+
+def decode_mux_credit(body) -> int:
+    if len(body) != _credit.size:
+        raise FrameError('bad credit')
+    return _credit.unpack(body)[0]
@@ -0,0 +1,259 @@
+"""
+Speaker embeddings (speechbrain ECAPA) of the user's speech profile and of their people's speech samples, and
+classification of transcript segments against them.
+
+Embeddings of the samples are computed once and stored next to them in the speech profiles bucket, tagged with the
+generations of the sample blobs they were computed from: adding, replacing or deleting a sample changes the
+generations, and the embedding is computed again on next use. The samples themselves are kept on local disk by
+generation (`get_cached_samples`), downloaded once per version. A conversation is then classified in one pass over
+its audio, its chunks embedded in batches and compared to the cached embeddings, the same scores `model.verify_files`
+gave chunk by chunk.
+"""
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from pydub import AudioSegment
+
+from utils.other.audio_frames import slice_frames
+from utils.other import storage
+
+embedding_model = 'speechbrain/spkrec-ecapa-voxceleb'
+sample_rate = 16000
+chunk_seconds = 30
+# `SpeakerRecognition.verify_batch` default, below it two signals are different speakers
+verification_threshold = 0.25
+encode_batch_size = int(os.getenv('SPEAKER_EMBEDDING_BATCH_SIZE', 16))
+
+# (batch, samples) float32 at `sample_rate` -> (batch, dimensions)
+Encoder = Callable[[np.ndarray], np.ndarray]
+
+_encoder: Optional[Encoder] = None
+_encoder_lock = threading.Lock()
+
+_embeddings: 'OrderedDict[Tuple[str, str], Tuple[str, np.ndarray]]' = OrderedDict()
+_embeddings_max = 1000
+_embeddings_lock = threading.Lock()
+
+samples_cache_dir = '_speech_profiles'
+samples_cache_max_files = int(os.getenv('SPEECH_SAMPLES_CACHE_MAX_FILES', 5000))
+_samples_lock = threading.Lock()
+
+
+def get_encoder() -> Encoder:
+    """The ECAPA encoder, loaded on first use and shared by the process."""
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            import torch
+            from speechbrain.inference.speaker import EncoderClassifier
+
+            device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+            model = EncoderClassifier.from_hparams(
+                source=embedding_model,
+                savedir="pretrained_models/spkrec-ecapa-voxceleb",
+                run_opts={"device": device},
+            )
+
+            def encode(batch: np.ndarray) -> np.ndarray:
+                with torch.no_grad():
+                    return model.encode_batch(torch.from_numpy(batch)).squeeze(1).cpu().numpy()
+
+            _encoder = encode
+        return _encoder
+
+
+def audio_samples(aseg: AudioSegment) -> np.ndarray:
+    """Mono float32 samples at `sample_rate`, as speechbrain's `load_audio` reads a wav."""
+    if aseg.channels != 1:
+        aseg = aseg.set_channels(1)
+    if aseg.frame_rate != sample_rate:
+        aseg = aseg.set_frame_rate(sample_rate)
+    samples = np.array(aseg.get_array_of_samples(), dtype=np.float32)
+    return samples / float(1 << (8 * aseg.sample_width - 1))
+
+
+def _similarity(embeddings: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    # torch.nn.CosineSimilarity(dim=-1, eps=1e-6), as `SpeakerRecognition.similarity`
+    norms = np.maximum(np.linalg.norm(embeddings, axis=-1), 1e-6) * max(np.linalg.norm(candidate), 1e-6)
+    return embeddings @ candidate / norms
+
+
+# *****************************
+# ********** CACHE ************
+# *****************************
+
+def _signature(generations: List[Tuple[str, int]]) -> str:
+    data = json.dumps([embedding_model, sorted([name, int(generation)] for name, generation in generations)])
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def _sample_file_prefix(blob_name: str) -> str:
+    return blob_name.replace('/', '__') + '.'
+
+
+def _prune_samples_cache():
+    files = [entry for entry in os.scandir(samples_cache_dir) if entry.name.endswith('.wav')]
+    if len(files) <= samples_cache_max_files:
+        return
+    files.sort(key=lambda entry: entry.stat().st_atime)
+    for entry in files[:len(files) - samples_cache_max_files]:
+        os.remove(entry.path)
+
+
+def get_cached_samples(generations: List[Tuple[str, int]]) -> List[str]:
+    """
+    Local paths of the speech profile bucket blobs at these generations, downloaded on first use. Older
+    generations of the same blobs are removed, and the least recently used files past `samples_cache_max_files`.
+    """
+    os.makedirs(samples_cache_dir, exist_ok=True)
+    paths = []
+    for name, generation in generations:
+        prefix = _sample_file_prefix(name)
+        path = os.path.join(samples_cache_dir, f'{prefix}{generation}.wav')
+        if not os.path.exists(path):
+            tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            try:
+                storage.download_speech_profile_sample(name, generation, tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            with _samples_lock:
+                for entry in os.scandir(samples_cache_dir):
+                    if entry.name.startswith(prefix) and entry.name.endswith('.wav') and entry.path != path:
+                        os.remove(entry.path)
+                _prune_samples_cache()
+        paths.append(path)
+    return paths
+
+
+def load_samples(generations: List[Tuple[str, int]]) -> AudioSegment:
+    """The concatenation of the (cached) samples, in `generations` order."""
+    aseg = AudioSegment.empty()
+    for path in get_cached_samples(generations):
+        aseg += AudioSegment.from_wav(path)
+    return aseg
+
+
+def _get_embedding(uid: str, key: str, generations: List[Tuple[str, int]],
+                   encode: Optional[Encoder]) -> Optional[np.ndarray]:
+    if not generations:
+        return None
+    signature = _signature(generations)
+    with _embeddings_lock:
+        cached = _embeddings.get((uid, key))
+        if cached and cached[0] == signature:
+            _embeddings.move_to_end((uid, key))
+            return cached[1]
+
+    stored = storage.get_speaker_embedding(uid, key)
+    if stored and stored.get('signature') == signature:
+        embedding = np.array(stored['embedding'], dtype=np.float32)
+    else:
+        samples = audio_samples(load_samples(generations))
+        if not len(samples):
+            return None
+        embedding = (encode or get_encoder())(samples[None, :])[0].astype(np.float32)
+        storage.upload_speaker_embedding(uid, key, {'signature': signature, 'model': embedding_model,
+                                                    'embedding': embedding.tolist()})
+
+    with _embeddings_lock:
+        _embeddings[(uid, key)] = (signature, embedding)
+        _embeddings.move_to_end((uid, key))
+        while len(_embeddings) > _embeddings_max:
+            _embeddings.popitem(last=False)
+    return embedding
+
+
+def get_user_speaker_embedding(uid: str, encode: Optional[Encoder] = None) -> Optional[np.ndarray]:
+    """Embedding of the speech profile with its additional recordings, None without a speech profile."""
+    return _get_embedding(uid, 'user', storage.get_speech_profile_generations(uid), encode)
+
+
+def get_people_speaker_embeddings(uid: str, encode: Optional[Encoder] = None) -> Dict[str, np.ndarray]:
+    """Embedding of each person's speech samples, by person id."""
+    people = {}
+    for person_id in dict.fromkeys(storage.get_user_people_ids(uid)):
+        generations = storage.get_user_person_speech_samples_generations(uid, person_id)
+        embedding = _get_embedding(uid, f'person_{person_id}', generations, encode)
+        if embedding is not None:
+            people[person_id] = embedding
+    return people
+
+
+# *****************************
+# ****** CLASSIFICATION *******
+# *****************************
+
+def _segment_chunks(samples: np.ndarray, segments: List[dict]) -> List[Tuple[int, int, int]]:
+    """(segment index, first sample, last sample) of each `chunk_seconds` chunk of each segment."""
+    chunks = []
+    for i, segment in enumerate(segments):
+        duration = segment['end'] - segment['start']
+        for j in range(0, int(duration), chunk_seconds):
+            start = segment['start'] + j
+            end = min(segment['end'], start + chunk_seconds)
+            first, last = slice_frames(len(samples), sample_rate, start * 1000, end * 1000)
+            chunks.append((i, first, last))
+    return chunks
+
+
+def _encode_chunks(samples: np.ndarray, chunks: List[Tuple[int, int, int]], encode: Encoder) -> List:
+    """Embedding of each chunk, None for the ones that could not be embedded (e.g. too short)."""
+    embeddings = [None] * len(chunks)
+    # chunks of the same length are batched together, no padding: the same embeddings as one by one
+    by_length = defaultdict(list)
+    for index, (_, first, last) in enumerate(chunks):
+        if last > first:
+            by_length[last - first].append(index)
+    for length, indexes in by_length.items():
+        for k in range(0, len(indexes), encode_batch_size):
+            batch = indexes[k:k + encode_batch_size]
+            try:
+                encoded = encode(np.stack([samples[chunks[index][1]:chunks[index][2]] for index in batch]))
+            except Exception as e:
+                print('speaker_embeddings encode', length, e)
+                continue
+            for index, embedding in zip(batch, encoded):
+                embeddings[index] = embedding
+    return embeddings
+
+
+def classify_segments(audio_file_path: str, candidates: Dict[str, np.ndarray], segments: List[dict],
+                      encode: Optional[Encoder] = None) -> List[dict]:
+    """
+    Speaker of each segment ({'start', 'end'} seconds in the audio): the candidate ('user' or a person id, in
+    `candidates` order) with the highest sum of matching scores over the segment's 30 seconds chunks.
+    Segments shorter than a second, or that no candidate matched, stay unassigned.
+    """
+    matches = [{'is_user': False, 'person_id': None}] * len(segments)
+    if not candidates:
+        return matches
+
+    samples = audio_samples(AudioSegment.from_wav(audio_file_path))
+    print('Duration:', len(samples) / sample_rate)
+    chunks = _segment_chunks(samples, segments)
+    embeddings = _encode_chunks(samples, chunks, encode or get_encoder())
+
+    by_segment_matches = {i: dict.fromkeys(candidates, 0.0) for i, _, _ in chunks}
+    embedded = [index for index, embedding in enumerate(embeddings) if embedding is not None]
+    if embedded:
+        stacked = np.stack([embeddings[index] for index in embedded])
+        for key, candidate in candidates.items():
+            for index, score in zip(embedded, _similarity(stacked, candidate).tolist()):
+                if score > verification_threshold:
+                    by_segment_matches[chunks[index][0]][key] += score
+
+    for i, segment_matches in by_segment_matches.items():
+        max_match = max(segment_matches, key=segment_matches.get)
+        if not segment_matches[max_match]:
+            # no chunk matched anyone, not the user by default
+            continue
+        matches[i] = {'is_user': max_match == 'user', 'person_id': None if max_match == 'user' else max_match}
+    return matches
@@ -1,16 +1,33 @@
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 import requests
-from pydub import AudioSegment
 
-from utils.other.storage import get_profile_audio_if_exists, get_additional_profile_recordings, get_user_people_ids, \
-    get_user_person_speech_samples
+from utils.other.storage import get_speech_profile_generations, get_user_people_ids, \
+    get_user_person_speech_samples_generations
+from utils.stt.speaker_embeddings import load_samples, get_user_speaker_embedding, get_people_speaker_embeddings, \
+    classify_segments
+
+# 'hosted' posts the audio to the speech profile service (modal/speech_profile_modal.py), 'local' runs the same
+# matching in this process
+speech_profile_matcher = os.getenv('SPEECH_PROFILE_MATCHER') or (
+    'hosted' if os.getenv('HOSTED_SPEECH_PROFILE_API_URL') else 'local')
+# the hosted service matches the user only
+speech_profile_match_people = os.getenv('SPEECH_PROFILE_MATCH_PEOPLE') == 'true'
+
+speech_profile_matcher_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('SPEECH_PROFILE_MATCHER_WORKERS', 2)), thread_name_prefix='speech-profile')
 
 
 def get_speech_profile_matching_predictions(uid: str, audio_file_path: str, segments: List) -> List[dict]:
-    print('get_speech_profile_matching_predictions')
+    """{'is_user', 'person_id'} for each segment ({'start', 'end', 'text'}) of the 16kHz wav."""
+    print('get_speech_profile_matching_predictions', speech_profile_matcher)
+    return speech_profile_matchers[speech_profile_matcher](uid, audio_file_path, segments)
+
+
+def _get_hosted_matching_predictions(uid: str, audio_file_path: str, segments: List) -> List[dict]:
     files = [
         ('audio_file', (os.path.basename(audio_file_path), open(audio_file_path, 'rb'), 'audio/wav')),
     ]
@@ -36,28 +53,48 @@ def get_speech_profile_matching_predictions(uid: str, audio_file_path: str, segm
         return default
 
 
+def match_speech_profile_segments(uid: str, audio_file_path: str, segments: List) -> List[dict]:
+    """The speech profile service's matching, on the cached speaker embeddings."""
+    embedding = get_user_speaker_embedding(uid)
+    if embedding is None:
+        return [{'is_user': False, 'person_id': None}] * len(segments)
+    candidates = {'user': embedding}
+    if speech_profile_match_people:
+        candidates.update(get_people_speaker_embeddings(uid))
+    return classify_segments(audio_file_path, candidates, segments)
+
+
+def _get_local_matching_predictions(uid: str, audio_file_path: str, segments: List) -> List[dict]:
+    try:
+        # bounded: embedding is CPU bound, at most `max_workers` conversations at once
+        job = speech_profile_matcher_executor.submit(match_speech_profile_segments, uid, audio_file_path, segments)
+        result = job.result()
+        print('get_speech_profile_matching_predictions', result)
+        return result
+    except Exception as e:
+        print('get_speech_profile_matching_predictions', str(e))
+        return [{'is_user': False, 'person_id': None}] * len(segments)
+
+
+speech_profile_matchers = {
+    'hosted': _get_hosted_matching_predictions,
+    'local': _get_local_matching_predictions,
+}
+
+
 def get_speech_profile_expanded(uid: str):
-    main = get_profile_audio_if_exists(uid, download=True)
-    if not main:
+    generations = get_speech_profile_generations(uid)
+    if not generations:
         return None
-    parts = get_additional_profile_recordings(uid, download=True)
-    aseg = AudioSegment.from_wav(main)
-    for part in parts:
-        aseg += AudioSegment.from_wav(part)
     path = f'_temp/{uid}_complete_speech_profile.wav'
-    aseg.export(path, format='wav')
+    load_samples(generations).export(path, format='wav')
     return path
 
 
 def get_people_with_speech_samples(uid: str):
-    people_ids = get_user_people_ids(uid)
     people = []
-    for pid in people_ids:
-        file_paths = get_user_person_speech_samples(uid, pid, download=True)
-        aseg = AudioSegment.empty()
-        for path in file_paths:
-            aseg += AudioSegment.from_wav(path)
+    for pid in dict.fromkeys(get_user_people_ids(uid)):
         path = f'_temp/{uid}_{pid}_complete_speech_profile.wav'
-        aseg.export(path, format='wav')
+        load_samples(get_user_person_speech_samples_generations(uid, pid)).export(path, format='wav')
         people.append({'id': pid, 'path': path})
     return people
@@ -254,7 +254,7 @@ async def process_audio_soniox(stream_transcript, sample_rate: int, language: st
     if not api_key:
         raise ValueError("SonioxAPI key is not set. Please set the SONIOX_API_KEY environment variable.")
 
-    uri = 'wss://stt-rt.soniox.com/transcribe-websocket'
+    uri = os.getenv('SONIOX_WS_URL', 'wss://stt-rt.soniox.com/transcribe-websocket')
 
     # Speaker identification only works with English and 16kHz sample rate
     # New Soniox streaming is not supported speaker indentification
@@ -417,7 +417,7 @@ async def process_audio_soniox(stream_transcript, sample_rate: int, language: st
 
 async def process_audio_speechmatics(stream_transcript, sample_rate: int, language: str, preseconds: int = 0):
     api_key = os.getenv('SPEECHMATICS_API_KEY')
-    uri = 'wss://eu2.rt.speechmatics.com/v2'
+    uri = os.getenv('SPEECHMATICS_WS_URL', 'wss://eu2.rt.speechmatics.com/v2')
 
     request = {
         "message": "StartRecognition",
@@ -1,5 +1,10 @@
+import hashlib
 import os
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from typing import Iterator, List, Tuple
 
 import numpy as np
 import requests
@@ -8,11 +13,37 @@ from fastapi import HTTPException
 from pydub import AudioSegment
 
 from database import redis_db
+from utils.audio import export_wav_slices
 
 torch.set_num_threads(1)
 torch.hub.set_dir('pretrained_models')
-model, utils = torch.hub.load(repo_or_dir='snakers4/silero-vad', model='silero_vad')
-(get_speech_timestamps, save_audio, read_audio, VADIterator, collect_chunks) = utils
+
+# 'local' runs silero in this process, 'hosted' posts the file to HOSTED_VAD_API_URL (vad_modal/vad.py, pyannote)
+vad_service = os.getenv('VAD_SERVICE', 'local')
+vad_onnx = os.getenv('VAD_ONNX', 'true') == 'true'
+# silero runs on the file in windows of this many seconds, memory stays flat for multi-hour files
+vad_window_seconds = 600
+# speech closer than this across two windows is one segment, as silero's own min_silence_duration_ms
+vad_min_silence_seconds = 0.1
+vad_cache_ttl = 60 * 60 * 24 * 7
+
+vad_executor = ThreadPoolExecutor(max_workers=int(os.getenv('VAD_WORKERS', 2)), thread_name_prefix='vad')
+
+_vad_models = threading.local()
+_vad_models_lock = threading.Lock()
+
+
+def get_vad_model():
+    """
+    This thread's silero model and utils, loaded on first use. Silero keeps its recurrent state in the model, so
+    threads don't share one: `vad_executor` bounds how many are loaded.
+    """
+    if not hasattr(_vad_models, 'model'):
+        # torch.hub downloads and caches the repo on first load, not safe to run concurrently
+        with _vad_models_lock:
+            _vad_models.model, _vad_models.utils = torch.hub.load(
+                repo_or_dir='snakers4/silero-vad', model='silero_vad', onnx=vad_onnx)
+    return _vad_models.model, _vad_models.utils
 
 
 class SpeechState(str, Enum):
@@ -50,6 +81,7 @@ def is_speech_present(data, vad_iterator, window_size_samples=256):
 
 
 def is_audio_empty(file_path, sample_rate=8000):
+    model, (get_speech_timestamps, _, read_audio, _, _) = get_vad_model()
     wav = read_audio(file_path)
     timestamps = get_speech_timestamps(wav, model, sampling_rate=sample_rate)
     if len(timestamps) == 1:
@@ -58,33 +90,85 @@ def is_audio_empty(file_path, sample_rate=8000):
     return len(timestamps) == 0
 
 
-def vad_is_empty(file_path, return_segments: bool = False, cache: bool = False):
-    """Uses vad_modal/vad.py deployment (Best quality)"""
-    caching_key = f'vad_is_empty:{file_path}'
-    if cache:
-        if exists := redis_db.get_generic_cache(caching_key):
-            if return_segments:
-                return exists
-            return len(exists) == 0
-
+def _file_digest(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _pcm_windows(file_path: str) -> Iterator[Tuple[np.ndarray, int]]:
+    """Mono float32 samples of the wav, `vad_window_seconds` at a time, with their sample rate (8 or 16kHz)."""
+    with wave.open(file_path, 'rb') as wav:
+        params = wav.getparams()
+        if params.sampwidth == 2 and params.framerate in (8000, 16000):
+            window = params.framerate * vad_window_seconds
+            while data := wav.readframes(window):
+                samples = np.frombuffer(data, dtype=np.int16).reshape(-1, params.nchannels).mean(axis=1)
+                yield (samples / 32768.0).astype(np.float32), params.framerate
+            return
+
+    # other rates or sample widths: converted as a whole, rare (device and app audio is 16kHz pcm16)
+    aseg = AudioSegment.from_wav(file_path).set_channels(1).set_frame_rate(16000).set_sample_width(2)
+    samples = np.frombuffer(aseg.raw_data, dtype=np.int16)
+    window = 16000 * vad_window_seconds
+    for i in range(0, len(samples), window):
+        yield (samples[i:i + window] / 32768.0).astype(np.float32), 16000
+
+
+def get_speech_segments(file_path: str) -> List[dict]:
+    """Speech in the wav as [{'start', 'end', 'duration'}] seconds, silero on this thread."""
+    model, (get_speech_timestamps, _, _, _, _) = get_vad_model()
+    segments = []
+    offset = 0.0
+    for samples, sample_rate in _pcm_windows(file_path):
+        for timestamp in get_speech_timestamps(torch.from_numpy(samples), model, sampling_rate=sample_rate):
+            start = offset + timestamp['start'] / sample_rate
+            end = offset + timestamp['end'] / sample_rate
+            if segments and start - segments[-1]['end'] < vad_min_silence_seconds:
+                segments[-1]['end'] = end
+            else:
+                segments.append({'start': start, 'end': end})
+        offset += len(samples) / sample_rate
+    for segment in segments:
+        segment['duration'] = segment['end'] - segment['start']
+    return segments
+
+
+def _get_hosted_speech_segments(file_path: str) -> List[dict]:
+    with open(file_path, 'rb') as file:
+        files = {'file': (file_path.split('/')[-1], file, 'audio/wav')}
+        response = requests.post(os.getenv('HOSTED_VAD_API_URL'), files=files)
+        return response.json()
+
+
+def vad_is_empty(file_path, return_segments: bool = False, cache: bool = True):
+    """
+    Speech segments of the wav ([{'start', 'end', 'duration'}] seconds) if `return_segments`, else whether it has
+    none. Runs silero on `vad_executor` (or the hosted service, `VAD_SERVICE`); results are cached by the file's
+    content, the same audio under another path is not analyzed again. If VAD fails, no segments and not empty.
+    """
     try:
-        # file_duration = AudioSegment.from_wav(file_path).duration_seconds
-        # print('vad_is_empty file duration:', file_duration)
-        with open(file_path, 'rb') as file:
-            files = {'file': (file_path.split('/')[-1], file, 'audio/wav')}
-            response = requests.post(os.getenv('HOSTED_VAD_API_URL'), files=files)
-            segments = response.json()
-            if cache:
-                redis_db.set_generic_cache(caching_key, segments, ttl=60 * 60 * 24)
-            if return_segments:
-                return segments
-            print('vad_is_empty', len(segments) == 0)  # compute % of empty files in someway
-            return len(segments) == 0  # but also check likelyhood of silence if only 1 segment?
+        caching_key = f'vad:{vad_service}:{_file_digest(file_path)}' if cache else None
+        segments = redis_db.get_generic_cache(caching_key) if caching_key else None
+        if segments is None:
+            if vad_service == 'hosted':
+                segments = _get_hosted_speech_segments(file_path)
+            else:
+                # bounded: silero is CPU bound, at most `max_workers` files at once
+                segments = vad_executor.submit(get_speech_segments, file_path).result()
+            if caching_key:
+                redis_db.set_generic_cache(caching_key, segments, ttl=vad_cache_ttl)
     except Exception as e:
         print('vad_is_empty', e)
         if return_segments:
             return []
         return False
+    if return_segments:
+        return segments
+    print('vad_is_empty', len(segments) == 0)  # compute % of empty files in someway
+    return len(segments) == 0  # but also check likelyhood of silence if only 1 segment?
 
 
 def apply_vad_for_speech_profile(file_path: str):
@@ -100,13 +184,13 @@ def apply_vad_for_speech_profile(file_path: str):
             joined_segments.append(segment)
 
     # trim silence out of file_path, but leave 1 sec of silence within chunks
-    trimmed_aseg = AudioSegment.empty()
+    slices = []
     for i, segment in enumerate(joined_segments):
         start = segment['start'] * 1000
         end = segment['end'] * 1000
-        trimmed_aseg += AudioSegment.from_wav(file_path)[start:end]
+        slices.append((start, end))
         if i < len(joined_segments) - 1:
-            trimmed_aseg += AudioSegment.from_wav(file_path)[end:end + 1000]
+            slices.append((end, end + 1000))
 
     # file_path.replace('.wav', '-cleaned.wav')
-    trimmed_aseg.export(file_path, format="wav")
+    export_wav_slices(file_path, file_path, slices)
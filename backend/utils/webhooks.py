@@ -3,7 +3,6 @@ import json
 from datetime import datetime
 from typing import List
 
-import requests
 import websockets
 
 from database.redis_db import get_user_webhook_db, user_webhook_status_db, disable_user_webhook_db, \
@@ -12,6 +11,7 @@ from models.conversation import Conversation
 from models.users import WebhookType
 import database.notifications as notification_db
 from utils.notifications import send_notification
+from utils.other.http_dispatcher import dispatcher
 
 
 def conversation_created_webhook(uid, memory: Conversation):
@@ -22,7 +22,7 @@ def conversation_created_webhook(uid, memory: Conversation):
             return
         webhook_url += f'?uid={uid}'
         try:
-            response = requests.post(
+            response = dispatcher.post(
                 webhook_url,
                 json=memory.as_dict_cleaned_dates(),
                 headers={'Content-Type': 'application/json'},
@@ -43,7 +43,7 @@ def day_summary_webhook(uid, summary: str):
             return
         webhook_url += f'?uid={uid}'
         try:
-            response = requests.post(
+            response = dispatcher.post(
                 webhook_url,
                 json={
                     'summary': summary,
@@ -60,7 +60,7 @@ def day_summary_webhook(uid, summary: str):
         return
 
 
-async def realtime_transcript_webhook(uid, segments: List[dict]):
+def realtime_transcript_webhook(uid, segments: List[dict]):
     print("realtime_transcript_webhook", uid)
     toggled = user_webhook_status_db(uid, WebhookType.realtime_transcript)
     if toggled:
@@ -69,7 +69,7 @@ async def realtime_transcript_webhook(uid, segments: List[dict]):
             return
         webhook_url += f'?uid={uid}'
         try:
-            response = requests.post(
+            response = dispatcher.post(
                 webhook_url,
                 json={'segments': segments, 'session_id': uid},
                 headers={'Content-Type': 'application/json'},
@@ -107,7 +107,7 @@ def get_audio_bytes_webhook_seconds(uid: str):
         return
 
 
-async def send_audio_bytes_developer_webhook(uid: str, sample_rate: int, data: bytearray):
+def send_audio_bytes_developer_webhook(uid: str, sample_rate: int, data: bytearray):
     print("send_audio_bytes_developer_webhook", uid)
     # TODO: add a lock, send shorter segments, validate regex.
     toggled = user_webhook_status_db(uid, WebhookType.audio_bytes)
@@ -118,7 +118,8 @@ async def send_audio_bytes_developer_webhook(uid: str, sample_rate: int, data: b
             return
         webhook_url += f'?sample_rate={sample_rate}&uid={uid}'
         try:
-            response = requests.post(webhook_url, data=data, headers={'Content-Type': 'application/octet-stream'}, timeout=15)
+            response = dispatcher.post(webhook_url, data=data, headers={'Content-Type': 'application/octet-stream'},
+                                       timeout=15)
             print('send_audio_bytes_developer_webhook:', webhook_url, response.status_code)
         except Exception as e:
             print(f"Error sending audio bytes to developer webhook: {e}")